@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+bench_dera.py
+
+Benchmarks reproducibles de la descarga DERA contra un servidor WFS local
+(wfs_standin.py), sin red.
+
+USO:
+    python bench_dera.py                               # 10^4 features, todas las etapas
+    python bench_dera.py --features 1000000            # 10^6 features
+    python bench_dera.py --latency 0.05 --error-rate 0.02
+    python bench_dera.py --stage fetch_wfs_features --page-concurrency 4
+    python bench_dera.py --json bench.json             # Resultados para comparar
+    python bench_dera.py --max-memory 64               # Presupuesto de memoria (dera_spill.py)
+
+ETAPAS:
+    fetch_wfs_features     - download_dera: paginación startIndex a memoria
+    iter_wfs_stream        - download_dera_actions: una capa en streaming, sin escribir
+    iter_layer_features    - download_dera_actions: dos capas agrupadas en un GetFeature
+    write_category_geojson - download_dera_actions: escritura en streaming, sin red
+    download_layer         - download_dera: descarga y escritura en streaming (indent=2)
+    process_category       - download_dera_actions: descarga y escritura en streaming
+
+Cada etapa se ejecuta en un proceso nuevo (el servidor queda en este), así
+que el pico de RSS es solo de esa etapa: se informa el de partida (tras
+importar los módulos) y el máximo alcanzado. Las peticiones y bytes son
+los que contó el servidor, errores inyectados incluidos.
+
+Por defecto el ritmo adaptativo de wfs_http no limita (--max-rate alto);
+--max-rate 20 reproduce el de producción.
+
+@version 1.0.0
+@date 2025-12-09
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from wfs_standin import DEFAULT_FEATURES, WFSStandin, synthetic_features
+
+# ============================================================================
+# CONFIGURACIÓN
+# ============================================================================
+
+LAYER = "bench:g12_01_CentroSalud"
+SECOND_LAYER = "bench:g12_02_Hospital_CAE"
+BENCH_MAX_RATE = 1e6  # peticiones/s: sin límite efectivo
+BENCH_RETRY_DELAY = 0.01  # segundos, base del backoff con errores inyectados
+
+STAGES = (
+    "fetch_wfs_features",
+    "iter_wfs_stream",
+    "iter_layer_features",
+    "write_category_geojson",
+    "download_layer",
+    "process_category",
+)
+
+
+def peak_rss_mb() -> float:
+    """Pico de RSS del proceso en MB (ru_maxrss: KB en Linux, bytes en macOS)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+# ============================================================================
+# ETAPAS (proceso hijo)
+# ============================================================================
+
+def _configure(args, workdir: Path):
+    import download_dera_actions
+    from dera_spill import parse_megabytes
+    from wfs_http import RATE_LIMITER, configure_session
+
+    download_dera_actions.MAX_MEMORY = parse_megabytes(args.max_memory)
+    download_dera_actions.RETRY_DELAY = BENCH_RETRY_DELAY
+    download_dera_actions.OUTPUT_DIR = workdir
+    RATE_LIMITER.configure(initial_rate=args.max_rate, max_rate=args.max_rate)
+    configure_session()
+
+
+def run_stage(stage: str, url: str, args, workdir: Path) -> int:
+    """Ejecuta una etapa y retorna las features procesadas."""
+    import download_dera
+    import download_dera_actions
+    from dera_spill import parse_megabytes
+
+    options = download_dera.DownloadOptions(batch_size=args.page_size, page_concurrency=args.page_concurrency,
+                                            max_memory=parse_megabytes(args.max_memory))
+    if stage == "fetch_wfs_features":
+        data = download_dera.fetch_wfs_features(url, LAYER, "Bench", options=options)
+        return len(data["features"])
+    if stage == "iter_wfs_stream":
+        return sum(1 for _ in download_dera_actions.iter_wfs_stream(url, LAYER))
+    if stage == "iter_layer_features":
+        download_dera_actions.WFS_LAYERS["bench"] = [(url, LAYER, "CAP"), (url, SECOND_LAYER, "Hospitales")]
+        return sum(1 for _ in download_dera_actions.iter_layer_features("bench"))
+    if stage == "write_category_geojson":
+        features = synthetic_features(LAYER, args.features)
+        start = time.perf_counter()
+        count = download_dera_actions.write_category_geojson("bench", "bench.geojson", features)
+        return count, time.perf_counter() - start
+    if stage == "download_layer":
+        download_dera.WFS_CONFIG["bench"] = {
+            "name": "Bench",
+            "urls": [{"url": url, "layer": LAYER, "description": "Bench"}],
+        }
+        ok = download_dera.download_layer("bench", workdir, options)
+        return args.features if ok else 0
+    if stage == "process_category":
+        download_dera_actions.WFS_LAYERS["bench"] = [(url, LAYER, "CAP")]
+        return download_dera_actions.process_category("bench")
+    raise ValueError(f"Etapa desconocida: {stage}")
+
+
+def child_main(args) -> int:
+    """Proceso hijo: una etapa, resultado en JSON en --result."""
+    with tempfile.TemporaryDirectory(prefix="bench-dera-") as tmp:
+        workdir = Path(tmp)
+        _configure(args, workdir)
+        baseline = peak_rss_mb()
+        cpu = time.process_time()
+        start = time.perf_counter()
+        result = run_stage(args.child, args.url, args, workdir)
+        wall = time.perf_counter() - start
+        if isinstance(result, tuple):  # etapas sin red: solo cuenta la escritura
+            result, wall = result
+        output_bytes = sum(f.stat().st_size for f in workdir.rglob("*.geojson"))
+        report = {
+            "features": result,
+            "wallSeconds": wall,
+            "cpuSeconds": time.process_time() - cpu,
+            "baselineRssMB": baseline,
+            "peakRssMB": peak_rss_mb(),
+            "outputBytes": output_bytes,
+        }
+    Path(args.result).write_text(json.dumps(report), encoding="utf-8")
+    return 0
+
+
+# ============================================================================
+# EJECUCIÓN (proceso principal)
+# ============================================================================
+
+def _child_command(stage: str, url: str, args, result: Path) -> list:
+    return [
+        sys.executable, str(Path(__file__).resolve()),
+        "--child", stage, "--url", url, "--result", str(result),
+        "--features", str(args.features),
+        "--page-size", str(args.page_size),
+        "--page-concurrency", str(args.page_concurrency),
+        "--max-rate", str(args.max_rate),
+    ] + (["--max-memory", str(args.max_memory)] if args.max_memory else [])
+
+
+def bench_stage(stage: str, server: WFSStandin, args) -> dict:
+    """Ejecuta una etapa en un proceso nuevo y combina sus métricas con las del servidor."""
+    server.reset_stats()
+    with tempfile.TemporaryDirectory(prefix="bench-dera-") as tmp:
+        result = Path(tmp) / "result.json"
+        output = None if args.verbose else subprocess.DEVNULL
+        completed = subprocess.run(_child_command(stage, server.url, args, result),
+                                   cwd=Path(__file__).parent, stdout=output, stderr=output)
+        if completed.returncode != 0 or not result.exists():
+            return {"stage": stage, "error": f"código de salida {completed.returncode}"}
+        report = json.loads(result.read_text(encoding="utf-8"))
+
+    wall = report["wallSeconds"]
+    return {
+        "stage": stage,
+        **report,
+        **server.stats(),
+        "featuresPerSecond": report["features"] / wall if wall > 0 else None,
+    }
+
+
+def format_row(row: dict) -> str:
+    if "error" in row:
+        return f"  {row['stage']:22} ❌ {row['error']}"
+    rate = row["featuresPerSecond"] or 0
+    return (f"  {row['stage']:22} {row['features']:>9} {rate:>11,.0f} {row['wallSeconds']:>8.2f} "
+            f"{row['requests']:>6} {row['errors']:>4} {row['peakRssMB']:>8.1f} {row['baselineRssMB']:>8.1f}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks de la descarga DERA contra un WFS local")
+    parser.add_argument("--features", type=int, default=DEFAULT_FEATURES,
+                        help=f"Features por capa en el servidor (default: {DEFAULT_FEATURES})")
+    parser.add_argument("--page-size", type=int, default=1000,
+                        help="Features por página de download_dera (BATCH_SIZE, default: 1000)")
+    parser.add_argument("--max-page", type=int, default=None,
+                        help="Máximo de features por respuesta del servidor (default: sin límite)")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="Segundos de latencia por respuesta (default: 0)")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="Fracción de peticiones que reciben 503 (default: 0)")
+    parser.add_argument("--seed", type=int, default=0, help="Semilla de la inyección de errores")
+    parser.add_argument("--page-concurrency", type=int, default=1,
+                        help="Páginas en vuelo en fetch_wfs_features y download_layer (default: 1)")
+    parser.add_argument("--max-rate", type=float, default=BENCH_MAX_RATE,
+                        help="Peticiones/segundo máximas por host (default: sin límite)")
+    parser.add_argument("--max-memory", type=float, default=None, metavar="MB",
+                        help="Presupuesto de features en memoria (download_dera y el delta de process_category)")
+    parser.add_argument("--stage", action="append", choices=STAGES,
+                        help="Etapa a medir (repetible; default: todas)")
+    parser.add_argument("--repeat", type=int, default=1, help="Repeticiones de cada etapa (default: 1)")
+    parser.add_argument("--json", type=Path, default=None, help="Guardar los resultados en JSON")
+    parser.add_argument("--verbose", "-v", action="store_true", help="Mostrar la salida de las etapas")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--url", help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    if args.child:
+        return child_main(args)
+
+    stages = args.stage or list(STAGES)
+    rows = []
+    with WFSStandin(features=args.features, latency=args.latency, max_page=args.max_page,
+                    error_rate=args.error_rate, seed=args.seed) as server:
+        print(f"🧪 WFS local {server.url}: {args.features} features/capa, página {args.page_size}, "
+              f"latencia {args.latency * 1000:.0f} ms, errores {args.error_rate:.0%}")
+        print(f"  {'etapa':22} {'features':>9} {'features/s':>11} {'tiempo s':>8} "
+              f"{'pet.':>6} {'err':>4} {'pico MB':>8} {'base MB':>8}")
+        for stage in stages:
+            for _ in range(args.repeat):
+                row = bench_stage(stage, server, args)
+                rows.append(row)
+                print(format_row(row))
+
+    if args.json:
+        report = {
+            "config": {key: getattr(args, key) for key in (
+                "features", "page_size", "max_page", "latency", "error_rate", "seed",
+                "page_concurrency", "max_rate", "max_memory", "repeat")},
+            "python": sys.version.split()[0],
+            "cpus": os.cpu_count(),
+            "results": rows,
+        }
+        args.json.write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+        print(f"📁 Resultados en {args.json}")
+
+    return 1 if any("error" in row for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
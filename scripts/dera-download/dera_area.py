@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+dera_area.py
+
+Refresco parcial por provincia o municipio (--province / --municipio).
+
+Cuando un municipio reporta un error en los datos basta con volver a
+pedir su zona: el filtro se envía al servidor como CQL_FILTER sobre
+cod_mun (todas las capas DERA lo tienen) y la porción correspondiente
+del GeoJSON publicado se sustituye por lo recibido, dejando intacto el
+resto de la capa.
+
+Se filtra por atributo y no por BBOX: los términos municipales no son
+rectángulos, así que un BBOX traería features de los municipios vecinos
+que habría que volver a filtrar en local; además GeoServer no admite BBOX
+y CQL_FILTER en la misma petición.
+
+@version 1.0.0
+@date 2025-12-09
+"""
+
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional
+
+from dera_search import fold
+from dera_shards import cod_mun
+from geojson_io import read_feature_file
+
+# Códigos INE de las provincias andaluzas
+PROVINCIAS = {
+    "04": "Almería",
+    "11": "Cádiz",
+    "14": "Córdoba",
+    "18": "Granada",
+    "21": "Huelva",
+    "23": "Jaén",
+    "29": "Málaga",
+    "41": "Sevilla",
+}
+_BY_NAME = {fold(name): code for code, name in PROVINCIAS.items()}
+
+
+def combine_cql(*filters: Optional[str]) -> Optional[str]:
+    """Une filtros CQL con AND (None si no hay ninguno)."""
+    filters = [f for f in filters if f]
+    if len(filters) <= 1:
+        return filters[0] if filters else None
+    return " AND ".join(f"({f})" for f in filters)
+
+
+class AreaFilter:
+    """
+    Zona a refrescar: unión de provincias (código o nombre) y municipios
+    (código INE de 5 dígitos).
+    """
+
+    def __init__(self, provincias: Iterable[str] = (), municipios: Iterable[str] = ()):
+        self.provincias = sorted({self._province_code(p) for p in provincias})
+        self.municipios = sorted({self._municipio_code(m) for m in municipios})
+        if not (self.provincias or self.municipios):
+            raise ValueError("Zona vacía: indica al menos una provincia o un municipio")
+
+    @classmethod
+    def from_args(cls, provincias: Optional[List[str]], municipios: Optional[List[str]]) -> Optional["AreaFilter"]:
+        """Zona de los argumentos de la CLI (admiten listas separadas por comas); None sin filtro."""
+        split = lambda values: [v.strip() for value in values or () for v in value.split(",") if v.strip()]
+        provincias, municipios = split(provincias), split(municipios)
+        if not (provincias or municipios):
+            return None
+        return cls(provincias, municipios)
+
+    @staticmethod
+    def _province_code(value: str) -> str:
+        value = str(value).strip()
+        code = value.zfill(2) if value.isdigit() else _BY_NAME.get(fold(value))
+        if code not in PROVINCIAS:
+            raise ValueError(f"Provincia desconocida: {value!r} (usa {', '.join(PROVINCIAS)} o su nombre)")
+        return code
+
+    @staticmethod
+    def _municipio_code(value: str) -> str:
+        value = str(value).strip()
+        if not value.isdigit() or len(value) > 5 or value.zfill(5)[:2] not in PROVINCIAS:
+            raise ValueError(f"Código de municipio no válido: {value!r} (código INE de 5 dígitos)")
+        return value.zfill(5)
+
+    def cql(self) -> str:
+        """Filtro CQL sobre cod_mun equivalente a matches()."""
+        parts = [f"cod_mun LIKE '{code}%'" for code in self.provincias]
+        if self.municipios:
+            parts.append("cod_mun IN (" + ",".join(f"'{code}'" for code in self.municipios) + ")")
+        return " OR ".join(parts)
+
+    def matches(self, feature: dict) -> bool:
+        code = cod_mun(feature)
+        return code[:2] in self.provincias or code in self.municipios
+
+    def describe(self) -> str:
+        names = [PROVINCIAS[code] for code in self.provincias] + self.municipios
+        return ", ".join(names)
+
+
+# ============================================================================
+# SUSTITUCIÓN DE LA PORCIÓN
+# ============================================================================
+
+class SliceStats:
+    """Resumen de un refresco parcial."""
+
+    def __init__(self):
+        self.kept = 0  # features de fuera de la zona, conservadas
+        self.replaced = 0  # features de la zona en el archivo anterior
+        self.fresh = 0  # features de la zona recibidas
+        self.outside = 0  # recibidas que no son de la zona (descartadas)
+
+
+def read_features(path: Path) -> Iterator[dict]:
+    """Features de un GeoJSON (o GeoJSONSeq) publicado, en streaming."""
+    return read_feature_file(path)
+
+
+def refresh_slice(existing: Iterable[dict], fresh: Iterable[dict], area: AreaFilter,
+                  stats: Optional[SliceStats] = None) -> Iterator[dict]:
+    """
+    Genera la capa refrescada: las features anteriores de fuera de la zona,
+    en su orden, seguidas de las recibidas para la zona. Las recibidas que
+    no pertenecen a la zona se descartan (no pueden duplicar las
+    conservadas).
+    """
+    stats = stats if stats is not None else SliceStats()
+    for feature in existing:
+        if area.matches(feature):
+            stats.replaced += 1
+            continue
+        stats.kept += 1
+        yield feature
+    for feature in fresh:
+        if not area.matches(feature):
+            stats.outside += 1
+            continue
+        stats.fresh += 1
+        yield feature
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+dera_cache.py
+
+Caché en disco de las respuestas GetFeature (--cache-dir, --cache-only).
+
+Cada respuesta se guarda comprimida con gzip en <dir>/<sha256 de la URL>.gz.
+La clave es la URL completa de build_wfs_url, así que cambiar de página,
+filtro, proyección o BBOX es otra entrada.
+
+- Caducidad: el mtime del archivo es el momento de la descarga; pasado
+  `ttl` la entrada no se usa (y se sobrescribe en la siguiente descarga).
+- Tamaño: el atime se fija explícitamente en cada acierto (no depende de
+  las opciones de montaje); al superar `max_bytes` se borran las entradas
+  usadas hace más tiempo (LRU).
+- Solo se guardan respuestas leídas enteras: un corte a mitad o un error
+  HTTP no dejan entrada.
+
+Con offline=True (--cache-only) un fallo de caché es CacheMissError en
+lugar de una petición, y la caducidad no se aplica: se sirve cualquier
+entrada guardada, así que reproduce una ejecución anterior sin red por
+antigua que sea.
+
+@version 1.0.0
+@date 2025-12-09
+"""
+
+import gzip
+import hashlib
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Iterator, Optional
+
+import requests
+
+from geojson_io import atomic_writer
+
+# ============================================================================
+# CONFIGURACIÓN
+# ============================================================================
+
+CACHE_ENV = "DERA_CACHE_DIR"
+DEFAULT_CACHE_DIR = Path.home() / ".cache" / "ptel-dera"
+DEFAULT_TTL = 24 * 3600  # segundos
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+CACHE_SUFFIX = ".gz"
+READ_CHUNK_SIZE = 64 * 1024
+
+
+class CacheMissError(requests.exceptions.RequestException):
+    """--cache-only y la URL no está en caché (se trata como un fallo de red)."""
+
+
+class ResponseCache:
+    """
+    Caché de cuerpos de respuesta por URL. Es seguro usarla desde varios
+    hilos; entre procesos, las escrituras son atómicas (temp + rename).
+    """
+
+    def __init__(self, directory: Path, ttl: float = DEFAULT_TTL,
+                 max_bytes: int = DEFAULT_MAX_BYTES, offline: bool = False,
+                 clock: Callable[[], float] = time.time):
+        self.dir = Path(directory)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.dir.mkdir(parents=True, exist_ok=True)
+
+    def path(self, url: str) -> Path:
+        return self.dir / (hashlib.sha256(url.encode("utf-8")).hexdigest() + CACHE_SUFFIX)
+
+    # ------------------------------------------------------------------
+    # Lectura
+    # ------------------------------------------------------------------
+
+    def _open(self, url: str):
+        """Archivo gzip de la entrada vigente (atime actualizado) o None."""
+        path = self.path(url)
+        now = self._clock()
+        try:
+            stored = path.stat().st_mtime
+            if not self.offline and now - stored > self.ttl:
+                return None
+            os.utime(path, (now, stored))
+            return gzip.open(path, "rb")
+        except OSError:
+            return None
+
+    def get(self, url: str) -> Optional[bytes]:
+        """Cuerpo completo de la respuesta en caché o None."""
+        f = self._open(url)
+        if f is None:
+            return None
+        with f:
+            return f.read()
+
+    def stream(self, url: str, fetch: Callable[[str], Iterator[bytes]]) -> Iterator[bytes]:
+        """
+        Genera el cuerpo de `url` por bloques: de la caché si está vigente,
+        si no de fetch(url), guardándolo al terminar.
+        """
+        f = self._open(url)
+        if f is not None:
+            with self._lock:
+                self.hits += 1
+            with f:
+                for chunk in iter(lambda: f.read(READ_CHUNK_SIZE), b""):
+                    yield chunk
+            return
+
+        with self._lock:
+            self.misses += 1
+        if self.offline:
+            raise CacheMissError(f"--cache-only: sin respuesta en caché para {url}")
+        yield from self._store(url, fetch(url))
+
+    # ------------------------------------------------------------------
+    # Escritura
+    # ------------------------------------------------------------------
+
+    def _store(self, url: str, chunks: Iterator[bytes]) -> Iterator[bytes]:
+        """Genera los bloques a la vez que los comprime; la entrada se publica al terminar."""
+        with atomic_writer(self.path(url), "wb") as raw:
+            with gzip.GzipFile(fileobj=raw, mode="wb", mtime=0) as out:
+                for chunk in chunks:
+                    out.write(chunk)
+                    yield chunk
+        now = self._clock()
+        os.utime(self.path(url), (now, now))
+        with self._lock:
+            self.stores += 1
+        self.evict()
+
+    def put(self, url: str, body: bytes):
+        """Guarda un cuerpo completo."""
+        for _ in self._store(url, iter([body])):
+            pass
+
+    # ------------------------------------------------------------------
+    # Tamaño
+    # ------------------------------------------------------------------
+
+    def entries(self) -> list:
+        """(atime, tamaño, ruta) de cada entrada."""
+        entries = []
+        for path in self.dir.glob("*" + CACHE_SUFFIX):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_atime, stat.st_size, path))
+        return entries
+
+    def size(self) -> int:
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self) -> int:
+        """Borra las entradas menos usadas hasta quedar en max_bytes. Retorna cuántas."""
+        with self._lock:
+            entries = sorted(self.entries(), key=lambda e: e[0])
+            total = sum(size for _, size, _ in entries)
+            removed = 0
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                path.unlink(missing_ok=True)
+                total -= size
+                removed += 1
+            self.evictions += removed
+            return removed
+
+    def summary(self) -> str:
+        return (f"{self.hits} aciertos, {self.misses} fallos, {self.stores} guardadas, "
+                f"{self.evictions} expulsadas, {self.size() / (1024 * 1024):.1f} MB en {self.dir}")
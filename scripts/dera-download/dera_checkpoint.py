@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+dera_checkpoint.py
+
+Diario de checkpoints para reanudar descargas paginadas de DERA.
+
+Por cada capa se guarda en <checkpoint-dir>/<capa>/ (por defecto en
+DEFAULT_CHECKPOINT_DIR, fuera de public/: lo que hay allí se publica con
+la aplicación):
+- journal.json: numberMatched y páginas completadas (offset → features)
+  de cada fuente, junto con los parámetros de la consulta
+- <n>-<offset>.ndjson: las features de cada página completada
+
+Con --resume las páginas ya completadas se leen del disco y solo se piden
+las que faltan. Sin --resume el diario se ignora (se piden todas las
+páginas) pero no se borra: las páginas nuevas se añaden a las guardadas,
+así que olvidar el flag una vez no tira lo ya descargado. El diario solo
+se borra cuando la capa se publica completa.
+
+@version 1.0.0
+@date 2025-12-09
+"""
+
+import json
+import shutil
+import threading
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional
+
+from geojson_io import atomic_writer, write_json
+
+DEFAULT_CHECKPOINT_DIR = Path.home() / ".cache" / "ptel-dera-checkpoints"
+JOURNAL_FILENAME = "journal.json"
+
+
+class CheckpointJournal:
+    """
+    Diario de páginas completadas de una capa.
+
+    Cada fuente se identifica por su typeName; si cambian la URL, el filtro,
+    el tamaño de página o el numberMatched del servidor, sus páginas
+    guardadas se descartan. Es seguro llamarlo desde varios hilos.
+    """
+
+    def __init__(self, root: Path, layer_key: str, resume: bool = False):
+        self.dir = Path(root) / layer_key
+        self.path = self.dir / JOURNAL_FILENAME
+        self.resume = resume
+        self._lock = threading.Lock()
+        self._data = {"layer": layer_key, "sources": {}}
+        self._written = set()  # (fuente, offset) guardados en esta ejecución
+
+        # Sin resume se carga igualmente, para conservar sus páginas al guardar
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                self._data = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    # ------------------------------------------------------------------
+    # Fuentes
+    # ------------------------------------------------------------------
+
+    def bind(self, source: str, url: str, cql_filter: Optional[str], batch_size: int):
+        """Asocia la fuente a su consulta; descarta páginas de otra consulta."""
+        query = {"url": url, "cqlFilter": cql_filter, "batchSize": batch_size}
+        with self._lock:
+            entry = self._data["sources"].get(source)
+            if entry is None or entry.get("query") != query:
+                self._drop(source)
+                used = [e["index"] for e in self._data["sources"].values()]
+                self._data["sources"][source] = {
+                    "index": max(used, default=-1) + 1,
+                    "query": query,
+                    "numberMatched": None,
+                    "pages": {},
+                }
+
+    def total(self, source: str) -> Optional[int]:
+        with self._lock:
+            return self._data["sources"][source]["numberMatched"]
+
+    def set_total(self, source: str, total: Optional[int]):
+        """Registra numberMatched; si cambió respecto al diario, las páginas no valen."""
+        with self._lock:
+            entry = self._data["sources"][source]
+            if entry["numberMatched"] != total:
+                if entry["pages"]:
+                    self._drop(source, keep_entry=True)
+                entry["numberMatched"] = total
+                self._save()
+
+    def page_size(self, source: str) -> Optional[int]:
+        """Tamaño de las páginas pedidas en paralelo (sus offsets dependen de él)."""
+        with self._lock:
+            return self._data["sources"][source].get("pageSize")
+
+    def set_page_size(self, source: str, size: int):
+        with self._lock:
+            entry = self._data["sources"][source]
+            if entry.get("pageSize") != size:
+                entry["pageSize"] = size
+                self._save()
+
+    def _usable(self, source: str, offset) -> bool:
+        """Sin resume solo cuentan las páginas guardadas en esta ejecución."""
+        return self.resume or (source, int(offset)) in self._written
+
+    def completed(self, source: str) -> List[int]:
+        with self._lock:
+            return sorted(int(offset) for offset in self._data["sources"][source]["pages"]
+                          if self._usable(source, offset))
+
+    def has_page(self, source: str, offset: int) -> bool:
+        with self._lock:
+            return str(offset) in self._data["sources"][source]["pages"] and self._usable(source, offset)
+
+    # ------------------------------------------------------------------
+    # Páginas
+    # ------------------------------------------------------------------
+
+    def _page_path(self, source: str, offset: int) -> Path:
+        return self.dir / f"{self._data['sources'][source]['index']}-{offset}.ndjson"
+
+    def save_page(self, source: str, offset: int, features: Iterable[dict]):
+        """Guarda una página completa (primero los datos, luego el diario)."""
+        with self._lock:
+            path = self._page_path(source, offset)
+
+        count = 0
+        with atomic_writer(path) as f:
+            for feature in features:
+                f.write(json.dumps(feature, ensure_ascii=False, separators=(",", ":")))
+                f.write("\n")
+                count += 1
+
+        with self._lock:
+            self._data["sources"][source]["pages"][str(offset)] = count
+            self._written.add((source, offset))
+            self._save()
+
+    def read_page(self, source: str, offset: int) -> Iterator[dict]:
+        with self._lock:
+            path = self._page_path(source, offset)
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def page_count(self, source: str, offset: int) -> int:
+        with self._lock:
+            return self._data["sources"][source]["pages"][str(offset)]
+
+    # ------------------------------------------------------------------
+    # Persistencia
+    # ------------------------------------------------------------------
+
+    def _drop(self, source: str, keep_entry: bool = False):
+        entry = self._data["sources"].get(source)
+        if entry is None:
+            return
+        for offset in list(entry["pages"]):
+            (self.dir / f"{entry['index']}-{offset}.ndjson").unlink(missing_ok=True)
+        entry["pages"] = {}
+        if not keep_entry:
+            del self._data["sources"][source]
+
+    def _save(self):
+        write_json(self.path, self._data, indent=2)
+
+    def clear(self):
+        """Borra el diario y las páginas guardadas."""
+        with self._lock:
+            shutil.rmtree(self.dir, ignore_errors=True)
+            self._data["sources"] = {}
+            self._written.clear()
@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+"""
+dera_columnar.py
+
+Exportación columnar binaria de las capas DERA para carga sin parseo en el
+cliente (typed arrays sobre un único ArrayBuffer).
+
+Formato de <capa>.columnar.bin (little-endian):
+
+    0   8 bytes   magia b"DERACOL1"
+    8   uint32    longitud N de la cabecera JSON
+    12  uint32    reservado (0)
+    16  N bytes   cabecera JSON UTF-8, rellena con espacios hasta múltiplo de 8
+    ...           columnas, cada una alineada a 8 bytes
+
+La cabecera describe cada columna con {"type", "offset", "length"}
+(offset en bytes desde el inicio del archivo, length en elementos), de
+modo que el cliente crea `new Float64Array(buffer, offset, length)` sin
+copiar:
+
+- x, y (float64): primer punto de la geometría; NaN si no tiene
+- idDera (float64): id_dera (exacto hasta 2^53)
+- codMun (int32): cod_mun como entero (41091); -1 si falta
+- category (int32): índice en `categories` del subtipo (tipo, tipo_abr o
+  tip_centro, igual que transform-to-dexie.cjs); -1 si no tiene
+- nombre, direccion, localidad, municipio, provincia, source (uint32):
+  índices en la tabla de cadenas; 0 es la cadena vacía
+
+La tabla de cadenas está deduplicada: `strings.offsets` (uint32, una
+entrada más que cadenas) delimita cada cadena dentro de `strings.data`
+(UTF-8).
+
+Con precisión (--precision, ver dera_precision.py) x e y se sustituyen
+por dx, dy (int32): el punto i es origin + (dx[0] + ... + dx[i]) ·
+precision, con origin y precision en la cabecera ("quantization"). Las
+features sin punto llevan `missing` (-2^31) y no avanzan la suma. Las
+columnas ocupan la mitad y, como las features llegan agrupadas por
+municipio, los deltas son pequeños y se comprimen bien en la transferencia.
+
+@version 1.0.0
+@date 2025-12-09
+"""
+
+import json
+import math
+import sys
+from array import array
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+
+from geojson_io import atomic_writer, read_feature_file
+
+# ============================================================================
+# CONFIGURACIÓN
+# ============================================================================
+
+COLUMNAR_SUFFIX = ".columnar.bin"
+COLUMNAR_MAGIC = b"DERACOL1"
+COLUMNAR_VERSION = 1
+ALIGNMENT = 8
+
+FLOAT_COLUMNS = ("x", "y", "idDera")
+INT_COLUMNS = ("codMun", "category")
+STRING_COLUMNS = {
+    "nombre": "nombre",
+    "direccion": "direccion",
+    "localidad": "localidad",
+    "municipio": "municipio",
+    "provincia": "provincia",
+    "source": "_source",
+}
+
+# Código de array → tipo de la cabecera (nombre del typed array sin "Array")
+_TYPES = {"d": "float64", "i": "int32", "I": "uint32"}
+MISSING_DELTA = -2 ** 31
+
+
+def columnar_path(output_dir: Path, layer: str) -> Path:
+    return Path(output_dir) / f"{layer}{COLUMNAR_SUFFIX}"
+
+
+def first_point(geometry: Optional[dict]):
+    """Primer punto de la geometría (Point o MultiPoint); (nan, nan) si no hay."""
+    coordinates = (geometry or {}).get("coordinates")
+    while isinstance(coordinates, list) and coordinates and isinstance(coordinates[0], list):
+        coordinates = coordinates[0]
+    if not coordinates or len(coordinates) < 2:
+        return math.nan, math.nan
+    return float(coordinates[0]), float(coordinates[1])
+
+
+def _subtype(properties: dict):
+    return properties.get("tipo") or properties.get("tipo_abr") or properties.get("tip_centro")
+
+
+def _int_or(value, default: int) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+# ============================================================================
+# ESCRITURA
+# ============================================================================
+
+class ColumnarWriter:
+    """
+    Acumula las columnas de una capa según pasan las features.
+
+    Uso (igual que Fingerprint y LayerDelta):
+
+        columns = ColumnarWriter("health")
+        writer.write_features(columns.wrap(features))
+        columns.write(path)
+
+    Con `precision` (metros) x e y se escriben como enteros en delta.
+    Las columnas se guardan en arrays compactos, no en dicts: una capa de
+    miles de features ocupa unos cientos de KB.
+    """
+
+    def __init__(self, layer: str, precision: Optional[float] = None):
+        self.layer = layer
+        self.precision = precision
+        self.columns = {name: array("d") for name in FLOAT_COLUMNS}
+        self.columns.update({name: array("i") for name in INT_COLUMNS})
+        self.columns.update({name: array("I") for name in STRING_COLUMNS})
+        self.strings = [""]
+        self._string_index = {"": 0}
+        self.categories = []
+        self._category_index = {}
+        self.source_fingerprint: Optional[str] = None  # huella del GeoJSON (ver dera_sidecars.py)
+
+    @property
+    def count(self) -> int:
+        return len(self.columns["x"])
+
+    def _intern(self, value) -> int:
+        if value is None:
+            return 0
+        value = str(value)
+        index = self._string_index.get(value)
+        if index is None:
+            index = self._string_index[value] = len(self.strings)
+            self.strings.append(value)
+        return index
+
+    def _category(self, value) -> int:
+        if not value:
+            return -1
+        index = self._category_index.get(value)
+        if index is None:
+            index = self._category_index[value] = len(self.categories)
+            self.categories.append(value)
+        return index
+
+    def add(self, feature: dict):
+        properties = feature.get("properties") or {}
+        x, y = first_point(feature.get("geometry"))
+        id_dera = properties.get("id_dera")
+
+        self.columns["x"].append(x)
+        self.columns["y"].append(y)
+        self.columns["idDera"].append(float(id_dera) if id_dera is not None else math.nan)
+        self.columns["codMun"].append(_int_or(properties.get("cod_mun"), -1))
+        self.columns["category"].append(self._category(_subtype(properties)))
+        for column, prop in STRING_COLUMNS.items():
+            self.columns[column].append(self._intern(properties.get(prop)))
+
+    def wrap(self, features: Iterable[dict]) -> Iterator[dict]:
+        """Genera las mismas features añadiendo cada una a las columnas."""
+        for feature in features:
+            self.add(feature)
+            yield feature
+
+    def bbox(self) -> Optional[list]:
+        points = [(x, y) for x, y in zip(self.columns["x"], self.columns["y"]) if not math.isnan(x)]
+        if not points:
+            return None
+        xs, ys = zip(*points)
+        return [min(xs), min(ys), max(xs), max(ys)]
+
+    def _origin(self) -> Optional[list]:
+        bbox = self.bbox()
+        if bbox is None:
+            return None
+        return [math.floor(bbox[0] / self.precision) * self.precision,
+                math.floor(bbox[1] / self.precision) * self.precision]
+
+    def _deltas(self, origin: list):
+        """Columnas dx, dy: pasos de `precision` desde el punto anterior (o desde origin)."""
+        dx, dy = array("i"), array("i")
+        last_x = last_y = 0
+        for x, y in zip(self.columns["x"], self.columns["y"]):
+            if math.isnan(x):
+                dx.append(MISSING_DELTA)
+                dy.append(MISSING_DELTA)
+                continue
+            qx = round((x - origin[0]) / self.precision)
+            qy = round((y - origin[1]) / self.precision)
+            dx.append(qx - last_x)
+            dy.append(qy - last_y)
+            last_x, last_y = qx, qy
+        return dx, dy
+
+    def _blocks(self):
+        """(nombre, bytes, tipo, longitud) de cada bloque en orden de escritura."""
+        encoded = [s.encode("utf-8") for s in self.strings]
+        offsets = array("I", [0])
+        for data in encoded:
+            offsets.append(offsets[-1] + len(data))
+
+        columns = list(self.columns.items())
+        if self.precision:
+            dx, dy = self._deltas(self._origin() or [0.0, 0.0])
+            columns = [("dx", dx), ("dy", dy)] + [c for c in columns if c[0] not in ("x", "y")]
+
+        blocks = []
+        for name, values in columns + [("strings.offsets", offsets)]:
+            if sys.byteorder != "little":
+                values = array(values.typecode, values)
+                values.byteswap()
+            blocks.append((name, values.tobytes(), _TYPES[values.typecode], len(values)))
+        blob = b"".join(encoded)
+        blocks.append(("strings.data", blob, "utf8", len(blob)))
+        return blocks
+
+    def to_bytes(self) -> bytes:
+        blocks = self._blocks()
+        header = {
+            "version": COLUMNAR_VERSION,
+            "layer": self.layer,
+            "count": self.count,
+            "crs": "EPSG:25830",
+            "bbox": self.bbox(),
+            "categories": self.categories,
+            "columns": {},
+            "strings": {},
+        }
+        if self.source_fingerprint:
+            header["sourceFingerprint"] = self.source_fingerprint
+        if self.precision:
+            header["quantization"] = {
+                "precision": self.precision,
+                "origin": self._origin() or [0.0, 0.0],
+                "missing": MISSING_DELTA,
+            }
+
+        # La cabecera contiene los offsets, que dependen de su propia longitud:
+        # se estima, se calcula y se repite hasta que la longitud no cambia.
+        header_length = 0
+        while True:
+            offset = _align(16 + header_length)
+            for name, data, kind, length in blocks:
+                target = header["strings"] if name.startswith("strings.") else header["columns"]
+                target[name.split(".")[-1]] = {"type": kind, "offset": offset, "length": length}
+                offset = _align(offset + len(data))
+            text = json.dumps(header, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            padded = _align(len(text))
+            if padded == header_length:
+                break
+            header_length = padded
+
+        out = bytearray(COLUMNAR_MAGIC)
+        out += header_length.to_bytes(4, "little") + bytes(4)
+        out += text + b" " * (header_length - len(text))
+        for _, data, _, _ in blocks:
+            out += bytes(_align(len(out)) - len(out))
+            out += data
+        return bytes(out)
+
+    def write(self, path: Path) -> int:
+        """Escribe el archivo de forma atómica. Retorna su tamaño en bytes."""
+        data = self.to_bytes()
+        with atomic_writer(path, "wb") as f:
+            f.write(data)
+        return len(data)
+
+
+def _align(offset: int) -> int:
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def columns_from_geojson(geojson_path: Path, layer: str,
+                         precision: Optional[float] = None) -> ColumnarWriter:
+    """Columnas de un GeoJSON ya publicado (capas sin cambios en el servidor)."""
+    columns = ColumnarWriter(layer, precision)
+    for feature in read_feature_file(geojson_path):
+        columns.add(feature)
+    return columns
+
+
+def write_columnar_from_geojson(geojson_path: Path, path: Path, layer: str,
+                                precision: Optional[float] = None) -> int:
+    """Genera el columnar de un GeoJSON ya publicado. Retorna count."""
+    columns = columns_from_geojson(geojson_path, layer, precision)
+    columns.write(path)
+    return columns.count
+
+
+# ============================================================================
+# LECTURA
+# ============================================================================
+
+def _parse_header(buffer: bytes, path: Path) -> dict:
+    if buffer[:8] != COLUMNAR_MAGIC:
+        raise ValueError(f"{path}: no es un archivo columnar DERA")
+    header_length = int.from_bytes(buffer[8:12], "little")
+    return json.loads(buffer[16:16 + header_length].decode("utf-8"))
+
+
+def read_columnar_header(path: Path) -> dict:
+    """Solo la cabecera JSON, sin leer las columnas."""
+    with open(path, "rb") as f:
+        prefix = f.read(16)
+        return _parse_header(prefix + f.read(int.from_bytes(prefix[8:12], "little")), path)
+
+
+def read_columnar(path: Path) -> dict:
+    """
+    Lee un archivo columnar (validación y tests; el cliente lo lee con
+    typed arrays). Retorna la cabecera con "data": {columna: lista} y
+    "strings": lista de cadenas. Las columnas dx, dy se decodifican a x, y.
+    """
+    buffer = Path(path).read_bytes()
+    header = _parse_header(buffer, path)
+
+    typecodes = {kind: code for code, kind in _TYPES.items()}
+    data = {}
+    for name, column in header["columns"].items():
+        values = array(typecodes[column["type"]])
+        values.frombytes(buffer[column["offset"]:column["offset"] + column["length"] * values.itemsize])
+        if sys.byteorder != "little":
+            values.byteswap()
+        data[name] = values.tolist()
+
+    quantization = header.get("quantization")
+    if quantization:
+        for axis, origin in zip(("x", "y"), quantization["origin"]):
+            position, decoded = 0, []
+            for delta in data.pop("d" + axis):
+                if delta == quantization["missing"]:
+                    decoded.append(math.nan)
+                    continue
+                position += delta
+                decoded.append(origin + position * quantization["precision"])
+            data[axis] = decoded
+
+    offsets = array("I")
+    meta = header["strings"]["offsets"]
+    offsets.frombytes(buffer[meta["offset"]:meta["offset"] + meta["length"] * offsets.itemsize])
+    if sys.byteorder != "little":
+        offsets.byteswap()
+    blob = buffer[header["strings"]["data"]["offset"]:]
+    header["data"] = data
+    header["strings"] = [
+        blob[start:end].decode("utf-8") for start, end in zip(offsets, offsets[1:])
+    ]
+    return header
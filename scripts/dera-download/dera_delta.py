@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+dera_delta.py
+
+Paquetes delta por feature entre versiones de una capa DERA.
+
+Por cada capa se mantiene un manifiesto con el hash del contenido de cada
+feature, indexado por id_dera (public/data/dera/delta/<capa>.manifest.json).
+En cada refresco se compara la descarga con el manifiesto y, si hay
+diferencias, se escribe delta/<capa>-v<N>.json con las features añadidas,
+modificadas y los id_dera eliminados. Un cliente en la versión N-1 aplica
+el delta en lugar de recargar la capa completa.
+
+La primera descarga (sin manifiesto) solo establece la versión 1: no hay
+nada contra lo que comparar.
+
+Con max_memory (--max-memory) las features añadidas y modificadas se
+acumulan en SpillBuffer, con la mitad del presupuesto cada una (ver
+dera_spill.py), y el delta se escribe
+recorriéndolas: un refresco que cambia la capa entera no la carga en
+memoria.
+
+@version 1.0.0
+@date 2025-12-09
+"""
+
+import hashlib
+import json
+import re
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from dera_spill import SpillBuffer
+from dera_state import canonical_json
+from geojson_io import atomic_writer, write_json
+
+# ============================================================================
+# CONFIGURACIÓN
+# ============================================================================
+
+DELTA_DIRNAME = "delta"
+DELTA_HISTORY = 10  # deltas conservados por capa (clientes hasta N versiones atrás)
+HASH_LENGTH = 16  # caracteres hex del hash por feature (64 bits)
+
+
+def feature_key(feature: dict) -> Optional[str]:
+    """Clave estable de una feature: id_dera, o el id WFS si no lo tiene."""
+    value = feature.get("properties", {}).get("id_dera", feature.get("id"))
+    return None if value is None else str(value)
+
+
+def feature_hash(feature: dict) -> str:
+    return hashlib.sha256(canonical_json(feature)).hexdigest()[:HASH_LENGTH]
+
+
+def manifest_path(delta_dir: Path, layer: str) -> Path:
+    return Path(delta_dir) / f"{layer}.manifest.json"
+
+
+def delta_path(delta_dir: Path, layer: str, version: int) -> Path:
+    return Path(delta_dir) / f"{layer}-v{version}.json"
+
+
+def load_manifest(delta_dir: Path, layer: str) -> Optional[dict]:
+    """Manifiesto {"version", "features": {id: hash}} o None si no existe."""
+    try:
+        with open(manifest_path(delta_dir, layer), encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(manifest.get("version"), int) or not isinstance(manifest.get("features"), dict):
+        return None
+    return manifest
+
+
+def list_deltas(delta_dir: Path, layer: str) -> List[int]:
+    """Versiones destino de los deltas disponibles de una capa, ordenadas."""
+    pattern = re.compile(rf"^{re.escape(layer)}-v(\d+)\.json$")
+    versions = []
+    for path in Path(delta_dir).glob(f"{layer}-v*.json"):
+        match = pattern.match(path.name)
+        if match:
+            versions.append(int(match.group(1)))
+    return sorted(versions)
+
+
+# ============================================================================
+# SEGUIMIENTO DE CAMBIOS
+# ============================================================================
+
+class LayerDelta:
+    """
+    Compara las features de una descarga con el manifiesto anterior.
+
+    Uso:
+        delta = LayerDelta("health", OUTPUT_DIR / "delta")
+        write(delta.wrap(features))
+        summary = delta.commit()   # solo si la escritura terminó bien
+
+    En memoria solo se guardan los hashes y las features que cambian.
+    """
+
+    def __init__(self, layer: str, delta_dir: Path, history: int = DELTA_HISTORY,
+                 max_memory: Optional[int] = None):
+        self.layer = layer
+        self.delta_dir = Path(delta_dir)
+        self.history = history
+        self.previous = load_manifest(self.delta_dir, layer)
+        self.hashes: Dict[str, str] = {}
+        # Presupuesto repartido: entre las dos no pasan de max_memory
+        share = None if max_memory is None else max(1, max_memory // 2)
+        self.added = SpillBuffer(share)
+        self.modified = SpillBuffer(share)
+        self.unkeyed = 0
+
+    def wrap(self, features: Iterable[dict]) -> Iterator[dict]:
+        """Deja pasar las features clasificándolas por el camino."""
+        old = self.previous["features"] if self.previous else None
+        for feature in features:
+            key = feature_key(feature)
+            if key is None:
+                self.unkeyed += 1
+            else:
+                digest = feature_hash(feature)
+                self.hashes[key] = digest
+                if old is not None:
+                    if key not in old:
+                        self.added.append(feature)
+                    elif old[key] != digest:
+                        self.modified.append(feature)
+            yield feature
+
+    @property
+    def removed(self) -> List[str]:
+        if not self.previous:
+            return []
+        return sorted(key for key in self.previous["features"] if key not in self.hashes)
+
+    def commit(self) -> Optional[dict]:
+        """
+        Publica el delta y el nuevo manifiesto.
+
+        Retorna el resumen {"version", "file", "added", "modified",
+        "removed", "bytes"} o None si no hay delta (primera versión o sin
+        cambios).
+        """
+        if self.previous is None:
+            write_json(manifest_path(self.delta_dir, self.layer), {"version": 1, "features": self.hashes})
+            return None
+
+        removed = self.removed
+        if not (self.added or self.modified or removed):
+            return None
+
+        version = self.previous["version"] + 1
+        path = delta_path(self.delta_dir, self.layer, version)
+        _write_delta(path, {
+            "layer": self.layer,
+            "fromVersion": version - 1,
+            "toVersion": version,
+            "added": self.added,
+            "modified": self.modified,
+            "removed": removed,
+        })
+        write_json(manifest_path(self.delta_dir, self.layer), {"version": version, "features": self.hashes})
+        self._prune(version)
+
+        summary = {
+            "version": version,
+            "file": path.name,
+            "added": len(self.added),
+            "modified": len(self.modified),
+            "removed": len(removed),
+            "bytes": path.stat().st_size,
+        }
+        self.added.close()
+        self.modified.close()
+        return summary
+
+    def _prune(self, version: int):
+        for old in list_deltas(self.delta_dir, self.layer):
+            if old <= version - self.history:
+                delta_path(self.delta_dir, self.layer, old).unlink(missing_ok=True)
+
+
+def _write_delta(path: Path, document: dict):
+    """
+    write_json compacto (mismos bytes), pero las listas de features se
+    escriben recorriéndolas: pueden ser SpillBuffer con parte en disco.
+    """
+    dumps = lambda value: json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+    with atomic_writer(path) as f:
+        for i, (key, value) in enumerate(document.items()):
+            f.write(("{" if i == 0 else ",") + dumps(key) + ":")
+            if isinstance(value, SpillBuffer):
+                f.write("[")
+                for j, feature in enumerate(value):
+                    f.write(("," if j else "") + dumps(feature))
+                f.write("]")
+            else:
+                f.write(dumps(value))
+        f.write("}")
+
+
+def delta_index(delta_dir: Path, layers: Iterable[str]) -> dict:
+    """Índice para metadata.json: versión actual y deltas disponibles por capa."""
+    index = {}
+    for layer in layers:
+        manifest = load_manifest(delta_dir, layer)
+        if manifest is None:
+            continue
+        index[layer] = {
+            "version": manifest["version"],
+            "deltas": [delta_path(delta_dir, layer, v).name for v in list_deltas(delta_dir, layer)],
+        }
+    return index
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+dera_engine.py
+
+Motor de descarga concurrente compartido por download_dera.py y
+download_dera_actions.py.
+
+- Sondeo barato de conteos (resultType=hits) para planificar la ejecución
+- Planificación "largest-first": las capas más grandes arrancan primero
+- Pool de workers (el límite por host lo aplica wfs_http)
+- Agrupación de typeNames por endpoint para pedirlos en un solo GetFeature
+
+@version 1.0.0
+@date 2025-12-08
+"""
+
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlencode
+
+import requests
+
+from wfs_http import http_get
+
+# ============================================================================
+# CONFIGURACIÓN
+# ============================================================================
+
+DEFAULT_JOBS = 1
+PROBE_TIMEOUT = 20  # segundos
+
+_NUMBER_MATCHED_RE = re.compile(r'numberMatched="(\d+)"')
+
+
+# ============================================================================
+# PLANIFICACIÓN
+# ============================================================================
+
+def probe_hits(url: str, layer: str, timeout: int = PROBE_TIMEOUT,
+               bbox: Optional[str] = None) -> Optional[int]:
+    """
+    Obtiene numberMatched de una capa con resultType=hits (sin descargar
+    features). `bbox` restringe el conteo a una ventana ("minx,miny,maxx,maxy,crs").
+    """
+    params = {
+        "service": "WFS",
+        "version": "2.0.0",
+        "request": "GetFeature",
+        "typeNames": layer,
+        "resultType": "hits",
+    }
+    if bbox:
+        params["bbox"] = bbox
+    request_url = f"{url}?{urlencode(params)}"
+
+    try:
+        response = http_get(request_url, timeout=timeout)
+        response.raise_for_status()
+    except requests.exceptions.RequestException:
+        return None
+
+    return parse_number_matched(response.text)
+
+
+def parse_number_matched(text: str) -> Optional[int]:
+    """Extrae numberMatched de una respuesta WFS 2.0 resultType=hits."""
+    match = _NUMBER_MATCHED_RE.search(text)
+    return int(match.group(1)) if match else None
+
+
+def plan_layers(sources: Dict[str, Iterable[Tuple[str, str]]],
+                probe: Callable[[str, str], Optional[int]] = probe_hits) -> List[Tuple[str, Optional[int]]]:
+    """
+    Ordena las capas de mayor a menor según el conteo sondeado.
+
+    sources: {clave: [(url, typeName), ...]}
+    Las capas cuyo sondeo falla van primero: su tamaño es desconocido
+    y arrancarlas tarde podría dejarlas como cola de la ejecución.
+    """
+    plan = []
+    for key, layer_sources in sources.items():
+        total: Optional[int] = 0
+        for url, layer in layer_sources:
+            hits = probe(url, layer)
+            if hits is None:
+                total = None
+                break
+            total += hits
+        plan.append((key, total))
+
+    plan.sort(key=lambda item: float("inf") if item[1] is None else item[1], reverse=True)
+    return plan
+
+
+def coalesce_sources(sources: Iterable[tuple]) -> List[Tuple[str, List[tuple]]]:
+    """
+    Agrupa fuentes consecutivas del mismo endpoint: [(url, [fuente, ...])].
+
+    Cada fuente es una tupla cuyo primer elemento es la URL. Solo se unen
+    fuentes contiguas, de modo que el orden de las features no cambia.
+    """
+    groups: List[Tuple[str, List[tuple]]] = []
+    for source in sources:
+        if groups and groups[-1][0] == source[0]:
+            groups[-1][1].append(source)
+        else:
+            groups.append((source[0], [source]))
+    return groups
+
+
+def local_type_name(feature_id) -> str:
+    """Tipo de una feature a partir de su id WFS ("g12_01_CentroSalud.42")."""
+    return str(feature_id).rsplit(".", 1)[0] if feature_id is not None else ""
+
+
+# ============================================================================
+# EJECUCIÓN
+# ============================================================================
+
+def run_layers(keys: List[str], worker: Callable[[str], object],
+               jobs: int = DEFAULT_JOBS,
+               on_error: Optional[Callable[[str, Exception], None]] = None) -> Dict[str, object]:
+    """
+    Ejecuta worker(clave) para cada capa con un pool de `jobs` hilos.
+
+    Las claves se envían en el orden recibido (usar plan_layers para
+    largest-first). Devuelve {clave: resultado} en ese mismo orden.
+    Una excepción en un worker no detiene al resto: su resultado es False
+    y se notifica con on_error(clave, excepción), para que cada script la
+    registre con su propio log.
+    """
+    results: Dict[str, object] = {}
+
+    def failed(key: str, error: Exception):
+        if on_error:
+            on_error(key, error)
+        results[key] = False
+
+    if jobs <= 1:
+        for key in keys:
+            try:
+                results[key] = worker(key)
+            except Exception as e:
+                failed(key, e)
+        return results
+
+    with ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="dera") as executor:
+        futures = [(key, executor.submit(worker, key)) for key in keys]
+        for key, future in futures:
+            try:
+                results[key] = future.result()
+            except Exception as e:
+                failed(key, e)
+    return results
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+dera_metrics.py
+
+Métricas estructuradas de una ejecución de descarga DERA (--metrics-dir).
+
+Se registran en METRICS, compartido por todos los hilos:
+- cada petición HTTP (wfs_http): host, capa, startIndex, estado, latencia
+  hasta cabeceras, duración total y bytes recibidos
+- reintentos por función
+- features por página (o por respuesta) y capa
+- duración de cada etapa (fetch_wfs_features, write_category_geojson,
+  download_layer, process_category) por capa
+
+Al terminar se escriben dos archivos:
+- dera-metrics.json: informe de la ejecución con los histogramas y la
+  lista de peticiones (hasta MAX_REQUEST_EVENTS)
+- dera.prom: formato textfile de Prometheus (node_exporter
+  --collector.textfile.directory) con los mismos histogramas
+
+Los histogramas usan cubos fijos (REQUEST_BUCKETS, PAGE_BUCKETS) para que
+las ejecuciones de distintos trimestres se puedan comparar cubo a cubo.
+
+@version 1.0.0
+@date 2025-12-09
+"""
+
+import functools
+import inspect
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ExitStack, contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from geojson_io import atomic_writer, write_json
+
+# ============================================================================
+# CONFIGURACIÓN
+# ============================================================================
+
+METRICS_JSON_FILENAME = "dera-metrics.json"
+METRICS_PROM_FILENAME = "dera.prom"
+PREFIX = "dera"
+MAX_REQUEST_EVENTS = 10_000
+
+# Segundos (latencia hasta cabeceras y duración de peticiones)
+REQUEST_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Features por página o respuesta
+PAGE_BUCKETS = (0, 10, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(**labels) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+
+def request_labels(url: str) -> dict:
+    """Host, capa (typeName) y startIndex de una URL GetFeature."""
+    parsed = urlparse(url)
+    params = {k.lower(): v[0] for k, v in parse_qs(parsed.query).items()}
+    return {
+        "host": parsed.netloc,
+        "layer": params.get("typenames") or params.get("typename"),
+        "startIndex": params.get("startindex"),
+    }
+
+
+class Histogram:
+    """Histograma acumulativo al estilo Prometheus (le = límite superior)."""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # el último es +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """[(le, conteo acumulado)] incluido +Inf."""
+        total, result = 0, []
+        for le, count in zip(list(self.buckets) + ["+Inf"], self.counts):
+            total += count
+            result.append((le, total))
+        return result
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "buckets": {str(le): n for le, n in self.cumulative()},
+        }
+
+
+# ============================================================================
+# REGISTRO
+# ============================================================================
+
+class Metrics:
+    """Registro de métricas de la ejecución. Es seguro usarlo desde varios hilos."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Context managers (name, layer) que envuelven cada etapa además
+        # de la medición; vacío salvo con --profile (dera_profile)
+        self.stage_hooks = []
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self.histograms: Dict[Tuple[str, Labels], Histogram] = {}
+            self.counters: Dict[Tuple[str, Labels], float] = {}
+            self.stages: Dict[Labels, float] = {}
+            self.requests = []
+            self.dropped_requests = 0
+
+    def _histogram(self, name: str, labels: Labels, buckets) -> Histogram:
+        key = (name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram(buckets)
+        return histogram
+
+    def _count(self, name: str, labels: Labels, value: float = 1):
+        key = (name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe_request(self, url: str, status: Optional[int], latency: float,
+                        duration: float, received: int):
+        """Una petición HTTP terminada (status None = sin respuesta)."""
+        info = request_labels(url)
+        status_label = str(status) if status is not None else "error"
+        with self._lock:
+            self._histogram("http_request_latency_seconds", _labels(host=info["host"]),
+                            REQUEST_BUCKETS).observe(latency)
+            self._histogram("http_request_duration_seconds", _labels(host=info["host"]),
+                            REQUEST_BUCKETS).observe(duration)
+            self._count("http_requests_total", _labels(host=info["host"], status=status_label))
+            self._count("http_received_bytes_total", _labels(host=info["host"]), received)
+            if len(self.requests) < MAX_REQUEST_EVENTS:
+                self.requests.append({
+                    **info,
+                    "status": status,
+                    "latency": round(latency, 6),
+                    "duration": round(duration, 6),
+                    "bytes": received,
+                    "at": round(time.time() - self.started, 3),
+                })
+            else:
+                self.dropped_requests += 1
+
+    def observe_page(self, layer: str, features: int):
+        """Features recibidas en una página o respuesta de una capa."""
+        with self._lock:
+            self._histogram("features_per_page", _labels(layer=layer), PAGE_BUCKETS).observe(features)
+
+    def retry(self, function: str):
+        with self._lock:
+            self._count("retries_total", _labels(function=function))
+
+    @contextmanager
+    def stage(self, name: str, layer: Optional[str] = None):
+        """Mide la duración de una etapa (se acumula si se repite)."""
+        start = time.perf_counter()
+        try:
+            if self.stage_hooks:
+                with ExitStack() as hooks:
+                    for hook in list(self.stage_hooks):
+                        hooks.enter_context(hook(name, layer))
+                    yield
+            else:
+                yield
+        finally:
+            elapsed = time.perf_counter() - start
+            labels = _labels(stage=name, layer=layer)
+            with self._lock:
+                self.stages[labels] = self.stages.get(labels, 0.0) + elapsed
+
+    def timed(self, name: str, layer_param: Optional[str] = None):
+        """
+        Decorador: mide cada llamada como la etapa `name`, con el argumento
+        `layer_param` de la función como etiqueta de capa.
+        """
+        def decorator(func):
+            signature = inspect.signature(func)
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                layer = None
+                if layer_param:
+                    layer = signature.bind_partial(*args, **kwargs).arguments.get(layer_param)
+                with self.stage(name, layer):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    # ------------------------------------------------------------------
+    # Salida
+    # ------------------------------------------------------------------
+
+    def report(self) -> dict:
+        """Informe de la ejecución (JSON)."""
+        with self._lock:
+            histograms: Dict[str, list] = {}
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                histograms.setdefault(name, []).append({"labels": dict(labels), **histogram.to_dict()})
+            counters: Dict[str, list] = {}
+            for (name, labels), value in sorted(self.counters.items()):
+                counters.setdefault(name, []).append({"labels": dict(labels), "value": value})
+            return {
+                "startedAt": datetime.utcfromtimestamp(self.started).isoformat() + "Z",
+                "durationSeconds": round(time.time() - self.started, 3),
+                "histograms": histograms,
+                "counters": counters,
+                "stages": [{**dict(labels), "seconds": round(seconds, 6)}
+                           for labels, seconds in sorted(self.stages.items())],
+                "requests": list(self.requests),
+                "droppedRequests": self.dropped_requests,
+            }
+
+    def prometheus(self) -> str:
+        """Las mismas métricas en formato de exposición de Prometheus."""
+        lines = []
+        with self._lock:
+            seen = set()
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                metric = f"{PREFIX}_{name}"
+                if metric not in seen:
+                    seen.add(metric)
+                    lines.append(f"# TYPE {metric} histogram")
+                for le, count in histogram.cumulative():
+                    lines.append(f"{metric}_bucket{_format_labels(labels + (('le', str(le)),))} {count}")
+                lines.append(f"{metric}_sum{_format_labels(labels)} {histogram.sum:.6f}")
+                lines.append(f"{metric}_count{_format_labels(labels)} {histogram.count}")
+            for (name, labels), value in sorted(self.counters.items()):
+                metric = f"{PREFIX}_{name}"
+                if metric not in seen:
+                    seen.add(metric)
+                    lines.append(f"# TYPE {metric} counter")
+                lines.append(f"{metric}{_format_labels(labels)} {value:g}")
+            if self.stages:
+                lines.append(f"# TYPE {PREFIX}_stage_duration_seconds gauge")
+                for labels, seconds in sorted(self.stages.items()):
+                    lines.append(f"{PREFIX}_stage_duration_seconds{_format_labels(labels)} {seconds:.6f}")
+            lines.append(f"# TYPE {PREFIX}_last_run_timestamp_seconds gauge")
+            lines.append(f"{PREFIX}_last_run_timestamp_seconds {self.started:.0f}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, directory: Path) -> Tuple[Path, Path]:
+        """Escribe dera-metrics.json y dera.prom (atómicos). Retorna sus rutas."""
+        directory = Path(directory)
+        json_path = directory / METRICS_JSON_FILENAME
+        prom_path = directory / METRICS_PROM_FILENAME
+        write_json(json_path, self.report(), indent=2)
+        _write_text(prom_path, self.prometheus())
+        return json_path, prom_path
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escape = lambda v: v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in labels) + "}"
+
+
+def _write_text(path: Path, text: str):
+    # El colector textfile puede leer en cualquier momento: temp + rename
+    with atomic_writer(path) as f:
+        f.write(text)
+
+
+METRICS = Metrics()
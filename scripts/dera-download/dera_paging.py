@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+dera_paging.py
+
+Tamaño de página de GetFeature según las capacidades del servidor y la
+duración observada de cada petición.
+
+GetCapabilities (WFS 2.0) anuncia en OperationsMetadata dos restricciones
+que deciden cómo paginar:
+- ImplementsResultPaging: si el servidor respeta startIndex/count
+- CountDefault: máximo de features por respuesta (maxFeatures de GeoServer)
+
+CapabilitiesCache las pide una vez por endpoint. El documento se lee en
+streaming y se deja de leer al llegar a FeatureTypeList, que en DERA
+ocupa casi todo el cuerpo.
+
+PageSizer decide el COUNT de cada página de una capa:
+- parte del tamaño configurado acotado por CountDefault
+- con un objetivo de segundos por petición, tras cada página completa
+  estima cuántas features caben en ese tiempo (y en MAX_PAGE_BYTES) y
+  sube o baja un peldaño de PAGE_LADDER
+- una página corta antes de numberMatched revela un límite no anunciado:
+  pasa a ser el máximo y se sigue desde lo recibido
+- has_more() dice si falta otra página y lanza PagingError si
+  numberMatched no se puede completar (sin paginación o página vacía),
+  en lugar de dar la capa por terminada truncada
+- check_first() detecta un servidor que ignora startIndex sin
+  anunciarlo: la página siguiente empieza por la misma feature
+
+@version 1.0.0
+@date 2025-12-09
+"""
+
+import json
+import threading
+import time
+from typing import Callable, Dict, Iterable, Iterator, Optional
+from urllib.parse import urlencode, urlparse
+from xml.etree import ElementTree
+
+import requests
+
+# ============================================================================
+# CONFIGURACIÓN
+# ============================================================================
+
+TARGET_SECONDS = 5.0  # duración objetivo de cada petición GetFeature
+TOLERANCE = 1.25  # solo se baja de peldaño si la página tardó más que esto × objetivo
+PAGE_LADDER = (100, 250, 500, 1000, 2500, 5000, 10_000, 25_000, 50_000)
+MAX_PAGE_BYTES = 64 * 1024 * 1024  # cuerpo máximo de una página (ya descomprimido)
+
+PAGING_CONSTRAINT = "ImplementsResultPaging"
+COUNT_CONSTRAINT = "CountDefault"
+
+
+class PagingError(ValueError):
+    """El servidor no permite completar numberMatched por páginas."""
+
+
+# ============================================================================
+# CAPACIDADES
+# ============================================================================
+
+class Capabilities:
+    """Restricciones de paginación de un endpoint (None = no anunciada)."""
+
+    def __init__(self, paging: Optional[bool] = None, count_default: Optional[int] = None):
+        self.paging = paging
+        self.count_default = count_default
+
+    def describe(self) -> str:
+        paging = {True: "sí", False: "no", None: "?"}[self.paging]
+        return f"paginación {paging}, CountDefault {self.count_default or '?'}"
+
+    def __repr__(self):
+        return f"Capabilities(paging={self.paging!r}, count_default={self.count_default!r})"
+
+
+def capabilities_url(url: str) -> str:
+    params = {"SERVICE": "WFS", "VERSION": "2.0.0", "REQUEST": "GetCapabilities"}
+    return f"{url}?{urlencode(params)}"
+
+
+def _local(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+def parse_capabilities(chunks: Iterable[bytes]) -> Capabilities:
+    """
+    Lee ImplementsResultPaging y CountDefault de un GetCapabilities
+    recibido por bloques. Deja de leer al llegar a FeatureTypeList.
+    """
+    parser = ElementTree.XMLPullParser(events=("start", "end"))
+    values: Dict[str, str] = {}
+    for chunk in chunks:
+        parser.feed(chunk)
+        for event, element in parser.read_events():
+            tag = _local(element.tag)
+            if event == "start" and tag == "FeatureTypeList":
+                return _capabilities(values)
+            if event == "end" and tag == "Constraint" and element.get("name") in (PAGING_CONSTRAINT,
+                                                                                   COUNT_CONSTRAINT):
+                for child in element:
+                    if _local(child.tag) == "DefaultValue" and child.text:
+                        values.setdefault(element.get("name"), child.text.strip())
+    parser.close()
+    return _capabilities(values)
+
+
+def _capabilities(values: Dict[str, str]) -> Capabilities:
+    paging = values.get(PAGING_CONSTRAINT)
+    try:
+        count_default = int(values[COUNT_CONSTRAINT])
+    except (KeyError, ValueError):
+        count_default = None
+    return Capabilities(
+        paging=None if paging is None else paging.upper() == "TRUE",
+        count_default=count_default if count_default and count_default > 0 else None,
+    )
+
+
+class CapabilitiesCache:
+    """
+    Capacidades por endpoint, pedidas una sola vez.
+
+    `stream` recibe la URL GetCapabilities y retorna un generador de
+    bloques (http_stream). Si la petición o el XML fallan, el endpoint
+    queda con capacidades desconocidas (y no se vuelve a pedir). Es seguro
+    usarlo desde varios hilos: el primero que pide un endpoint lo descarga
+    y los demás esperan a su resultado.
+    """
+
+    def __init__(self, stream: Callable[[str], Iterator[bytes]]):
+        self._stream = stream
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Capabilities] = {}
+        self.errors: Dict[str, str] = {}
+
+    def get(self, url: str) -> Capabilities:
+        with self._lock:
+            if url not in self._entries:
+                self._entries[url] = self._fetch(url)
+            return self._entries[url]
+
+    def _fetch(self, url: str) -> Capabilities:
+        chunks = self._stream(capabilities_url(url))
+        try:
+            return parse_capabilities(chunks)
+        except (requests.exceptions.RequestException, ElementTree.ParseError) as e:
+            self.errors[url] = str(e)
+            return Capabilities()
+        finally:
+            chunks.close()
+
+    def describe(self, url: str) -> str:
+        host = urlparse(url).netloc
+        capabilities = self.get(url)
+        if url in self.errors:
+            return f"{host}: GetCapabilities no disponible ({self.errors[url]})"
+        return f"{host}: {capabilities.describe()}"
+
+
+# ============================================================================
+# TAMAÑO DE PÁGINA
+# ============================================================================
+
+class PageSizer:
+    """
+    COUNT de las páginas de una capa.
+
+    Uso:
+        sizer = PageSizer(1000, capabilities, TARGET_SECONDS)
+        while True:
+            count = sizer.size
+            ...pedir la página desde `fetched` con COUNT=count...
+            sizer.observe(count, received, seconds, nbytes)
+            fetched += received
+            if not sizer.has_more(count, received, fetched, number_matched):
+                break
+
+    Con target=None el tamaño solo cambia por los límites del servidor.
+    """
+
+    def __init__(self, initial: int, capabilities: Optional[Capabilities] = None,
+                 target: Optional[float] = None):
+        capabilities = capabilities or Capabilities()
+        self.paging = capabilities.paging
+        self.limit = capabilities.count_default
+        self.target = target
+        if self.paging is False:
+            # startIndex se ignora: una sola petición, tan grande como se admita
+            initial = self.limit or PAGE_LADDER[-1]
+        self.size = self._bounded(initial)
+        self._first = None  # primera feature de la última página, en JSON
+
+    def _bounded(self, size: int) -> int:
+        if self.limit:
+            size = min(size, self.limit)
+        return max(1, size)
+
+    def observe(self, requested: int, received: int, seconds: float, nbytes: int = 0) -> int:
+        """
+        Ajusta el tamaño tras una página. Solo cuentan las completas: la
+        última de una capa es corta y no dice nada de la duración.
+        """
+        if self.target is None or received == 0 or received < requested or seconds <= 0:
+            return self.size
+        wanted = self.target * received / seconds
+        if nbytes:
+            wanted = min(wanted, MAX_PAGE_BYTES * received / nbytes)
+
+        if wanted * TOLERANCE < self.size:
+            smaller = [s for s in PAGE_LADDER if s < self.size]
+            if smaller:
+                self.size = self._bounded(smaller[-1])
+        else:
+            larger = [s for s in PAGE_LADDER if s > self.size]
+            if larger and wanted >= larger[0]:
+                self.size = self._bounded(larger[0])
+        return self.size
+
+    def observe_limit(self, received: int):
+        """El servidor devolvió `received` (< COUNT) sin llegar al final: es su máximo."""
+        if received and (self.limit is None or received < self.limit):
+            self.limit = received
+            self.size = self._bounded(self.size)
+
+    def has_more(self, requested: int, received: int, fetched: int, expected,
+                 observe: bool = True) -> bool:
+        """
+        True si falta otra página tras recibir `received` de `requested`
+        (`fetched` en total, `expected` = numberMatched o None).
+
+        observe=False para páginas leídas del diario de --resume: se
+        guardaron con otro tamaño y no dicen nada del límite del servidor.
+        """
+        if not isinstance(expected, int):
+            # Sin numberMatched solo una página completa indica que hay más
+            return received >= requested > 0
+        if fetched >= expected:
+            return False
+        if received == 0:
+            raise PagingError(f"conteo incompleto {fetched}/{expected}: página vacía")
+        if self.paging is False:
+            raise PagingError(f"conteo incompleto {fetched}/{expected}: el servidor no admite "
+                              f"paginación ({PAGING_CONSTRAINT}=FALSE)")
+        if observe and received < requested:
+            self.observe_limit(received)
+        return True
+
+    def check_first(self, feature: dict, start: int):
+        """Primera feature de la página que empieza en `start` (antes de entregarla)."""
+        first = json.dumps(feature, sort_keys=True)
+        if start and first == self._first:
+            raise PagingError(f"el servidor ignora startIndex ({start}): la página repite la anterior")
+        self._first = first
+
+
+class TransferMeter:
+    """Bytes y segundos de una respuesta recibida por bloques."""
+
+    def __init__(self):
+        self.bytes = 0
+        self.seconds = 0.0
+
+    def wrap(self, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        # La petición se lanza al pedir el primer bloque (http_stream)
+        start = time.perf_counter()
+        try:
+            for chunk in chunks:
+                self.bytes += len(chunk)
+                yield chunk
+        finally:
+            self.seconds = time.perf_counter() - start
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+dera_precision.py
+
+Política de precisión de coordenadas por capa (--precision).
+
+El WFS devuelve coordenadas EPSG:25830 con 8 decimales (190372.28344586):
+precisión submilimétrica que no aporta nada para situar un parque de
+bomberos y que ocupa ~17 bytes por punto en cada GeoJSON. Con la política
+activa, cada coordenada se redondea al múltiplo de la precisión de su capa
+durante la escritura (antes de la huella y del delta, que así describen lo
+publicado).
+
+Quantizer lleva la cuenta de lo ahorrado y del error introducido:
+- bytes: caracteres de los números de las coordenadas antes y después
+  (lo mismo que ocupan en el GeoJSON compacto)
+- maxError: mayor distancia en metros entre un punto original y el
+  redondeado (como mucho precisión · √2 / 2)
+
+La misma precisión se usa en el columnar (ver dera_columnar.py) para
+guardar x/y como enteros int32 codificados en delta.
+
+@version 1.0.0
+@date 2025-12-09
+"""
+
+import math
+from decimal import Decimal
+from typing import Dict, Iterable, Iterator, List, Optional
+
+# ============================================================================
+# CONFIGURACIÓN
+# ============================================================================
+
+DEFAULT_PRECISION = 1.0  # metros
+
+# Precisión por capa en metros (las capas no listadas usan DEFAULT_PRECISION)
+PRECISION = {
+    "health": 1.0,
+    "security": 1.0,
+    "education": 1.0,
+    "municipal": 1.0,
+    "emergency": 1.0,
+    # Parques eólicos: el punto representa una instalación de cientos de metros
+    "energy": 10.0,
+}
+
+
+def _positive(value: str) -> float:
+    try:
+        meters = float(value)
+    except ValueError:
+        meters = math.nan
+    if not meters > 0 or math.isinf(meters):
+        raise ValueError(f"Precisión no válida: {value!r} (metros, mayor que 0)")
+    return meters
+
+
+class PrecisionPolicy:
+    """Precisión en metros de cada capa."""
+
+    def __init__(self, default: float = DEFAULT_PRECISION, layers: Optional[Dict[str, float]] = None):
+        self.default = default
+        self.layers = dict(PRECISION if layers is None else layers)
+
+    @classmethod
+    def from_args(cls, values: Optional[List[str]], known_layers: Iterable[str]) -> Optional["PrecisionPolicy"]:
+        """
+        Política de los argumentos de --precision; None si no se pasó.
+
+        Sin valores se usa PRECISION. "0.1" fija la precisión de todas las
+        capas y "health=0.1" la de una sola (se admiten varios, separados
+        por espacios o comas).
+        """
+        if values is None:
+            return None
+        policy = cls()
+        known_layers = set(known_layers)
+        for spec in (v.strip() for value in values for v in value.split(",") if v.strip()):
+            layer, sep, meters = spec.rpartition("=")
+            if not sep:
+                policy.default = _positive(meters)
+                policy.layers = {}
+            elif layer not in known_layers:
+                raise ValueError(f"Capa desconocida en --precision: {layer!r} ({', '.join(sorted(known_layers))})")
+            else:
+                policy.layers[layer] = _positive(meters)
+        return policy
+
+    def for_layer(self, layer: str) -> float:
+        return self.layers.get(layer, self.default)
+
+
+def format_meters(meters: float) -> str:
+    return f"{meters:g} m"
+
+
+# ============================================================================
+# REDONDEO
+# ============================================================================
+
+class Quantizer:
+    """
+    Redondea las coordenadas de las features al múltiplo de `precision`.
+
+    Uso (igual que Fingerprint y LayerDelta):
+
+        quantizer = Quantizer(1.0)
+        writer.write_features(quantizer.wrap(features))
+        quantizer.saved, quantizer.max_error
+    """
+
+    def __init__(self, precision: float):
+        self.precision = precision
+        exponent = Decimal(repr(precision)).normalize().as_tuple().exponent
+        self.decimals = max(0, -exponent)
+        self.points = 0
+        self.max_error = 0.0
+        self.bytes_before = 0
+        self.bytes_after = 0
+
+    @property
+    def saved(self) -> int:
+        """Bytes ahorrados en los números de las coordenadas."""
+        return self.bytes_before - self.bytes_after
+
+    def value(self, v: float):
+        """Coordenada redondeada; entera si la precisión no tiene decimales."""
+        q = round(v / self.precision) * self.precision
+        return int(round(q)) if self.decimals == 0 else round(q, self.decimals)
+
+    def _coordinates(self, coordinates):
+        if not coordinates or not isinstance(coordinates[0], (int, float)):
+            return [self._coordinates(part) for part in coordinates or ()]
+        x, y = coordinates[0], coordinates[1]
+        qx, qy = self.value(x), self.value(y)
+        self.points += 1
+        self.max_error = max(self.max_error, math.hypot(qx - x, qy - y))
+        self.bytes_before += len(repr(x)) + len(repr(y))
+        self.bytes_after += len(repr(qx)) + len(repr(qy))
+        return [qx, qy, *coordinates[2:]]
+
+    def add(self, feature: dict) -> dict:
+        geometry = feature.get("geometry")
+        if geometry and geometry.get("coordinates") is not None:
+            geometry["coordinates"] = self._coordinates(geometry["coordinates"])
+        return feature
+
+    def wrap(self, features: Iterable[dict]) -> Iterator[dict]:
+        """Genera las mismas features con las coordenadas redondeadas."""
+        for feature in features:
+            yield self.add(feature)
+
+    def summary(self) -> str:
+        return (f"precisión {format_meters(self.precision)}: {self.saved / 1024:.1f} KB menos en "
+                f"{self.points} puntos, error máximo {self.max_error:.3f} m")
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+dera_profile.py
+
+Modo de perfilado por etapas (--profile).
+
+Se engancha a las mismas etapas que dera_metrics (fetch_wfs_features,
+write_category_geojson, download_layer, process_category) a través de
+METRICS.stage_hooks, así que sin --profile
+no hay ningún coste añadido: la lista de ganchos está vacía.
+
+Por etapa y capa se anota:
+- wallSeconds y cpuSeconds (CPU del hilo que ejecuta la etapa); la
+  diferencia (waitSeconds) es sobre todo espera de red y de disco
+- con "cprofile": las funciones con más tiempo acumulado y un volcado
+  <etapa>-<capa>.pstats (snakeviz, python -m pstats)
+- con "tracemalloc": pico de memoria asignada durante la etapa y las
+  líneas que más memoria retienen al terminar
+
+cProfile solo puede perfilar una etapa a la vez (Python 3.12 no admite
+dos perfiladores activos): con --jobs o etapas anidadas, las que empiezan
+mientras otra se perfila llevan solo tiempos. El pico de tracemalloc es
+del proceso, así que con etapas en paralelo incluye lo de las demás.
+
+Salida en el directorio de artefactos: profile.json y profile.txt.
+
+@version 1.0.0
+@date 2025-12-09
+"""
+
+import cProfile
+import pstats
+import re
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional
+
+from geojson_io import write_json
+
+# ============================================================================
+# CONFIGURACIÓN
+# ============================================================================
+
+PROFILE_MODES = ("cprofile", "tracemalloc")
+DEFAULT_PROFILE_ROOT = Path("dera-profile")
+PROFILE_JSON_FILENAME = "profile.json"
+PROFILE_TEXT_FILENAME = "profile.txt"
+TOP_FUNCTIONS = 15
+TOP_ALLOCATIONS = 10
+
+
+def default_profile_dir() -> Path:
+    return DEFAULT_PROFILE_ROOT / datetime.now().strftime("%Y%m%d-%H%M%S")
+
+
+def _safe(text: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", text)
+
+
+def top_functions(profile: cProfile.Profile, limit: int = TOP_FUNCTIONS) -> List[dict]:
+    """Funciones con más tiempo acumulado de un cProfile."""
+    stats = pstats.Stats(profile).stats
+    rows = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:limit]
+    return [
+        {
+            "function": f"{func} ({Path(filename).name}:{line})" if line else func,
+            "calls": calls,
+            "tottime": round(tottime, 6),
+            "cumtime": round(cumtime, 6),
+        }
+        for (filename, line, func), (_, calls, tottime, cumtime, _) in rows
+    ]
+
+
+class Profiler:
+    """
+    Perfilador de etapas. Uso:
+
+        profiler = Profiler(directory, modes=["cprofile"]).attach(METRICS)
+        ...
+        profiler.detach(METRICS)
+        profiler.write()
+    """
+
+    def __init__(self, directory: Path, modes=()):
+        unknown = set(modes) - set(PROFILE_MODES)
+        if unknown:
+            raise ValueError(f"Modo de perfilado desconocido: {', '.join(sorted(unknown))}")
+        self.dir = Path(directory)
+        self.cprofile = "cprofile" in modes
+        self.tracemalloc = "tracemalloc" in modes
+        self.stages: List[dict] = []
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self._cprofile_lock = threading.Lock()
+        self._active: List[dict] = []
+        if self.tracemalloc and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def attach(self, metrics) -> "Profiler":
+        """Envuelve las etapas de `metrics` (dera_metrics.Metrics)."""
+        metrics.stage_hooks.append(self.stage)
+        return self
+
+    def detach(self, metrics):
+        if self.stage in metrics.stage_hooks:
+            metrics.stage_hooks.remove(self.stage)
+
+    def _fold_peak(self):
+        """Lleva el pico actual a las etapas activas antes de reiniciarlo."""
+        peak = tracemalloc.get_traced_memory()[1]
+        for record in self._active:
+            record["peakBytes"] = max(record["peakBytes"], peak - record["_baseBytes"])
+
+    @contextmanager
+    def stage(self, name: str, layer: Optional[str] = None):
+        record = {"stage": name, "layer": layer, "thread": threading.current_thread().name}
+        if self.tracemalloc:
+            with self._lock:
+                self._fold_peak()
+                record["_baseBytes"] = tracemalloc.get_traced_memory()[0]
+                record["peakBytes"] = 0
+                tracemalloc.reset_peak()
+                self._active.append(record)
+
+        profile = None
+        if self.cprofile and self._cprofile_lock.acquire(blocking=False):
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:  # otro perfilador activo
+                self._cprofile_lock.release()
+                profile = None
+
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            record["wallSeconds"] = round(time.perf_counter() - wall, 6)
+            record["cpuSeconds"] = round(time.thread_time() - cpu, 6)
+            record["waitSeconds"] = round(max(0.0, record["wallSeconds"] - record["cpuSeconds"]), 6)
+            if profile is not None:
+                profile.disable()
+                self._cprofile_lock.release()
+                self.dir.mkdir(parents=True, exist_ok=True)
+                dump = self.dir / f"{len(self.stages):03d}-{_safe(name)}-{_safe(layer or 'all')}.pstats"
+                profile.dump_stats(dump)
+                record["pstats"] = dump.name
+                record["topFunctions"] = top_functions(profile)
+            elif self.cprofile:
+                record["pstats"] = None  # otra etapa se estaba perfilando
+            if self.tracemalloc:
+                with self._lock:
+                    self._fold_peak()
+                    self._active.remove(record)
+                    del record["_baseBytes"]
+                record["topAllocations"] = [
+                    {"line": str(stat.traceback), "bytes": stat.size, "blocks": stat.count}
+                    for stat in tracemalloc.take_snapshot().statistics("lineno")[:TOP_ALLOCATIONS]
+                ]
+            with self._lock:
+                self.stages.append(record)
+
+    # ------------------------------------------------------------------
+    # Informe
+    # ------------------------------------------------------------------
+
+    def report(self) -> dict:
+        with self._lock:
+            return {
+                "generatedAt": datetime.utcnow().isoformat() + "Z",
+                "wallSeconds": round(time.perf_counter() - self.started, 6),
+                "modes": [m for m in PROFILE_MODES if getattr(self, m)],
+                "stages": list(self.stages),
+            }
+
+    def text(self) -> str:
+        report = self.report()
+        lines = [f"Perfil DERA ({', '.join(report['modes']) or 'solo tiempos'}), "
+                 f"{report['wallSeconds']:.2f} s en total", ""]
+        lines.append(f"{'etapa':20} {'capa':32} {'reloj s':>9} {'CPU s':>9} {'espera s':>9} {'pico MB':>9}")
+        for record in report["stages"]:
+            peak = f"{record['peakBytes'] / (1024 * 1024):9.1f}" if "peakBytes" in record else f"{'-':>9}"
+            lines.append(f"{record['stage']:20} {str(record['layer'] or '-'):32} {record['wallSeconds']:9.3f} "
+                         f"{record['cpuSeconds']:9.3f} {record['waitSeconds']:9.3f} {peak}")
+        for record in report["stages"]:
+            if record.get("topFunctions"):
+                lines += ["", f"== {record['stage']} {record['layer'] or ''} ({record['pstats']})",
+                          f"{'cumtime':>10} {'tottime':>10} {'llamadas':>9}  función"]
+                lines += [f"{f['cumtime']:10.3f} {f['tottime']:10.3f} {f['calls']:9}  {f['function']}"
+                          for f in record["topFunctions"]]
+            if record.get("topAllocations"):
+                lines += ["", f"== memoria retenida tras {record['stage']} {record['layer'] or ''}"]
+                lines += [f"{a['bytes'] / 1024:10.1f} KB {a['blocks']:9}  {a['line']}"
+                          for a in record["topAllocations"]]
+        return "\n".join(lines) + "\n"
+
+    def write(self) -> Path:
+        """Escribe profile.json y profile.txt. Retorna el directorio."""
+        self.dir.mkdir(parents=True, exist_ok=True)
+        write_json(self.dir / PROFILE_JSON_FILENAME, self.report(), indent=2)
+        (self.dir / PROFILE_TEXT_FILENAME).write_text(self.text(), encoding="utf-8")
+        if self.tracemalloc:
+            tracemalloc.stop()
+        return self.dir
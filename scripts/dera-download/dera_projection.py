@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+dera_projection.py
+
+Proyección de atributos (propertyName) para las peticiones WFS de DERA.
+
+transform-to-dexie.cjs y LocalDataService solo leen un subconjunto fijo de
+atributos. Pedir al servidor solo esos campos (más la geometría) reduce el
+tamaño de la respuesta, el tiempo de parseo y el GeoJSON en disco.
+
+Las listas por capa son la intersección de CONSUMED_PROPERTIES con el
+esquema de cada capa. Pedir un atributo que la capa no tiene hace que
+GeoServer rechace la petición entera (InvalidParameterValue), así que
+antes de usarlas se validan con DescribeFeatureType (SchemaCache): se
+descartan los atributos que el esquema ya no tiene y se usa el nombre
+real de la geometría. Si el esquema no se puede obtener, o la capa no
+está en LAYER_PROPERTIES, se piden todos los atributos.
+
+@version 1.0.0
+@date 2025-12-09
+"""
+
+import threading
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import urlencode, urlparse
+from xml.etree import ElementTree
+
+import requests
+
+from geojson_io import FeatureStream
+
+# ============================================================================
+# CONFIGURACIÓN
+# ============================================================================
+
+# Atributos que leen transform-to-dexie.cjs y LocalDataService
+CONSUMED_PROPERTIES = (
+    "id_dera", "nombre", "tipo", "tipo_abr", "tip_centro", "direccion", "localidad",
+    "cod_mun", "municipio", "provincia", "gestion", "titular", "categoria",
+    "potenc_MW", "codigo",
+)
+
+GEOMETRY_PROPERTY = "geom"  # geometry_name de las capas DERA
+
+_BASE = ["id_dera", "nombre", "direccion", "localidad", "cod_mun", "municipio", "provincia"]
+
+LAYER_PROPERTIES = {
+    "DERA_g12_servicios:g12_01_CentroSalud": _BASE,
+    "DERA_g12_servicios:g12_02_Hospital_CAE": _BASE + ["tipo"],
+    "DERA_g12_servicios:g12_26_Policia": _BASE + ["tipo"],
+    "DERA_g12_servicios:g12_29_ParqueBomberos":
+        ["id_dera", "nombre", "direccion", "cod_mun", "municipio", "provincia"],
+    "DERA_g12_servicios:g12_34_GuardiaCivil": _BASE,
+    "DERA_g12_servicios:g12_35_GestionEmergencias":
+        ["id_dera", "nombre", "tipo", "direccion", "cod_mun", "municipio", "provincia"],
+    "DERA_g12_servicios:g12_05_CentroEducativo":
+        _BASE + ["tipo", "tipo_abr", "gestion", "titular", "categoria"],
+    "DERA_g12_servicios:g12_32_CentrosJuntaAndalucia":
+        ["id_dera", "nombre", "tipo", "tip_centro", "cod_mun", "municipio", "provincia"],
+    "DERA_g12_servicios:g12_11_Ayuntamiento":
+        ["id_dera", "nombre", "direccion", "cod_mun", "municipio", "provincia"],
+    "DERA_g10_infra_energetica:g10_02_ParqueEolico":
+        ["id_dera", "nombre", "codigo", "potenc_MW", "cod_mun", "municipio", "provincia"],
+}
+
+SAMPLE_SIZE = 100  # features por muestra en projection_savings
+
+
+def property_names(layers: Iterable[str],
+                   schema: Optional[Callable[[str], Optional["Schema"]]] = None) -> Optional[str]:
+    """
+    Valor de PROPERTYNAME para uno o varios typeNames (WFS 2.0).
+
+    Una capa: "a,b,geom". Varias (petición agrupada): "(a,geom)(c,geom)".
+    `schema(layer)` retorna el esquema validado de la capa (SchemaCache);
+    con él la lista se limita a los atributos que existen. None si alguna
+    capa no tiene proyección configurada o su esquema es desconocido.
+    """
+    lists = []
+    for layer in layers:
+        properties = LAYER_PROPERTIES.get(layer)
+        if properties is None:
+            return None
+        geometry = GEOMETRY_PROPERTY
+        if schema is not None:
+            described = schema(layer)
+            if described is None or described.geometry is None:
+                return None
+            properties = [name for name in properties if name in described.properties]
+            geometry = described.geometry
+        lists.append(",".join(list(properties) + [geometry]))
+    if len(lists) == 1:
+        return lists[0]
+    return "".join(f"({names})" for names in lists)
+
+
+# ============================================================================
+# ESQUEMAS (DescribeFeatureType)
+# ============================================================================
+
+class Schema:
+    """Atributos de una capa según DescribeFeatureType."""
+
+    def __init__(self, properties: Iterable[str] = (), geometry: Optional[str] = None):
+        self.properties = tuple(properties)
+        self.geometry = geometry
+
+    def problems(self, layer: str) -> List[str]:
+        """Diferencias con LAYER_PROPERTIES y GEOMETRY_PROPERTY (vacía si coinciden)."""
+        problems = [name for name in LAYER_PROPERTIES.get(layer, ()) if name not in self.properties]
+        if self.geometry != GEOMETRY_PROPERTY:
+            problems.append(f"geometría {GEOMETRY_PROPERTY} (es {self.geometry})")
+        return problems
+
+
+def describe_feature_type_url(url: str, layer: str) -> str:
+    """URL DescribeFeatureType (WFS 2.0) de una capa."""
+    params = {"service": "WFS", "version": "2.0.0", "request": "DescribeFeatureType", "typeNames": layer}
+    return f"{url}?{urlencode(params)}"
+
+
+def parse_schema(chunks: Iterable[bytes]) -> Schema:
+    """
+    Lee los xsd:element de la secuencia del tipo de la capa. La geometría
+    es el elemento cuyo tipo es una propiedad GML (gml:*PropertyType).
+    Un ExceptionReport o un XSD sin elementos da un esquema vacío.
+    """
+    parser = ElementTree.XMLPullParser(events=("start", "end"))
+    properties: List[str] = []
+    geometry = None
+    depth = 0  # xsd:sequence abiertas
+    for chunk in chunks:
+        parser.feed(chunk)
+        for event, element in parser.read_events():
+            tag = element.tag.rsplit("}", 1)[-1]
+            if tag == "sequence":
+                depth += 1 if event == "start" else -1
+            elif tag == "element" and event == "start" and depth and element.get("name"):
+                name = element.get("name")
+                prefix, _, local = element.get("type", "").rpartition(":")
+                if geometry is None and prefix == "gml" and local.endswith("PropertyType"):
+                    geometry = name
+                else:
+                    properties.append(name)
+    parser.close()
+    return Schema(properties, geometry)
+
+
+class SchemaCache:
+    """
+    Esquemas por capa, pedidos una sola vez.
+
+    `stream` recibe la URL DescribeFeatureType y retorna un generador de
+    bloques. Si la petición o el XML fallan, o el esquema llega vacío, la
+    capa queda con esquema desconocido (None) y se pide sin proyección.
+    Es seguro usarlo desde varios hilos, como CapabilitiesCache.
+    """
+
+    def __init__(self, stream: Callable[[str], Iterator[bytes]]):
+        self._stream = stream
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Optional[Schema]] = {}
+        self.errors: Dict[str, str] = {}
+
+    def get(self, url: str, layer: str) -> Optional[Schema]:
+        with self._lock:
+            if layer not in self._entries:
+                self._entries[layer] = self._fetch(url, layer)
+            return self._entries[layer]
+
+    def _fetch(self, url: str, layer: str) -> Optional[Schema]:
+        chunks = self._stream(describe_feature_type_url(url, layer))
+        try:
+            schema = parse_schema(chunks)
+        except (requests.exceptions.RequestException, ElementTree.ParseError) as e:
+            self.errors[layer] = str(e)
+            return None
+        finally:
+            chunks.close()
+        if not schema.properties and schema.geometry is None:
+            self.errors[layer] = "esquema vacío"
+            return None
+        return schema
+
+    def lookup(self, url: str) -> Callable[[str], Optional[Schema]]:
+        """Función schema(layer) de property_names para las capas de `url`."""
+        return lambda layer: self.get(url, layer)
+
+    def describe(self, url: str, layer: str) -> str:
+        host = urlparse(url).netloc
+        schema = self.get(url, layer)
+        if schema is None:
+            return f"{host} {layer}: esquema no disponible ({self.errors[layer]}), se piden todos los atributos"
+        if schema.geometry is None:
+            return f"{host} {layer}: sin geometría GML, se piden todos los atributos"
+        problems = schema.problems(layer)
+        if problems:
+            return f"{host} {layer}: sin {', '.join(problems)}"
+        return f"{host} {layer}: proyección validada"
+
+    def valid(self, url: str, layer: str) -> bool:
+        """True si la lista configurada de la capa coincide con su esquema."""
+        schema = self.get(url, layer)
+        return schema is not None and not schema.problems(layer)
+
+
+# ============================================================================
+# INFORME
+# ============================================================================
+
+def projection_savings(fetch_chunks, total: Optional[int]) -> Optional[dict]:
+    """
+    Estima el ahorro comparando una muestra con y sin proyección.
+
+    fetch_chunks(projected: bool) genera los bloques de una petición de
+    SAMPLE_SIZE features. Retorna {"fullBytes", "projectedBytes", "ratio",
+    "estimatedSaved"} (bytes decodificados, extrapolados a `total`) o None
+    si la muestra está vacía.
+    """
+    sizes = {}
+    count = 0
+    for projected in (False, True):
+        size = 0
+
+        def counted(chunks):
+            nonlocal size
+            for chunk in chunks:
+                size += len(chunk)
+                yield chunk
+
+        features = list(FeatureStream(counted(fetch_chunks(projected))))
+        sizes[projected] = size
+        count = count or len(features)
+
+    if not count or not sizes[False]:
+        return None
+    ratio = 1 - sizes[True] / sizes[False]
+    per_feature = (sizes[False] - sizes[True]) / count
+    return {
+        "fullBytes": sizes[False],
+        "projectedBytes": sizes[True],
+        "ratio": ratio,
+        "estimatedSaved": int(per_feature * (total if total is not None else count)),
+    }
+
+
+def layer_savings(sources: Iterable[tuple], sample_url: Callable[[str, str, bool], str],
+                  hits: Callable[[str, str], Optional[int]],
+                  stream: Callable[[str], Iterator[bytes]]) -> Iterator[Tuple[tuple, Optional[dict], Optional[str]]]:
+    """
+    Ahorro de la proyección en cada fuente (url, layer, ...).
+
+    sample_url(url, layer, projected) construye la petición de SAMPLE_SIZE
+    features con o sin PROPERTYNAME, hits(url, layer) da numberMatched y
+    stream(url) genera el cuerpo por bloques. Genera (fuente, ahorro,
+    error): ahorro None si la muestra está vacía o la petición falló, y
+    en ese caso error con el motivo.
+    """
+    for source in sources:
+        url, layer = source[0], source[1]
+        try:
+            savings = projection_savings(
+                lambda projected: stream(sample_url(url, layer, projected)), hits(url, layer))
+        except (requests.exceptions.RequestException, ValueError) as e:
+            yield source, None, str(e)
+            continue
+        yield source, savings, None
@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+"""
+dera_rtree.py
+
+Índice espacial R-tree empaquetado (Hilbert) precalculado en la descarga.
+
+spatialIndex.ts construye un Flatbush en cada sesión aunque el índice
+solo depende de los datos, que cambian cada trimestre. Aquí se construye
+el mismo árbol en Python con el algoritmo de Flatbush 4.x (orden Hilbert
+de los centros, quicksort parcial por nodos y empaquetado de abajo
+arriba), de modo que el buffer es idéntico byte a byte al de
+`new Flatbush(n)` + `add()` + `finish()` con las mismas features, y el
+cliente lo abre con `Flatbush.from(buffer)` sin coste de construcción.
+
+Salida por capa:
+- <capa>.rtree.bin: buffer Flatbush (cabecera de 8 bytes, cajas Float64,
+  índices Uint16/Uint32)
+- <capa>.rtree.json: nodeSize, bbox, idDera (elemento del árbol →
+  id_dera) y order (elementos en orden Hilbert, para reordenar las
+  features del cliente con localidad espacial)
+
+El árbol indexa las features con coordenadas válidas en el orden del
+GeoJSON; igual que transform-to-dexie.cjs, se descartan las que no tienen
+geometría o están en (0, 0).
+
+@version 1.0.0
+@date 2025-12-09
+"""
+
+import heapq
+import math
+import sys
+from array import array
+from bisect import bisect_right
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+
+from geojson_io import atomic_writer, write_json
+
+# ============================================================================
+# CONFIGURACIÓN
+# ============================================================================
+
+RTREE_SUFFIX = ".rtree.bin"
+RTREE_META_SUFFIX = ".rtree.json"
+NODE_SIZE = 16  # nodeSize por defecto de Flatbush
+
+FLATBUSH_MAGIC = 0xFB
+FLATBUSH_VERSION = 3  # formato de Flatbush 4.x
+FLOAT64_TYPE_INDEX = 8  # posición de Float64Array en ARRAY_TYPES de Flatbush
+HILBERT_MAX = (1 << 16) - 1
+
+BBox = Tuple[float, float, float, float]
+
+
+def rtree_paths(output_dir: Path, layer: str) -> Tuple[Path, Path]:
+    output_dir = Path(output_dir)
+    return output_dir / f"{layer}{RTREE_SUFFIX}", output_dir / f"{layer}{RTREE_META_SUFFIX}"
+
+
+def level_bounds(num_items: int, node_size: int) -> List[int]:
+    """Fin (en posiciones de caja ×4) de cada nivel del árbol, como Flatbush."""
+    n = num_items
+    num_nodes = n
+    bounds = [n * 4]
+    while True:
+        n = math.ceil(n / node_size)
+        num_nodes += n
+        bounds.append(num_nodes * 4)
+        if n == 1:
+            return bounds
+
+
+def hilbert(x: int, y: int) -> int:
+    """Valor Hilbert de (x, y) en [0, 2^16), idéntico al de Flatbush."""
+    a = x ^ y
+    b = 0xFFFF ^ a
+    c = 0xFFFF ^ (x | y)
+    d = x & (y ^ 0xFFFF)
+
+    A = a | (b >> 1)
+    B = (a >> 1) ^ a
+    C = ((c >> 1) ^ (b & (d >> 1))) ^ c
+    D = ((a & (c >> 1)) ^ (d >> 1)) ^ d
+
+    a, b, c, d = A, B, C, D
+    A = (a & (a >> 2)) ^ (b & (b >> 2))
+    B = (a & (b >> 2)) ^ (b & ((a ^ b) >> 2))
+    C ^= (a & (c >> 2)) ^ (b & (d >> 2))
+    D ^= (b & (c >> 2)) ^ ((a ^ b) & (d >> 2))
+
+    a, b, c, d = A, B, C, D
+    A = (a & (a >> 4)) ^ (b & (b >> 4))
+    B = (a & (b >> 4)) ^ (b & ((a ^ b) >> 4))
+    C ^= (a & (c >> 4)) ^ (b & (d >> 4))
+    D ^= (b & (c >> 4)) ^ ((a ^ b) & (d >> 4))
+
+    a, b, c, d = A, B, C, D
+    C ^= (a & (c >> 8)) ^ (b & (d >> 8))
+    D ^= (b & (c >> 8)) ^ ((a ^ b) & (d >> 8))
+
+    a = C ^ (C >> 1)
+    b = D ^ (D >> 1)
+
+    i0 = x ^ y
+    i1 = b | (0xFFFF ^ (i0 | a))
+
+    i0 = (i0 | (i0 << 8)) & 0x00FF00FF
+    i0 = (i0 | (i0 << 4)) & 0x0F0F0F0F
+    i0 = (i0 | (i0 << 2)) & 0x33333333
+    i0 = (i0 | (i0 << 1)) & 0x55555555
+
+    i1 = (i1 | (i1 << 8)) & 0x00FF00FF
+    i1 = (i1 | (i1 << 4)) & 0x0F0F0F0F
+    i1 = (i1 | (i1 << 2)) & 0x33333333
+    i1 = (i1 | (i1 << 1)) & 0x55555555
+
+    return ((i1 << 1) | i0) & 0xFFFFFFFF
+
+
+def _sort(values, boxes, indices, left: int, right: int, node_size: int):
+    """Quicksort parcial de Flatbush: no ordena dentro de un mismo nodo."""
+    stack = [(left, right)]
+    while stack:
+        left, right = stack.pop()
+        if left // node_size >= right // node_size:
+            continue
+        pivot = values[(left + right) >> 1]
+        i = left - 1
+        j = right + 1
+        while True:
+            i += 1
+            while values[i] < pivot:
+                i += 1
+            j -= 1
+            while values[j] > pivot:
+                j -= 1
+            if i >= j:
+                break
+            values[i], values[j] = values[j], values[i]
+            k, m = 4 * i, 4 * j
+            boxes[k:k + 4], boxes[m:m + 4] = boxes[m:m + 4], boxes[k:k + 4]
+            indices[i], indices[j] = indices[j], indices[i]
+        # Mismo orden de recursión que Flatbush (izquierda primero)
+        stack.append((j + 1, right))
+        stack.append((left, j))
+
+
+# ============================================================================
+# CONSTRUCCIÓN
+# ============================================================================
+
+def build_flatbush(boxes: Iterable[BBox], node_size: int = NODE_SIZE) -> bytes:
+    """
+    Construye el buffer de Flatbush para las cajas dadas (en orden de
+    inserción). Los puntos se pasan como (x, y, x, y).
+    """
+    node_size = min(max(node_size, 2), 65535)
+    items = array("d")
+    for box in boxes:
+        items.extend(box)
+    num_items = len(items) // 4
+    if not num_items:
+        raise ValueError("Flatbush necesita al menos un elemento")
+
+    bounds = level_bounds(num_items, node_size)
+    num_nodes = bounds[-1] // 4
+    index_type = "H" if num_nodes < 16384 else "I"
+
+    data = array("d", items)
+    data.extend([0.0] * (num_nodes * 4 - len(items)))
+    indices = array(index_type, range(num_items))
+    indices.extend([0] * (num_nodes - num_items))
+
+    min_x = min(items[0::4])
+    min_y = min(items[1::4])
+    max_x = max(items[2::4])
+    max_y = max(items[3::4])
+    pos = num_items * 4
+
+    if num_items <= node_size:
+        # Un solo nodo: sin ordenar, solo la caja raíz
+        data[pos:pos + 4] = array("d", (min_x, min_y, max_x, max_y))
+    else:
+        width = (max_x - min_x) or 1
+        height = (max_y - min_y) or 1
+        values = []
+        for i in range(num_items):
+            bx0, by0, bx1, by1 = data[4 * i:4 * i + 4]
+            hx = math.floor(HILBERT_MAX * ((bx0 + bx1) / 2 - min_x) / width)
+            hy = math.floor(HILBERT_MAX * ((by0 + by1) / 2 - min_y) / height)
+            values.append(hilbert(hx, hy))
+        _sort(values, data, indices, 0, num_items - 1, node_size)
+
+        # Nodos de cada nivel, de abajo arriba
+        node_pos = 0
+        for end in bounds[:-1]:
+            while node_pos < end:
+                node_index = node_pos
+                nx0, ny0, nx1, ny1 = data[node_pos:node_pos + 4]
+                node_pos += 4
+                j = 1
+                while j < node_size and node_pos < end:
+                    nx0 = min(nx0, data[node_pos])
+                    ny0 = min(ny0, data[node_pos + 1])
+                    nx1 = max(nx1, data[node_pos + 2])
+                    ny1 = max(ny1, data[node_pos + 3])
+                    node_pos += 4
+                    j += 1
+                indices[pos >> 2] = node_index
+                data[pos:pos + 4] = array("d", (nx0, ny0, nx1, ny1))
+                pos += 4
+
+    header = bytes([FLATBUSH_MAGIC, (FLATBUSH_VERSION << 4) + FLOAT64_TYPE_INDEX])
+    header += node_size.to_bytes(2, "little") + num_items.to_bytes(4, "little")
+    if sys.byteorder != "little":
+        data.byteswap()
+        indices.byteswap()
+    return header + data.tobytes() + indices.tobytes()
+
+
+def write_rtree(columns, output_dir: Path, layer: str, node_size: int = NODE_SIZE) -> Optional[int]:
+    """
+    Escribe <capa>.rtree.bin y <capa>.rtree.json a partir de las columnas
+    acumuladas por ColumnarWriter. Retorna los elementos indexados (None si
+    la capa no tiene ninguno con coordenadas).
+    """
+    points = [
+        (x, y, id_dera)
+        for x, y, id_dera in zip(columns.columns["x"], columns.columns["y"], columns.columns["idDera"])
+        if not math.isnan(x) and not math.isnan(y) and x != 0 and y != 0
+    ]
+    if not points:
+        return None
+
+    buffer = build_flatbush(((x, y, x, y) for x, y, _ in points), node_size)
+    tree = FlatbushIndex(buffer)
+    bin_path, meta_path = rtree_paths(output_dir, layer)
+    _write_bytes(bin_path, buffer)
+    meta = {
+        "layer": layer,
+        "count": len(points),
+        "nodeSize": tree.node_size,
+        "bbox": list(tree.bbox),
+        "idDera": [None if math.isnan(id_dera) else int(id_dera) for _, _, id_dera in points],
+        "order": tree.order(),
+    }
+    if getattr(columns, "source_fingerprint", None):
+        meta["sourceFingerprint"] = columns.source_fingerprint
+    write_json(meta_path, meta)
+    return len(points)
+
+
+def _write_bytes(path: Path, data: bytes):
+    with atomic_writer(path, "wb") as f:
+        f.write(data)
+
+
+# ============================================================================
+# LECTURA (validación y tests; el cliente usa Flatbush.from)
+# ============================================================================
+
+class FlatbushIndex:
+    """Lector de un buffer Flatbush con las búsquedas de la librería."""
+
+    def __init__(self, buffer: bytes):
+        if buffer[0] != FLATBUSH_MAGIC:
+            raise ValueError("No es un buffer Flatbush")
+        if buffer[1] >> 4 != FLATBUSH_VERSION or buffer[1] & 0x0F != FLOAT64_TYPE_INDEX:
+            raise ValueError(f"Versión o tipo de Flatbush no soportado: {buffer[1]:#x}")
+        self.node_size = int.from_bytes(buffer[2:4], "little")
+        self.num_items = int.from_bytes(buffer[4:8], "little")
+        self.level_bounds = level_bounds(self.num_items, self.node_size)
+        num_nodes = self.level_bounds[-1] // 4
+
+        self.boxes = array("d")
+        self.boxes.frombytes(buffer[8:8 + num_nodes * 32])
+        self.indices = array("H" if num_nodes < 16384 else "I")
+        self.indices.frombytes(buffer[8 + num_nodes * 32:])
+        if sys.byteorder != "little":
+            self.boxes.byteswap()
+            self.indices.byteswap()
+        if len(self.indices) != num_nodes:
+            raise ValueError("Buffer Flatbush truncado")
+        self.bbox = tuple(self.boxes[-4:])
+
+    def order(self) -> List[int]:
+        """Elementos en el orden de las hojas (orden Hilbert)."""
+        return self.indices[:self.num_items].tolist()
+
+    def _children(self, node_index: int):
+        end = min(node_index + self.node_size * 4,
+                  self.level_bounds[bisect_right(self.level_bounds, node_index)])
+        return range(node_index, end, 4)
+
+    def search(self, min_x: float, min_y: float, max_x: float, max_y: float) -> List[int]:
+        """Elementos cuya caja corta la ventana (como Flatbush.search)."""
+        boxes = self.boxes
+        queue = []
+        results = []
+        node_index = len(boxes) - 4
+        while node_index is not None:
+            for pos in self._children(node_index):
+                if (max_x < boxes[pos] or max_y < boxes[pos + 1]
+                        or min_x > boxes[pos + 2] or min_y > boxes[pos + 3]):
+                    continue
+                index = self.indices[pos >> 2]
+                if node_index >= self.num_items * 4:
+                    queue.append(index)
+                else:
+                    results.append(index)
+            node_index = queue.pop() if queue else None
+        return results
+
+    def neighbors(self, x: float, y: float, max_results: int = 1,
+                  max_distance: float = math.inf) -> List[int]:
+        """Los max_results elementos más cercanos a (x, y), de menor a mayor distancia."""
+        boxes = self.boxes
+        max_dist_sq = max_distance * max_distance
+        heap = []
+        results = []
+        node_index = len(boxes) - 4
+        while node_index is not None:
+            for pos in self._children(node_index):
+                dx = max(boxes[pos] - x, 0, x - boxes[pos + 2])
+                dy = max(boxes[pos + 1] - y, 0, y - boxes[pos + 3])
+                dist = dx * dx + dy * dy
+                if dist > max_dist_sq:
+                    continue
+                is_leaf = node_index < self.num_items * 4
+                heapq.heappush(heap, (dist, not is_leaf, self.indices[pos >> 2]))
+            node_index = None
+            while heap and not heap[0][1]:
+                results.append(heapq.heappop(heap)[2])
+                if len(results) == max_results:
+                    return results
+            if heap:
+                node_index = heapq.heappop(heap)[2]
+        return results
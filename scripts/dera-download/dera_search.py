@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+dera_search.py
+
+Índice de búsqueda por nombre precalculado para el geocodificador offline.
+
+LocalDataService compara nombres recorriendo todas las features de la
+categoría en cada consulta. Aquí, en la descarga, se normaliza el nombre
+de cada feature y se construye un índice invertido de trigramas
+particionado por cod_mun: buscar "centro de salud X" en el municipio Y es
+cruzar las listas de los trigramas de "x" dentro de la partición de Y.
+
+Normalización (la de normalizeText en LocalDataService.ts, más):
+- abreviaturas con puntos unidas: "C.S." → "cs", "C.E.I.P." → "ceip"
+- sin palabras vacías ni siglas de tipología (STOPWORDS); si el nombre
+  solo tiene palabras vacías se conserva entero
+
+Salida por capa, <capa>.search.json:
+- names: nombre normalizado de cada feature (orden del GeoJSON)
+- idDera: id_dera de cada feature
+- postings: {cod_mun: {trigrama: [índices de feature]}}
+
+@version 1.0.0
+@date 2025-12-09
+"""
+
+import math
+import re
+import unicodedata
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from geojson_io import write_json
+
+# ============================================================================
+# CONFIGURACIÓN
+# ============================================================================
+
+SEARCH_SUFFIX = ".search.json"
+SEARCH_VERSION = 1
+MIN_SIMILARITY = 0.3  # Jaccard de trigramas mínimo en search()
+NO_MUNICIPIO = "00000"  # partición de las features sin cod_mun
+
+# Siglas de tipología y palabras vacías (ya normalizadas)
+STOPWORDS = frozenset({
+    # Sanitarios
+    "cs", "c", "s", "cap", "centro", "salud", "consultorio", "auxiliar", "hospital",
+    "chare", "uga",
+    # Educativos
+    "ceip", "cei", "cp", "cpr", "ei", "ies", "eei", "cepr", "ceper", "sies", "spe", "ceee", "cdp", "ipep",
+    "colegio", "instituto", "escuela", "infantil", "primaria", "educacion", "publico", "publica",
+    # Seguridad y emergencias
+    "puesto", "cuartel", "comisaria", "parque", "bomberos", "policia", "local", "guardia", "civil",
+    # Artículos y preposiciones
+    "de", "del", "la", "las", "el", "los", "y", "e", "en", "a", "al",
+})
+
+_DOTTED = re.compile(r"\b([a-z0-9])\.")
+_NON_ALNUM = re.compile(r"[^a-z0-9\s]")
+_SPACES = re.compile(r"\s+")
+
+
+def search_path(output_dir: Path, layer: str) -> Path:
+    return Path(output_dir) / f"{layer}{SEARCH_SUFFIX}"
+
+
+def fold(text: Optional[str]) -> str:
+    """Minúsculas, sin acentos, abreviaturas unidas y solo [a-z0-9 ]."""
+    text = unicodedata.normalize("NFD", (text or "").lower())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    # "c.s." → "cs": se quitan los puntos detrás de una sola letra
+    text = _DOTTED.sub(r"\1", text)
+    text = _NON_ALNUM.sub(" ", text)
+    return _SPACES.sub(" ", text).strip()
+
+
+def normalize_name(text: Optional[str]) -> str:
+    """Nombre para buscar: fold() sin palabras vacías (salvo que no quede nada)."""
+    tokens = fold(text).split()
+    kept = [token for token in tokens if token not in STOPWORDS]
+    return " ".join(kept or tokens)
+
+
+def trigrams(name: str) -> List[str]:
+    """Trigramas de cada palabra rodeada de espacios (" tr", "tri", ..., "na ")."""
+    grams = set()
+    for token in name.split():
+        padded = f" {token} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return sorted(grams)
+
+
+# ============================================================================
+# CONSTRUCCIÓN
+# ============================================================================
+
+def build_search_index(columns) -> dict:
+    """Índice de una capa a partir de las columnas de ColumnarWriter."""
+    strings = columns.strings
+    names = [normalize_name(strings[i]) for i in columns.columns["nombre"]]
+    postings: Dict[str, Dict[str, List[int]]] = {}
+
+    for index, (name, cod_mun) in enumerate(zip(names, columns.columns["codMun"])):
+        partition = postings.setdefault(f"{cod_mun:05d}" if cod_mun >= 0 else NO_MUNICIPIO, {})
+        for gram in trigrams(name):
+            partition.setdefault(gram, []).append(index)
+
+    index = {
+        "version": SEARCH_VERSION,
+        "layer": columns.layer,
+        "count": len(names),
+        "stopwords": sorted(STOPWORDS),
+        "names": names,
+        "idDera": [None if math.isnan(id_dera) else int(id_dera) for id_dera in columns.columns["idDera"]],
+        "postings": {cod: dict(sorted(grams.items())) for cod, grams in sorted(postings.items())},
+    }
+    if getattr(columns, "source_fingerprint", None):
+        index["sourceFingerprint"] = columns.source_fingerprint
+    return index
+
+
+def write_search_index(columns, output_dir: Path, layer: str) -> int:
+    """Escribe <capa>.search.json. Retorna el número de municipios indexados."""
+    index = build_search_index(columns)
+    write_json(search_path(output_dir, layer), index)
+    return len(index["postings"])
+
+
+# ============================================================================
+# CONSULTA (referencia del algoritmo del cliente)
+# ============================================================================
+
+def search(index: dict, query: str, cod_mun: Optional[str] = None, limit: int = 5,
+           min_similarity: float = MIN_SIMILARITY) -> List[Tuple[int, float]]:
+    """
+    Features cuyo nombre se parece a `query`: [(índice, similitud)] de
+    mayor a menor. La similitud es el Jaccard de trigramas; los candidatos
+    salen de contar apariciones en las listas de los trigramas de la
+    consulta, sin recorrer los nombres.
+    """
+    grams = trigrams(normalize_name(query))
+    if not grams:
+        return []
+    if cod_mun is not None:
+        partitions = [index["postings"].get(str(cod_mun).zfill(5), {})]
+    else:
+        partitions = index["postings"].values()
+
+    shared = Counter()
+    for partition in partitions:
+        for gram in grams:
+            shared.update(partition.get(gram, ()))
+
+    results = []
+    for feature, hits in shared.items():
+        size = len(trigrams(index["names"][feature]))
+        similarity = hits / (len(grams) + size - hits)
+        if similarity >= min_similarity:
+            results.append((feature, similarity))
+    results.sort(key=lambda r: (-r[1], r[0]))
+    return results[:limit]
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+dera_shards.py
+
+Particiones por municipio y provincia de cada capa, con un manifiesto.
+
+Un documento PTEL cubre un solo municipio, pero los consumidores cargan
+el GeoJSON de toda Andalucía. Aquí cada capa publicada se reparte en:
+
+    shards/<capa>/prov-<cc>.geojson      (cc = dos primeros dígitos de cod_mun)
+    shards/<capa>/mun-<ccccc>.geojson
+    shards/<capa>/manifest.json
+
+El manifiesto lista cada partición con su número de features, bbox y
+tamaño en bytes, para que el cliente pida solo las del municipio que
+procesa.
+
+El reparto lee el GeoJSON ya publicado en streaming: primero a un NDJSON
+temporal por provincia (8 archivos abiertos) y después, provincia a
+provincia, se agrupa por municipio. La memoria queda acotada a la
+provincia más grande.
+
+@version 1.0.0
+@date 2025-12-09
+"""
+
+import json
+import shutil
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, Optional
+
+from geojson_io import FeatureCollectionWriter, read_feature_file, write_json
+
+# ============================================================================
+# CONFIGURACIÓN
+# ============================================================================
+
+SHARDS_DIRNAME = "shards"
+MANIFEST_FILENAME = "manifest.json"
+SHARDS_VERSION = 1
+NO_MUNICIPIO = "00000"  # features sin cod_mun
+
+
+def shard_dir(output_dir: Path, layer: str) -> Path:
+    return Path(output_dir) / SHARDS_DIRNAME / layer
+
+
+def manifest_path(output_dir: Path, layer: str) -> Path:
+    return shard_dir(output_dir, layer) / MANIFEST_FILENAME
+
+
+def cod_mun(feature: dict) -> str:
+    """cod_mun con 5 dígitos (como transform-to-dexie.cjs); NO_MUNICIPIO si falta."""
+    value = str((feature.get("properties") or {}).get("cod_mun") or "").strip()
+    return value.zfill(5) if value.isdigit() else NO_MUNICIPIO
+
+
+def _points(coordinates) -> Iterator[list]:
+    if coordinates and isinstance(coordinates[0], (int, float)):
+        yield coordinates
+    else:
+        for part in coordinates or ():
+            yield from _points(part)
+
+
+class BBoxAccumulator:
+    """Extensión de las geometrías vistas (todas las coordenadas, no solo la primera)."""
+
+    def __init__(self):
+        self.bbox = None
+
+    def add(self, geometry: Optional[dict]):
+        for point in _points((geometry or {}).get("coordinates")):
+            x, y = point[0], point[1]
+            if self.bbox is None:
+                self.bbox = [x, y, x, y]
+            else:
+                b = self.bbox
+                b[0], b[1], b[2], b[3] = min(b[0], x), min(b[1], y), max(b[2], x), max(b[3], y)
+
+
+# ============================================================================
+# ESCRITURA
+# ============================================================================
+
+def _write_shard(path: Path, features: Iterable[dict], indent: Optional[int], metadata: dict) -> dict:
+    """Escribe una partición y retorna su entrada del manifiesto."""
+    bbox = BBoxAccumulator()
+
+    def tracked():
+        for feature in features:
+            bbox.add(feature.get("geometry"))
+            yield feature
+
+    with FeatureCollectionWriter(path, indent=indent) as writer:
+        writer.write_features(tracked())
+        writer.finish(metadata=dict(metadata, featuresCount=writer.count))
+    return {"file": path.name, "count": writer.count, "bbox": bbox.bbox, "bytes": path.stat().st_size}
+
+
+def write_shards(geojson_path: Path, output_dir: Path, layer: str,
+                 indent: Optional[int] = None, fingerprint: Optional[str] = None) -> dict:
+    """
+    Reparte el GeoJSON publicado de una capa por provincia y municipio y
+    escribe el manifiesto. Las particiones de municipios que ya no tienen
+    features se borran. Retorna el manifiesto.
+
+    `fingerprint` (huella del GeoJSON, ver dera_state.py) queda en el
+    manifiesto para detectar particiones de otra versión de la capa.
+    """
+    target = shard_dir(output_dir, layer)
+    target.mkdir(parents=True, exist_ok=True)
+    manifest = {
+        "version": SHARDS_VERSION,
+        "layer": layer,
+        "generatedAt": datetime.utcnow().isoformat() + "Z",
+        "source": Path(geojson_path).name,
+        "count": 0,
+        "provincias": {},
+        "municipios": {},
+    }
+    if fingerprint:
+        manifest["sourceFingerprint"] = fingerprint
+
+    spill = Path(tempfile.mkdtemp(prefix=f".{layer}.", dir=target))
+    try:
+        # 1. Reparto por provincia a NDJSON temporales
+        files: Dict[str, object] = {}
+        try:
+            for feature in read_feature_file(geojson_path):
+                province = cod_mun(feature)[:2]
+                if province not in files:
+                    files[province] = open(spill / f"{province}.ndjson", "w", encoding="utf-8")
+                files[province].write(json.dumps(feature, ensure_ascii=False, separators=(",", ":")))
+                files[province].write("\n")
+                manifest["count"] += 1
+        finally:
+            for f in files.values():
+                f.close()
+
+        # 2. Por provincia: partición provincial y agrupación por municipio
+        for province in sorted(files):
+            with open(spill / f"{province}.ndjson", encoding="utf-8") as f:
+                features = [json.loads(line) for line in f]
+
+            manifest["provincias"][province] = _write_shard(
+                target / f"prov-{province}.geojson", features, indent,
+                {"layer": layer, "provincia": province},
+            )
+
+            by_municipio: Dict[str, list] = {}
+            for feature in features:
+                by_municipio.setdefault(cod_mun(feature), []).append(feature)
+            for code in sorted(by_municipio):
+                entry = _write_shard(
+                    target / f"mun-{code}.geojson", by_municipio[code], indent,
+                    {"layer": layer, "codMun": code},
+                )
+                entry["provincia"] = province
+                manifest["municipios"][code] = entry
+    finally:
+        shutil.rmtree(spill, ignore_errors=True)
+
+    # Particiones que ya no existen en esta versión
+    current = {e["file"] for e in manifest["provincias"].values()}
+    current |= {e["file"] for e in manifest["municipios"].values()}
+    for stale in target.glob("*.geojson"):
+        if stale.name not in current:
+            stale.unlink()
+
+    write_json(manifest_path(output_dir, layer), manifest, indent=indent)
+    return manifest
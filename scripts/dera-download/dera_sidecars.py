@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+dera_sidecars.py
+
+Sidecars de una capa que no ha cambiado en el servidor.
+
+Una capa sin cambios no se descarga, pero sus sidecars (--columnar,
+--rtree, --search-index, --shards) pueden faltar, porque la ejecución
+anterior no los pedía, o no corresponder a esta: otra --precision, un
+formato de versión anterior o un GeoJSON distinto del que se generaron.
+
+Cada sidecar guarda en sus metadatos la versión de su formato y
+sourceFingerprint, la huella del GeoJSON del que sale (la misma de
+dera_state.py). stale_sidecars() compara esos metadatos con las opciones
+de la ejecución y refresh_sidecars() regenera, leyendo el GeoJSON
+publicado, los que faltan o no coinciden. Lo usan download_dera.py y
+download_dera_actions.py.
+
+@version 1.0.0
+@date 2025-12-09
+"""
+
+import json
+from pathlib import Path
+from typing import List, Optional
+
+from dera_columnar import COLUMNAR_VERSION, columnar_path, columns_from_geojson, read_columnar_header
+from dera_rtree import NODE_SIZE, rtree_paths, write_rtree
+from dera_search import SEARCH_VERSION, search_path, write_search_index
+from dera_shards import SHARDS_VERSION, manifest_path, write_shards
+
+# Sidecars que salen de las columnas de ColumnarWriter
+COLUMN_SIDECARS = ("columnar", "rtree", "search")
+
+
+def _read_json(path: Path) -> dict:
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def stale_sidecars(source: Path, output_dir: Path, layer: str,
+                   columnar: bool = False, rtree: bool = False,
+                   search_index: bool = False, shards: bool = False,
+                   precision: Optional[float] = None,
+                   fingerprint: Optional[str] = None) -> List[str]:
+    """
+    Sidecars pedidos que faltan o no coinciden con las opciones actuales:
+    versión del formato, `precision` (metros) del columnar, GeoJSON de
+    origen de las particiones y `fingerprint` del contenido.
+    """
+    stale = []
+    if columnar:
+        try:
+            header = read_columnar_header(columnar_path(output_dir, layer))
+        except (OSError, ValueError):
+            header = {}
+        if (header.get("version") != COLUMNAR_VERSION
+                or (header.get("quantization") or {}).get("precision") != precision
+                or header.get("sourceFingerprint") != fingerprint):
+            stale.append("columnar")
+    if rtree:
+        bin_path, meta_path = rtree_paths(output_dir, layer)
+        meta = _read_json(meta_path)
+        if (not bin_path.exists() or meta.get("nodeSize") != NODE_SIZE
+                or meta.get("sourceFingerprint") != fingerprint):
+            stale.append("rtree")
+    if search_index:
+        index = _read_json(search_path(output_dir, layer))
+        if index.get("version") != SEARCH_VERSION or index.get("sourceFingerprint") != fingerprint:
+            stale.append("search")
+    if shards:
+        manifest = _read_json(manifest_path(output_dir, layer))
+        if (manifest.get("version") != SHARDS_VERSION
+                or manifest.get("source") != Path(source).name
+                or manifest.get("sourceFingerprint") != fingerprint):
+            stale.append("shards")
+    return stale
+
+
+def refresh_sidecars(source: Path, output_dir: Path, layer: str,
+                     columnar: bool = False, rtree: bool = False,
+                     search_index: bool = False, shards: bool = False,
+                     precision: Optional[float] = None,
+                     fingerprint: Optional[str] = None,
+                     indent: Optional[int] = None) -> List[str]:
+    """
+    Regenera desde el GeoJSON publicado `source` los sidecars que indique
+    stale_sidecars. Retorna sus nombres (lista vacía si estaban al día).
+    """
+    stale = stale_sidecars(source, output_dir, layer, columnar, rtree, search_index, shards,
+                           precision, fingerprint)
+    if any(name in COLUMN_SIDECARS for name in stale):
+        columns = columns_from_geojson(source, layer, precision)
+        columns.source_fingerprint = fingerprint
+        if "columnar" in stale:
+            columns.write(columnar_path(output_dir, layer))
+        if "rtree" in stale:
+            write_rtree(columns, output_dir, layer)
+        if "search" in stale:
+            write_search_index(columns, output_dir, layer)
+    if "shards" in stale:
+        write_shards(source, output_dir, layer, indent=indent, fingerprint=fingerprint)
+    return stale
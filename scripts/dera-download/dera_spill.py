@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+dera_spill.py
+
+Acumulación de features con presupuesto de memoria (--max-memory).
+
+SpillBuffer sustituye a las listas de features de download_dera
+(fetch_wfs_features y las páginas en vuelo) y del delta de
+download_dera_actions (dera_delta.py). Mientras la estimación de lo acumulado no supera el
+presupuesto, las features quedan en memoria; al superarlo, lo acumulado se
+vuelca a un NDJSON temporal (una feature por línea) y se sigue
+acumulando. Recorrer el buffer genera las features en el orden de
+llegada: primero los NDJSON, en orden, y al final lo que quedó en
+memoria; escribir la salida es así una sola pasada en streaming.
+
+El tamaño en memoria de una feature se estima como MEMORY_FACTOR veces
+su JSON compacto (un dict de GeoJSON ocupa unas 7 veces su texto),
+midiendo una de cada SAMPLE_EVERY features.
+
+Los temporales se borran con close() (o al salir del with) y, si no, al
+liberar el buffer.
+
+El presupuesto solo cubre estas features. Los derivados que se construyen
+al escribir la capa no se vuelcan: ColumnarWriter (dera_columnar.py), las
+cajas del índice Flatbush (dera_rtree.py) y el índice de trigramas
+(dera_search.py) crecen con cada feature, y write_shards (dera_shards.py)
+tiene en memoria una provincia entera. Con ellos activos el pico de
+memoria no queda acotado por --max-memory.
+
+@version 1.0.0
+@date 2025-12-09
+"""
+
+import json
+import os
+import tempfile
+import weakref
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional
+
+# ============================================================================
+# CONFIGURACIÓN
+# ============================================================================
+
+MEMORY_FACTOR = 7
+SAMPLE_EVERY = 64
+SPILL_PREFIX = "dera-spill-"
+
+
+def parse_megabytes(value: Optional[float]) -> Optional[int]:
+    """MB de --max-memory a bytes (None = sin presupuesto)."""
+    if value is None:
+        return None
+    if value <= 0:
+        raise ValueError(f"--max-memory debe ser positivo: {value:g}")
+    return int(value * 1024 * 1024)
+
+
+def _remove(paths: List[Path]):
+    for path in paths:
+        path.unlink(missing_ok=True)
+    paths.clear()
+
+
+def _dumps(feature: dict) -> str:
+    return json.dumps(feature, ensure_ascii=False, separators=(",", ":"))
+
+
+class SpillBuffer:
+    """
+    Lista de features que se vuelca a disco al superar `max_bytes`.
+
+    Uso:
+        with SpillBuffer(256 * 1024 * 1024) as features:
+            for page in pages:
+                features.extend(page)
+            write_features(features)   # una pasada, en orden
+
+    Con max_bytes=None nunca se vuelca (una lista normal).
+    """
+
+    def __init__(self, max_bytes: Optional[int] = None, directory: Optional[Path] = None):
+        self.max_bytes = max_bytes
+        self.dir = Path(directory) if directory else Path(tempfile.gettempdir())
+        self.files: List[Path] = []
+        self.spilled = 0
+        self.memory_bytes = 0
+        self._memory: List[dict] = []
+        self._count = 0
+        self._estimate = 0
+        self._finalizer = weakref.finalize(self, _remove, self.files)
+
+    def append(self, feature: dict):
+        if self.max_bytes is not None:
+            if self._count % SAMPLE_EVERY == 0:
+                self._estimate = len(_dumps(feature)) * MEMORY_FACTOR
+            self.memory_bytes += self._estimate
+        self._memory.append(feature)
+        self._count += 1
+        if self.max_bytes is not None and self.memory_bytes > self.max_bytes:
+            self.spill()
+
+    def extend(self, features: Iterable[dict]):
+        for feature in features:
+            self.append(feature)
+
+    def spill(self):
+        """Vuelca lo que hay en memoria a un NDJSON temporal nuevo."""
+        if not self._memory:
+            return
+        self.dir.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix=SPILL_PREFIX, suffix=".ndjson", dir=self.dir)
+        self.files.append(Path(tmp))
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            for feature in self._memory:
+                f.write(_dumps(feature) + "\n")
+        self.spilled += len(self._memory)
+        self._memory = []
+        self.memory_bytes = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __iter__(self) -> Iterator[dict]:
+        for path in list(self.files):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    yield json.loads(line)
+        yield from self._memory
+
+    def close(self):
+        """Borra los temporales y vacía el buffer."""
+        self._finalizer()
+        self._memory = []
+        self.memory_bytes = 0
+        self._count = 0
+        self.spilled = 0
+
+    def summary(self) -> str:
+        disk = sum(p.stat().st_size for p in self.files if p.exists())
+        return (f"{self.spilled} de {self._count} features volcadas a {len(self.files)} "
+                f"temporales ({disk / (1024 * 1024):.1f} MB)")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
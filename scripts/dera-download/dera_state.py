@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+dera_state.py
+
+Estado persistente por capa para el refresco condicional de DERA.
+
+Por cada capa se guarda, en dera-state.json (por defecto en
+DEFAULT_STATE_DIR, fuera de public/: lo que hay allí se publica con la
+aplicación):
+- Validadores HTTP (ETag / Last-Modified) y numberMatched de cada fuente,
+  obtenidos con una petición condicional resultType=hits
+- Si el servidor no envía validadores (lo normal en las respuestas hits
+  de GeoServer), la huella de una muestra de contenido: las SAMPLE_SIZE
+  primeras features ordenadas por id_dera
+- Número de features y huella (sha256) del contenido descargado
+
+En la siguiente ejecución una capa se salta si el servidor indica que no
+ha cambiado: 304 Not Modified, mismos validadores y mismo conteo o, sin
+validadores, mismo conteo y misma muestra. Un conteo igual sin muestra no
+basta (puede haber cambios de atributos). La muestra no ve un cambio de
+atributos fuera de ella; para eso está --force (FORCE_UPDATE).
+
+Con --jobs, plan_layers sondea con probe_planner(), que guarda cada
+sondeo para que check_layer no repita la petición.
+
+@version 1.0.0
+@date 2025-12-09
+"""
+
+import hashlib
+import json
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, Optional, Tuple
+from urllib.parse import urlencode
+
+import requests
+
+from dera_engine import parse_number_matched
+from geojson_io import write_json
+from wfs_http import http_get
+
+# ============================================================================
+# CONFIGURACIÓN
+# ============================================================================
+
+STATE_FILENAME = "dera-state.json"
+DEFAULT_STATE_DIR = Path.home() / ".cache" / "ptel-dera-state"
+STATE_VERSION = 1
+PROBE_TIMEOUT = 20  # segundos
+SAMPLE_SIZE = 100  # features de la muestra de contenido (fuentes sin validadores)
+SAMPLE_SORT = "id_dera"
+SOURCE_FIELDS = ("etag", "lastModified", "numberMatched", "sample")
+
+
+def is_force_env(value: Optional[str]) -> bool:
+    """Interpreta FORCE_UPDATE (true/1/yes)."""
+    return (value or "").strip().lower() in ("1", "true", "yes", "on")
+
+
+# ============================================================================
+# PERSISTENCIA
+# ============================================================================
+
+def default_state_file(output_dir: Path) -> Path:
+    """
+    dera-state.json de un directorio de salida, en DEFAULT_STATE_DIR: cada
+    directorio tiene su propio estado (el salto depende de sus archivos).
+    """
+    digest = hashlib.sha256(str(Path(output_dir).resolve()).encode("utf-8")).hexdigest()[:12]
+    return DEFAULT_STATE_DIR / f"{Path(output_dir).name}-{digest}" / STATE_FILENAME
+
+
+def load_state(path: Path) -> dict:
+    """Carga el estado; si no existe o es ilegible, empieza de cero."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return {"version": STATE_VERSION, "layers": {}}
+    if state.get("version") != STATE_VERSION:
+        return {"version": STATE_VERSION, "layers": {}}
+    state.setdefault("layers", {})
+    return state
+
+
+def save_state(path: Path, state: dict):
+    """Guarda el estado de forma atómica (temp + rename)."""
+    write_json(path, state, indent=2, sort_keys=True)
+
+
+# ============================================================================
+# SONDEO CONDICIONAL
+# ============================================================================
+
+def probe_source(url: str, layer: str, previous: Optional[dict] = None,
+                 timeout: int = PROBE_TIMEOUT) -> Optional[dict]:
+    """
+    Petición condicional resultType=hits para una fuente.
+
+    Retorna {"etag", "lastModified", "numberMatched", "notModified"} o None
+    si el sondeo falla (en ese caso la capa se descarga). Sin validadores
+    en la respuesta se añade "sample" (ver probe_sample).
+    """
+    params = {
+        "service": "WFS",
+        "version": "2.0.0",
+        "request": "GetFeature",
+        "typeNames": layer,
+        "resultType": "hits",
+    }
+    headers = {}
+    if previous:
+        if previous.get("etag"):
+            headers["If-None-Match"] = previous["etag"]
+        if previous.get("lastModified"):
+            headers["If-Modified-Since"] = previous["lastModified"]
+
+    try:
+        response = http_get(f"{url}?{urlencode(params)}", timeout=timeout, headers=headers)
+        if response.status_code == 304 and previous:
+            return {**previous, "notModified": True}
+        response.raise_for_status()
+    except requests.exceptions.RequestException:
+        return None
+
+    probe = {
+        "etag": response.headers.get("ETag"),
+        "lastModified": response.headers.get("Last-Modified"),
+        "numberMatched": parse_number_matched(response.text),
+        "notModified": False,
+    }
+    if not (probe["etag"] or probe["lastModified"]):
+        probe["sample"] = probe_sample(url, layer, timeout)
+    return probe
+
+
+def probe_sample(url: str, layer: str, timeout: int = PROBE_TIMEOUT) -> Optional[str]:
+    """
+    Huella de las SAMPLE_SIZE primeras features de la fuente ordenadas por
+    SAMPLE_SORT: una petición pequeña que delata cambios de contenido
+    cuando el servidor no envía ETag ni Last-Modified. None si falla.
+    """
+    params = {
+        "service": "WFS",
+        "version": "2.0.0",
+        "request": "GetFeature",
+        "typeNames": layer,
+        "count": str(SAMPLE_SIZE),
+        "sortBy": SAMPLE_SORT,
+        "outputFormat": "application/json",
+    }
+    try:
+        response = http_get(f"{url}?{urlencode(params)}", timeout=timeout)
+        response.raise_for_status()
+        data = response.json()
+    except (requests.exceptions.RequestException, ValueError):
+        return None
+    features = data.get("features") if isinstance(data, dict) else None
+    if not isinstance(features, list):
+        return None
+
+    fingerprint = Fingerprint()
+    for feature in features:
+        fingerprint.update(feature)
+    return fingerprint.hexdigest()
+
+
+def source_unchanged(previous: Optional[dict], current: Optional[dict]) -> bool:
+    """
+    True si el servidor señala que la fuente no cambió (304 o mismos
+    validadores) o, sin validadores, si coinciden conteo y muestra.
+    """
+    if not previous or not current:
+        return False
+    if current.get("notModified"):
+        return True
+    if current.get("numberMatched") != previous.get("numberMatched"):
+        return False
+    if current.get("etag") or current.get("lastModified"):
+        return (
+            current.get("etag") == previous.get("etag")
+            and current.get("lastModified") == previous.get("lastModified")
+        )
+    # Sin validadores: conteo conocido y misma muestra de contenido
+    return (
+        current.get("numberMatched") is not None
+        and current.get("sample") is not None
+        and current.get("sample") == previous.get("sample")
+    )
+
+
+def probe_planner(state: dict, probed: Dict[str, Optional[dict]]) -> Callable[[str, str], Optional[int]]:
+    """
+    Sondeo para plan_layers que hace el sondeo condicional de probe_source
+    y lo guarda en `probed` ({typeName: sondeo}), para que check_layer lo
+    reutilice en lugar de repetir la petición.
+    """
+    previous = {
+        layer: source
+        for entry in state["layers"].values()
+        for layer, source in entry.get("sources", {}).items()
+    }
+
+    def probe(url: str, layer: str) -> Optional[int]:
+        probed[layer] = probe_source(url, layer, previous.get(layer))
+        return probed[layer]["numberMatched"] if probed[layer] else None
+
+    return probe
+
+
+def check_layer(key: str, sources: Iterable[Tuple[str, str]], state: dict,
+                output_path: Path, probed: Optional[Dict[str, Optional[dict]]] = None
+                ) -> Tuple[bool, Dict[str, Optional[dict]]]:
+    """
+    Sondea todas las fuentes de una capa (las que ya estén en `probed`,
+    ver probe_planner, no se vuelven a pedir).
+
+    Retorna (sin_cambios, sondeos). Una capa sin archivo de salida o sin
+    estado previo nunca se considera sin cambios.
+    """
+    previous = state["layers"].get(key, {}).get("sources", {})
+    probed = probed or {}
+    probes = {
+        layer: probed[layer] if layer in probed else probe_source(url, layer, previous.get(layer))
+        for url, layer in sources
+    }
+
+    unchanged = (
+        Path(output_path).exists()
+        and bool(previous)
+        and set(previous) == set(probes)
+        and all(source_unchanged(previous[layer], probe) for layer, probe in probes.items())
+    )
+    return unchanged, probes
+
+
+def record_layer(state: dict, key: str, probes: Dict[str, Optional[dict]],
+                 count: int, fingerprint: str) -> bool:
+    """Actualiza el estado de una capa. Retorna True si el contenido cambió."""
+    previous = state["layers"].get(key, {})
+    sources = {}
+    for layer, probe in probes.items():
+        if probe:
+            sources[layer] = {k: probe.get(k) for k in SOURCE_FIELDS if k in probe}
+
+    changed = previous.get("fingerprint") != fingerprint
+    state["layers"][key] = {
+        "sources": sources,
+        "featuresCount": count,
+        "fingerprint": fingerprint,
+        # Sin cambios de contenido se conserva la fecha: el estado no ensucia el diff
+        "updatedAt": (datetime.utcnow().isoformat() + "Z") if changed else previous.get("updatedAt"),
+    }
+    return changed
+
+
+# ============================================================================
+# HUELLA DE CONTENIDO
+# ============================================================================
+
+def canonical_json(feature: dict) -> bytes:
+    """Serialización estable (claves ordenadas, compacta) para calcular hashes."""
+    return json.dumps(feature, ensure_ascii=False, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+
+class Fingerprint:
+    """sha256 incremental del contenido de las features (independiente del formato)."""
+
+    def __init__(self):
+        self._hash = hashlib.sha256()
+        self.count = 0
+
+    def update(self, feature: dict):
+        self._hash.update(canonical_json(feature))
+        self._hash.update(b"\n")
+        self.count += 1
+
+    def wrap(self, features: Iterable[dict]) -> Iterator[dict]:
+        """Deja pasar las features calculando la huella por el camino."""
+        for feature in features:
+            self.update(feature)
+            yield feature
+
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
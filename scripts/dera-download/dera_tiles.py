@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+dera_tiles.py
+
+Descarga por teselas BBOX como alternativa a la paginación por startIndex.
+
+Con offsets altos (startIndex de varios miles) GeoServer tiene que recorrer
+y descartar todo lo anterior en cada página. Aquí la extensión de Andalucía
+(EPSG:25830) se divide en una rejilla de BBOX; cada tesela se cuenta con
+resultType=hits y, si supera el máximo por petición, se subdivide en cuatro
+hasta quedar por debajo. Cada tesela se pide de una vez y en paralelo.
+
+Una feature en el borde entre teselas (o una línea/polígono que cruza
+varias) llega más de una vez: se eliminan duplicados por id.
+
+Este módulo no hace HTTP: recibe funciones de conteo y descarga.
+
+@version 1.0.0
+@date 2025-12-09
+"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+# ============================================================================
+# CONFIGURACIÓN
+# ============================================================================
+
+# Extensión de Andalucía en EPSG:25830 (con margen)
+ANDALUCIA_BBOX = (100000.0, 3980000.0, 625000.0, 4290000.0)
+TILE_CRS = "EPSG:25830"
+GRID_SIZE = 4  # rejilla inicial GRID_SIZE x GRID_SIZE
+TILE_MAX_FEATURES = 1000  # features por tesela (una petición)
+MAX_DEPTH = 6  # subdivisiones máximas por tesela
+TILE_CONCURRENCY = 4
+
+BBox = Tuple[float, float, float, float]
+
+
+def bbox_param(bbox: BBox, crs: str = TILE_CRS) -> str:
+    """Valor del parámetro BBOX de WFS 2.0."""
+    return ",".join(f"{v:.3f}".rstrip("0").rstrip(".") for v in bbox) + f",{crs}"
+
+
+def grid(bbox: BBox, size: int) -> List[BBox]:
+    """Divide una ventana en size x size teselas (filas de sur a norte)."""
+    minx, miny, maxx, maxy = bbox
+    dx = (maxx - minx) / size
+    dy = (maxy - miny) / size
+    return [
+        (minx + i * dx, miny + j * dy,
+         maxx if i == size - 1 else minx + (i + 1) * dx,
+         maxy if j == size - 1 else miny + (j + 1) * dy)
+        for j in range(size) for i in range(size)
+    ]
+
+
+def split(bbox: BBox) -> List[BBox]:
+    """Cuatro cuadrantes de una tesela."""
+    return grid(bbox, 2)
+
+
+def feature_id(feature: dict):
+    """Identidad para eliminar duplicados: id WFS o, si falta, id_dera."""
+    fid = feature.get("id")
+    if fid is None:
+        fid = feature.get("properties", {}).get("id_dera")
+    return fid
+
+
+# ============================================================================
+# PLANIFICACIÓN
+# ============================================================================
+
+def plan_tiles(count: Callable[[BBox], Optional[int]], bbox: BBox = ANDALUCIA_BBOX,
+               grid_size: int = GRID_SIZE, max_features: int = TILE_MAX_FEATURES,
+               max_depth: int = MAX_DEPTH, concurrency: int = TILE_CONCURRENCY
+               ) -> List[Tuple[BBox, Optional[int]]]:
+    """
+    Teselas a descargar con su conteo, subdividiendo las densas.
+
+    Los conteos de cada nivel se piden en paralelo. Las teselas vacías se
+    descartan. Una tesela cuyo conteo falla (None) se conserva sin
+    subdividir; una que sigue siendo densa en max_depth también.
+    """
+    tiles = []
+    level = grid(bbox, grid_size)
+    depth = 0
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        while level:
+            next_level = []
+            for tile, hits in zip(level, executor.map(count, level)):
+                if hits == 0:
+                    continue
+                if hits is not None and hits > max_features and depth < max_depth:
+                    next_level.extend(split(tile))
+                else:
+                    tiles.append((tile, hits))
+            level = next_level
+            depth += 1
+
+    return tiles
+
+
+# ============================================================================
+# DESCARGA
+# ============================================================================
+
+class TileResult:
+    """Resumen de una descarga por teselas."""
+
+    def __init__(self):
+        self.tiles = 0
+        self.failed = 0
+        self.short = 0  # teselas con menos features que su conteo
+        self.duplicates = 0
+        self.unique = 0
+
+    @property
+    def complete(self) -> bool:
+        return not (self.failed or self.short)
+
+
+def iter_tiled_features(fetch: Callable[[BBox, Optional[int]], list],
+                        tiles: Iterable[Tuple[BBox, Optional[int]]],
+                        concurrency: int = TILE_CONCURRENCY,
+                        result: Optional[TileResult] = None,
+                        errors: Tuple[type, ...] = (Exception,),
+                        on_error: Optional[Callable[[BBox, Exception], None]] = None
+                        ) -> Iterator[dict]:
+    """
+    Descarga las teselas en paralelo (ventana deslizante) y genera sus
+    features sin duplicados, en el orden de las teselas.
+
+    `fetch(bbox, hits)` retorna la lista de features de una tesela. Los
+    errores de tipo `errors` cuentan como tesela fallida en `result`.
+    """
+    result = result if result is not None else TileResult()
+    seen = set()
+    tiles = iter(tiles)
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        pending = deque(
+            (tile, hits, executor.submit(fetch, tile, hits))
+            for tile, hits in islice(tiles, max(1, concurrency))
+        )
+        while pending:
+            tile, hits, future = pending.popleft()
+            following = next(tiles, None)
+            if following is not None:
+                pending.append((*following, executor.submit(fetch, *following)))
+
+            result.tiles += 1
+            try:
+                features = future.result()
+            except errors as e:
+                result.failed += 1
+                if on_error:
+                    on_error(tile, e)
+                continue
+
+            if hits is not None and len(features) < hits:
+                result.short += 1
+            for feature in features:
+                fid = feature_id(feature)
+                if fid is not None:
+                    if fid in seen:
+                        result.duplicates += 1
+                        continue
+                    seen.add(fid)
+                result.unique += 1
+                yield feature
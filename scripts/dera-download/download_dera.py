@@ -9,6 +9,27 @@ USO:
     python download_dera.py                    # Descargar todas las capas
     python download_dera.py --layer health     # Solo centros sanitarios
     python download_dera.py --output ./data    # Directorio personalizado
+    python download_dera.py --jobs 4           # Descarga concurrente (largest-first)
+    python download_dera.py --page-concurrency 4  # Páginas de una capa en paralelo
+    python download_dera.py --force            # Ignorar el estado y descargar todo
+    python download_dera.py --resume           # Reanudar capas interrumpidas
+    python download_dera.py --tiled            # Teselas BBOX en lugar de startIndex
+    python download_dera.py --coalesce         # Varios typeNames por petición
+    python download_dera.py --all-properties   # Sin proyección de atributos
+    python download_dera.py --projection-report # Estimar los bytes que ahorra la proyección
+    python download_dera.py --columnar         # Además, <capa>.columnar.bin
+    python download_dera.py --rtree            # Además, índice Flatbush precalculado
+    python download_dera.py --search-index     # Además, índice de nombres por municipio
+    python download_dera.py --shards           # Además, particiones por municipio/provincia
+    python download_dera.py --province 41      # Refrescar solo Sevilla (también --municipio 41091)
+    python download_dera.py --precision        # Coordenadas redondeadas según la política por capa
+    python download_dera.py --format geojsonseq # Una feature por línea (<capa>.geojsonl + .meta.json)
+    python download_dera.py --cache-dir .cache # Guardar/reutilizar respuestas GetFeature en disco
+    python download_dera.py --cache-only       # Reproducir sin red desde la caché
+    python download_dera.py --metrics-dir out  # Métricas JSON + textfile de Prometheus
+    python download_dera.py --profile cprofile # Perfil por etapa en dera-profile/<fecha>/
+    python download_dera.py --page-size 500    # Páginas fijas de 500 features (sin ajuste)
+    python download_dera.py --max-memory 256   # Páginas en vuelo acotadas a ~256 MB en memoria
 
 CAPAS DISPONIBLES:
     health      - Centros de salud y hospitales (DERA g12)
@@ -19,6 +40,79 @@ CAPAS DISPONIBLES:
     hydraulic   - Infraestructuras hidráulicas (DERA)
     sports      - Instalaciones deportivas (DERA)
 
+REFRESCO PARCIAL:
+    --province y --municipio piden al servidor solo esa zona (CQL_FILTER
+    sobre cod_mun) y sustituyen su porción del GeoJSON publicado; el resto
+    de la capa no se descarga (ver dera_area.py).
+
+PRECISIÓN DE COORDENADAS:
+    --precision redondea las coordenadas al escribir (1 m por defecto,
+    ver PRECISION en dera_precision.py); "--precision 0.1" la fija para
+    todas las capas y "--precision health=0.1" para una. Con --columnar,
+    x/y se guardan además como enteros en delta.
+
+FORMATO DE SALIDA:
+    --format geojsonseq escribe <capa>.geojsonl, una feature por línea
+    (GeoJSONSeq), y los metadatos en el sidecar <capa>.meta.json. El
+    consumidor puede indexar cada línea según llega, con memoria constante.
+    Los derivados (--columnar, --shards...) y --province leen ambos
+    formatos (ver geojson_io.py).
+
+PROYECCIÓN DE ATRIBUTOS:
+    Solo se piden los atributos que consume la aplicación (propertyName,
+    ver dera_projection.py). Antes de usar las listas se validan con
+    DescribeFeatureType: se descartan los atributos que la capa ya no
+    tiene y, si el esquema no llega, la capa se pide completa.
+    --all-properties pide todos y --projection-report estima con una
+    muestra por fuente los bytes ahorrados.
+
+TAMAÑO DE PÁGINA:
+    Antes de descargar se pide GetCapabilities de cada endpoint (una vez):
+    ImplementsResultPaging dice si se puede paginar y CountDefault acota
+    el COUNT de cada petición. Las páginas empiezan en BATCH_SIZE y se
+    ajustan por capa según la duración y el tamaño de cada respuesta, con
+    --target-seconds como objetivo por petición; una página corta antes
+    de numberMatched se toma como límite del servidor y se sigue pidiendo
+    desde lo recibido. --page-size fija el tamaño (ver dera_paging.py).
+
+REANUDACIÓN:
+    Cada página completada se guarda en un diario por capa, en
+    --checkpoint-dir (por defecto ~/.cache/ptel-dera-checkpoints, fuera
+    de public/ para que no se publique con la aplicación). --resume lee
+    de ahí las páginas ya descargadas; sin --resume se ignora pero se
+    conserva, y solo se borra cuando la capa se publica completa (ver
+    dera_checkpoint.py).
+
+CACHÉ DE RESPUESTAS:
+    Con --cache-dir (o $DERA_CACHE_DIR) cada página GetFeature se guarda
+    comprimida, con la URL de build_wfs_url como clave, caducidad
+    (--cache-ttl) y tamaño máximo con expulsión LRU (--cache-max-mb).
+    --cache-only no hace peticiones GetFeature ni aplica --cache-ttl: sirve
+    cualquier entrada guardada y lo que no esté en caché falla como un
+    error de red. --no-cache la desactiva (ver dera_cache.py).
+    En ese modo no se sondea el servidor (ni estado, ni plan de --jobs, ni
+    GetCapabilities); los conteos de --tiled sí necesitan red. Con caché
+    el tamaño de página no se ajusta: COUNT forma parte de la clave.
+
+PRESUPUESTO DE MEMORIA:
+    --max-memory MB acota las features de las páginas en vuelo (la primera
+    mientras se guarda en el diario y las que esperan turno con
+    --page-concurrency o --tiled): el presupuesto se reparte entre ellas y
+    lo que lo supera se vuelca a NDJSON temporales (ver dera_spill.py).
+    El GeoJSON ya se escribe según llega.
+    No cubre los derivados: las columnas de --columnar, las cajas de
+    --rtree y el índice de --search-index crecen con cada feature de la
+    capa, y --shards agrupa en memoria la provincia más grande. Con ellos
+    el pico de memoria depende del tamaño de la capa.
+
+REFRESCO CONDICIONAL:
+    Antes de descargar cada capa se sondea el servidor (ETag/Last-Modified
+    y numberMatched; sin validadores, además una muestra de contenido). Si
+    nada cambió desde la última ejecución (estado en dera-state.json, por
+    defecto en ~/.cache/ptel-dera-state, fuera de public/) la capa se
+    salta. Con --jobs se reutiliza el sondeo del plan. FORCE_UPDATE=true
+    equivale a --force.
+
 RESULTADO:
     Archivos GeoJSON en public/data/dera/
     Aproximadamente 5-10 MB comprimido
@@ -28,13 +122,16 @@ RESULTADO:
 """
 
 import argparse
-import json
 import os
 import sys
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
 from datetime import datetime
+from itertools import islice
 from pathlib import Path
-from typing import Optional
+from typing import Iterator, Optional
 from urllib.parse import urlencode
 
 try:
@@ -43,6 +140,32 @@ except ImportError:
     print("ERROR: requests no instalado. Ejecuta: pip install requests")
     sys.exit(1)
 
+from dera_area import AreaFilter, SliceStats, combine_cql, read_features, refresh_slice
+from dera_cache import CACHE_ENV, DEFAULT_CACHE_DIR, DEFAULT_MAX_BYTES, DEFAULT_TTL, ResponseCache
+from dera_checkpoint import DEFAULT_CHECKPOINT_DIR, CheckpointJournal
+from dera_columnar import ColumnarWriter, columnar_path
+from dera_engine import DEFAULT_JOBS, coalesce_sources, plan_layers, probe_hits, run_layers
+from dera_metrics import METRICS
+from dera_paging import TARGET_SECONDS, CapabilitiesCache, PageSizer, TransferMeter
+from dera_profile import PROFILE_MODES, Profiler, default_profile_dir
+from dera_precision import DEFAULT_PRECISION, PrecisionPolicy, Quantizer
+from dera_projection import SAMPLE_SIZE, SchemaCache, layer_savings, property_names
+from dera_rtree import rtree_paths, write_rtree
+from dera_search import search_path, write_search_index
+from dera_sidecars import refresh_sidecars
+from dera_shards import write_shards
+from dera_spill import SpillBuffer, parse_megabytes
+from dera_state import (
+    Fingerprint, check_layer, default_state_file, is_force_env, load_state, probe_planner, record_layer,
+    save_state,
+)
+from dera_tiles import TILE_CONCURRENCY, TILE_MAX_FEATURES, TileResult, bbox_param, iter_tiled_features, plan_tiles
+from geojson_io import OUTPUT_FORMATS, FeatureStream, feature_filename, feature_writer
+from wfs_http import (
+    HOST_LIMITER, MAX_PER_HOST, MAX_RATE, POOL_SIZE, RATE_LIMITER,
+    configure_session, format_stats, http_stream,
+)
+
 # ============================================================================
 # CONFIGURACIÓN
 # ============================================================================
@@ -123,6 +246,51 @@ WFS_CONFIG = {
 DEFAULT_OUTPUT_DIR = Path(__file__).parent.parent.parent / "public" / "data" / "dera"
 REQUEST_TIMEOUT = 60  # segundos
 BATCH_SIZE = 1000  # features por petición
+PAGE_CONCURRENCY = 1  # páginas en vuelo por capa (1 = secuencial)
+
+
+# ============================================================================
+# OPCIONES
+# ============================================================================
+
+@dataclass(frozen=True)
+class DownloadOptions:
+    """
+    Opciones de una ejecución, que main construye a partir de la línea de
+    comandos y se pasan explícitamente a download_all, download_layer y
+    las funciones de descarga. Son inmutables: los workers de --jobs
+    comparten la misma instancia sin estado global.
+    """
+    # Peticiones
+    batch_size: int = BATCH_SIZE  # features por página al empezar (o fijo con page_target=None)
+    page_target: Optional[float] = None  # segundos objetivo por petición (ver dera_paging.py)
+    page_concurrency: int = PAGE_CONCURRENCY  # páginas en vuelo por capa (1 = secuencial)
+    project: bool = True  # pedir solo los atributos consumidos (ver dera_projection.py)
+    capabilities: Optional[CapabilitiesCache] = None  # GetCapabilities por endpoint (ver dera_paging.py)
+    schemas: Optional[SchemaCache] = None  # DescribeFeatureType por capa (ver dera_projection.py)
+    response_cache: Optional[ResponseCache] = None  # caché de GetFeature (--cache-dir, ver dera_cache.py)
+    max_memory: Optional[int] = None  # bytes de features en memoria (--max-memory, ver dera_spill.py)
+    checkpoint_dir: Optional[Path] = None  # diario de --resume (--checkpoint-dir); None = sin diario
+    # Capas
+    force: bool = False
+    resume: bool = False
+    tiled: bool = False
+    coalesce: bool = False
+    columnar: bool = False
+    rtree: bool = False
+    search_index: bool = False
+    shards: bool = False
+    area: Optional[AreaFilter] = None
+    precision: Optional[PrecisionPolicy] = None
+    output_format: str = "geojson"
+    
+    @property
+    def offline(self) -> bool:
+        """--cache-only: las respuestas salen de la caché, sin red."""
+        return self.response_cache is not None and self.response_cache.offline
+
+
+DEFAULT_OPTIONS = DownloadOptions()
 
 
 # ============================================================================
@@ -130,8 +298,14 @@ BATCH_SIZE = 1000  # features por petición
 # ============================================================================
 
 def build_wfs_url(base_url: str, layer: str, cql_filter: Optional[str] = None, 
-                  start_index: int = 0, count: int = BATCH_SIZE) -> str:
-    """Construye URL de petición WFS GetFeature."""
+                  start_index: int = 0, count: int = BATCH_SIZE,
+                  bbox: Optional[str] = None, options: DownloadOptions = DEFAULT_OPTIONS) -> str:
+    """
+    Construye URL de petición WFS GetFeature.
+    
+    Con options.project solo se piden los atributos consumidos, validados
+    con options.schemas si está activo.
+    """
     params = {
         "service": "WFS",
         "version": "2.0.0",
@@ -145,51 +319,329 @@ def build_wfs_url(base_url: str, layer: str, cql_filter: Optional[str] = None,
     
     if cql_filter:
         params["CQL_FILTER"] = cql_filter
+    if bbox:
+        params["BBOX"] = bbox
+    schema = options.schemas.lookup(base_url) if options.schemas is not None else None
+    properties = property_names(layer.split(","), schema) if options.project else None
+    if properties:
+        params["propertyName"] = properties
     
     return f"{base_url}?{urlencode(params)}"
 
 
-def fetch_wfs_features(url: str, layer: str, description: str, 
-                       cql_filter: Optional[str] = None) -> dict:
-    """Descarga todas las features de una capa WFS con paginación."""
-    all_features = []
-    start_index = 0
-    total_features = None
+def getfeature_stream(request_url: str, cache: Optional[ResponseCache] = None) -> Iterator[bytes]:
+    """Cuerpo de una petición GetFeature por bloques, a través de `cache` si la hay."""
+    if cache is None:
+        return http_stream(request_url, timeout=REQUEST_TIMEOUT)
+    return cache.stream(request_url, lambda u: http_stream(u, timeout=REQUEST_TIMEOUT))
+
+
+def stream_wfs_page(url: str, layer: str, cql_filter: Optional[str],
+                    start_index: int, count: Optional[int] = None,
+                    meter: Optional[TransferMeter] = None,
+                    options: DownloadOptions = DEFAULT_OPTIONS) -> FeatureStream:
+    """
+    Abre una página GetFeature en streaming (count=None: options.batch_size).
+    
+    La petición se lanza al empezar a iterar; las features se generan según
+    llegan los bloques y numberMatched queda en .members al terminar.
+    `meter` mide los bytes y la duración de la respuesta.
+    """
+    request_url = build_wfs_url(url, layer, cql_filter, start_index, count or options.batch_size, options=options)
+    chunks = getfeature_stream(request_url, options.response_cache)
+    return FeatureStream(meter.wrap(chunks) if meter else chunks)
+
+
+def fetch_wfs_page(url: str, layer: str, cql_filter: Optional[str],
+                   start_index: int, count: Optional[int] = None,
+                   meter: Optional[TransferMeter] = None,
+                   options: DownloadOptions = DEFAULT_OPTIONS) -> dict:
+    """Descarga una página GetFeature y retorna el JSON decodificado."""
+    stream = stream_wfs_page(url, layer, cql_filter, start_index, count, meter, options)
+    features = list(stream)
+    return {**stream.members, "features": features}
+
+
+def page_buffer(in_flight: int = 1, options: DownloadOptions = DEFAULT_OPTIONS):
+    """
+    Contenedor de las features de una página: una lista o, con
+    options.max_memory, un SpillBuffer con su parte del presupuesto
+    (`in_flight` páginas a la vez en memoria).
+    """
+    if options.max_memory is None:
+        return []
+    return SpillBuffer(max(1, options.max_memory // max(1, in_flight)))
+
+
+def page_sizer(url: str, options: DownloadOptions = DEFAULT_OPTIONS) -> PageSizer:
+    """
+    Tamaño de página de una fuente: options.batch_size acotado por el
+    CountDefault del endpoint y, con options.page_target, ajustado a la
+    duración de cada petición (ver dera_paging.py).
+    """
+    capabilities = None
+    if options.capabilities is not None and not options.offline:
+        capabilities = options.capabilities.get(url)
+    # Con caché el COUNT forma parte de la clave: tamaño fijo para reutilizarla
+    target = options.page_target if options.response_cache is None else None
+    return PageSizer(options.batch_size, capabilities, target)
+
+
+class LayerProgress:
+    """Conteo esperado frente a recibido de una capa (todas sus fuentes)."""
+    
+    def __init__(self):
+        self.expected = 0
+        self.received = 0
+        self.complete = True
+    
+    def add(self, expected, received: int, failed: bool):
+        self.received += received
+        if isinstance(expected, int):
+            self.expected += expected
+            self.complete = self.complete and not failed and received == expected
+        else:
+            self.complete = self.complete and not failed
+
+
+class IncompleteLayerError(Exception):
+    """La capa no llegó completa: no se publica (se conserva el archivo anterior)."""
+
+
+def iter_wfs_features(url: str, layer: str, description: str,
+                      cql_filter: Optional[str] = None,
+                      journal: Optional[CheckpointJournal] = None,
+                      progress: Optional[LayerProgress] = None,
+                      options: DownloadOptions = DEFAULT_OPTIONS) -> Iterator[dict]:
+    """
+    Genera las features de una capa WFS una a una, en orden.
+    
+    La primera página se procesa en streaming según llega. Con
+    options.page_concurrency > 1, tras ella se conocen todos los offsets
+    (numberMatched) y el resto se piden en paralelo, con ese máximo de
+    páginas en vuelo. Nunca hay más de page_concurrency páginas en memoria.
+    
+    Con `journal` cada página completada se guarda en disco y las ya
+    guardadas (--resume) se leen de ahí en lugar de pedirse. `progress`
+    recibe el conteo esperado y recibido de la fuente.
     
+    El COUNT de cada página lo decide page_sizer(); una página corta antes
+    de numberMatched no termina la fuente, y si el servidor no permite
+    completarla (sin paginación) la fuente cuenta como fallida.
+    """
     print(f"\n  📡 {description}")
     print(f"     Capa: {layer}")
+    sizer = page_sizer(url, options)
+    first_count = sizer.size
     
-    while True:
-        request_url = build_wfs_url(url, layer, cql_filter, start_index, BATCH_SIZE)
+    if journal is not None:
+        journal.bind(layer, url, cql_filter, options.batch_size)
+        if journal.has_page(layer, 0):
+            # El servidor puede haber cambiado desde la ejecución interrumpida
+            hits = probe_hits(url, layer)
+            if hits is not None:
+                journal.set_total(layer, hits)
+    
+    downloaded = 0
+    failed = False
+    replayed = journal is not None and journal.has_page(layer, 0)
+    if replayed:
+        total_features = journal.total(layer)
+        print(f"     ♻️  Reanudando: {len(journal.completed(layer))} páginas en disco")
+        for feature in journal.read_page(layer, 0):
+            downloaded += 1
+            yield feature
+    else:
+        meter = TransferMeter()
+        first = stream_wfs_page(url, layer, cql_filter, 0, first_count, meter, options)
+        page = page_buffer(options=options) if journal is not None else None
+        try:
+            for feature in first:
+                downloaded += 1
+                if page is not None:
+                    page.append(feature)
+                yield feature
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"     ❌ Error: {e}")
+            failed = True
+        else:
+            METRICS.observe_page(layer, downloaded)
+            sizer.observe(first_count, downloaded, meter.seconds, meter.bytes)
         
+        total_features = first.members.get("numberMatched", first.members.get("totalFeatures", "?"))
+        if journal is not None and not failed:
+            journal.set_total(layer, total_features if isinstance(total_features, int) else None)
+            journal.save_page(layer, 0, page)
+    
+    if downloaded:
+        print(f"     Total esperado: {total_features}")
+        print(f"     Descargados: {downloaded} features")
+    
+    total = total_features if isinstance(total_features, int) else None
+    more = False
+    if not failed:
         try:
-            response = requests.get(request_url, timeout=REQUEST_TIMEOUT)
-            response.raise_for_status()
-            data = response.json()
-            
-            features = data.get("features", [])
-            if not features:
-                break
-                
-            all_features.extend(features)
-            
-            # Primera petición: obtener total
-            if total_features is None:
-                total_features = data.get("numberMatched", data.get("totalFeatures", "?"))
-                print(f"     Total esperado: {total_features}")
-            
-            print(f"     Descargados: {len(all_features)} features")
-            
-            # Si devolvió menos del batch, terminamos
-            if len(features) < BATCH_SIZE:
-                break
-                
-            start_index += BATCH_SIZE
-            time.sleep(0.5)  # Rate limiting
-            
-        except requests.exceptions.RequestException as e:
+            more = sizer.has_more(first_count, downloaded, downloaded, total, observe=not replayed)
+        except ValueError as e:
             print(f"     ❌ Error: {e}")
-            break
+            failed = True
+    
+    if more:
+        if sizer.size != first_count:
+            print(f"     📏 Páginas de {sizer.size} features")
+        if options.page_concurrency > 1 and total is not None:
+            pages = _iter_pages_parallel(url, layer, cql_filter, downloaded, total, sizer.size,
+                                         journal, options)
+        else:
+            pages = _iter_pages_sequential(url, layer, cql_filter, sizer, downloaded, total, journal, options)
+        for features in pages:
+            if features is None:
+                failed = True
+                continue
+            downloaded += len(features)
+            print(f"     Descargados: {downloaded} features")
+            yield from features
+    
+    if isinstance(total_features, int) and downloaded != total_features:
+        print(f"     ⚠️  Conteo incompleto: {downloaded}/{total_features}")
+    
+    if progress is not None:
+        progress.add(total_features, downloaded, failed)
+
+
+def fetch_wfs_tile(url: str, layer: str, bbox, hits: Optional[int], in_flight: int = 1,
+                   options: DownloadOptions = DEFAULT_OPTIONS):
+    """Descarga una tesela BBOX completa en una sola petición."""
+    count = max(hits or 0, TILE_MAX_FEATURES)
+    request_url = build_wfs_url(url, layer, None, 0, count, bbox_param(bbox), options)
+    features = page_buffer(in_flight, options)
+    features.extend(FeatureStream(getfeature_stream(request_url, options.response_cache)))
+    METRICS.observe_page(layer, len(features))
+    return features
+
+
+def iter_wfs_tiles(url: str, layer: str, description: str,
+                   concurrency: int = TILE_CONCURRENCY,
+                   progress: Optional[LayerProgress] = None,
+                   options: DownloadOptions = DEFAULT_OPTIONS) -> Iterator[dict]:
+    """
+    Genera las features de una capa WFS por teselas BBOX (ver dera_tiles.py).
+    
+    Cada tesela cuesta una petición acotada (TILE_MAX_FEATURES) y se piden
+    `concurrency` a la vez. Al final el total sin duplicados se compara con
+    numberMatched de la capa entera: así se detectan features fuera de la
+    extensión o teselas incompletas.
+    """
+    print(f"\n  📡 {description} (teselas)")
+    print(f"     Capa: {layer}")
+    
+    total = probe_hits(url, layer)
+    tiles = plan_tiles(lambda tile: probe_hits(url, layer, bbox=bbox_param(tile)),
+                       concurrency=concurrency)
+    print(f"     Total esperado: {total if total is not None else '?'} en {len(tiles)} teselas")
+    
+    result = TileResult()
+    yield from iter_tiled_features(
+        lambda tile, hits: fetch_wfs_tile(url, layer, tile, hits, concurrency, options),
+        tiles,
+        concurrency,
+        result,
+        errors=(requests.exceptions.RequestException, ValueError),
+        on_error=lambda tile, e: print(f"     ❌ Error en tesela {bbox_param(tile)}: {e}"),
+    )
+    
+    print(f"     Descargados: {result.unique} features "
+          f"({result.duplicates} duplicados en bordes descartados)")
+    if result.short:
+        print(f"     ⚠️  {result.short} teselas con menos features que su conteo")
+    if isinstance(total, int) and result.unique != total:
+        print(f"     ⚠️  Conteo incompleto: {result.unique}/{total}")
+    
+    if progress is not None:
+        progress.add(total, result.unique, not result.complete)
+
+
+def iter_layer_features(layer_key: str,
+                        journal: Optional[CheckpointJournal] = None,
+                        progress: Optional[LayerProgress] = None,
+                        cql_filter: Optional[str] = None,
+                        options: DownloadOptions = DEFAULT_OPTIONS) -> Iterator[dict]:
+    """
+    API pública: genera todas las features de una capa de WFS_CONFIG,
+    fuente a fuente, sin acumularlas en memoria.
+    
+    Con options.tiled las fuentes sin cql_filter se descargan por teselas
+    BBOX (GeoServer no admite BBOX y CQL_FILTER a la vez). Con
+    options.coalesce las fuentes contiguas del mismo endpoint se piden
+    juntas (typeName=a,b). `cql_filter` se añade (AND) al filtro de cada
+    fuente.
+    """
+    sources = WFS_CONFIG[layer_key]["urls"]
+    if options.coalesce:
+        sources = _coalesce_config_sources(sources)
+    if cql_filter:
+        sources = [dict(s, cql_filter=combine_cql(s.get("cql_filter"), cql_filter)) for s in sources]
+    
+    for source in sources:
+        if options.tiled and not source.get("cql_filter"):
+            yield from iter_wfs_tiles(
+                source["url"],
+                source["layer"],
+                source["description"],
+                max(options.page_concurrency, TILE_CONCURRENCY),
+                progress,
+                options
+            )
+            continue
+        yield from iter_wfs_features(
+            source["url"],
+            source["layer"],
+            source["description"],
+            source.get("cql_filter"),
+            journal,
+            progress,
+            options
+        )
+
+
+def _coalesce_config_sources(sources: list) -> list:
+    """Une fuentes contiguas con misma URL y filtro en una sola con varios typeNames."""
+    merged = []
+    keyed = [((s["url"], s.get("cql_filter")), s) for s in sources]
+    for _, group in coalesce_sources(keyed):
+        group = [source for _, source in group]
+        if len(group) == 1:
+            merged.append(group[0])
+            continue
+        merged.append({
+            "url": group[0]["url"],
+            "layer": ",".join(s["layer"] for s in group),
+            "description": " + ".join(s["description"] for s in group),
+            "cql_filter": group[0].get("cql_filter"),
+        })
+    return merged
+
+
+@METRICS.timed("fetch_wfs_features", "layer")
+def fetch_wfs_features(url: str, layer: str, description: str, 
+                       cql_filter: Optional[str] = None,
+                       options: DownloadOptions = DEFAULT_OPTIONS) -> dict:
+    """
+    Descarga todas las features de una capa WFS con paginación.
+    
+    Con options.max_memory, "features" es un SpillBuffer (ver
+    dera_spill.py): lo que supera el presupuesto queda en NDJSON temporales
+    y se recorre en streaming. download_layer escribe según llega: solo
+    acota las páginas en vuelo (page_buffer).
+    """
+    features = iter_wfs_features(url, layer, description, cql_filter, options=options)
+    if options.max_memory is not None:
+        all_features = SpillBuffer(options.max_memory)
+        all_features.extend(features)
+        if all_features.spilled:
+            print(f"     💽 {all_features.summary()}")
+    else:
+        all_features = list(features)
     
     return {
         "type": "FeatureCollection",
@@ -200,58 +652,300 @@ def fetch_wfs_features(url: str, layer: str, description: str,
     }
 
 
-def download_layer(layer_key: str, output_dir: Path) -> bool:
-    """Descarga una capa completa y guarda en GeoJSON."""
+def _fetch_page_features(url: str, layer: str, cql_filter: Optional[str], start_index: int,
+                         count: int, journal: Optional[CheckpointJournal],
+                         sizer: Optional[PageSizer] = None, in_flight: int = 1,
+                         options: DownloadOptions = DEFAULT_OPTIONS):
+    """
+    Página desde el diario si ya se descargó; si no, del servidor (y al
+    diario). Con `sizer`, la duración de la petición ajusta el tamaño.
+    Retorna page_buffer(in_flight) con las features.
+    """
+    features = page_buffer(in_flight, options)
+    if journal is not None and journal.has_page(layer, start_index):
+        features.extend(journal.read_page(layer, start_index))
+        return features
+    
+    meter = TransferMeter()
+    features.extend(stream_wfs_page(url, layer, cql_filter, start_index, count, meter, options))
+    METRICS.observe_page(layer, len(features))
+    if sizer is not None:
+        sizer.observe(count, len(features), meter.seconds, meter.bytes)
+    if journal is not None:
+        journal.save_page(layer, start_index, features)
+    return features
+
+
+def _iter_pages_sequential(url: str, layer: str, cql_filter: Optional[str],
+                           sizer: PageSizer, start_index: int, total: Optional[int],
+                           journal: Optional[CheckpointJournal] = None,
+                           options: DownloadOptions = DEFAULT_OPTIONS) -> Iterator[Optional[list]]:
+    """
+    Pagina una a una desde start_index, cada página desde donde acabó la
+    anterior, hasta completar `total` (o, sin él, hasta una página
+    incompleta). None = página fallida.
+    """
+    while True:
+        # El ritmo entre páginas lo marca el limitador adaptativo de wfs_http
+        count = sizer.size
+        # Las páginas del diario no ajustan el tamaño (ver PageSizer.has_more)
+        replayed = journal is not None and journal.has_page(layer, start_index)
+        try:
+            features = _fetch_page_features(url, layer, cql_filter, start_index, count, journal, sizer,
+                                            options=options)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"     ❌ Error: {e}")
+            yield None
+            break
+        
+        if features:
+            yield features
+        start_index += len(features)
+        
+        try:
+            if not sizer.has_more(count, len(features), start_index, total, observe=not replayed):
+                break
+        except ValueError as e:
+            print(f"     ❌ Error: {e}")
+            yield None
+            break
+        if sizer.size != count:
+            print(f"     📏 Páginas de {sizer.size} features")
+
+
+def _iter_pages_parallel(url: str, layer: str, cql_filter: Optional[str],
+                         start: int, total: int, size: int,
+                         journal: Optional[CheckpointJournal] = None,
+                         options: DownloadOptions = DEFAULT_OPTIONS) -> Iterator[Optional[list]]:
+    """
+    Pide los offsets restantes (desde `start`, de `size` en `size`) con una
+    ventana deslizante de options.page_concurrency páginas y los genera en
+    orden. None = página fallida.
+    
+    El tamaño queda fijo tras la primera página: los offsets se reparten
+    por adelantado. Con diario se guarda, para que --resume pida los
+    mismos offsets aunque el ajuste de esta ejecución sea otro.
+    """
+    if journal is not None:
+        size = journal.page_size(layer) or size
+        journal.set_page_size(layer, size)
+    offsets = iter(range(start, total, size))
+    pages = 1 + -(-(total - start) // size)
+    page_concurrency = options.page_concurrency
+    
+    with ThreadPoolExecutor(max_workers=page_concurrency) as executor:
+        pending = deque(
+            (offset, executor.submit(_fetch_page_features, url, layer, cql_filter, offset, size, journal,
+                                     None, page_concurrency, options))
+            for offset in islice(offsets, page_concurrency)
+        )
+        while pending:
+            offset, future = pending.popleft()
+            next_offset = next(offsets, None)
+            if next_offset is not None:
+                pending.append((next_offset, executor.submit(
+                    _fetch_page_features, url, layer, cql_filter, next_offset, size, journal,
+                    None, page_concurrency, options)))
+            try:
+                features = future.result()
+            except (requests.exceptions.RequestException, ValueError) as e:
+                print(f"     ❌ Error en página {(offset - start) // size + 2}/{pages}: {e}")
+                yield None
+                continue
+            yield features
+
+
+@METRICS.timed("download_layer", "layer_key")
+def download_layer(layer_key: str, output_dir: Path,
+                   options: DownloadOptions = DEFAULT_OPTIONS,
+                   state: Optional[dict] = None,
+                   probed: Optional[dict] = None) -> bool:
+    """
+    Descarga una capa completa y la escribe en GeoJSON según llega.
+    
+    Con `state` (ver dera_state.py) la capa se salta si el servidor indica
+    que no ha cambiado, salvo con options.force. `probed` son los sondeos
+    ya hechos al planificar (ver download_all), que no se repiten.
+    
+    La capa solo se publica (y cuenta como éxito) si el número de features
+    coincide con numberMatched. Si no, se conserva el archivo anterior y
+    las páginas completadas quedan en el diario de options.checkpoint_dir
+    para --resume.
+    
+    Con options.columnar se escribe además <capa>.columnar.bin (ver
+    dera_columnar.py) con las mismas features, y con options.rtree el
+    índice Flatbush <capa>.rtree.bin (ver dera_rtree.py). Con
+    options.search_index, el índice de nombres <capa>.search.json (ver
+    dera_search.py). Con options.shards, las particiones por municipio y
+    provincia (dera_shards.py).
+    
+    Con options.area solo se pide esa zona y se sustituye su porción del
+    GeoJSON publicado (ver dera_area.py); sin archivo previo no hay nada
+    que refrescar. Tras un refresco parcial el estado no guarda los
+    sondeos, así que la siguiente ejecución completa no se salta la capa.
+    Lo mismo con --cache-only (options.offline), que tampoco sondea.
+    
+    Con options.precision las coordenadas se redondean según la política
+    de la capa (ver dera_precision.py) y se informa de lo ahorrado y del
+    error.
+    
+    Con output_format="geojsonseq" se escribe <capa>.geojsonl con una
+    feature por línea y los metadatos en <capa>.meta.json.
+    """
     if layer_key not in WFS_CONFIG:
         print(f"❌ Capa desconocida: {layer_key}")
         return False
     
     config = WFS_CONFIG[layer_key]
-    print(f"\n🔄 Descargando: {config['name']}")
+    area = options.area
+    output_file = output_dir / feature_filename(layer_key, options.output_format)
+    meters = options.precision.for_layer(layer_key) if options.precision else None
     
-    all_features = []
+    if area is not None and not output_file.exists():
+        print(f"❌ {output_file.name} no existe: descarga la capa completa antes de refrescar una zona")
+        return False
     
-    for source in config["urls"]:
-        result = fetch_wfs_features(
-            source["url"],
-            source["layer"],
-            source["description"],
-            source.get("cql_filter")
-        )
-        all_features.extend(result.get("features", []))
+    probes = {}
+    if state is not None and area is None and not options.offline:
+        sources = [(s["url"], s["layer"]) for s in config["urls"]]
+        unchanged, probes = check_layer(layer_key, sources, state, output_file, probed)
+        if unchanged and not options.force:
+            print(f"\n⏭️  Sin cambios: {config['name']} ({output_file.name})")
+            rebuilt = refresh_sidecars(output_file, output_dir, layer_key, options.columnar, options.rtree,
+                                       options.search_index, options.shards, meters,
+                                       state["layers"][layer_key].get("fingerprint"), indent=2)
+            if rebuilt:
+                print(f"  🔁 Regenerados: {', '.join(rebuilt)}")
+            return True
     
-    # Guardar resultado
-    output_file = output_dir / f"{layer_key}.geojson"
-    geojson = {
-        "type": "FeatureCollection",
-        "features": all_features,
-        "metadata": {
-            "layer": layer_key,
-            "name": config["name"],
-            "featuresCount": len(all_features),
-            "downloadedAt": datetime.utcnow().isoformat() + "Z",
-            "sources": [s["layer"] for s in config["urls"]]
-        }
-    }
+    print(f"\n🔄 Descargando: {config['name']}" + (f" (zona: {area.describe()})" if area else ""))
+    previous_size = output_file.stat().st_size if output_file.exists() else None
+    fingerprint = Fingerprint()
+    journal = None
+    if options.checkpoint_dir:
+        journal = CheckpointJournal(options.checkpoint_dir, layer_key, resume=options.resume)
+    progress = LayerProgress()
+    columns = None
+    if options.columnar or options.rtree or options.search_index:
+        columns = ColumnarWriter(layer_key, meters)
+    quantizer = Quantizer(meters) if meters else None
+    slice_stats = SliceStats()
     
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(geojson, f, ensure_ascii=False, indent=2)
+    try:
+        with feature_writer(output_file, indent=2) as writer:
+            features = iter_layer_features(layer_key, journal, progress, area.cql() if area else None, options)
+            if area:
+                features = refresh_slice(read_features(output_file), features, area, slice_stats)
+            if quantizer:
+                features = quantizer.wrap(features)
+            features = fingerprint.wrap(features)
+            writer.write_features(columns.wrap(features) if columns else features)
+            if not progress.complete:
+                raise IncompleteLayerError(f"{progress.received}/{progress.expected or '?'} features")
+            
+            writer.finish(metadata={
+                "layer": layer_key,
+                "name": config["name"],
+                "featuresCount": writer.count,
+                "downloadedAt": datetime.utcnow().isoformat() + "Z",
+                "sources": [s["layer"] for s in config["urls"]],
+                **({"refreshedArea": area.describe()} if area else {}),
+                **({"coordinatePrecision": meters} if meters else {}),
+            })
+    except IncompleteLayerError as e:
+        print(f"  ❌ Capa incompleta ({e}): se conserva {output_file.name}. "
+              f"Reintenta con --resume para pedir solo las páginas que faltan")
+        return False
     
+    if journal is not None:
+        journal.clear()
     file_size = output_file.stat().st_size / 1024
-    print(f"  ✅ Guardado: {output_file.name} ({len(all_features)} features, {file_size:.1f} KB)")
+    change = f", {file_size - previous_size / 1024:+.1f} KB respecto al anterior" if previous_size else ""
+    print(f"  ✅ Guardado: {output_file.name} ({writer.count} features, {file_size:.1f} KB{change})")
+    if area:
+        print(f"  🔁 Zona {area.describe()}: {slice_stats.replaced} → {slice_stats.fresh} features "
+              f"({slice_stats.kept} conservadas fuera de la zona)")
+        if slice_stats.outside:
+            print(f"  ⚠️  {slice_stats.outside} features recibidas fuera de la zona descartadas")
+    if quantizer:
+        print(f"  📐 Coordenadas: {quantizer.summary()}")
+    if columns:
+        columns.source_fingerprint = fingerprint.hexdigest()
+    if options.columnar:
+        binary_size = columns.write(columnar_path(output_dir, layer_key)) / 1024
+        print(f"  ✅ Columnar: {columnar_path(output_dir, layer_key).name} ({binary_size:.1f} KB, "
+              f"{len(columns.strings)} cadenas)")
+    if options.rtree:
+        indexed = write_rtree(columns, output_dir, layer_key)
+        print(f"  ✅ Índice: {rtree_paths(output_dir, layer_key)[0].name} ({indexed or 0} elementos)")
+    if options.search_index:
+        municipios = write_search_index(columns, output_dir, layer_key)
+        print(f"  ✅ Búsqueda: {search_path(output_dir, layer_key).name} ({municipios} municipios)")
+    if options.shards:
+        manifest = write_shards(output_file, output_dir, layer_key, indent=2, fingerprint=fingerprint.hexdigest())
+        print(f"  ✅ Particiones: {len(manifest['municipios'])} municipios, "
+              f"{len(manifest['provincias'])} provincias")
+    
+    if state is not None:
+        record_layer(state, layer_key, {} if area else probes, writer.count, fingerprint.hexdigest())
     
     return True
 
 
-def download_all(output_dir: Path) -> dict:
-    """Descarga todas las capas disponibles."""
-    results = {}
+def download_all(output_dir: Path, jobs: int = DEFAULT_JOBS,
+                 options: DownloadOptions = DEFAULT_OPTIONS,
+                 state: Optional[dict] = None) -> dict:
+    """
+    Descarga todas las capas disponibles.
     
-    for layer_key in WFS_CONFIG.keys():
-        success = download_layer(layer_key, output_dir)
-        results[layer_key] = success
+    Con jobs > 1 sondea el tamaño de cada capa y lanza primero las más
+    grandes en un pool de `jobs` workers (límite por host en wfs_http).
+    Con `state`, ese sondeo es el condicional del refresco y cada capa lo
+    reutiliza en lugar de sondear otra vez.
+    """
+    keys = list(WFS_CONFIG.keys())
+    probed = {}
     
-    return results
+    if jobs > 1 and not options.offline:
+        conditional = state is not None and options.area is None
+        plan = plan_layers({
+            key: [(s["url"], s["layer"]) for s in config["urls"]]
+            for key, config in WFS_CONFIG.items()
+        }, probe_planner(state, probed) if conditional else probe_hits)
+        print("\n📋 Plan de descarga (mayor a menor):")
+        for key, hits in plan:
+            print(f"  {key:12} {hits if hits is not None else '?'} features")
+        keys = [key for key, _ in plan]
+    
+    results = run_layers(
+        keys,
+        lambda key: download_layer(key, output_dir, options, state, probed),
+        jobs,
+        on_error=lambda key, e: print(f"❌ Error en capa {WFS_CONFIG[key]['name']}: {e}"),
+    )
+    return {key: results[key] for key in WFS_CONFIG.keys()}
+
+
+def report_projection(keys, options: DownloadOptions = DEFAULT_OPTIONS) -> int:
+    """
+    Compara una muestra de cada fuente con y sin propertyName y extrapola
+    el ahorro a su numberMatched. Retorna los bytes ahorrados estimados.
+    """
+    total_saved = 0
+    sources = [(s["url"], s["layer"], s["description"]) for key in keys for s in WFS_CONFIG[key]["urls"]]
+    sample_url = lambda url, layer, projected: build_wfs_url(url, layer, count=SAMPLE_SIZE,
+                                                             options=replace(options, project=projected))
+    stream = lambda request_url: http_stream(request_url, timeout=REQUEST_TIMEOUT)
+    for (_, _, desc), savings, error in layer_savings(sources, sample_url, probe_hits, stream):
+        if error is not None:
+            print(f"  ⚠️  Proyección {desc}: sin muestra ({error})")
+        if savings is None:
+            continue
+        total_saved += savings["estimatedSaved"]
+        print(f"  ✂️  Proyección {desc}: -{savings['ratio'] * 100:.0f}% "
+              f"(~{savings['estimatedSaved'] / 1024:.1f} KB menos)")
+    print(f"  ✂️  Proyección: ~{total_saved / 1024:.1f} KB ahorrados en total")
+    return total_saved
 
 
 # ============================================================================
@@ -279,6 +973,200 @@ def main():
         action="store_true",
         help="Listar capas disponibles"
     )
+    parser.add_argument(
+        "--jobs", "-j",
+        type=int,
+        default=DEFAULT_JOBS,
+        help=f"Capas descargadas en paralelo (default: {DEFAULT_JOBS})"
+    )
+    parser.add_argument(
+        "--max-per-host",
+        type=int,
+        default=MAX_PER_HOST,
+        help=f"Peticiones simultáneas máximas por host (default: {MAX_PER_HOST})"
+    )
+    parser.add_argument(
+        "--page-concurrency",
+        type=int,
+        default=PAGE_CONCURRENCY,
+        help="Páginas de una misma capa en vuelo; acotado también por --max-per-host "
+             f"(default: {PAGE_CONCURRENCY})"
+    )
+    parser.add_argument(
+        "--page-size",
+        type=int,
+        default=None,
+        help=f"Features por petición, fijo (default: {BATCH_SIZE} al empezar, ajustado según "
+             "--target-seconds); siempre acotado por el CountDefault del servidor"
+    )
+    parser.add_argument(
+        "--target-seconds",
+        type=float,
+        default=TARGET_SECONDS,
+        help=f"Duración objetivo de cada petición para ajustar el tamaño de página (default: {TARGET_SECONDS:g})"
+    )
+    parser.add_argument(
+        "--pool-size",
+        type=int,
+        default=POOL_SIZE,
+        help=f"Conexiones keep-alive por host (default: {POOL_SIZE})"
+    )
+    parser.add_argument(
+        "--max-rate",
+        type=float,
+        default=MAX_RATE,
+        help=f"Peticiones/segundo máximas por host; el ritmo se adapta por debajo (default: {MAX_RATE})"
+    )
+    parser.add_argument(
+        "--force", "-f",
+        action="store_true",
+        default=is_force_env(os.environ.get("FORCE_UPDATE")),
+        help="Descargar aunque el servidor indique que no hay cambios (default: $FORCE_UPDATE)"
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Reanudar capas interrumpidas: solo se piden las páginas que faltan"
+    )
+    parser.add_argument(
+        "--checkpoint-dir",
+        type=Path,
+        default=DEFAULT_CHECKPOINT_DIR,
+        help=f"Diario de páginas completadas para --resume, fuera de public/ "
+             f"(default: {DEFAULT_CHECKPOINT_DIR})"
+    )
+    parser.add_argument(
+        "--tiled",
+        action="store_true",
+        help="Descargar por teselas BBOX de Andalucía (subdivididas hasta "
+             f"{TILE_MAX_FEATURES} features) en lugar de paginar por startIndex"
+    )
+    parser.add_argument(
+        "--coalesce",
+        action="store_true",
+        help="Pedir juntas (typeName=a,b) las fuentes de una capa que comparten endpoint"
+    )
+    parser.add_argument(
+        "--all-properties",
+        dest="project",
+        action="store_false",
+        help="Pedir todos los atributos (sin propertyName)"
+    )
+    parser.add_argument(
+        "--projection-report",
+        action="store_true",
+        help="Estimar con una muestra por fuente los bytes que ahorra la proyección"
+    )
+    parser.add_argument(
+        "--columnar",
+        action="store_true",
+        help="Escribir además <capa>.columnar.bin (columnas binarias para typed arrays)"
+    )
+    parser.add_argument(
+        "--rtree",
+        action="store_true",
+        help="Escribir además <capa>.rtree.bin (R-tree Flatbush precalculado, orden Hilbert)"
+    )
+    parser.add_argument(
+        "--search-index",
+        action="store_true",
+        help="Escribir además <capa>.search.json (trigramas de nombres por cod_mun)"
+    )
+    parser.add_argument(
+        "--shards",
+        action="store_true",
+        help="Escribir además particiones por municipio y provincia con manifiesto (shards/<capa>/)"
+    )
+    parser.add_argument(
+        "--province",
+        action="append",
+        help="Refrescar solo esta provincia (código INE o nombre; repetible o separado por comas)"
+    )
+    parser.add_argument(
+        "--municipio",
+        action="append",
+        help="Refrescar solo este municipio (código INE de 5 dígitos; repetible o separado por comas)"
+    )
+    parser.add_argument(
+        "--precision",
+        nargs="*",
+        metavar="[CAPA=]METROS",
+        help="Redondear las coordenadas al escribir: sin valor, la política por capa "
+             f"(por defecto {DEFAULT_PRECISION:g} m); METROS para todas o CAPA=METROS para una"
+    )
+    parser.add_argument(
+        "--format",
+        choices=OUTPUT_FORMATS,
+        default="geojson",
+        help="geojson: un FeatureCollection por capa; geojsonseq: una feature por línea "
+             "(<capa>.geojsonl) con metadatos en <capa>.meta.json (default: geojson)"
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=Path,
+        default=Path(os.environ[CACHE_ENV]) if os.environ.get(CACHE_ENV) else None,
+        help=f"Guardar y reutilizar las respuestas GetFeature en este directorio (default: ${CACHE_ENV})"
+    )
+    parser.add_argument(
+        "--cache-ttl",
+        type=float,
+        default=DEFAULT_TTL / 3600,
+        help=f"Horas de validez de una respuesta en caché; --cache-only la ignora "
+             f"(default: {DEFAULT_TTL / 3600:g})"
+    )
+    parser.add_argument(
+        "--cache-max-mb",
+        type=float,
+        default=DEFAULT_MAX_BYTES / (1024 * 1024),
+        help=f"Tamaño máximo de la caché; se expulsan las menos usadas (default: "
+             f"{DEFAULT_MAX_BYTES // (1024 * 1024)})"
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="No usar la caché de respuestas aunque haya --cache-dir o $" + CACHE_ENV
+    )
+    parser.add_argument(
+        "--cache-only",
+        action="store_true",
+        help=f"Sin red: servir todo desde la caché (default: --cache-dir o {DEFAULT_CACHE_DIR})"
+    )
+    parser.add_argument(
+        "--metrics-dir",
+        type=Path,
+        default=None,
+        help="Escribir métricas de la ejecución (dera-metrics.json y dera.prom) en este directorio"
+    )
+    parser.add_argument(
+        "--profile",
+        nargs="*",
+        choices=PROFILE_MODES,
+        metavar="MODO",
+        help="Perfilar cada etapa (tiempo de reloj y CPU); MODO añade cprofile (funciones "
+             "con más tiempo) y/o tracemalloc (pico de memoria por capa)"
+    )
+    parser.add_argument(
+        "--profile-dir",
+        type=Path,
+        default=None,
+        help="Directorio de artefactos del perfil (default: dera-profile/<fecha>)"
+    )
+    parser.add_argument(
+        "--max-memory",
+        type=float,
+        default=None,
+        metavar="MB",
+        help="Presupuesto de features en memoria, repartido entre las páginas en vuelo: "
+             "lo que lo supera se vuelca a NDJSON temporales (default: sin límite). "
+             "No acota --columnar, --rtree, --search-index ni --shards"
+    )
+    parser.add_argument(
+        "--state-file",
+        type=Path,
+        default=None,
+        help="Estado del refresco condicional, fuera de public/ "
+             "(default: uno por directorio de salida en ~/.cache/ptel-dera-state)"
+    )
     
     args = parser.parse_args()
     
@@ -290,8 +1178,56 @@ def main():
                 print(f"                └─ {source['description']}")
         return 0
     
+    try:
+        area = AreaFilter.from_args(args.province, args.municipio)
+        precision = PrecisionPolicy.from_args(args.precision, WFS_CONFIG.keys())
+        max_memory = parse_megabytes(args.max_memory)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.cache_only and args.no_cache:
+        parser.error("--cache-only y --no-cache son incompatibles")
+    if args.page_size is not None and args.page_size < 1:
+        parser.error("--page-size debe ser positivo")
+    if args.target_seconds <= 0:
+        parser.error("--target-seconds debe ser positivo")
+    cache_dir = args.cache_dir or (DEFAULT_CACHE_DIR if args.cache_only else None)
+    response_cache = None
+    if cache_dir and not args.no_cache:
+        response_cache = ResponseCache(cache_dir, ttl=args.cache_ttl * 3600,
+                                       max_bytes=int(args.cache_max_mb * 1024 * 1024),
+                                       offline=args.cache_only)
+    offline = response_cache is not None and response_cache.offline
+    
     # Crear directorio de salida
     args.output.mkdir(parents=True, exist_ok=True)
+    HOST_LIMITER.configure(args.max_per_host)
+    RATE_LIMITER.configure(max_rate=args.max_rate)
+    configure_session(pool_size=args.pool_size)
+    state_file = args.state_file or default_state_file(args.output)
+    state = load_state(state_file)
+    options = DownloadOptions(
+        batch_size=args.page_size or BATCH_SIZE,
+        page_target=None if args.page_size else args.target_seconds,
+        page_concurrency=args.page_concurrency,
+        project=args.project,
+        capabilities=None if offline else CapabilitiesCache(lambda u: http_stream(u, timeout=REQUEST_TIMEOUT)),
+        # A través de la caché: con --cache-only las URLs validadas siguen coincidiendo
+        schemas=SchemaCache(lambda u: getfeature_stream(u, response_cache)) if args.project else None,
+        response_cache=response_cache,
+        max_memory=max_memory,
+        checkpoint_dir=args.checkpoint_dir,
+        force=args.force,
+        resume=args.resume,
+        tiled=args.tiled,
+        coalesce=args.coalesce,
+        columnar=args.columnar,
+        rtree=args.rtree,
+        search_index=args.search_index,
+        shards=args.shards,
+        area=area,
+        precision=precision,
+        output_format=args.format,
+    )
     
     print(f"""
 ╔══════════════════════════════════════════════════════════════════╗
@@ -299,14 +1235,45 @@ def main():
 ╚══════════════════════════════════════════════════════════════════╝
   Directorio: {args.output}
   Capas: {args.layer if args.layer != 'all' else ', '.join(WFS_CONFIG.keys())}
+  Workers: {args.jobs} (máx. {args.max_per_host} por host)
+  Refresco: {'zona ' + area.describe() if area else 'forzado' if args.force else 'condicional'} ({state_file})
+  Caché: {('solo caché, sin red' if offline else 'activa') + f' ({response_cache.dir})' if response_cache else 'no'}
+  Páginas: {options.batch_size} features{f', ajustadas a ~{options.page_target:g}s por petición' if options.page_target and not response_cache else ''}
+  Memoria: {f'{max_memory / (1024 * 1024):.0f} MB por capa' if max_memory is not None else 'sin límite'}
 """)
+    sidecars = [flag for flag, on in (("--columnar", args.columnar), ("--rtree", args.rtree),
+                                      ("--search-index", args.search_index), ("--shards", args.shards)) if on]
+    if max_memory is not None and sidecars:
+        print(f"  ⚠️  --max-memory no acota {', '.join(sidecars)}: crecen con el tamaño de la capa")
+    keys = WFS_CONFIG.keys() if args.layer == "all" else [args.layer]
+    if options.capabilities is not None:
+        for url in dict.fromkeys(s["url"] for key in keys for s in WFS_CONFIG[key]["urls"]):
+            print(f"  📑 {options.capabilities.describe(url)}")
+    if options.schemas is not None:
+        for source in (s for key in keys for s in WFS_CONFIG[key]["urls"]):
+            mark = "📐" if options.schemas.valid(source["url"], source["layer"]) else "⚠️ "
+            print(f"  {mark} {options.schemas.describe(source['url'], source['layer'])}")
+        if args.projection_report and not offline:
+            report_projection(keys, options)
     
     start_time = time.time()
+    METRICS.reset()
+    profiler = None
+    if args.profile is not None:
+        profiler = Profiler(args.profile_dir or default_profile_dir(), args.profile).attach(METRICS)
     
     if args.layer == "all":
-        results = download_all(args.output)
+        results = download_all(args.output, args.jobs, options, state)
     else:
-        results = {args.layer: download_layer(args.layer, args.output)}
+        results = {args.layer: download_layer(args.layer, args.output, options, state)}
+    
+    save_state(state_file, state)
+    if args.metrics_dir:
+        for path in METRICS.write(args.metrics_dir):
+            print(f"📈 Métricas: {path}")
+    if profiler:
+        profiler.detach(METRICS)
+        print(f"🔬 Perfil: {profiler.write()}")
     
     elapsed = time.time() - start_time
     
@@ -320,6 +1287,8 @@ def main():
 ╠══════════════════════════════════════════════════════════════════╣
   ✅ Completadas: {success}/{total}
   ⏱️  Tiempo: {elapsed:.1f}s
+  🌐 HTTP: {format_stats()}
+  💾 Caché: {response_cache.summary() if response_cache else 'no'}
   📁 Archivos en: {args.output}
 ╚══════════════════════════════════════════════════════════════════╝
 """)
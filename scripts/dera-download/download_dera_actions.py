@@ -5,20 +5,113 @@ download_dera_actions.py
 Versión optimizada para GitHub Actions del descargador DERA.
 Más robusto, con reintentos y logging detallado.
 
+USO:
+    python download_dera_actions.py            # Secuencial
+    python download_dera_actions.py --jobs 4   # Concurrente (largest-first)
+    python download_dera_actions.py --force    # Ignorar dera-state.json
+
+Las categorías que el servidor indica sin cambios (304, mismos
+validadores y numberMatched o, sin validadores, mismo numberMatched y
+misma muestra de contenido) no se descargan; si ninguna cambia,
+metadata.json no se reescribe y el commit del workflow queda vacío.
+FORCE_UPDATE=true equivale a --force.
+
+Cada categoría descargada se compara feature a feature (por id_dera) con
+la versión anterior; los cambios se publican en public/data/dera/delta/
+y metadata.json lleva la versión de datos y los deltas disponibles.
+
+Las capas de una categoría servidas por el mismo endpoint se piden en un
+único GetFeature con varios typeNames (--no-coalesce para desactivarlo).
+
+Solo se piden los atributos que consume la aplicación (PROPERTYNAME, ver
+dera_projection.py). Las listas se validan antes con DescribeFeatureType:
+los atributos que la capa ya no tiene se descartan y, si el esquema no
+llega, la capa se pide completa. --all-properties pide todos y
+--projection-report estima el ahorro con una muestra por capa.
+
+--province y --municipio refrescan solo esa zona: se pide con CQL_FILTER
+sobre cod_mun y se sustituye su porción de cada GeoJSON (ver dera_area.py).
+
+Con --columnar cada categoría se escribe además en <categoría>.columnar.bin
+(columnas binarias para typed arrays, ver dera_columnar.py) y con --rtree
+se precalcula su índice Flatbush (<categoría>.rtree.bin, ver dera_rtree.py).
+--search-index añade el índice de nombres <categoría>.search.json
+(trigramas por municipio, ver dera_search.py) y --shards las particiones
+por municipio y provincia con su manifiesto (shards/<categoría>/, ver
+dera_shards.py).
+
+--precision redondea las coordenadas según la política por capa (ver
+dera_precision.py) e informa de los bytes ahorrados y el error máximo;
+en el columnar x/y pasan a enteros codificados en delta.
+
+--metrics-dir escribe las métricas de la ejecución (latencias por
+petición, reintentos, features por respuesta y duración de cada etapa)
+en dera-metrics.json y en el textfile de Prometheus dera.prom (ver
+dera_metrics.py).
+
+--format geojsonseq escribe <categoría>.geojsonl, una feature por
+línea, y el crs en el sidecar <categoría>.meta.json: los cargadores del
+navegador y transform-to-dexie.cjs procesan línea a línea sin esperar al
+final del archivo (ver geojson_io.py).
+
+--max-memory MB acota las features acumuladas en memoria: las
+añadidas y modificadas del delta pasan a NDJSON temporales al superarlo
+(ver dera_spill.py). El GeoJSON ya se escribe según llega. Los derivados
+no entran en el presupuesto: --columnar, --rtree y --search-index crecen
+con cada feature de la categoría y --shards agrupa en memoria la
+provincia más grande.
+
+--profile mide cada etapa (reloj y CPU) y, con los modos cprofile y
+tracemalloc, las funciones con más tiempo y el pico de memoria por capa;
+el informe queda en --profile-dir (ver dera_profile.py).
+
+Cada GetFeature lleva COUNT y STARTINDEX: se pagina hasta completar
+numberMatched en lugar de confiar en el máximo por defecto del servidor.
+GetCapabilities de cada endpoint (ImplementsResultPaging y CountDefault)
+se pide una vez; el tamaño de página empieza en PAGE_SIZE y se ajusta por
+capa a --target-seconds por petición (--page-size lo fija). Si numberMatched
+no se puede completar la categoría no se publica (ver dera_paging.py).
+
 @version 1.0.0
 @date 2025-12-03
 """
 
+import argparse
 import json
 import os
 import sys
 import time
 from datetime import datetime
 from pathlib import Path
+from typing import Iterable, Iterator, Optional, Tuple
 from urllib.parse import urlencode
 
 import requests
 
+from dera_area import AreaFilter, SliceStats, read_features, refresh_slice
+from dera_columnar import ColumnarWriter, columnar_path
+from dera_delta import DELTA_DIRNAME, LayerDelta, delta_index
+from dera_engine import DEFAULT_JOBS, coalesce_sources, local_type_name, plan_layers, probe_hits, run_layers
+from dera_metrics import METRICS
+from dera_paging import TARGET_SECONDS, CapabilitiesCache, PageSizer, PagingError, TransferMeter
+from dera_profile import PROFILE_MODES, Profiler, default_profile_dir
+from dera_precision import DEFAULT_PRECISION, PrecisionPolicy, Quantizer
+from dera_projection import SAMPLE_SIZE, SchemaCache, layer_savings, property_names
+from dera_rtree import rtree_paths, write_rtree
+from dera_search import search_path, write_search_index
+from dera_sidecars import refresh_sidecars
+from dera_shards import write_shards
+from dera_spill import parse_megabytes
+from dera_state import (
+    Fingerprint, check_layer, default_state_file, is_force_env, load_state, probe_planner, record_layer,
+    save_state,
+)
+from geojson_io import OUTPUT_FORMATS, FeatureStream, feature_filename, feature_writer, write_json
+from wfs_http import (
+    HOST_LIMITER, MAX_PER_HOST, MAX_RATE, POOL_SIZE, RATE_LIMITER,
+    backoff_delay, configure_session, format_stats, http_stream, retry_after_seconds,
+)
+
 # ============================================================================
 # CONFIGURACIÓN
 # ============================================================================
@@ -27,8 +120,19 @@ OUTPUT_DIR = Path("public/data/dera")
 METADATA_FILE = Path("public/data/metadata.json")
 
 MAX_RETRIES = 3
-RETRY_DELAY = 5  # segundos
+RETRY_DELAY = 5  # segundos, base del backoff exponencial (con jitter)
 REQUEST_TIMEOUT = 60  # segundos
+PROJECT_PROPERTIES = True  # pedir solo los atributos consumidos (PROPERTYNAME)
+MAX_MEMORY: Optional[int] = None  # bytes de features acumuladas en memoria (--max-memory, ver dera_spill.py)
+PAGE_SIZE = 10_000  # COUNT inicial de cada GetFeature (acotado por CountDefault)
+CAPABILITIES: Optional[CapabilitiesCache] = None  # GetCapabilities por endpoint (ver dera_paging.py)
+SCHEMAS: Optional[SchemaCache] = None  # DescribeFeatureType por capa (ver dera_projection.py)
+PAGE_TARGET: Optional[float] = None  # segundos objetivo por petición; None = páginas de PAGE_SIZE
+
+CRS = {
+    "type": "name",
+    "properties": {"name": "EPSG:25830"}
+}
 
 WFS_LAYERS = {
     "health": [
@@ -76,8 +180,15 @@ def log(msg: str, level: str = "INFO"):
     print(f"[{ts}] {prefix} {msg}")
 
 
-def fetch_wfs(url: str, layer: str) -> dict:
-    """Descarga una capa WFS con reintentos."""
+def build_getfeature_url(url: str, layer: str, project: Optional[bool] = None,
+                         count: Optional[int] = None, cql_filter: Optional[str] = None,
+                         start_index: Optional[int] = None) -> str:
+    """
+    Construye la URL GetFeature de una capa completa (o de varias separadas
+    por comas). Con proyección solo se piden los atributos consumidos;
+    `cql_filter` limita la respuesta en el servidor (CQL_FILTER) y
+    count/start_index piden una página (COUNT/STARTINDEX).
+    """
     params = {
         "SERVICE": "WFS",
         "VERSION": "2.0.0",
@@ -86,91 +197,261 @@ def fetch_wfs(url: str, layer: str) -> dict:
         "OUTPUTFORMAT": "application/json",
         "SRSNAME": "EPSG:25830",
     }
+    schema = SCHEMAS.lookup(url) if SCHEMAS is not None else None
+    properties = property_names(layer.split(","), schema) if (
+        PROJECT_PROPERTIES if project is None else project) else None
+    if properties:
+        params["PROPERTYNAME"] = properties
+    if count is not None:
+        params["COUNT"] = str(count)
+    if start_index is not None:
+        params["STARTINDEX"] = str(start_index)
+    if cql_filter:
+        params["CQL_FILTER"] = cql_filter
+    return f"{url}?{urlencode(params)}"
+
+
+def page_sizer(url: str) -> PageSizer:
+    """
+    Tamaño de página de una capa: PAGE_SIZE acotado por el CountDefault
+    del endpoint y, con PAGE_TARGET, ajustado a la duración de cada
+    petición (ver dera_paging.py).
+    """
+    capabilities = CAPABILITIES.get(url) if CAPABILITIES is not None else None
+    return PageSizer(PAGE_SIZE, capabilities, PAGE_TARGET)
+
+
+def _wait_retry(attempt: int, retry_after=None):
+    """Backoff exponencial con jitter; respeta Retry-After si el servidor lo envía."""
+    delay = backoff_delay(attempt, base=RETRY_DELAY, retry_after=retry_after)
+    log(f"Reintentando en {delay:.1f}s...")
+    time.sleep(delay)
+
+
+def iter_wfs_stream(url: str, layer: str, attempts: int = MAX_RETRIES,
+                    cql_filter: Optional[str] = None) -> Iterator[dict]:
+    """
+    Descarga una capa WFS en streaming, generando las features una a una.
     
-    full_url = f"{url}?{urlencode(params)}"
+    Se pide por páginas (COUNT/STARTINDEX, ver page_sizer) hasta completar
+    numberMatched. Cada página se reintenta mientras no haya generado
+    ninguna feature; un fallo a mitad de respuesta se propaga (no se puede
+    repetir lo ya entregado), igual que agotar los intentos de una página.
+    Un conteo distinto de numberMatched también es un fallo: no se publica
+    truncada ni sin la capa.
+    """
+    sizer = page_sizer(url)
+    fetched = 0
     
-    for attempt in range(1, MAX_RETRIES + 1):
-        try:
-            log(f"Descargando {layer} (intento {attempt}/{MAX_RETRIES})...")
-            response = requests.get(full_url, timeout=REQUEST_TIMEOUT)
-            response.raise_for_status()
+    while True:
+        count = sizer.size
+        page_url = build_getfeature_url(url, layer, count=count, cql_filter=cql_filter, start_index=fetched)
+        received = 0
+        for attempt in range(1, attempts + 1):
+            retry_after = None
+            try:
+                log(f"Descargando {layer} en streaming" + (f" desde {fetched}" if fetched else "")
+                    + f" (intento {attempt}/{attempts})...")
+                meter = TransferMeter()
+                stream = FeatureStream(meter.wrap(http_stream(page_url, timeout=REQUEST_TIMEOUT)))
+                for feature in stream:
+                    if not received:
+                        sizer.check_first(feature, fetched)
+                    received += 1
+                    yield feature
+                break
+            except (requests.exceptions.RequestException, ValueError) as e:
+                if received or isinstance(e, PagingError):
+                    raise
+                log(f"Error en {layer}: {e}", "WARN")
+                if attempt == attempts:
+                    raise
+                retry_after = retry_after_seconds(getattr(e, "response", None))
             
-            data = response.json()
-            count = len(data.get("features", []))
-            log(f"{layer}: {count} features", "OK")
-            return data
-            
-        except requests.exceptions.Timeout:
-            log(f"Timeout en {layer}", "WARN")
-        except requests.exceptions.HTTPError as e:
-            log(f"HTTP Error {e.response.status_code} en {layer}", "WARN")
-        except requests.exceptions.RequestException as e:
-            log(f"Error de red en {layer}: {e}", "WARN")
-        except json.JSONDecodeError:
-            log(f"Respuesta no válida JSON en {layer}", "WARN")
+            METRICS.retry("iter_wfs_stream")
+            _wait_retry(attempt, retry_after)
         
-        if attempt < MAX_RETRIES:
-            log(f"Reintentando en {RETRY_DELAY}s...")
-            time.sleep(RETRY_DELAY)
+        METRICS.observe_page(layer, received)
+        sizer.observe(count, received, meter.seconds, meter.bytes)
+        fetched += received
+        expected = stream.members.get("numberMatched")
+        if not sizer.has_more(count, received, fetched, expected):
+            break
+        if sizer.size != count:
+            log(f"{layer}: páginas de {sizer.size} features")
     
-    log(f"Falló descarga de {layer} después de {MAX_RETRIES} intentos", "ERROR")
-    return {"type": "FeatureCollection", "features": []}
+    if isinstance(expected, int) and fetched != expected:
+        raise ValueError(f"conteo incompleto {fetched}/{expected}")
+    log(f"{layer}: {fetched} features", "OK")
 
 
-def merge_features(layers: list) -> dict:
-    """Combina features de múltiples capas."""
-    all_features = []
+def iter_coalesced_stream(url: str, sources: list, cql_filter: Optional[str] = None) -> Iterator[dict]:
+    """
+    Descarga varias capas del mismo endpoint en un único GetFeature
+    (TYPENAME=a,b,... de WFS 2.0) y etiqueta cada feature con el _source de
+    su capa, deducido del prefijo de su id.
     
-    for url, layer, desc in layers:
-        data = fetch_wfs(url, layer)
-        features = data.get("features", [])
-        
-        # Añadir metadata de origen
-        for f in features:
-            if "properties" not in f:
-                f["properties"] = {}
-            f["properties"]["_source"] = desc
-        
-        all_features.extend(features)
-    
-    return {
-        "type": "FeatureCollection",
-        "features": all_features,
-        "crs": {
-            "type": "name",
-            "properties": {"name": "EPSG:25830"}
-        }
-    }
+    Si el servidor no acepta la petición agrupada (error antes de la primera
+    feature) se descarga capa a capa como siempre.
+    """
+    tags = {layer.split(":")[-1]: desc for _, layer, desc in sources}
+    counts = dict.fromkeys(tags.values(), 0)
+    count = 0
+    try:
+        for feature in iter_wfs_stream(url, ",".join(layer for _, layer, _ in sources),
+                                       attempts=1, cql_filter=cql_filter):
+            desc = tags.get(local_type_name(feature.get("id")))
+            if desc is None:
+                raise ValueError(f"feature {feature.get('id')!r} sin capa de origen reconocible")
+            feature.setdefault("properties", {})["_source"] = desc
+            counts[desc] += 1
+            count += 1
+            yield feature
+    except (requests.exceptions.RequestException, ValueError) as e:
+        if count:
+            raise
+        log(f"Petición agrupada no admitida ({e}); se descarga capa a capa", "WARN")
+        yield from _iter_tagged_sources(sources, cql_filter)
+        return
+    
+    log(f"Agrupadas {len(sources)} capas en 1 petición: "
+        + ", ".join(f"{desc} {n}" for desc, n in counts.items()), "OK")
+
+
+def _iter_tagged_sources(sources: list, cql_filter: Optional[str] = None) -> Iterator[dict]:
+    for url, layer, desc in sources:
+        for feature in iter_wfs_stream(url, layer, cql_filter=cql_filter):
+            feature.setdefault("properties", {})["_source"] = desc
+            yield feature
+
+
+def iter_layer_features(category: str, coalesce: bool = True,
+                        cql_filter: Optional[str] = None) -> Iterator[dict]:
+    """
+    API pública: genera las features de una categoría de WFS_LAYERS,
+    etiquetadas con _source, sin acumularlas en memoria.
+    
+    Con coalesce, las capas contiguas del mismo endpoint se piden juntas.
+    Con cql_filter, solo las features que cumplen el filtro.
+    """
+    for url, sources in coalesce_sources(WFS_LAYERS[category]):
+        if coalesce and len(sources) > 1:
+            yield from iter_coalesced_stream(url, sources, cql_filter)
+        else:
+            yield from _iter_tagged_sources(sources, cql_filter)
 
 
-def save_geojson(data: dict, filename: str) -> int:
-    """Guarda GeoJSON y retorna count."""
-    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+@METRICS.timed("write_category_geojson", "filename")
+def write_category_geojson(category: str, filename: str,
+                           features: Optional[Iterable[dict]] = None) -> int:
+    """
+    Descarga la categoría y escribe cada feature en disco según llega, sin
+    acumularla en memoria. Retorna count (0 si la descarga falla).
+    
+    Si la respuesta se corta a mitad, se conserva el archivo anterior. Con
+    extensión .geojsonl se escribe GeoJSONSeq (ver geojson_io.py).
+    """
     path = OUTPUT_DIR / filename
+    previous_size = path.stat().st_size if path.exists() else None
+    if features is None:
+        features = iter_layer_features(category)
     
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+    try:
+        with feature_writer(path) as writer:
+            writer.write_features(features)
+            writer.finish(crs=CRS)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        log(f"Descarga de {category} interrumpida, se conserva {filename}: {e}", "ERROR")
+        return 0
     
-    count = len(data.get("features", []))
-    size_kb = path.stat().st_size / 1024
-    log(f"Guardado {filename}: {count} features ({size_kb:.1f} KB)", "OK")
-    return count
+    _log_saved(path, writer.count, previous_size)
+    return writer.count
 
 
-def update_metadata(stats: dict):
-    """Actualiza archivo de metadata."""
+def _log_saved(path: Path, count: int, previous_size: Optional[int] = None):
+    size = path.stat().st_size
+    change = ""
+    if previous_size:
+        change = f", {(size - previous_size) / 1024:+.1f} KB respecto al anterior"
+    log(f"Guardado {path.name}: {count} features ({size / 1024:.1f} KB{change})", "OK")
+
+
+def report_projection(categories) -> int:
+    """
+    Compara una muestra de cada capa con y sin PROPERTYNAME y extrapola el
+    ahorro al tamaño de la capa. Retorna los bytes ahorrados estimados.
+    """
+    total_saved = 0
+    sources = [(url, layer, desc, category) for category in categories for url, layer, desc in WFS_LAYERS[category]]
+    sample_url = lambda url, layer, projected: build_getfeature_url(url, layer, projected, SAMPLE_SIZE)
+    stream = lambda request_url: http_stream(request_url, timeout=REQUEST_TIMEOUT)
+    for (_, _, desc, category), savings, error in layer_savings(sources, sample_url, probe_hits, stream):
+        if error is not None:
+            log(f"Proyección {desc}: sin muestra ({error})", "WARN")
+        if savings is None:
+            continue
+        total_saved += savings["estimatedSaved"]
+        log(f"Proyección {category}/{desc}: -{savings['ratio'] * 100:.0f}% "
+            f"(~{savings['estimatedSaved'] / 1024:.1f} KB menos)")
+    log(f"Proyección: ~{total_saved / 1024:.1f} KB ahorrados en total", "OK")
+    return total_saved
+
+
+def _previous_metadata() -> dict:
+    try:
+        with open(METADATA_FILE, encoding="utf-8") as f:
+            metadata = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return metadata if isinstance(metadata, dict) else {}
+
+
+def _previous_data_version() -> int:
+    version = _previous_metadata().get("dataVersion", 0)
+    return version if isinstance(version, int) else 0
+
+
+def layer_counts(results: dict, state: dict) -> Tuple[dict, list]:
+    """
+    Conteos por categoría para metadata.json y lista de categorías fallidas.
+    
+    Una categoría sin features (descarga interrumpida o excepción) conserva
+    su archivo anterior, así que se cuenta con el conteo del estado o, si
+    no lo hay, con el del metadata.json anterior.
+    """
+    previous = _previous_metadata().get("layers") or {}
+    stats, failed = {}, []
+    for category in WFS_LAYERS.keys():
+        count = int(results.get(category) or 0)
+        if not count:
+            failed.append(category)
+            count = state["layers"].get(category, {}).get("featuresCount", previous.get(category, 0))
+        stats[category] = count
+    return stats, failed
+
+
+def update_metadata(stats: dict, output_format: str = "geojson"):
+    """
+    Actualiza archivo de metadata.
+    
+    dataVersion sube en cada publicación; "deltas" indica por categoría la
+    versión actual y los paquetes delta disponibles en dera/delta/.
+    "format" es el de los archivos publicados (--format).
+    """
     METADATA_FILE.parent.mkdir(parents=True, exist_ok=True)
     
     metadata = {
         "lastUpdate": datetime.now().isoformat(),
         "source": "IDEAndalucía DERA WFS",
         "crs": "EPSG:25830",
+        "format": output_format,
+        "dataVersion": _previous_data_version() + 1,
         "layers": stats,
         "totalFeatures": sum(stats.values()),
+        "deltas": delta_index(OUTPUT_DIR / DELTA_DIRNAME, stats.keys()),
     }
     
-    with open(METADATA_FILE, "w", encoding="utf-8") as f:
-        json.dump(metadata, f, indent=2, ensure_ascii=False)
+    write_json(METADATA_FILE, metadata, indent=2)
     
     log(f"Metadata actualizado: {sum(stats.values())} features totales", "OK")
 
@@ -179,19 +460,335 @@ def update_metadata(stats: dict):
 # MAIN
 # ============================================================================
 
-def main():
+@METRICS.timed("process_category", "category")
+def process_category(category: str, state: Optional[dict] = None, force: bool = False,
+                     coalesce: bool = True, columnar: bool = False, rtree: bool = False,
+                     search_index: bool = False, shards: bool = False,
+                     area: Optional[AreaFilter] = None,
+                     precision: Optional[PrecisionPolicy] = None,
+                     output_format: str = "geojson",
+                     probed: Optional[dict] = None) -> int:
+    """
+    Descarga, combina y guarda una categoría. Retorna count, o 0 si no se
+    pudo publicar (se conserva el archivo anterior).
+    
+    Con `state`, si el servidor indica que ninguna fuente cambió se conserva
+    el archivo y se retorna el conteo anterior. `probed` son los sondeos ya
+    hechos al planificar con --jobs, que no se repiten.
+    
+    Con columnar=True se escribe además <categoría>.columnar.bin, con
+    rtree=True el índice <categoría>.rtree.bin y con search_index=True el
+    índice de nombres <categoría>.search.json. Con shards=True se reparte
+    además por municipio y provincia.
+    
+    Con `area` solo se pide esa zona y se sustituye su porción del GeoJSON
+    publicado; el estado no guarda los sondeos para que la siguiente
+    ejecución completa no se salte la categoría.
+    
+    Con `precision` las coordenadas se redondean según la política de la
+    categoría (ver dera_precision.py).
+    
+    Con output_format="geojsonseq" se escribe <categoría>.geojsonl (una
+    feature por línea) con los metadatos en <categoría>.meta.json.
+    """
+    log(f"\n--- Procesando {category} ---")
+    filename = feature_filename(category, output_format)
+    meters = precision.for_layer(category) if precision else None
+    
+    if area is not None and not (OUTPUT_DIR / filename).exists():
+        log(f"{filename} no existe: descarga la categoría completa antes de refrescar una zona", "ERROR")
+        return 0
+    
+    probes = {}
+    if state is not None and area is None:
+        sources = [(url, layer) for url, layer, _ in WFS_LAYERS[category]]
+        unchanged, probes = check_layer(category, sources, state, OUTPUT_DIR / filename, probed)
+        if unchanged and not force:
+            count = state["layers"][category]["featuresCount"]
+            log(f"{category}: sin cambios en el servidor, se conserva {filename} ({count} features)", "OK")
+            rebuilt = refresh_sidecars(OUTPUT_DIR / filename, OUTPUT_DIR, category, columnar, rtree, search_index,
+                                       shards, meters, state["layers"][category].get("fingerprint"))
+            if rebuilt:
+                log(f"{category}: regenerados {', '.join(rebuilt)}", "OK")
+            return count
+    
+    fingerprint = Fingerprint()
+    delta = LayerDelta(category, OUTPUT_DIR / DELTA_DIRNAME, max_memory=MAX_MEMORY)
+    columns = ColumnarWriter(category, meters) if columnar or rtree or search_index else None
+    quantizer = Quantizer(meters) if meters else None
+    slice_stats = SliceStats()
+    features = iter_layer_features(category, coalesce, area.cql() if area else None)
+    if area:
+        features = refresh_slice(read_features(OUTPUT_DIR / filename), features, area, slice_stats)
+    if quantizer:
+        features = quantizer.wrap(features)
+    features = delta.wrap(fingerprint.wrap(features))
+    count = write_category_geojson(category, filename, columns.wrap(features) if columns else features)
+    if not count:
+        return count
+    if area:
+        log(f"{category}: zona {area.describe()} {slice_stats.replaced} → {slice_stats.fresh} features "
+            f"({slice_stats.kept} conservadas)", "OK")
+        if slice_stats.outside:
+            log(f"{category}: {slice_stats.outside} features recibidas fuera de la zona descartadas", "WARN")
+    if quantizer:
+        log(f"{category}: {quantizer.summary()}", "OK")
+    
+    if columns:
+        columns.source_fingerprint = fingerprint.hexdigest()
+    if columnar:
+        size = columns.write(columnar_path(OUTPUT_DIR, category))
+        log(f"Guardado {columnar_path(OUTPUT_DIR, category).name}: {count} features ({size / 1024:.1f} KB)", "OK")
+    if rtree:
+        indexed = write_rtree(columns, OUTPUT_DIR, category)
+        log(f"Guardado {rtree_paths(OUTPUT_DIR, category)[0].name}: {indexed or 0} elementos indexados", "OK")
+    if search_index:
+        municipios = write_search_index(columns, OUTPUT_DIR, category)
+        log(f"Guardado {search_path(OUTPUT_DIR, category).name}: {municipios} municipios", "OK")
+    if shards:
+        manifest = write_shards(OUTPUT_DIR / filename, OUTPUT_DIR, category, fingerprint=fingerprint.hexdigest())
+        log(f"Particiones de {category}: {len(manifest['municipios'])} municipios, "
+            f"{len(manifest['provincias'])} provincias", "OK")
+    
+    summary = delta.commit()
+    if summary:
+        log(f"{category}: delta v{summary['version']} +{summary['added']} "
+            f"~{summary['modified']} -{summary['removed']} ({summary['bytes'] / 1024:.1f} KB)", "OK")
+    if delta.unkeyed:
+        log(f"{category}: {delta.unkeyed} features sin id_dera quedan fuera del delta", "WARN")
+    if state is not None:
+        if not record_layer(state, category, {} if area else probes, count, fingerprint.hexdigest()):
+            log(f"{category}: contenido idéntico al anterior")
+    return count
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Descarga DERA para GitHub Actions")
+    parser.add_argument(
+        "--jobs", "-j",
+        type=int,
+        default=int(os.environ.get("DERA_JOBS", DEFAULT_JOBS)),
+        help="Categorías descargadas en paralelo (default: $DERA_JOBS o 1)"
+    )
+    parser.add_argument(
+        "--max-per-host",
+        type=int,
+        default=MAX_PER_HOST,
+        help=f"Peticiones simultáneas máximas por host (default: {MAX_PER_HOST})"
+    )
+    parser.add_argument(
+        "--pool-size",
+        type=int,
+        default=POOL_SIZE,
+        help=f"Conexiones keep-alive por host (default: {POOL_SIZE})"
+    )
+    parser.add_argument(
+        "--max-rate",
+        type=float,
+        default=MAX_RATE,
+        help=f"Peticiones/segundo máximas por host; el ritmo se adapta por debajo (default: {MAX_RATE})"
+    )
+    parser.add_argument(
+        "--page-size",
+        type=int,
+        default=None,
+        help=f"Features por petición, fijo (default: {PAGE_SIZE} al empezar, ajustado según "
+             "--target-seconds); siempre acotado por el CountDefault del servidor"
+    )
+    parser.add_argument(
+        "--target-seconds",
+        type=float,
+        default=TARGET_SECONDS,
+        help=f"Duración objetivo de cada petición para ajustar el tamaño de página (default: {TARGET_SECONDS:g})"
+    )
+    parser.add_argument(
+        "--no-coalesce",
+        dest="coalesce",
+        action="store_false",
+        help="Pedir cada capa por separado en lugar de agrupar typeNames por endpoint"
+    )
+    parser.add_argument(
+        "--all-properties",
+        dest="project",
+        action="store_false",
+        help="Pedir todos los atributos (sin PROPERTYNAME)"
+    )
+    parser.add_argument(
+        "--projection-report",
+        action="store_true",
+        help="Estimar con una muestra por capa los bytes que ahorra la proyección"
+    )
+    parser.add_argument(
+        "--columnar",
+        action="store_true",
+        help="Escribir además <categoría>.columnar.bin (columnas binarias para typed arrays)"
+    )
+    parser.add_argument(
+        "--rtree",
+        action="store_true",
+        help="Escribir además <categoría>.rtree.bin (R-tree Flatbush precalculado)"
+    )
+    parser.add_argument(
+        "--search-index",
+        action="store_true",
+        help="Escribir además <categoría>.search.json (trigramas de nombres por cod_mun)"
+    )
+    parser.add_argument(
+        "--shards",
+        action="store_true",
+        help="Escribir además particiones por municipio y provincia con manifiesto (shards/<categoría>/)"
+    )
+    parser.add_argument(
+        "--province",
+        action="append",
+        help="Refrescar solo esta provincia (código INE o nombre; repetible o separado por comas)"
+    )
+    parser.add_argument(
+        "--municipio",
+        action="append",
+        help="Refrescar solo este municipio (código INE de 5 dígitos; repetible o separado por comas)"
+    )
+    parser.add_argument(
+        "--precision",
+        nargs="*",
+        metavar="[CATEGORÍA=]METROS",
+        help="Redondear las coordenadas al escribir: sin valor, la política por categoría "
+             f"(por defecto {DEFAULT_PRECISION:g} m); METROS para todas o CATEGORÍA=METROS para una"
+    )
+    parser.add_argument(
+        "--metrics-dir",
+        type=Path,
+        default=None,
+        help="Escribir métricas de la ejecución (dera-metrics.json y dera.prom) en este directorio"
+    )
+    parser.add_argument(
+        "--format",
+        choices=OUTPUT_FORMATS,
+        default="geojson",
+        help="geojson: un FeatureCollection por categoría; geojsonseq: una feature por línea "
+             "(<categoría>.geojsonl) con metadatos en <categoría>.meta.json (default: geojson)"
+    )
+    parser.add_argument(
+        "--max-memory",
+        type=float,
+        default=None,
+        metavar="MB",
+        help="Presupuesto de features en memoria: lo que lo supera (cambios del delta) "
+             "se vuelca a NDJSON temporales (default: sin límite). "
+             "No acota --columnar, --rtree, --search-index ni --shards"
+    )
+    parser.add_argument(
+        "--profile",
+        nargs="*",
+        choices=PROFILE_MODES,
+        metavar="MODO",
+        help="Perfilar cada etapa (tiempo de reloj y CPU); MODO añade cprofile (funciones "
+             "con más tiempo) y/o tracemalloc (pico de memoria por capa)"
+    )
+    parser.add_argument(
+        "--profile-dir",
+        type=Path,
+        default=None,
+        help="Directorio de artefactos del perfil (default: dera-profile/<fecha>)"
+    )
+    parser.add_argument(
+        "--force", "-f",
+        action="store_true",
+        default=is_force_env(os.environ.get("FORCE_UPDATE")),
+        help="Descargar aunque el servidor indique que no hay cambios (default: $FORCE_UPDATE)"
+    )
+    parser.add_argument(
+        "--state-file",
+        type=Path,
+        default=None,
+        help="Estado del refresco condicional, fuera de public/ "
+             "(default: ~/.cache/ptel-dera-state/...; el workflow lo guarda en el repositorio)"
+    )
+    args = parser.parse_args(argv)
+    try:
+        args.area = AreaFilter.from_args(args.province, args.municipio)
+        args.precision = PrecisionPolicy.from_args(args.precision, WFS_LAYERS.keys())
+        args.max_memory = parse_megabytes(args.max_memory)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.page_size is not None and args.page_size < 1:
+        parser.error("--page-size debe ser positivo")
+    if args.target_seconds <= 0:
+        parser.error("--target-seconds debe ser positivo")
+    return args
+
+
+def main(argv=None):
+    global PROJECT_PROPERTIES, MAX_MEMORY, PAGE_SIZE, PAGE_TARGET, CAPABILITIES, SCHEMAS
+    args = parse_args(argv)
+    PROJECT_PROPERTIES = args.project
+    MAX_MEMORY = args.max_memory
+    PAGE_SIZE = args.page_size or PAGE_SIZE
+    PAGE_TARGET = None if args.page_size else args.target_seconds
+    CAPABILITIES = CapabilitiesCache(lambda u: http_stream(u, timeout=REQUEST_TIMEOUT))
+    SCHEMAS = SchemaCache(lambda u: http_stream(u, timeout=REQUEST_TIMEOUT)) if args.project else None
+    HOST_LIMITER.configure(args.max_per_host)
+    RATE_LIMITER.configure(max_rate=args.max_rate)
+    configure_session(pool_size=args.pool_size)
+    METRICS.reset()
+    profiler = None
+    if args.profile is not None:
+        profiler = Profiler(args.profile_dir or default_profile_dir(), args.profile).attach(METRICS)
+    
     log("=== Descarga DERA para GitHub Actions ===")
     log(f"Directorio destino: {OUTPUT_DIR}")
+    log(f"Workers: {args.jobs} (máx. {args.max_per_host} por host)")
+    if MAX_MEMORY is not None:
+        log(f"Presupuesto de memoria: {MAX_MEMORY / (1024 * 1024):.0f} MB")
+        sidecars = [flag for flag, on in (("--columnar", args.columnar), ("--rtree", args.rtree),
+                                          ("--search-index", args.search_index), ("--shards", args.shards)) if on]
+        if sidecars:
+            log(f"--max-memory no acota {', '.join(sidecars)}: crecen con el tamaño de la categoría", "WARN")
+    log(f"Páginas: {PAGE_SIZE} features" + (f", ajustadas a ~{PAGE_TARGET:g}s por petición" if PAGE_TARGET else ""))
+    for url in dict.fromkeys(url for layers in WFS_LAYERS.values() for url, _, _ in layers):
+        log(f"Capacidades {CAPABILITIES.describe(url)}")
+    if SCHEMAS is not None:
+        for url, layer, _ in (source for layers in WFS_LAYERS.values() for source in layers):
+            log(f"Esquema {SCHEMAS.describe(url, layer)}", "INFO" if SCHEMAS.valid(url, layer) else "WARN")
+    state_file = args.state_file or default_state_file(OUTPUT_DIR)
+    log(f"Refresco: {'zona ' + args.area.describe() if args.area else 'forzado' if args.force else 'condicional'} "
+        f"({state_file})")
     
-    stats = {}
+    state = load_state(state_file)
+    fingerprints = {key: layer.get("fingerprint") for key, layer in state["layers"].items()}
     
-    for category, layers in WFS_LAYERS.items():
-        log(f"\n--- Procesando {category} ---")
-        data = merge_features(layers)
-        count = save_geojson(data, f"{category}.geojson")
-        stats[category] = count
+    categories = list(WFS_LAYERS.keys())
+    if args.projection_report:
+        report_projection(categories)
     
-    update_metadata(stats)
+    probed = {}
+    if args.jobs > 1:
+        plan = plan_layers({
+            category: [(url, layer) for url, layer, _ in layers]
+            for category, layers in WFS_LAYERS.items()
+        }, probe_hits if args.area else probe_planner(state, probed))
+        for category, hits in plan:
+            log(f"Plan: {category} ~{hits if hits is not None else '?'} features")
+        categories = [category for category, _ in plan]
+    
+    results = run_layers(
+        categories,
+        lambda c: process_category(c, state, args.force, args.coalesce, args.columnar, args.rtree,
+                                   args.search_index, args.shards, args.area, args.precision,
+                                   args.format, probed),
+        args.jobs,
+        on_error=lambda category, e: log(f"Error en {category}: {e}", "ERROR"),
+    )
+    stats, failed = layer_counts(results, state)
+    
+    save_state(state_file, state)
+    changed = [key for key, layer in state["layers"].items()
+               if layer.get("fingerprint") != fingerprints.get(key)]
+    published = [c for c in stats if c in changed or (args.force and c not in failed)]
+    if published or not METADATA_FILE.exists():
+        update_metadata(stats, args.format)
+    else:
+        log("No se publicó ninguna categoría: metadata.json se conserva")
     
     log("\n=== Resumen ===")
     total = 0
@@ -199,9 +796,21 @@ def main():
         log(f"  {cat}: {count}")
         total += count
     log(f"  TOTAL: {total} features")
+    if failed:
+        log(f"  Fallidas (se conservan los archivos anteriores): {', '.join(failed)}", "ERROR")
+    log(f"  HTTP: {format_stats()}")
+    if args.metrics_dir:
+        for path in METRICS.write(args.metrics_dir):
+            log(f"Métricas: {path}", "OK")
+    if profiler:
+        profiler.detach(METRICS)
+        log(f"Perfil: {profiler.write()}", "OK")
     
     # Exit code basado en éxito
-    if total > 0:
+    if failed:
+        log(f"\nDescarga incompleta: {len(failed)} categorías fallidas", "ERROR")
+        sys.exit(1)
+    elif total > 0:
         log("\nDescarga completada exitosamente", "OK")
         sys.exit(0)
     else:
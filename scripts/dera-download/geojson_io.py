@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+"""
+geojson_io.py
+
+Escritura incremental de GeoJSON para los scripts DERA.
+
+FeatureCollectionWriter añade features al disco según llegan (página a
+página) y completa los metadatos al final, de modo que la memoria queda
+acotada a una página sea cual sea el tamaño de la capa. La escritura es
+atómica: se escribe en un temporal del mismo directorio y se renombra.
+
+La salida es idéntica byte a byte a json.dump con los mismos parámetros
+(indent=2 en download_dera.py, compacta en download_dera_actions.py).
+
+FeatureSequenceWriter escribe el formato alternativo --format geojsonseq:
+<capa>.geojsonl con una feature por línea (GeoJSON Text Sequence sin el
+separador RS, el GeoJSONSeq de GDAL) y el resto de miembros en el sidecar
+<capa>.meta.json. El consumidor procesa cada línea según la recibe, sin
+esperar al final del archivo. feature_writer() elige el escritor por la
+extensión y read_feature_file() lee cualquiera de los dos.
+
+FeatureStream hace el camino inverso: lee un FeatureCollection por
+bloques y genera las features una a una (respuestas WFS en streaming).
+
+atomic_writer() es la escritura atómica que comparten todos los módulos
+DERA (caché, diario, sidecars, deltas, métricas): un temporal con nombre
+único en el directorio destino, fsync y os.replace al terminar, y el
+temporal borrado si algo falla.
+
+@version 1.0.0
+@date 2025-12-08
+"""
+
+import codecs
+import json
+import os
+import tempfile
+import textwrap
+from contextlib import contextmanager
+from pathlib import Path
+from typing import IO, Iterable, Iterator, Optional
+
+
+# ============================================================================
+# ESCRITURA ATÓMICA
+# ============================================================================
+
+class AtomicFile:
+    """
+    Temporal del mismo directorio que se publica sobre `path` con commit()
+    o se descarta con discard(). El nombre es único (mkstemp), así que dos
+    procesos que escriben el mismo destino no se pisan el temporal.
+    """
+
+    def __init__(self, path: Path, mode: str = "w"):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix=f".{self.path.name}.", suffix=".tmp", dir=self.path.parent)
+        self.tmp_path = Path(tmp)
+        self.file: IO = os.fdopen(fd, mode, encoding=None if "b" in mode else "utf-8")
+        self.closed = False
+
+    def commit(self):
+        if self.closed:
+            return
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        os.replace(self.tmp_path, self.path)
+        self.closed = True
+
+    def discard(self):
+        if self.closed:
+            return
+        self.file.close()
+        self.tmp_path.unlink(missing_ok=True)
+        self.closed = True
+
+
+@contextmanager
+def atomic_writer(path: Path, mode: str = "w") -> Iterator[IO]:
+    """
+    Abre `path` para escribir de forma atómica ("w" texto UTF-8, "wb"
+    binario): el destino solo cambia si el bloque termina sin excepción.
+    """
+    atomic = AtomicFile(path, mode)
+    try:
+        yield atomic.file
+    except BaseException:
+        atomic.discard()
+        raise
+    atomic.commit()
+
+
+class FeatureCollectionWriter:
+    """
+    Escritor incremental y atómico de FeatureCollection.
+
+    Uso:
+        with FeatureCollectionWriter(path, indent=2) as writer:
+            for page in pages:
+                writer.write_features(page)
+            writer.finish(metadata={"featuresCount": writer.count})
+
+    Si el bloque termina con excepción, el temporal se descarta y el
+    archivo destino queda intacto.
+    """
+
+    def __init__(self, path: Path, indent: Optional[int] = None):
+        self.path = Path(path)
+        self.indent = indent
+        self.count = 0
+        self._closed = False
+
+        self._pad = " " * indent if indent else ""
+        self._nl = "\n" if indent else ""
+        self._kv = ": " if indent else ":"
+
+        self._atomic = AtomicFile(self.path)
+        self._file = self._atomic.file
+
+        self._file.write(f'{{{self._nl}{self._pad}"type"{self._kv}"FeatureCollection",'
+                         f'{self._nl}{self._pad}"features"{self._kv}[')
+
+    def _dumps(self, value) -> str:
+        if self.indent:
+            return json.dumps(value, ensure_ascii=False, indent=self.indent)
+        return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+    def write_features(self, features: Iterable[dict]):
+        """Añade features al final de la colección."""
+        for feature in features:
+            text = self._dumps(feature)
+            if self.indent:
+                text = textwrap.indent(text, self._pad * 2)
+            self._file.write(("," if self.count else "") + self._nl + text)
+            self.count += 1
+
+    def finish(self, **members):
+        """Cierra el array de features, añade miembros finales y publica el archivo."""
+        if self._closed:
+            return
+        self._file.write(f"{self._nl}{self._pad}]" if self.count else "]")
+        for key, value in members.items():
+            text = self._dumps(value)
+            if self.indent:
+                text = text.replace("\n", "\n" + self._pad)
+            self._file.write(f",{self._nl}{self._pad}{json.dumps(key)}{self._kv}{text}")
+        self._file.write(f"{self._nl}}}")
+
+        self._atomic.commit()
+        self._closed = True
+
+    def abort(self):
+        """Descarta el temporal sin tocar el destino."""
+        if self._closed:
+            return
+        self._atomic.discard()
+        self._closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.finish()
+        return False
+
+
+# ============================================================================
+# GEOJSONSEQ (una feature por línea + sidecar)
+# ============================================================================
+
+OUTPUT_FORMATS = ("geojson", "geojsonseq")
+GEOJSON_SUFFIX = ".geojson"
+GEOJSONSEQ_SUFFIX = ".geojsonl"
+SIDECAR_SUFFIX = ".meta.json"
+_RS = "\x1e"  # separador de RFC 8142, admitido al leer
+
+
+def feature_filename(layer: str, output_format: str = "geojson") -> str:
+    """Nombre del archivo publicado de una capa según --format."""
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Formato desconocido: {output_format}")
+    return layer + (GEOJSONSEQ_SUFFIX if output_format == "geojsonseq" else GEOJSON_SUFFIX)
+
+
+def is_sequence(path: Path) -> bool:
+    return Path(path).suffix == GEOJSONSEQ_SUFFIX
+
+
+def sidecar_path(path: Path) -> Path:
+    """<capa>.meta.json de un <capa>.geojsonl."""
+    path = Path(path)
+    return path.with_name(path.name[:-len(path.suffix)] + SIDECAR_SUFFIX)
+
+
+class FeatureSequenceWriter:
+    """
+    Escritor incremental y atómico de GeoJSONSeq, con la misma interfaz que
+    FeatureCollectionWriter: una feature compacta por línea y, al terminar,
+    el sidecar con {"type", "features": <archivo>, "featuresCount", ...
+    miembros de finish()}. El sidecar se publica después de las features,
+    así que su featuresCount siempre corresponde a un archivo completo.
+    """
+
+    def __init__(self, path: Path, indent: Optional[int] = None):
+        self.path = Path(path)
+        self.count = 0
+        self._closed = False
+        self._atomic = AtomicFile(self.path)
+        self._file = self._atomic.file
+
+    def write_features(self, features: Iterable[dict]):
+        for feature in features:
+            self._file.write(json.dumps(feature, ensure_ascii=False, separators=(",", ":")) + "\n")
+            self.count += 1
+
+    def finish(self, **members):
+        """Publica las features y después el sidecar con los miembros."""
+        if self._closed:
+            return
+        self._atomic.commit()
+        self._closed = True
+        write_json(sidecar_path(self.path), {
+            "type": "FeatureCollection",
+            "features": self.path.name,
+            "featuresCount": self.count,
+            **members,
+        }, indent=2)
+
+    def abort(self):
+        if self._closed:
+            return
+        self._atomic.discard()
+        self._closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.finish()
+        return False
+
+
+def feature_writer(path: Path, indent: Optional[int] = None):
+    """FeatureSequenceWriter para .geojsonl, FeatureCollectionWriter si no."""
+    if is_sequence(path):
+        return FeatureSequenceWriter(path)
+    return FeatureCollectionWriter(path, indent=indent)
+
+
+def write_feature_collection(path: Path, data: dict, indent: Optional[int] = None) -> int:
+    """Escribe un FeatureCollection ya en memoria de forma atómica. Retorna count."""
+    with feature_writer(path, indent=indent) as writer:
+        writer.write_features(data.get("features", []))
+        writer.finish(**{k: v for k, v in data.items() if k not in ("type", "features")})
+    return writer.count
+
+
+def write_json(path: Path, data, indent: Optional[int] = None, sort_keys: bool = False):
+    """Escribe un documento JSON cualquiera de forma atómica (temp + rename)."""
+    separators = None if indent else (",", ":")
+    with atomic_writer(path) as f:
+        json.dump(data, f, ensure_ascii=False, indent=indent, sort_keys=sort_keys, separators=separators)
+
+
+# ============================================================================
+# LECTURA INCREMENTAL
+# ============================================================================
+
+_WHITESPACE = " \t\n\r"
+
+
+class FeatureStream:
+    """
+    Parser incremental de un FeatureCollection recibido por bloques.
+
+    Itera las features una a una según llegan los bytes, sin construir el
+    documento completo. Los miembros de primer nivel distintos de
+    "features" (numberMatched, totalFeatures, crs...) quedan en `members`;
+    los que van detrás del array (GeoServer pone numberMatched al final)
+    solo están disponibles cuando la iteración termina.
+    """
+
+    def __init__(self, chunks: Iterable):
+        self.members = {}
+        self._chunks = iter(chunks)
+        self._decoder = json.JSONDecoder()
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self) -> bool:
+        """Añade el siguiente bloque al buffer. False si no quedan datos."""
+        if self._eof:
+            return False
+        for chunk in self._chunks:
+            text = self._utf8.decode(chunk) if isinstance(chunk, bytes) else chunk
+            if text:
+                self._buf = self._buf[self._pos:] + text
+                self._pos = 0
+                return True
+        self._eof = True
+        self._buf = self._buf[self._pos:] + self._utf8.decode(b"", final=True)
+        self._pos = 0
+        return False
+
+    def _peek(self) -> str:
+        """Primer carácter no blanco (sin consumirlo)."""
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in _WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                raise json.JSONDecodeError("Fin de datos inesperado", self._buf, self._pos)
+
+    def _expect(self, chars: str) -> str:
+        ch = self._peek()
+        if ch not in chars:
+            raise json.JSONDecodeError(f"Se esperaba {chars!r}", self._buf, self._pos)
+        self._pos += 1
+        return ch
+
+    def _value(self):
+        """Decodifica el siguiente valor JSON completo, pidiendo más bloques si hace falta."""
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # Un número al final del buffer puede estar cortado ("12" de "1234")
+            if end == len(self._buf) and isinstance(value, (int, float)) and self._fill():
+                continue
+            self._pos = end
+            return value
+
+    def __iter__(self) -> Iterator[dict]:
+        self._expect("{")
+        if self._peek() == "}":
+            self._pos += 1
+            return
+
+        while True:
+            key = self._value()
+            self._expect(":")
+            if key == "features":
+                self._expect("[")
+                if self._peek() == "]":
+                    self._pos += 1
+                else:
+                    while True:
+                        yield self._value()
+                        if self._expect(",]") == "]":
+                            break
+            else:
+                self.members[key] = self._value()
+
+            if self._expect(",}") == "}":
+                break
+
+        # Consumir el resto del origen (espacios finales) para que se cierre
+        while self._fill():
+            pass
+
+
+def iter_features(chunks: Iterable) -> Iterator[dict]:
+    """Atajo: genera las features de un FeatureCollection recibido por bloques."""
+    return iter(FeatureStream(chunks))
+
+
+def read_feature_file(path: Path) -> Iterator[dict]:
+    """Features de un archivo publicado (.geojson o .geojsonl), en streaming."""
+    if is_sequence(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip().lstrip(_RS)
+                if line:
+                    yield json.loads(line)
+        return
+    with open(path, "rb") as f:
+        yield from FeatureStream(iter(lambda: f.read(1 << 16), b""))
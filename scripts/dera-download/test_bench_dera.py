@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+test_bench_dera.py
+
+Tests del servidor WFS local (wfs_standin.py) y del benchmark (bench_dera.py).
+Ejecutar con: pytest test_bench_dera.py -v
+
+@version 1.0.0
+@date 2025-12-09
+"""
+
+import json
+
+import pytest
+import requests
+
+import bench_dera
+import download_dera
+from dera_engine import probe_hits
+from wfs_http import configure_session
+from wfs_standin import WFSStandin, synthetic_feature
+
+
+@pytest.fixture
+def standin():
+    configure_session()
+    with WFSStandin(features=2500) as server:
+        yield server
+    configure_session()
+
+
+def _get(server, query: str):
+    # Sin la sesión de wfs_http: los 503 inyectados frenarían su ritmo adaptativo
+    return requests.get(f"{server.url}?SERVICE=WFS&REQUEST=GetFeature&{query}", timeout=5)
+
+
+# ============================================================================
+# TESTS DEL SERVIDOR
+# ============================================================================
+
+class TestServidor:
+    """Paginación, conteos e inyección de errores."""
+
+    def test_paginacion(self, standin):
+        data = _get(standin, "typeName=bench:capa&startIndex=2000&count=1000").json()
+        assert data["numberMatched"] == 2500
+        assert data["numberReturned"] == 500
+        assert [f["id"] for f in data["features"][:2]] == ["capa.2001", "capa.2002"]
+
+    def test_typenames_agrupados(self, standin):
+        data = _get(standin, "TYPENAMES=bench:a,bench:b&startIndex=2499&count=2").json()
+        assert [f["id"] for f in data["features"]] == ["a.2500", "b.1"]
+        assert data["numberMatched"] == 5000
+
+    def test_hits(self, standin):
+        assert probe_hits(standin.url, "bench:a,bench:b") == 5000
+
+    def test_max_page(self, standin):
+        standin.max_page = 300
+        assert len(_get(standin, "typeName=bench:capa").json()["features"]) == 300
+
+    def test_determinista(self):
+        assert synthetic_feature("bench:capa", 7) == synthetic_feature("otro:capa", 7)
+        assert json.loads(synthetic_feature("bench:capa", 8))["properties"]["cod_mun"] == "41091"
+
+    def test_errores_inyectados_reproducibles(self, standin):
+        standin.error_rate = 0.5
+        estados = [_get(standin, "typeName=bench:capa&count=1").status_code for _ in range(10)]
+        assert 503 in estados and 200 in estados
+        assert standin.stats()["errors"] == estados.count(503)
+        standin.reset_stats()
+        assert [_get(standin, "typeName=bench:capa&count=1").status_code for _ in range(10)] == estados
+
+    def test_fetch_wfs_features_completo(self, standin):
+        options = download_dera.DownloadOptions(page_concurrency=2)
+        data = download_dera.fetch_wfs_features(standin.url, "bench:capa", "Bench", options=options)
+        assert len(data["features"]) == 2500
+        assert standin.stats()["requests"] == 3
+        assert standin.stats()["featuresSent"] == 2500
+
+
+# ============================================================================
+# TESTS DEL BENCHMARK
+# ============================================================================
+
+class TestBenchmark:
+    """Etapas en proceso aparte con métricas."""
+
+    @pytest.mark.parametrize("stage, features", [("fetch_wfs_features", 1200), ("iter_layer_features", 2400),
+                                                 ("download_layer", 1200)])
+    def test_etapa(self, stage, features):
+        args = bench_dera.parse_args(["--features", "1200", "--page-size", "500"])
+        with WFSStandin(features=args.features) as server:
+            row = bench_dera.bench_stage(stage, server, args)
+
+        assert "error" not in row
+        assert row["features"] == features
+        assert row["featuresPerSecond"] > 0
+        assert row["peakRssMB"] >= row["baselineRssMB"] > 0
+        assert row["requests"] >= 1
+
+    def test_json(self, tmp_path):
+        path = tmp_path / "bench.json"
+        assert bench_dera.main(["--features", "100", "--stage", "write_category_geojson", "--json", str(path)]) == 0
+        report = json.loads(path.read_text(encoding="utf-8"))
+        assert report["config"]["features"] == 100
+        assert report["results"][0]["stage"] == "write_category_geojson"
+        assert report["results"][0]["outputBytes"] > 0
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v", "--tb=short"])
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+test_dera_area.py
+
+Tests del refresco parcial por provincia/municipio (dera_area.py,
+--province y --municipio en los dos scripts).
+Ejecutar con: pytest test_dera_area.py -v
+
+@version 1.0.0
+@date 2025-12-09
+"""
+
+import json
+import re
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+from unittest.mock import patch
+
+import download_dera
+import download_dera_actions
+from dera_area import AreaFilter, SliceStats, combine_cql, refresh_slice
+from geojson_io import write_feature_collection
+
+
+def _feature(i, cod_mun, nombre="Anterior"):
+    return {"type": "Feature", "id": f"g10_02_ParqueEolico.{i}",
+            "geometry": {"type": "MultiPoint", "coordinates": [[500000.0 + i, 4100000.0]]},
+            "properties": {"id_dera": i, "nombre": nombre, "cod_mun": cod_mun}}
+
+
+ANTERIOR = [_feature(1, "04083"), _feature(2, "41091"), _feature(3, "41057"), _feature(4, "11020")]
+SERVIDOR = [_feature(1, "04083", "Nuevo"), _feature(2, "41091", "Nuevo"), _feature(5, "41091", "Nuevo"),
+            _feature(4, "11020", "Nuevo")]
+
+
+def _cumple(cql, feature):
+    """Evalúa los filtros que genera AreaFilter.cql() (como haría GeoServer)."""
+    code = feature["properties"]["cod_mun"]
+    prefijos = re.findall(r"cod_mun LIKE '(\d+)%'", cql)
+    lista = re.search(r"cod_mun IN \(([^)]*)\)", cql)
+    codigos = re.findall(r"'(\d+)'", lista.group(1)) if lista else []
+    return any(code.startswith(p) for p in prefijos) or code in codigos
+
+
+def _servidor(url, timeout=None, features=SERVIDOR):
+    params = {k.upper(): v[0] for k, v in parse_qs(urlparse(url).query).items()}
+    cql = params.get("CQL_FILTER")
+    seleccion = [f for f in features if cql is None or _cumple(cql, f)]
+    yield json.dumps({"type": "FeatureCollection", "features": seleccion,
+                      "numberMatched": len(seleccion)}).encode("utf-8")
+
+
+# ============================================================================
+# TESTS DEL FILTRO
+# ============================================================================
+
+class TestFiltro:
+    """Zona a partir de los argumentos de la CLI."""
+
+    def test_provincias_por_codigo_o_nombre(self):
+        area = AreaFilter.from_args(["sevilla", "4,Cádiz"], None)
+        assert area.provincias == ["04", "11", "41"]
+        assert area.cql() == "cod_mun LIKE '04%' OR cod_mun LIKE '11%' OR cod_mun LIKE '41%'"
+
+    def test_municipios(self):
+        area = AreaFilter.from_args(None, ["41091,4083"])
+        assert area.municipios == ["04083", "41091"]
+        assert area.cql() == "cod_mun IN ('04083','41091')"
+        assert area.matches(_feature(0, "41091"))
+        assert not area.matches(_feature(0, "41057"))
+
+    def test_sin_filtro(self):
+        assert AreaFilter.from_args(None, []) is None
+
+    @pytest.mark.parametrize("provincia, municipio", [
+        (["Madrid"], None), (["28"], None), (None, ["28079"]), (None, ["sevilla"]),
+    ])
+    def test_zona_no_valida(self, provincia, municipio):
+        with pytest.raises(ValueError):
+            AreaFilter.from_args(provincia, municipio)
+
+    def test_combine_cql(self):
+        assert combine_cql(None, "a = 1") == "a = 1"
+        assert combine_cql("a = 1", "b = 2") == "(a = 1) AND (b = 2)"
+        assert combine_cql(None, None) is None
+
+    def test_refresh_slice(self):
+        area = AreaFilter(municipios=["41091"])
+        stats = SliceStats()
+        resultado = list(refresh_slice(ANTERIOR, SERVIDOR, area, stats))
+
+        assert [f["properties"]["id_dera"] for f in resultado] == [1, 3, 4, 2, 5]
+        assert (stats.kept, stats.replaced, stats.fresh, stats.outside) == (3, 1, 2, 2)
+
+
+# ============================================================================
+# TESTS DE INTEGRACIÓN
+# ============================================================================
+
+class TestRefrescoActions:
+    """download_dera_actions.process_category con area."""
+
+    @pytest.fixture
+    def salida(self, tmp_path):
+        write_feature_collection(tmp_path / "energy.geojson", {"type": "FeatureCollection", "features": ANTERIOR})
+        with patch.object(download_dera_actions, "OUTPUT_DIR", tmp_path):
+            yield tmp_path
+
+    def test_sustituye_solo_la_zona(self, salida):
+        state = {"layers": {}}
+        area = AreaFilter(provincias=["41"])
+        with patch("download_dera_actions.http_stream", side_effect=_servidor) as mock_stream:
+            assert download_dera_actions.process_category("energy", state, area=area) == 4
+
+        url = mock_stream.call_args.args[0]
+        assert parse_qs(urlparse(url).query)["CQL_FILTER"] == ["cod_mun LIKE '41%'"]
+
+        data = json.loads((salida / "energy.geojson").read_text(encoding="utf-8"))
+        por_id = {f["properties"]["id_dera"]: f["properties"]["nombre"] for f in data["features"]}
+        assert por_id == {1: "Anterior", 4: "Anterior", 2: "Nuevo", 5: "Nuevo"}
+        # Sin sondeos: la próxima ejecución completa no se salta la capa
+        assert state["layers"]["energy"]["sources"] == {}
+
+    def test_corte_conserva_el_archivo(self, salida):
+        antes = (salida / "energy.geojson").read_bytes()
+
+        def corte(url, timeout=None):
+            yield b'{"type":"FeatureCollection","features":[' + json.dumps(SERVIDOR[1]).encode() + b","
+            raise download_dera_actions.requests.exceptions.ConnectionError("corte")
+
+        with patch("download_dera_actions.http_stream", side_effect=corte):
+            assert download_dera_actions.process_category("energy", area=AreaFilter(provincias=["41"])) == 0
+        assert (salida / "energy.geojson").read_bytes() == antes
+
+    def test_sin_archivo_previo(self, tmp_path):
+        with patch.object(download_dera_actions, "OUTPUT_DIR", tmp_path), \
+             patch("download_dera_actions.http_stream") as mock_stream:
+            assert download_dera_actions.process_category("energy", area=AreaFilter(provincias=["41"])) == 0
+        mock_stream.assert_not_called()
+
+    def test_stream_con_filtro(self):
+        vacia = lambda url, timeout: iter([b'{"type": "FeatureCollection", "features": []}'])
+        with patch("download_dera_actions.http_stream", side_effect=vacia) as mock_stream:
+            list(download_dera_actions.iter_wfs_stream("http://t/wfs", "a:b", cql_filter="cod_mun IN ('41091')"))
+        assert "CQL_FILTER=cod_mun+IN+%28%2741091%27%29" in mock_stream.call_args.args[0]
+
+    def test_cli_rechaza_zona_no_valida(self):
+        with pytest.raises(SystemExit):
+            download_dera_actions.parse_args(["--province", "Madrid"])
+        assert download_dera_actions.parse_args(["--municipio", "41091"]).area.municipios == ["41091"]
+
+
+class TestRefrescoDownloadDera:
+    """download_dera.download_layer con area."""
+
+    def test_sustituye_solo_la_zona(self, tmp_path):
+        write_feature_collection(tmp_path / "energy.geojson", {"type": "FeatureCollection", "features": ANTERIOR},
+                                 indent=2)
+        with patch("download_dera.http_stream", side_effect=_servidor) as mock_stream:
+            assert download_dera.download_layer(
+                "energy", tmp_path, download_dera.DownloadOptions(area=AreaFilter(municipios=["41091"])))
+
+        assert all("CQL_FILTER" in parse_qs(urlparse(c.args[0]).query) for c in mock_stream.call_args_list)
+        data = json.loads((tmp_path / "energy.geojson").read_text(encoding="utf-8"))
+        assert [f["properties"]["id_dera"] for f in data["features"]] == [1, 3, 4, 2, 5]
+        assert data["metadata"]["refreshedArea"] == "41091"
+        assert data["metadata"]["featuresCount"] == 5
+
+    def test_sin_archivo_previo(self, tmp_path):
+        assert not download_dera.download_layer(
+            "energy", tmp_path, download_dera.DownloadOptions(area=AreaFilter(provincias=["41"])))
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v", "--tb=short"])
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+test_dera_cache.py
+
+Tests de la caché de respuestas GetFeature (dera_cache.py, --cache-dir y
+--cache-only en download_dera.py).
+Ejecutar con: pytest test_dera_cache.py -v
+
+@version 1.0.0
+@date 2025-12-09
+"""
+
+import gzip
+import json
+
+import pytest
+from unittest.mock import patch
+
+import download_dera
+from dera_cache import CacheMissError, ResponseCache
+from wfs_http import configure_session
+from wfs_standin import WFSStandin
+
+BODY = json.dumps({"type": "FeatureCollection", "features": [{"type": "Feature", "id": i} for i in range(500)]})
+BODY = BODY.encode("utf-8")
+
+
+class _Reloj:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def _leer(cache, url, fetch=None):
+    return b"".join(cache.stream(url, fetch or (lambda u: iter([BODY[:100], BODY[100:]]))))
+
+
+# ============================================================================
+# TESTS DE LA CACHÉ
+# ============================================================================
+
+class TestCache:
+    """Aciertos, caducidad, tamaño y modo sin red."""
+
+    def test_guarda_comprimido_y_acierta(self, tmp_path):
+        cache = ResponseCache(tmp_path)
+        assert _leer(cache, "http://wfs?a=1") == BODY
+        assert _leer(cache, "http://wfs?a=1", fetch=lambda u: pytest.fail("no debe pedirse")) == BODY
+
+        path = cache.path("http://wfs?a=1")
+        assert path.stat().st_size < len(BODY)
+        assert gzip.decompress(path.read_bytes()) == BODY
+        assert (cache.hits, cache.misses, cache.stores) == (1, 1, 1)
+
+    def test_url_distinta_es_otra_entrada(self, tmp_path):
+        cache = ResponseCache(tmp_path)
+        _leer(cache, "http://wfs?startIndex=0")
+        assert cache.get("http://wfs?startIndex=1000") is None
+
+    def test_caducidad(self, tmp_path):
+        reloj = _Reloj()
+        cache = ResponseCache(tmp_path, ttl=60, clock=reloj)
+        _leer(cache, "http://wfs?a=1")
+        reloj.now += 59
+        assert cache.get("http://wfs?a=1") == BODY
+        reloj.now += 2
+        assert cache.get("http://wfs?a=1") is None
+
+    def test_expulsion_lru(self, tmp_path):
+        reloj = _Reloj()
+        cache = ResponseCache(tmp_path, clock=reloj)
+        for i in range(3):
+            reloj.now += 1
+            cache.put(f"http://wfs?p={i}", BODY + bytes([i]) * 1000)
+        tamano = {i: cache.path(f"http://wfs?p={i}").stat().st_size for i in range(3)}
+
+        reloj.now += 1
+        assert cache.get("http://wfs?p=0") is not None  # la más antigua pasa a ser la más usada
+        cache.max_bytes = tamano[0] + tamano[2]
+        assert cache.evict() == 1
+        assert cache.get("http://wfs?p=1") is None
+        assert cache.get("http://wfs?p=0") is not None and cache.get("http://wfs?p=2") is not None
+
+    def test_respuesta_cortada_no_se_guarda(self, tmp_path):
+        cache = ResponseCache(tmp_path)
+
+        def cortada(url):
+            yield BODY[:100]
+            raise ConnectionError("corte")
+
+        with pytest.raises(ConnectionError):
+            _leer(cache, "http://wfs?a=1", cortada)
+        assert list(tmp_path.iterdir()) == []
+
+    def test_solo_cache(self, tmp_path):
+        cache = ResponseCache(tmp_path, offline=True)
+        with pytest.raises(CacheMissError):
+            _leer(cache, "http://wfs?a=1", fetch=lambda u: pytest.fail("no debe pedirse"))
+
+    def test_solo_cache_ignora_caducidad(self, tmp_path):
+        reloj = _Reloj()
+        _leer(ResponseCache(tmp_path, ttl=60, clock=reloj), "http://wfs?a=1")
+        reloj.now += 3600
+        cache = ResponseCache(tmp_path, ttl=60, offline=True, clock=reloj)
+        assert _leer(cache, "http://wfs?a=1", fetch=lambda u: pytest.fail("no debe pedirse")) == BODY
+        assert ResponseCache(tmp_path, ttl=60, clock=reloj).get("http://wfs?a=1") is None
+
+
+# ============================================================================
+# TESTS DE INTEGRACIÓN
+# ============================================================================
+
+class TestDownloadDera:
+    """download_layer con la caché activa."""
+
+    @pytest.fixture
+    def capa(self):
+        configure_session()
+        with WFSStandin(features=2500) as server, \
+             patch.dict(download_dera.WFS_CONFIG, {"bench": {
+                 "name": "Bench", "urls": [{"url": server.url, "layer": "bench:capa", "description": "Bench"}],
+             }}):
+            yield server
+
+    def test_segunda_descarga_sin_red(self, capa, tmp_path):
+        cache = ResponseCache(tmp_path / "cache")
+        options = download_dera.DownloadOptions(response_cache=cache)
+        assert download_dera.download_layer("bench", tmp_path / "a", options)
+        assert capa.stats()["requests"] == 3
+        assert cache.path(download_dera.build_wfs_url(capa.url, "bench:capa", None, 1000)).exists()
+
+        capa.reset_stats()
+        assert download_dera.download_layer("bench", tmp_path / "b", options)
+        assert capa.stats()["requests"] == 0
+        assert (tmp_path / "a" / "bench.geojson").read_bytes().split(b'"downloadedAt"')[0] == \
+            (tmp_path / "b" / "bench.geojson").read_bytes().split(b'"downloadedAt"')[0]
+
+    def test_solo_cache_sin_sondeos(self, capa, tmp_path):
+        cache = ResponseCache(tmp_path / "cache", offline=True)
+        state = {"layers": {}}
+        options = download_dera.DownloadOptions(response_cache=cache)
+        with patch("download_dera.check_layer") as mock_check:
+            assert not download_dera.download_layer("bench", tmp_path, options, state=state)
+        mock_check.assert_not_called()
+        assert capa.stats()["requests"] == 0
+        assert not (tmp_path / "bench.geojson").exists()
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v", "--tb=short"])
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+test_dera_checkpoint.py
+
+Tests del diario de checkpoints (dera_checkpoint.py) y de --resume en
+download_dera.py.
+Ejecutar con: pytest test_dera_checkpoint.py -v
+
+@version 1.0.0
+@date 2025-12-09
+"""
+
+import json
+from dataclasses import replace
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+import requests
+from unittest.mock import patch
+
+import download_dera
+from dera_checkpoint import CheckpointJournal
+
+TOTAL = 35
+BATCH = 10
+
+
+def _pagina(url, timeout, fallos=()):
+    """Servidor WFS simulado: páginas de BATCH features con id secuencial."""
+    start_index = int(parse_qs(urlparse(url).query)["startIndex"][0])
+    if start_index in fallos:
+        raise requests.exceptions.Timeout()
+    ids = range(start_index, min(start_index + BATCH, TOTAL))
+    yield json.dumps({
+        "type": "FeatureCollection",
+        "features": [{"type": "Feature", "id": i, "properties": {}} for i in ids],
+        "numberMatched": TOTAL,
+    }).encode("utf-8")
+
+
+# ============================================================================
+# TESTS DEL DIARIO
+# ============================================================================
+
+class TestDiario:
+    """Persistencia de páginas completadas."""
+
+    def test_guarda_y_reanuda_paginas(self, tmp_path):
+        journal = CheckpointJournal(tmp_path, "education")
+        journal.bind("src", "http://t/wfs", None, BATCH)
+        journal.set_total("src", TOTAL)
+        journal.save_page("src", 10, [{"id": 10}, {"id": 11}])
+
+        resumed = CheckpointJournal(tmp_path, "education", resume=True)
+        resumed.bind("src", "http://t/wfs", None, BATCH)
+        assert resumed.total("src") == TOTAL
+        assert resumed.completed("src") == [10]
+        assert list(resumed.read_page("src", 10)) == [{"id": 10}, {"id": 11}]
+
+    def test_sin_resume_empieza_de_cero(self, tmp_path):
+        journal = CheckpointJournal(tmp_path, "education")
+        journal.bind("src", "http://t/wfs", None, BATCH)
+        journal.save_page("src", 0, [{"id": 0}])
+
+        fresh = CheckpointJournal(tmp_path, "education")
+        fresh.bind("src", "http://t/wfs", None, BATCH)
+        assert fresh.completed("src") == []
+        assert not fresh.has_page("src", 0)
+
+    def test_sin_resume_conserva_el_diario(self, tmp_path):
+        """Olvidar --resume no borra las páginas: un --resume posterior las usa."""
+        journal = CheckpointJournal(tmp_path, "education")
+        journal.bind("src", "http://t/wfs", None, BATCH)
+        journal.set_total("src", TOTAL)
+        journal.save_page("src", 0, [{"id": 0}])
+
+        fresh = CheckpointJournal(tmp_path, "education")
+        fresh.bind("src", "http://t/wfs", None, BATCH)
+        fresh.set_total("src", TOTAL)
+        fresh.save_page("src", BATCH, [{"id": BATCH}])
+        assert fresh.completed("src") == [BATCH]
+
+        resumed = CheckpointJournal(tmp_path, "education", resume=True)
+        resumed.bind("src", "http://t/wfs", None, BATCH)
+        assert resumed.completed("src") == [0, BATCH]
+        assert list(resumed.read_page("src", 0)) == [{"id": 0}]
+
+    @pytest.mark.parametrize("cambio", ["batch", "total"])
+    def test_consulta_distinta_descarta_paginas(self, tmp_path, cambio):
+        journal = CheckpointJournal(tmp_path, "education")
+        journal.bind("src", "http://t/wfs", None, BATCH)
+        journal.set_total("src", TOTAL)
+        journal.save_page("src", 0, [{"id": 0}])
+
+        resumed = CheckpointJournal(tmp_path, "education", resume=True)
+        if cambio == "batch":
+            resumed.bind("src", "http://t/wfs", None, BATCH * 2)
+        else:
+            resumed.bind("src", "http://t/wfs", None, BATCH)
+            resumed.set_total("src", TOTAL + 1)
+        assert resumed.completed("src") == []
+
+
+# ============================================================================
+# TESTS DE REANUDACIÓN (download_dera.py)
+# ============================================================================
+
+class TestReanudacion:
+    """Una capa solo se publica completa; --resume pide solo lo que falta."""
+
+    @pytest.fixture(autouse=True)
+    def _conteo(self):
+        with patch("download_dera.probe_hits", return_value=TOTAL):
+            yield
+
+    def _opciones(self, tmp_path, **kwargs):
+        return download_dera.DownloadOptions(batch_size=BATCH, checkpoint_dir=tmp_path / "diario", **kwargs)
+
+    @pytest.mark.parametrize("page_concurrency", [1, 4])
+    def test_pagina_fallida_no_publica_la_capa(self, tmp_path, page_concurrency):
+        anterior = tmp_path / "energy.geojson"
+        anterior.write_text("anterior", encoding="utf-8")
+        options = self._opciones(tmp_path, page_concurrency=page_concurrency)
+
+        with patch("download_dera.http_stream", side_effect=lambda url, timeout: _pagina(url, timeout, fallos=(20,))):
+            assert not download_dera.download_layer("energy", tmp_path, options)
+
+        assert anterior.read_text(encoding="utf-8") == "anterior"
+        assert (tmp_path / "diario" / "energy").is_dir()
+        # El diario no queda junto a lo que se publica
+        assert sorted(p.name for p in tmp_path.iterdir()) == ["diario", "energy.geojson"]
+
+    @pytest.mark.parametrize("page_concurrency", [1, 4])
+    def test_resume_pide_solo_las_paginas_pendientes(self, tmp_path, page_concurrency):
+        options = self._opciones(tmp_path, page_concurrency=page_concurrency)
+        with patch("download_dera.http_stream", side_effect=lambda url, timeout: _pagina(url, timeout, fallos=(20,))):
+            assert not download_dera.download_layer("energy", tmp_path, options)
+
+        with patch("download_dera.http_stream", side_effect=_pagina) as mock_page:
+            assert download_dera.download_layer("energy", tmp_path, replace(options, resume=True))
+
+        pedidas = sorted(int(parse_qs(urlparse(c.args[0]).query)["startIndex"][0]) for c in mock_page.call_args_list)
+        if page_concurrency == 1:
+            assert pedidas == [20, 30]  # la secuencial se detuvo en el fallo
+        else:
+            assert pedidas == [20]
+
+        data = json.loads((tmp_path / "energy.geojson").read_text(encoding="utf-8"))
+        assert [f["id"] for f in data["features"]] == list(range(TOTAL))
+        assert not (tmp_path / "diario" / "energy").exists()
+
+    def test_olvidar_resume_no_pierde_paginas(self, tmp_path):
+        """Una ejecución sin --resume no borra el diario de la interrumpida."""
+        with patch("download_dera.http_stream", side_effect=lambda url, timeout: _pagina(url, timeout, fallos=(20,))):
+            assert not download_dera.download_layer("energy", tmp_path, self._opciones(tmp_path))
+        with patch("download_dera.http_stream", side_effect=lambda url, timeout: _pagina(url, timeout, fallos=(0,))):
+            assert not download_dera.download_layer("energy", tmp_path, self._opciones(tmp_path))
+
+        with patch("download_dera.http_stream", side_effect=_pagina) as mock_page:
+            assert download_dera.download_layer("energy", tmp_path, self._opciones(tmp_path, resume=True))
+
+        pedidas = [int(parse_qs(urlparse(c.args[0]).query)["startIndex"][0]) for c in mock_page.call_args_list]
+        assert pedidas == [20, 30]
+
+    def test_paginas_del_diario_no_ajustan_el_tamanio(self, tmp_path):
+        """Páginas guardadas con otro tamaño no se toman como límite del servidor."""
+        journal = CheckpointJournal(tmp_path / "diario", "capa")
+        journal.bind("bench:capa", "http://t/wfs", None, BATCH)
+        journal.set_total("bench:capa", TOTAL)
+        for offset in (0, 5):
+            journal.save_page("bench:capa", offset, [{"type": "Feature", "id": i, "properties": {}}
+                                                     for i in range(offset, offset + 5)])
+
+        resumed = CheckpointJournal(tmp_path / "diario", "capa", resume=True)
+        with patch("download_dera.http_stream", side_effect=_pagina) as mock_page:
+            features = list(download_dera.iter_wfs_features("http://t/wfs", "bench:capa", "Bench",
+                                                            journal=resumed, options=self._opciones(tmp_path)))
+
+        assert [f["id"] for f in features] == list(range(TOTAL))
+        pedidas = [parse_qs(urlparse(c.args[0]).query) for c in mock_page.call_args_list]
+        assert [q["startIndex"][0] for q in pedidas] == ["10", "20", "30"]
+        assert all(q["count"][0] == str(BATCH) for q in pedidas)
+
+    def test_primera_pagina_fallida_no_publica_vacio(self, tmp_path):
+        """Antes se publicaba un GeoJSON vacío y la capa contaba como éxito."""
+        with patch("download_dera.http_stream", side_effect=lambda url, timeout: _pagina(url, timeout, fallos=(0,))):
+            assert not download_dera.download_layer("energy", tmp_path, self._opciones(tmp_path))
+        assert not (tmp_path / "energy.geojson").exists()
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v", "--tb=short"])
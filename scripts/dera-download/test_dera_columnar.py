@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+test_dera_columnar.py
+
+Tests de la exportación columnar binaria (dera_columnar.py).
+Ejecutar con: pytest test_dera_columnar.py -v
+
+@version 1.0.0
+@date 2025-12-09
+"""
+
+import json
+import math
+from pathlib import Path
+
+import pytest
+from unittest.mock import patch
+
+import download_dera_actions
+from dera_columnar import (
+    ALIGNMENT, COLUMNAR_MAGIC, ColumnarWriter, columnar_path, read_columnar, write_columnar_from_geojson,
+)
+from geojson_io import write_feature_collection
+
+DATA_DIR = Path(__file__).parent.parent.parent / "public" / "data" / "dera"
+
+
+def _feature(id_dera, nombre, cod_mun="41091", tipo=None, coordinates=None):
+    properties = {"id_dera": id_dera, "nombre": nombre, "cod_mun": cod_mun,
+                  "municipio": "Sevilla", "provincia": "Sevilla", "_source": "CAP"}
+    if tipo:
+        properties["tipo"] = tipo
+    return {
+        "type": "Feature",
+        "id": f"g12_01_CentroSalud.{id_dera}",
+        "geometry": {"type": "MultiPoint", "coordinates": coordinates or [[235000.5 + id_dera, 4142000.25]]},
+        "properties": properties,
+    }
+
+
+FEATURES = [
+    _feature(1, "Centro de Salud Triana", tipo="CAP"),
+    _feature(2, "Hospital Virgen del Rocío", tipo="Hospital"),
+    _feature(3, "Centro de Salud Triana", cod_mun="04013", tipo="CAP"),
+    {"type": "Feature", "geometry": None, "properties": {"nombre": "Sin geometría"}},
+]
+
+
+# ============================================================================
+# TESTS DEL FORMATO
+# ============================================================================
+
+class TestFormato:
+    """Ida y vuelta y requisitos de los typed arrays."""
+
+    @pytest.fixture
+    def archivo(self, tmp_path):
+        columns = ColumnarWriter("health")
+        assert list(columns.wrap(FEATURES)) == FEATURES
+        path = tmp_path / "health.columnar.bin"
+        assert columns.write(path) == path.stat().st_size
+        return path
+
+    def test_ida_y_vuelta(self, archivo):
+        data = read_columnar(archivo)
+        columns, strings = data["data"], data["strings"]
+
+        assert data["count"] == 4
+        assert columns["x"][:3] == [235001.5, 235002.5, 235003.5]
+        assert columns["idDera"][:3] == [1, 2, 3]
+        assert columns["codMun"] == [41091, 41091, 4013, -1]
+        assert [strings[i] for i in columns["nombre"]] == [f["properties"]["nombre"] for f in FEATURES]
+        assert [data["categories"][i] for i in columns["category"][:3]] == ["CAP", "Hospital", "CAP"]
+        assert columns["category"][3] == -1
+
+    def test_sin_geometria_es_nan(self, archivo):
+        data = read_columnar(archivo)
+        assert math.isnan(data["data"]["x"][3])
+        assert data["bbox"] == [235001.5, 4142000.25, 235003.5, 4142000.25]
+
+    def test_cadenas_deduplicadas(self, archivo):
+        strings = read_columnar(archivo)["strings"]
+        assert strings[0] == ""
+        assert len(strings) == len(set(strings))
+        assert strings.count("Centro de Salud Triana") == 1
+
+    def test_columnas_alineadas(self, archivo):
+        buffer = archivo.read_bytes()
+        assert buffer[:8] == COLUMNAR_MAGIC
+        header_length = int.from_bytes(buffer[8:12], "little")
+        header = json.loads(buffer[16:16 + header_length])
+        blocks = list(header["columns"].values()) + list(header["strings"].values())
+        assert all(block["offset"] % ALIGNMENT == 0 for block in blocks)
+        assert min(block["offset"] for block in blocks) >= 16 + header_length
+
+    @pytest.mark.skipif(not (DATA_DIR / "health.geojson").exists(), reason="sin datos DERA")
+    def test_menor_que_el_geojson(self, tmp_path):
+        path = tmp_path / "health.columnar.bin"
+        count = write_columnar_from_geojson(DATA_DIR / "health.geojson", path, "health")
+        assert read_columnar(path)["count"] == count
+        assert path.stat().st_size < (DATA_DIR / "health.geojson").stat().st_size / 2
+
+
+# ============================================================================
+# TESTS DE INTEGRACIÓN
+# ============================================================================
+
+class TestIntegracion:
+    """process_category con columnar=True."""
+
+    def test_escribe_columnar_junto_al_geojson(self, tmp_path):
+        body = json.dumps({"type": "FeatureCollection", "features": FEATURES[:3]}).encode("utf-8")
+        with patch.object(download_dera_actions, "OUTPUT_DIR", tmp_path), \
+             patch("download_dera_actions.http_stream", return_value=iter([body])):
+            assert download_dera_actions.process_category("energy", columnar=True) == 3
+
+        data = read_columnar(columnar_path(tmp_path, "energy"))
+        assert data["count"] == 3
+        assert data["layer"] == "energy"
+
+    def test_capa_sin_cambios_genera_columnar_si_falta(self, tmp_path):
+        write_feature_collection(tmp_path / "energy.geojson", {"type": "FeatureCollection", "features": FEATURES})
+        state = {"layers": {"energy": {"featuresCount": 4}}}
+        with patch.object(download_dera_actions, "OUTPUT_DIR", tmp_path), \
+             patch("download_dera_actions.check_layer", return_value=(True, {})):
+            assert download_dera_actions.process_category("energy", state, columnar=True) == 4
+
+        assert read_columnar(columnar_path(tmp_path, "energy"))["count"] == 4
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v", "--tb=short"])
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+test_dera_delta.py
+
+Tests de los paquetes delta por feature (dera_delta.py).
+Ejecutar con: pytest test_dera_delta.py -v
+
+@version 1.0.0
+@date 2025-12-09
+"""
+
+import json
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+import requests
+from unittest.mock import patch
+
+import download_dera_actions
+from dera_delta import LayerDelta, delta_index, list_deltas, load_manifest
+
+
+def _feature(id_dera, nombre="Centro", x=190372.28):
+    return {
+        "type": "Feature",
+        "id": f"g12_01_CentroSalud.{id_dera}",
+        "geometry": {"type": "MultiPoint", "coordinates": [[x, 4172207.46]]},
+        "properties": {"id_dera": id_dera, "nombre": nombre, "cod_mun": "29067"},
+    }
+
+
+def _publicar(delta_dir, features, layer="health", **kwargs):
+    delta = LayerDelta(layer, delta_dir, **kwargs)
+    assert list(delta.wrap(features)) == features
+    return delta.commit()
+
+
+def _aplicar(features, delta):
+    """Lo que haría el cliente: aplicar un delta sobre la versión anterior."""
+    by_id = {f["properties"]["id_dera"]: f for f in features}
+    for removed in delta["removed"]:
+        by_id.pop(int(removed))
+    for f in delta["added"] + delta["modified"]:
+        by_id[f["properties"]["id_dera"]] = f
+    return by_id
+
+
+# ============================================================================
+# TESTS DE DELTAS
+# ============================================================================
+
+class TestDeltas:
+    """Clasificación de cambios y publicación de paquetes."""
+
+    def test_primera_version_sin_delta(self, tmp_path):
+        """Sin manifiesto previo solo se establece la versión 1."""
+        assert _publicar(tmp_path, [_feature(1), _feature(2)]) is None
+        manifest = load_manifest(tmp_path, "health")
+        assert manifest["version"] == 1
+        assert set(manifest["features"]) == {"1", "2"}
+        assert list_deltas(tmp_path, "health") == []
+
+    def test_sin_cambios_no_publica(self, tmp_path):
+        features = [_feature(1), _feature(2)]
+        _publicar(tmp_path, features)
+        assert _publicar(tmp_path, features) is None
+        assert load_manifest(tmp_path, "health")["version"] == 1
+
+    def test_anadidas_modificadas_eliminadas(self, tmp_path):
+        v1 = [_feature(1), _feature(2), _feature(3)]
+        v2 = [_feature(1), _feature(2, nombre="Centro renombrado"), _feature(4)]
+        _publicar(tmp_path, v1)
+
+        summary = _publicar(tmp_path, v2)
+        assert summary["version"] == 2
+        assert (summary["added"], summary["modified"], summary["removed"]) == (1, 1, 1)
+
+        delta = json.loads((tmp_path / summary["file"]).read_text(encoding="utf-8"))
+        assert delta["fromVersion"] == 1 and delta["toVersion"] == 2
+        assert delta["removed"] == ["3"]
+        assert _aplicar(v1, delta) == {f["properties"]["id_dera"]: f for f in v2}
+
+    def test_delta_mucho_menor_que_la_capa(self, tmp_path):
+        """Un cambio en una feature produce un delta de una feature."""
+        v1 = [_feature(i) for i in range(500)]
+        v2 = [dict(f) for f in v1]
+        v2[250] = _feature(250, x=190400.0)
+        _publicar(tmp_path, v1)
+
+        summary = _publicar(tmp_path, v2)
+        assert summary["modified"] == 1
+        assert summary["bytes"] < len(json.dumps(v2)) / 100
+
+    def test_conserva_historial_limitado(self, tmp_path):
+        _publicar(tmp_path, [_feature(0)], history=3)
+        for i in range(1, 6):
+            _publicar(tmp_path, [_feature(j) for j in range(i + 1)], history=3)
+
+        assert list_deltas(tmp_path, "health") == [4, 5, 6]
+        assert delta_index(tmp_path, ["health", "energy"]) == {
+            "health": {"version": 6, "deltas": ["health-v4.json", "health-v5.json", "health-v6.json"]},
+        }
+
+
+# ============================================================================
+# TESTS DE INTEGRACIÓN (download_dera_actions)
+# ============================================================================
+
+class TestIntegracion:
+    """process_category publica el delta junto al GeoJSON."""
+
+    def _descargar(self, tmp_path, features):
+        body = json.dumps({"type": "FeatureCollection", "features": features}).encode("utf-8")
+        with patch.object(download_dera_actions, "OUTPUT_DIR", tmp_path), \
+             patch("download_dera_actions.http_stream", return_value=iter([body])):
+            return download_dera_actions.process_category("energy")
+
+    def test_segunda_descarga_genera_delta(self, tmp_path):
+        assert self._descargar(tmp_path, [_feature(1), _feature(2)]) == 2
+        assert self._descargar(tmp_path, [_feature(1)]) == 1
+
+        delta = json.loads((tmp_path / "delta" / "energy-v2.json").read_text(encoding="utf-8"))
+        assert delta["removed"] == ["2"]
+
+    def test_fuente_fallida_conserva_archivo_estado_y_delta(self, tmp_path):
+        """Si una fuente agota los reintentos no se publica la categoría sin ella."""
+        def servidor(url, timeout, falla=None):
+            tipo = parse_qs(urlparse(url).query)["TYPENAME"][0]
+            if tipo == falla:
+                raise requests.exceptions.ConnectionError("sin conexión")
+            features = [_feature(1)] if "CentroSalud" in tipo else [_feature(2)]
+            yield json.dumps({"type": "FeatureCollection", "features": features,
+                              "numberMatched": 1}).encode("utf-8")
+
+        state = {"layers": {}}
+        hospitales = download_dera_actions.WFS_LAYERS["health"][1][1]
+        with patch.object(download_dera_actions, "OUTPUT_DIR", tmp_path), \
+             patch("dera_state.http_get", side_effect=requests.exceptions.Timeout()), \
+             patch("download_dera_actions.time.sleep"):
+            with patch("download_dera_actions.http_stream", side_effect=servidor):
+                assert download_dera_actions.process_category("health", state, coalesce=False) == 2
+            antes = (tmp_path / "health.geojson").read_bytes()
+            estado = json.loads(json.dumps(state))
+            deltas = load_manifest(tmp_path / "delta", "health")
+
+            with patch("download_dera_actions.http_stream",
+                       side_effect=lambda url, timeout: servidor(url, timeout, falla=hospitales)):
+                assert download_dera_actions.process_category("health", state, force=True,
+                                                              coalesce=False) == 0
+
+        assert (tmp_path / "health.geojson").read_bytes() == antes
+        assert state == estado
+        assert load_manifest(tmp_path / "delta", "health") == deltas
+        assert list_deltas(tmp_path / "delta", "health") == []
+
+    def test_metadata_incluye_version(self, tmp_path):
+        self._descargar(tmp_path, [_feature(1)])
+        metadata_file = tmp_path / "metadata.json"
+        with patch.object(download_dera_actions, "OUTPUT_DIR", tmp_path), \
+             patch.object(download_dera_actions, "METADATA_FILE", metadata_file):
+            download_dera_actions.update_metadata({"energy": 1})
+            download_dera_actions.update_metadata({"energy": 1})
+
+        metadata = json.loads(metadata_file.read_text(encoding="utf-8"))
+        assert metadata["dataVersion"] == 2
+        assert metadata["deltas"] == {"energy": {"version": 1, "deltas": []}}
+
+    def test_categoria_fallida_conserva_su_conteo(self, tmp_path):
+        metadata_file = tmp_path / "metadata.json"
+        metadata_file.write_text(json.dumps({"dataVersion": 3, "layers": {"energy": 7, "health": 9}}))
+        state = {"layers": {"health": {"featuresCount": 8}}}
+        results = {category: 5 for category in download_dera_actions.WFS_LAYERS}
+        results.update(energy=0, health=False)
+        with patch.object(download_dera_actions, "METADATA_FILE", metadata_file):
+            stats, failed = download_dera_actions.layer_counts(results, state)
+
+        assert failed == ["health", "energy"]
+        assert stats["energy"] == 7 and stats["health"] == 8
+        assert all(stats[c] == 5 for c in stats if c not in failed)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v", "--tb=short"])
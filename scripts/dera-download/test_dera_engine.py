@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+test_dera_engine.py
+
+Tests del motor de descarga concurrente (dera_engine.py).
+Ejecutar con: pytest test_dera_engine.py -v
+
+@version 1.0.0
+@date 2025-12-08
+"""
+
+import time
+
+import pytest
+from unittest.mock import patch, MagicMock
+
+from dera_engine import coalesce_sources, local_type_name, plan_layers, probe_hits, run_layers
+
+
+# ============================================================================
+# TESTS DE PLANIFICACIÓN
+# ============================================================================
+
+class TestPlanificacion:
+    """Tests del sondeo de conteos y orden largest-first."""
+
+    def test_probe_hits_lee_number_matched(self):
+        """probe_hits debe extraer numberMatched de la respuesta hits."""
+        mock_response = MagicMock()
+        mock_response.text = '<wfs:FeatureCollection numberMatched="6725" numberReturned="0"/>'
+        mock_response.raise_for_status.return_value = None
+
+        with patch('dera_engine.http_get', return_value=mock_response) as mock_get:
+            assert probe_hits("http://test.com/wfs", "test:layer") == 6725
+            assert "resultType=hits" in mock_get.call_args[0][0]
+
+    def test_probe_hits_devuelve_none_en_error(self):
+        """probe_hits no debe propagar errores de red."""
+        import requests
+        with patch('dera_engine.http_get', side_effect=requests.exceptions.Timeout()):
+            assert probe_hits("http://test.com/wfs", "test:layer") is None
+
+    def test_plan_ordena_de_mayor_a_menor(self):
+        """Las capas con más features deben ir primero, sumando fuentes."""
+        hits = {"a": 10, "b1": 300, "b2": 400, "c": 500}
+        plan = plan_layers(
+            {"small": [("u", "a")], "health": [("u", "b1"), ("u", "b2")], "education": [("u", "c")]},
+            probe=lambda url, layer: hits[layer],
+        )
+        assert plan == [("health", 700), ("education", 500), ("small", 10)]
+
+    def test_coalesce_agrupa_contiguas_por_endpoint(self):
+        """Solo se agrupan fuentes contiguas: el orden de salida no cambia."""
+        sources = [("u1", "a"), ("u1", "b"), ("u2", "c"), ("u1", "d")]
+        assert coalesce_sources(sources) == [
+            ("u1", [("u1", "a"), ("u1", "b")]),
+            ("u2", [("u2", "c")]),
+            ("u1", [("u1", "d")]),
+        ]
+
+    def test_local_type_name(self):
+        assert local_type_name("g12_01_CentroSalud.42") == "g12_01_CentroSalud"
+        assert local_type_name(None) == ""
+
+    def test_plan_capas_desconocidas_primero(self):
+        """Si el sondeo falla, la capa se trata como grande."""
+        plan = plan_layers(
+            {"known": [("u", "a")], "unknown": [("u", "b")]},
+            probe=lambda url, layer: None if layer == "b" else 50,
+        )
+        assert plan[0] == ("unknown", None)
+
+
+# ============================================================================
+# TESTS DE EJECUCIÓN CONCURRENTE
+# ============================================================================
+
+class TestEjecucion:
+    """Tests del pool de workers."""
+
+    def test_run_layers_conserva_orden_de_claves(self):
+        """El resultado debe respetar el orden de envío."""
+        resultado = run_layers(["c", "a", "b"], lambda key: key.upper(), jobs=3)
+        assert list(resultado.items()) == [("c", "C"), ("a", "A"), ("b", "B")]
+
+    def test_run_layers_en_paralelo(self):
+        """Con jobs > 1 el tiempo total se aproxima al de la capa más lenta."""
+        start = time.time()
+        run_layers(["a", "b", "c", "d"], lambda key: time.sleep(0.2), jobs=4)
+        assert time.time() - start < 0.6
+
+    @pytest.mark.parametrize("jobs", [1, 2])
+    def test_run_layers_aisla_errores(self, jobs):
+        """Una capa que falla no debe abortar las demás, con o sin pool."""
+        def worker(key):
+            if key == "mala":
+                raise RuntimeError("boom")
+            return True
+
+        errores = []
+        resultado = run_layers(["mala", "buena"], worker, jobs=jobs,
+                               on_error=lambda key, e: errores.append((key, str(e))))
+        assert resultado == {"mala": False, "buena": True}
+        assert errores == [("mala", "boom")]
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v", "--tb=short"])
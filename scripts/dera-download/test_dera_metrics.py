@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+test_dera_metrics.py
+
+Tests de las métricas estructuradas (dera_metrics.py) contra el servidor
+WFS local.
+Ejecutar con: pytest test_dera_metrics.py -v
+
+@version 1.0.0
+@date 2025-12-09
+"""
+
+import json
+
+import pytest
+from unittest.mock import patch
+
+import download_dera
+import download_dera_actions
+from dera_metrics import METRICS, Histogram, Metrics
+from wfs_http import INITIAL_RATE, MAX_RATE, RATE_LIMITER, configure_session
+from wfs_standin import WFSStandin
+
+
+@pytest.fixture
+def standin():
+    configure_session()
+    RATE_LIMITER.configure(initial_rate=1000, max_rate=1000)
+    METRICS.reset()
+    with WFSStandin(features=2500) as server:
+        yield server
+    RATE_LIMITER.configure(initial_rate=INITIAL_RATE, max_rate=MAX_RATE)
+    configure_session()
+    METRICS.reset()
+
+
+def _counter(report, name, **labels):
+    return sum(c["value"] for c in report["counters"].get(name, [])
+               if all(c["labels"].get(k) == v for k, v in labels.items()))
+
+
+# ============================================================================
+# TESTS DEL REGISTRO
+# ============================================================================
+
+class TestRegistro:
+    """Histogramas, etapas y formatos de salida."""
+
+    def test_histograma_acumulativo(self):
+        histogram = Histogram((0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 3.0):
+            histogram.observe(value)
+        assert histogram.cumulative() == [(0.1, 2), (1.0, 3), ("+Inf", 4)]
+        assert histogram.sum == pytest.approx(3.65)
+
+    def test_etapa_decorada(self):
+        metrics = Metrics()
+
+        @metrics.timed("descarga", "capa")
+        def descarga(url, capa):
+            return capa
+
+        assert descarga("http://x", capa="health") == "health"
+        assert descarga("http://x", "health") == "health"
+        assert [s["layer"] for s in metrics.report()["stages"]] == ["health"]
+
+    def test_prometheus_y_json(self, tmp_path):
+        metrics = Metrics()
+        metrics.observe_request("http://wfs.local/wfs?typeName=a:b&startIndex=0", 200, 0.2, 0.3, 1024)
+        metrics.observe_request("http://wfs.local/wfs?typeName=a:b", None, 5.0, 5.0, 0)
+        metrics.observe_page("a:b", 1000)
+        metrics.retry("fetch_wfs")
+        with metrics.stage("save_geojson", 'capa"rara'):
+            pass
+
+        json_path, prom_path = metrics.write(tmp_path)
+        text = prom_path.read_text(encoding="utf-8")
+        assert '# TYPE dera_http_request_latency_seconds histogram' in text
+        assert 'dera_http_request_latency_seconds_bucket{host="wfs.local",le="0.25"} 1' in text
+        assert 'dera_http_request_latency_seconds_bucket{host="wfs.local",le="+Inf"} 2' in text
+        assert 'dera_http_requests_total{host="wfs.local",status="error"} 1' in text
+        assert 'dera_features_per_page_bucket{layer="a:b",le="1000"} 1' in text
+        assert 'dera_retries_total{function="fetch_wfs"} 1' in text
+        assert 'layer="capa\\"rara"' in text
+
+        report = json.loads(json_path.read_text(encoding="utf-8"))
+        assert report["requests"][0]["layer"] == "a:b"
+        assert report["requests"][0]["startIndex"] == "0"
+        assert report["requests"][1]["status"] is None
+        assert _counter(report, "http_received_bytes_total") == 1024
+
+
+# ============================================================================
+# TESTS DE INTEGRACIÓN
+# ============================================================================
+
+class TestIntegracion:
+    """Métricas registradas por los scripts."""
+
+    def test_fetch_wfs_features(self, standin):
+        download_dera.fetch_wfs_features(standin.url, "bench:capa", "Bench")
+
+        report = METRICS.report()
+        assert [r["startIndex"] for r in report["requests"]] == ["0", "1000", "2000"]
+        assert all(r["bytes"] > 0 and r["status"] == 200 for r in report["requests"])
+        pages = report["histograms"]["features_per_page"][0]
+        assert pages["count"] == 3 and pages["sum"] == 2500
+        assert report["stages"][0]["stage"] == "fetch_wfs_features"
+        assert report["stages"][0]["layer"] == "bench:capa"
+
+    def test_reintentos_iter_wfs_stream(self, standin):
+        standin.error_rate = 1.0
+        with patch.object(download_dera_actions, "RETRY_DELAY", 0.001):
+            with pytest.raises(download_dera_actions.requests.exceptions.HTTPError):
+                list(download_dera_actions.iter_wfs_stream(standin.url, "bench:capa"))
+
+        report = METRICS.report()
+        assert _counter(report, "retries_total", function="iter_wfs_stream") == download_dera_actions.MAX_RETRIES - 1
+        assert _counter(report, "http_requests_total", status="503") == download_dera_actions.MAX_RETRIES
+
+    def test_process_category(self, standin, tmp_path):
+        layers = {"bench": [(standin.url, "bench:a", "A"), (standin.url, "bench:b", "B")]}
+        with patch.object(download_dera_actions, "OUTPUT_DIR", tmp_path), \
+                patch.dict(download_dera_actions.WFS_LAYERS, layers):
+            assert download_dera_actions.process_category("bench") == 5000
+
+        stages = {s["stage"] for s in METRICS.report()["stages"]}
+        assert {"process_category", "write_category_geojson"} <= stages
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v", "--tb=short"])
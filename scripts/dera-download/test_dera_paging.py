@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+test_dera_paging.py
+
+Tests del tamaño de página según GetCapabilities y la duración de cada
+petición (dera_paging.py).
+Ejecutar con: pytest test_dera_paging.py -v
+
+@version 1.0.0
+@date 2025-12-09
+"""
+
+import pytest
+from unittest.mock import patch
+
+import download_dera
+import download_dera_actions
+from dera_paging import (
+    MAX_PAGE_BYTES, Capabilities, CapabilitiesCache, PageSizer, PagingError, parse_capabilities,
+)
+from wfs_http import INITIAL_RATE, MAX_RATE, RATE_LIMITER, configure_session, http_stream
+from wfs_standin import WFSStandin
+
+
+@pytest.fixture
+def rapido():
+    configure_session()
+    RATE_LIMITER.configure(initial_rate=1000, max_rate=1000)
+    yield
+    RATE_LIMITER.configure(initial_rate=INITIAL_RATE, max_rate=MAX_RATE)
+    configure_session()
+
+
+def _cache() -> CapabilitiesCache:
+    return CapabilitiesCache(lambda url: http_stream(url, timeout=5))
+
+
+def _ids(features) -> list:
+    return [int(f["id"].rsplit(".", 1)[1]) for f in features]
+
+
+# ============================================================================
+# TESTS DE CAPACIDADES
+# ============================================================================
+
+class TestCapacidades:
+    """ImplementsResultPaging y CountDefault de GetCapabilities."""
+
+    def test_lee_las_restricciones_por_bloques(self):
+        with WFSStandin(count_default=500) as server:
+            xml = server.capabilities().encode("utf-8")
+        chunks = [xml[i:i + 16] for i in range(0, len(xml), 16)]
+        caps = parse_capabilities(chunks)
+        assert caps.paging is True and caps.count_default == 500
+
+    def test_deja_de_leer_en_feature_type_list(self):
+        with WFSStandin(paging=False) as server:
+            xml = server.capabilities().encode("utf-8")
+        head = xml[:xml.index(b"<wfs:FeatureTypeList>") + len(b"<wfs:FeatureTypeList>")]
+
+        def chunks():
+            yield head
+            raise AssertionError("se leyó FeatureTypeList")
+
+        caps = parse_capabilities(chunks())
+        assert caps.paging is False and caps.count_default is None
+
+    def test_sin_restricciones(self):
+        caps = parse_capabilities([b'<WFS_Capabilities version="1.1.0"><FeatureTypeList/></WFS_Capabilities>'])
+        assert caps.paging is None and caps.count_default is None
+
+    def test_una_peticion_por_endpoint(self, rapido):
+        with WFSStandin(count_default=700) as server:
+            cache = _cache()
+            assert cache.get(server.url).count_default == 700
+            assert cache.get(server.url).count_default == 700
+            assert server.stats()["requests"] == 1
+            assert "CountDefault 700" in cache.describe(server.url)
+
+    def test_endpoint_sin_capacidades(self, rapido):
+        with WFSStandin() as server:
+            url = server.url.replace("/wfs", "/otro")
+            cache = _cache()
+            caps = cache.get(url)
+            assert caps.paging is None and caps.count_default is None
+            assert "no disponible" in cache.describe(url)
+
+
+# ============================================================================
+# TESTS DEL TAMAÑO DE PÁGINA
+# ============================================================================
+
+class TestPageSizer:
+    """Ajuste por duración, límites del servidor y fin de la paginación."""
+
+    def test_acotado_por_count_default(self):
+        assert PageSizer(10_000, Capabilities(True, 1000)).size == 1000
+        assert PageSizer(10_000, Capabilities(False, None)).size == 50_000
+        assert PageSizer(500, Capabilities(False, 2000)).size == 2000
+
+    def test_sin_objetivo_no_cambia(self):
+        sizer = PageSizer(1000)
+        sizer.observe(1000, 1000, 0.01)
+        assert sizer.size == 1000
+
+    def test_sube_y_baja_un_peldanio(self):
+        sizer = PageSizer(1000, target=5.0)
+        assert sizer.observe(1000, 1000, 0.1) == 2500   # cabrían 50.000: un solo peldaño
+        assert sizer.observe(2500, 2500, 5.5) == 2500   # dentro de la tolerancia
+        assert sizer.observe(2500, 2500, 20.0) == 1000  # 4 veces el objetivo: baja uno
+        assert sizer.observe(1000, 400, 0.01) == 1000   # página corta: no cuenta
+
+    def test_limite_de_bytes_y_count_default(self):
+        sizer = PageSizer(1000, target=5.0)
+        assert sizer.observe(1000, 1000, 0.1, nbytes=MAX_PAGE_BYTES // 2) == 1000
+        sizer = PageSizer(1000, Capabilities(True, 1200), target=5.0)
+        assert sizer.observe(1000, 1000, 0.1) == 1200
+
+    def test_fin_de_paginacion(self):
+        sizer = PageSizer(1000)
+        # Página corta leída del diario: no revela ningún límite
+        assert sizer.has_more(1000, 300, 300, 2500, observe=False) and sizer.limit is None
+        assert not sizer.has_more(1000, 500, 2500, 2500)
+        assert sizer.has_more(1000, 1000, 1000, None)
+        assert not sizer.has_more(1000, 999, 999, None)
+        # Página corta antes de numberMatched: límite del servidor
+        assert sizer.has_more(1000, 300, 300, 2500) and sizer.size == sizer.limit == 300
+        with pytest.raises(PagingError):
+            sizer.has_more(300, 0, 300, 2500)
+        with pytest.raises(PagingError):
+            PageSizer(1000, Capabilities(False, 1000)).has_more(1000, 1000, 1000, 2500)
+
+
+# ============================================================================
+# TESTS DE INTEGRACIÓN
+# ============================================================================
+
+class TestDownloadDera:
+    """Paginación de download_dera contra el servidor local."""
+
+    def test_limite_no_anunciado_no_trunca(self, rapido):
+        with WFSStandin(features=2500, max_page=300) as server:
+            progress = download_dera.LayerProgress()
+            features = list(download_dera.iter_wfs_features(server.url, "bench:capa", "Bench", progress=progress))
+        assert _ids(features) == list(range(1, 2501))
+        assert progress.complete
+
+    @pytest.mark.parametrize("page_concurrency", [1, 4])
+    def test_count_default_acota_cada_peticion(self, rapido, page_concurrency):
+        options = download_dera.DownloadOptions(capabilities=_cache(), page_concurrency=page_concurrency)
+        with WFSStandin(features=2500, count_default=400) as server:
+            data = download_dera.fetch_wfs_features(server.url, "bench:capa", "Bench", options=options)
+            assert server.stats()["requests"] == 1 + 7  # GetCapabilities + 7 páginas de 400
+        assert _ids(data["features"]) == list(range(1, 2501))
+
+    def test_sin_paginacion_la_capa_queda_incompleta(self, rapido):
+        options = download_dera.DownloadOptions(capabilities=_cache())
+        with WFSStandin(features=2500, count_default=1000, paging=False) as server:
+            progress = download_dera.LayerProgress()
+            features = list(download_dera.iter_wfs_features(server.url, "bench:capa", "Bench",
+                                                            progress=progress, options=options))
+            assert server.stats()["requests"] == 2  # GetCapabilities + una sola página
+        assert len(features) == 1000 and not progress.complete
+
+    def test_ajuste_reduce_peticiones(self, rapido):
+        options = download_dera.DownloadOptions(batch_size=100, page_target=60.0)
+        with WFSStandin(features=5000) as server:
+            data = download_dera.fetch_wfs_features(server.url, "bench:capa", "Bench", options=options)
+            requests = server.stats()["requests"]
+        assert _ids(data["features"]) == list(range(1, 5001))
+        assert requests == 6  # 100, 250, 500, 1000, 2500 y el resto, en lugar de 50
+
+
+class TestActions:
+    """download_dera_actions pide siempre COUNT y pagina hasta numberMatched."""
+
+    def test_stream_con_limite_no_anunciado(self, rapido):
+        with WFSStandin(features=1000, max_page=300) as server:
+            features = list(download_dera_actions.iter_wfs_stream(server.url, "bench:capa"))
+            assert server.stats()["requests"] == 4
+        assert _ids(features) == list(range(1, 1001))
+
+    def test_servidor_que_ignora_startindex(self, rapido):
+        with WFSStandin(features=1000, max_page=300, paging=False) as server:
+            with pytest.raises(PagingError):
+                list(download_dera_actions.iter_wfs_stream(server.url, "bench:capa"))
+
+    def test_sin_paginacion_anunciada(self, rapido):
+        with WFSStandin(features=1000, count_default=300, paging=False) as server, \
+                patch.object(download_dera_actions, "CAPABILITIES", _cache()):
+            with pytest.raises(PagingError):
+                list(download_dera_actions.iter_wfs_stream(server.url, "bench:capa"))
+            assert server.stats()["requests"] == 2  # GetCapabilities + una sola página
+
+    def test_argumentos(self):
+        args = download_dera_actions.parse_args([])
+        assert args.page_size is None and args.target_seconds > 0
+        assert download_dera_actions.parse_args(["--page-size", "500"]).page_size == 500
+        with pytest.raises(SystemExit):
+            download_dera_actions.parse_args(["--page-size", "0"])
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v", "--tb=short"])
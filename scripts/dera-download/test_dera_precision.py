@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+test_dera_precision.py
+
+Tests de la política de precisión de coordenadas (dera_precision.py) y de
+las coordenadas en delta del columnar.
+Ejecutar con: pytest test_dera_precision.py -v
+
+@version 1.0.0
+@date 2025-12-09
+"""
+
+import json
+import math
+
+import pytest
+from unittest.mock import patch
+
+import download_dera_actions
+from dera_columnar import ColumnarWriter, MISSING_DELTA, read_columnar
+from dera_precision import DEFAULT_PRECISION, PRECISION, PrecisionPolicy, Quantizer
+
+
+def _feature(i, coordinates):
+    return {"type": "Feature", "id": f"g12_01_CentroSalud.{i}",
+            "geometry": {"type": "MultiPoint", "coordinates": coordinates},
+            "properties": {"id_dera": i, "nombre": f"Centro {i}", "cod_mun": "41091"}}
+
+
+FEATURES = [
+    _feature(1, [[190372.28344586, 4172207.46443277]]),
+    _feature(2, [[190380.7374446, 4172190.25758694], [190390.5, 4172100.49]]),
+    {"type": "Feature", "geometry": None, "properties": {"id_dera": 3}},
+    _feature(4, [[487828.3374446, 4113551.65758694]]),
+]
+
+
+def _copia():
+    return json.loads(json.dumps(FEATURES))
+
+
+# ============================================================================
+# TESTS DE LA POLÍTICA
+# ============================================================================
+
+class TestPolitica:
+    """--precision en la CLI."""
+
+    def test_sin_opcion(self):
+        assert PrecisionPolicy.from_args(None, PRECISION) is None
+
+    def test_politica_por_defecto(self):
+        policy = PrecisionPolicy.from_args([], PRECISION)
+        assert policy.for_layer("energy") == PRECISION["energy"]
+        assert policy.for_layer("otra") == DEFAULT_PRECISION
+
+    def test_global_y_por_capa(self):
+        policy = PrecisionPolicy.from_args(["0.5", "health=0.1,energy=2"], PRECISION)
+        assert policy.for_layer("health") == 0.1
+        assert policy.for_layer("energy") == 2.0
+        assert policy.for_layer("education") == 0.5
+
+    @pytest.mark.parametrize("valor", ["0", "-1", "abc", "nan", "inf", "rios=1"])
+    def test_valor_no_valido(self, valor):
+        with pytest.raises(ValueError):
+            PrecisionPolicy.from_args([valor], PRECISION)
+
+
+# ============================================================================
+# TESTS DEL REDONDEO
+# ============================================================================
+
+class TestRedondeo:
+    """Quantizer sobre las features."""
+
+    def test_metro(self):
+        quantizer = Quantizer(1.0)
+        features = list(quantizer.wrap(_copia()))
+
+        assert features[0]["geometry"]["coordinates"] == [[190372, 4172207]]
+        assert features[1]["geometry"]["coordinates"] == [[190381, 4172190], [190390, 4172100]]
+        assert features[2]["geometry"] is None
+        assert quantizer.points == 4
+        assert quantizer.max_error <= math.sqrt(2) / 2
+        assert quantizer.saved > 0
+
+    def test_decimetro(self):
+        quantizer = Quantizer(0.1)
+        features = list(quantizer.wrap(_copia()))
+
+        assert features[0]["geometry"]["coordinates"] == [[190372.3, 4172207.5]]
+        assert json.dumps(features[3]["geometry"]["coordinates"]) == "[[487828.3, 4113551.7]]"
+        assert quantizer.max_error <= 0.1 * math.sqrt(2) / 2
+
+    def test_idempotente(self):
+        quantizer = Quantizer(1.0)
+        redondeadas = list(quantizer.wrap(_copia()))
+        otra = Quantizer(1.0)
+        assert list(otra.wrap(json.loads(json.dumps(redondeadas)))) == redondeadas
+        assert otra.max_error == 0 and otra.saved == 0
+
+    def test_decimales_de_la_precision(self):
+        assert Quantizer(10.0).decimals == 0
+        assert Quantizer(0.25).decimals == 2
+        assert Quantizer(10.0).value(190375.0) in (190370, 190380)
+
+
+# ============================================================================
+# TESTS DEL COLUMNAR EN DELTA
+# ============================================================================
+
+class TestColumnarDelta:
+    """x/y como enteros en delta."""
+
+    def test_ida_y_vuelta(self, tmp_path):
+        columns = ColumnarWriter("health", 0.1)
+        list(columns.wrap(Quantizer(0.1).wrap(_copia())))
+        columns.write(tmp_path / "health.columnar.bin")
+
+        data = read_columnar(tmp_path / "health.columnar.bin")
+        assert "x" not in data["columns"] and data["columns"]["dx"]["type"] == "int32"
+        assert data["quantization"]["precision"] == 0.1
+        for decoded, original in zip(data["data"]["x"], columns.columns["x"]):
+            assert (math.isnan(decoded) and math.isnan(original)) or decoded == pytest.approx(original, abs=1e-6)
+        assert math.isnan(data["data"]["y"][2])
+
+    def test_deltas(self):
+        columns = ColumnarWriter("health", 1.0)
+        list(columns.wrap(Quantizer(1.0).wrap(_copia())))
+        dx, dy = columns._deltas(columns._origin())
+
+        assert list(dx) == [0, 9, MISSING_DELTA, 487828 - 190381]
+        assert dy[0] == 4172207 - 4113552
+
+    def test_mas_pequeno(self):
+        sin = ColumnarWriter("health")
+        con = ColumnarWriter("health", 1.0)
+        for feature in _copia() * 100:
+            sin.add(feature)
+            con.add(feature)
+        assert len(con.to_bytes()) < len(sin.to_bytes())
+
+
+# ============================================================================
+# TESTS DE INTEGRACIÓN
+# ============================================================================
+
+class TestIntegracion:
+    """download_dera_actions con --precision."""
+
+    def test_process_category(self, tmp_path, capsys):
+        body = json.dumps({"type": "FeatureCollection", "features": FEATURES}).encode("utf-8")
+        policy = PrecisionPolicy.from_args(["health=1"], download_dera_actions.WFS_LAYERS)
+        with patch.object(download_dera_actions, "OUTPUT_DIR", tmp_path), \
+             patch("download_dera_actions.http_stream", side_effect=lambda url, timeout: iter([body])):
+            assert download_dera_actions.process_category("health", coalesce=False, precision=policy,
+                                                          columnar=True) == 8
+
+        data = json.loads((tmp_path / "health.geojson").read_text(encoding="utf-8"))
+        assert data["features"][0]["geometry"]["coordinates"] == [[190372, 4172207]]
+        assert read_columnar(tmp_path / "health.columnar.bin")["quantization"]["precision"] == 1.0
+        assert "error máximo" in capsys.readouterr().out
+
+    def test_cli(self):
+        assert download_dera_actions.parse_args([]).precision is None
+        args = download_dera_actions.parse_args(["--precision"])
+        assert args.precision.for_layer("energy") == PRECISION["energy"]
+        with pytest.raises(SystemExit):
+            download_dera_actions.parse_args(["--precision", "0"])
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v", "--tb=short"])
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+test_dera_profile.py
+
+Tests del perfilado por etapas (dera_profile.py).
+Ejecutar con: pytest test_dera_profile.py -v
+
+@version 1.0.0
+@date 2025-12-09
+"""
+
+import json
+import pstats
+import time
+
+import pytest
+from unittest.mock import patch
+
+import download_dera_actions
+from dera_metrics import METRICS, Metrics
+from dera_profile import PROFILE_JSON_FILENAME, PROFILE_TEXT_FILENAME, Profiler
+from wfs_http import INITIAL_RATE, MAX_RATE, RATE_LIMITER, configure_session
+from wfs_standin import WFSStandin
+
+
+def _busy(n: int) -> int:
+    return sum(i * i for i in range(n))
+
+
+# ============================================================================
+# TESTS DEL PERFILADOR
+# ============================================================================
+
+class TestPerfilador:
+    """Tiempos, cProfile y tracemalloc por etapa."""
+
+    def test_sin_perfil_no_hay_ganchos(self):
+        assert Metrics().stage_hooks == []
+
+    def test_tiempos_de_reloj_y_cpu(self, tmp_path):
+        metrics = Metrics()
+        profiler = Profiler(tmp_path).attach(metrics)
+
+        @metrics.timed("espera", "capa")
+        def espera(capa):
+            time.sleep(0.05)
+
+        espera("bench:a")
+        [record] = profiler.stages
+        assert record["stage"] == "espera" and record["layer"] == "bench:a"
+        assert record["wallSeconds"] >= 0.05
+        assert record["cpuSeconds"] < record["wallSeconds"]
+        assert record["waitSeconds"] > 0.03
+        assert "pstats" not in record and "peakBytes" not in record
+
+        profiler.detach(metrics)
+        espera("bench:b")
+        assert len(profiler.stages) == 1
+
+    def test_cprofile(self, tmp_path):
+        metrics = Metrics()
+        profiler = Profiler(tmp_path, ["cprofile"]).attach(metrics)
+        with metrics.stage("cálculo", "bench:a"):
+            _busy(200_000)
+
+        [record] = profiler.stages
+        assert any("_busy" in f["function"] for f in record["topFunctions"])
+        dump = tmp_path / record["pstats"]
+        assert pstats.Stats(str(dump)).total_calls > 0
+
+    def test_cprofile_una_etapa_a_la_vez(self, tmp_path):
+        metrics = Metrics()
+        profiler = Profiler(tmp_path, ["cprofile"]).attach(metrics)
+        with metrics.stage("fuera"):
+            with metrics.stage("dentro"):
+                _busy(1000)
+
+        inner, outer = profiler.stages
+        assert inner["stage"] == "dentro" and inner["pstats"] is None
+        assert outer["stage"] == "fuera" and outer["pstats"]
+
+    def test_tracemalloc_pico_por_capa(self, tmp_path):
+        metrics = Metrics()
+        profiler = Profiler(tmp_path, ["tracemalloc"]).attach(metrics)
+        try:
+            with metrics.stage("fuera", "bench:a"):
+                with metrics.stage("dentro", "bench:a"):
+                    data = [bytes(1024) for _ in range(4000)]
+                    del data
+                with metrics.stage("vacía", "bench:b"):
+                    pass
+        finally:
+            profiler.detach(metrics)
+            profiler.write()
+
+        by_stage = {r["stage"]: r for r in profiler.stages}
+        assert by_stage["dentro"]["peakBytes"] > 4000 * 1024
+        assert by_stage["fuera"]["peakBytes"] >= by_stage["dentro"]["peakBytes"]
+        assert by_stage["vacía"]["peakBytes"] < 1024 * 1024
+        assert by_stage["dentro"]["topAllocations"]
+
+    def test_modo_desconocido(self, tmp_path):
+        with pytest.raises(ValueError):
+            Profiler(tmp_path, ["perf"])
+
+
+# ============================================================================
+# TESTS DE INTEGRACIÓN
+# ============================================================================
+
+class TestIntegracion:
+    """Perfil de las etapas de download_dera_actions."""
+
+    def test_process_category(self, tmp_path):
+        configure_session()
+        RATE_LIMITER.configure(initial_rate=1000, max_rate=1000)
+        profiler = Profiler(tmp_path / "perfil", ["cprofile", "tracemalloc"]).attach(METRICS)
+        try:
+            with WFSStandin(features=500) as server, \
+                    patch.object(download_dera_actions, "OUTPUT_DIR", tmp_path), \
+                    patch.dict(download_dera_actions.WFS_LAYERS, {"bench": [(server.url, "bench:capa", "CAP")]}):
+                assert download_dera_actions.process_category("bench") == 500
+        finally:
+            profiler.detach(METRICS)
+            RATE_LIMITER.configure(initial_rate=INITIAL_RATE, max_rate=MAX_RATE)
+            configure_session()
+        directory = profiler.write()
+
+        report = json.loads((directory / PROFILE_JSON_FILENAME).read_text(encoding="utf-8"))
+        stages = {(s["stage"], s["layer"]) for s in report["stages"]}
+        assert ("process_category", "bench") in stages
+        assert report["modes"] == ["cprofile", "tracemalloc"]
+        outer = next(s for s in report["stages"] if s["stage"] == "process_category")
+        assert outer["topFunctions"] and outer["peakBytes"] > 0
+        assert "process_category" in (directory / PROFILE_TEXT_FILENAME).read_text(encoding="utf-8")
+
+    def test_argumentos(self):
+        assert download_dera_actions.parse_args([]).profile is None
+        assert download_dera_actions.parse_args(["--profile"]).profile == []
+        args = download_dera_actions.parse_args(["--profile", "cprofile", "tracemalloc"])
+        assert args.profile == ["cprofile", "tracemalloc"]
+        with pytest.raises(SystemExit):
+            download_dera_actions.parse_args(["--profile", "perf"])
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v", "--tb=short"])
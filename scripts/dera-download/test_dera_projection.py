@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+test_dera_projection.py
+
+Tests de la proyección de atributos (dera_projection.py) y de su uso en
+las URLs GetFeature de los dos scripts.
+Ejecutar con: pytest test_dera_projection.py -v
+
+@version 1.0.0
+@date 2025-12-09
+"""
+
+import json
+from unittest.mock import patch
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+import requests
+
+import download_dera
+import download_dera_actions
+from dera_projection import (
+    CONSUMED_PROPERTIES, GEOMETRY_PROPERTY, LAYER_PROPERTIES, Schema, SchemaCache, layer_savings,
+    parse_schema, projection_savings, property_names,
+)
+from wfs_http import http_stream
+from wfs_standin import WFSStandin
+
+HOSPITAL = "DERA_g12_servicios:g12_02_Hospital_CAE"
+AYUNTAMIENTO = "DERA_g12_servicios:g12_11_Ayuntamiento"
+
+
+def _params(url):
+    return {k.upper(): v[0] for k, v in parse_qs(urlparse(url).query).items()}
+
+
+# ============================================================================
+# TESTS DE LISTAS
+# ============================================================================
+
+class TestPropertyNames:
+    """Valor de PROPERTYNAME por capa."""
+
+    def test_una_capa(self):
+        names = property_names([HOSPITAL]).split(",")
+        assert names[0] == "id_dera"
+        assert names[-1] == GEOMETRY_PROPERTY
+        assert "sistema_sa" not in names
+
+    def test_varias_capas_entre_parentesis(self):
+        value = property_names([HOSPITAL, AYUNTAMIENTO])
+        assert value.startswith("(") and value.endswith(")")
+        assert value.count("(") == 2
+        assert "telefono" not in value
+
+    def test_capa_desconocida_sin_proyeccion(self):
+        assert property_names([HOSPITAL, "otro:capa"]) is None
+
+    def test_solo_atributos_consumidos(self):
+        for layer, properties in LAYER_PROPERTIES.items():
+            assert "id_dera" in properties, layer
+            assert set(properties) <= set(CONSUMED_PROPERTIES), layer
+
+    def test_todas_las_capas_configuradas(self):
+        layers = {layer for sources in download_dera_actions.WFS_LAYERS.values() for _, layer, _ in sources}
+        assert layers <= set(LAYER_PROPERTIES)
+
+
+# ============================================================================
+# TESTS DE URLS
+# ============================================================================
+
+class TestUrls:
+    """Las peticiones GetFeature llevan PROPERTYNAME salvo --all-properties."""
+
+    def test_actions_proyecta(self):
+        params = _params(download_dera_actions.build_getfeature_url("http://t/wfs", HOSPITAL))
+        assert params["PROPERTYNAME"] == property_names([HOSPITAL])
+
+    def test_actions_agrupada(self):
+        url = download_dera_actions.build_getfeature_url("http://t/wfs", f"{HOSPITAL},{AYUNTAMIENTO}")
+        assert _params(url)["PROPERTYNAME"] == property_names([HOSPITAL, AYUNTAMIENTO])
+
+    def test_actions_sin_proyeccion(self):
+        url = download_dera_actions.build_getfeature_url("http://t/wfs", HOSPITAL, project=False)
+        assert "PROPERTYNAME" not in _params(url)
+
+    def test_download_dera_proyecta(self):
+        url = download_dera.build_wfs_url("http://t/wfs", HOSPITAL, None, 0, 100)
+        assert _params(url)["PROPERTYNAME"] == property_names([HOSPITAL])
+
+    def test_download_dera_all_properties(self):
+        options = download_dera.DownloadOptions(project=False)
+        url = download_dera.build_wfs_url("http://t/wfs", HOSPITAL, None, 0, 100, options=options)
+        assert "PROPERTYNAME" not in _params(url)
+
+
+# ============================================================================
+# TESTS DE ESQUEMAS
+# ============================================================================
+
+XSD = (
+    b'<?xml version="1.0" encoding="UTF-8"?><xsd:schema xmlns:xsd="http://www.w3.org/2001/XMLSchema" '
+    b'xmlns:gml="http://www.opengis.net/gml/3.2"><xsd:complexType name="g12_02_Hospital_CAEType">'
+    b'<xsd:complexContent><xsd:extension base="gml:AbstractFeatureType"><xsd:sequence>'
+    b'<xsd:element name="the_geom" type="gml:MultiPointPropertyType"/>'
+    b'<xsd:element name="id_dera" type="xsd:long"/><xsd:element name="nombre" type="xsd:string"/>'
+    b'<xsd:element name="municipio" type="xsd:string"/>'
+    b'</xsd:sequence></xsd:extension></xsd:complexContent></xsd:complexType>'
+    b'<xsd:element name="g12_02_Hospital_CAE" type="g12_02_Hospital_CAEType"/></xsd:schema>'
+)
+
+
+class TestEsquema:
+    """Validación de las listas con DescribeFeatureType."""
+
+    def test_parse_schema_por_bloques(self):
+        schema = parse_schema(XSD[i:i + 50] for i in range(0, len(XSD), 50))
+        assert schema.geometry == "the_geom"
+        assert schema.properties == ("id_dera", "nombre", "municipio")
+
+    def test_descarta_atributos_y_usa_la_geometria_real(self):
+        schema = parse_schema([XSD])
+        assert property_names([HOSPITAL], lambda layer: schema) == "id_dera,nombre,municipio,the_geom"
+        assert "direccion" in schema.problems(HOSPITAL)
+
+    def test_esquema_desconocido_sin_proyeccion(self):
+        assert property_names([HOSPITAL], lambda layer: None) is None
+        assert property_names([HOSPITAL], lambda layer: Schema(["id_dera"])) is None
+
+    def test_exception_report_es_desconocido(self):
+        report = b'<ows:ExceptionReport xmlns:ows="http://www.opengis.net/ows/1.1"/>'
+        cache = SchemaCache(lambda url: (chunk for chunk in [report]))
+        assert cache.get("http://t/wfs", HOSPITAL) is None
+        assert "no disponible" in cache.describe("http://t/wfs", HOSPITAL)
+
+    def test_error_de_red_se_pide_una_vez(self):
+        calls = []
+
+        def stream(url):
+            calls.append(url)
+            raise requests.exceptions.ConnectionError("sin red")
+            yield b""
+
+        cache = SchemaCache(stream)
+        assert cache.get("http://t/wfs", HOSPITAL) is None
+        assert cache.get("http://t/wfs", HOSPITAL) is None
+        assert len(calls) == 1
+        assert "sin red" in cache.errors[HOSPITAL]
+
+    def test_contra_el_servidor(self):
+        with WFSStandin() as server:
+            cache = SchemaCache(lambda url: http_stream(url, timeout=5))
+            assert cache.valid(server.url, "DERA_g12_servicios:g12_01_CentroSalud")
+            assert not cache.valid(server.url, HOSPITAL)
+            assert "sin tipo" in cache.describe(server.url, HOSPITAL)
+
+    def test_urls_validadas(self):
+        cache = SchemaCache(lambda url: (chunk for chunk in [XSD]))
+        options = download_dera.DownloadOptions(schemas=cache)
+        url = download_dera.build_wfs_url("http://t/wfs", HOSPITAL, None, 0, 100, options=options)
+        assert _params(url)["PROPERTYNAME"] == "id_dera,nombre,municipio,the_geom"
+        with patch.object(download_dera_actions, "SCHEMAS", cache):
+            url = download_dera_actions.build_getfeature_url("http://t/wfs", HOSPITAL)
+            assert _params(url)["PROPERTYNAME"] == "id_dera,nombre,municipio,the_geom"
+
+
+# ============================================================================
+# TESTS DEL INFORME
+# ============================================================================
+
+class TestAhorro:
+    """Estimación de bytes ahorrados a partir de una muestra."""
+
+    def _muestra(self, projected):
+        properties = {"id_dera": 1, "nombre": "H"}
+        if not projected:
+            properties["telefono"] = "955000000"
+        features = [{"type": "Feature", "properties": dict(properties, id_dera=i)} for i in range(10)]
+        yield json.dumps({"type": "FeatureCollection", "features": features}).encode("utf-8")
+
+    def test_extrapola_al_total(self):
+        savings = projection_savings(self._muestra, 1000)
+        assert savings["projectedBytes"] < savings["fullBytes"]
+        per_feature = (savings["fullBytes"] - savings["projectedBytes"]) / 10
+        assert savings["estimatedSaved"] == int(per_feature * 1000)
+        assert 0 < savings["ratio"] < 1
+
+    def test_muestra_vacia(self):
+        vacia = lambda projected: iter([b'{"type":"FeatureCollection","features":[]}'])
+        assert projection_savings(vacia, 0) is None
+
+    def test_por_fuente(self):
+        def stream(url):
+            if "falla" in url:
+                raise requests.exceptions.ConnectionError("sin red")
+            return self._muestra("PROPERTYNAME" in url)
+
+        sample_url = lambda url, layer, projected: download_dera_actions.build_getfeature_url(url, layer, projected)
+        sources = [("http://t/wfs", HOSPITAL, "Hospitales"), ("http://falla/wfs", HOSPITAL, "Otra")]
+        results = list(layer_savings(sources, sample_url, lambda url, layer: 1000, stream))
+        assert results[0][0] == sources[0] and results[0][1]["estimatedSaved"] > 0
+        assert results[1][1] is None and "sin red" in results[1][2]
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v", "--tb=short"])
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+test_dera_rtree.py
+
+Tests del R-tree Flatbush precalculado (dera_rtree.py) contra búsquedas
+por fuerza bruta.
+Ejecutar con: pytest test_dera_rtree.py -v
+
+@version 1.0.0
+@date 2025-12-09
+"""
+
+import json
+import math
+import random
+
+import pytest
+from unittest.mock import patch
+
+import download_dera_actions
+from dera_columnar import ColumnarWriter
+from dera_rtree import FlatbushIndex, build_flatbush, hilbert, level_bounds, rtree_paths, write_rtree
+
+random.seed(11)
+PUNTOS = [(random.uniform(100000, 625000), random.uniform(3980000, 4290000)) for _ in range(3000)]
+# Puntos repetidos (misma dirección en dos capas): caja de tamaño cero
+PUNTOS += [PUNTOS[0]] * 5
+
+
+def _caja(x, y):
+    return (x, y, x, y)
+
+
+@pytest.fixture(scope="module")
+def indice():
+    return FlatbushIndex(build_flatbush(_caja(x, y) for x, y in PUNTOS))
+
+
+def _fuerza_bruta_bbox(puntos, min_x, min_y, max_x, max_y):
+    return sorted(i for i, (x, y) in enumerate(puntos) if min_x <= x <= max_x and min_y <= y <= max_y)
+
+
+def _distancia(i, x, y):
+    return math.hypot(PUNTOS[i][0] - x, PUNTOS[i][1] - y)
+
+
+# ============================================================================
+# TESTS DEL FORMATO
+# ============================================================================
+
+class TestFormato:
+    """Buffer compatible con Flatbush.from (Flatbush 4.x)."""
+
+    def test_cabecera(self):
+        buffer = build_flatbush(_caja(x, y) for x, y in PUNTOS[:100])
+        assert buffer[0] == 0xFB
+        assert buffer[1] == (3 << 4) + 8  # versión 3, Float64Array
+        assert int.from_bytes(buffer[2:4], "little") == 16
+        assert int.from_bytes(buffer[4:8], "little") == 100
+
+        num_nodes = level_bounds(100, 16)[-1] // 4
+        assert num_nodes == 100 + 7 + 1
+        assert len(buffer) == 8 + num_nodes * 32 + num_nodes * 2  # índices Uint16
+
+    def test_indices_uint32_con_muchos_nodos(self):
+        n = 16384
+        buffer = build_flatbush(_caja(i % 128, i // 128) for i in range(n))
+        num_nodes = level_bounds(n, 16)[-1] // 4
+        assert len(buffer) == 8 + num_nodes * 32 + num_nodes * 4
+        tree = FlatbushIndex(buffer)
+        assert sorted(tree.search(10, 10, 11, 11)) == [10 + 128 * 10, 11 + 128 * 10, 10 + 128 * 11, 11 + 128 * 11]
+
+    def test_un_solo_nodo(self):
+        tree = FlatbushIndex(build_flatbush([(1, 2, 1, 2), (3, 4, 3, 4)]))
+        assert tree.bbox == (1, 2, 3, 4)
+        assert tree.order() == [0, 1]
+
+    def test_nodos_contienen_a_sus_hijos(self, indice):
+        boxes = indice.boxes
+        for level_start, level_end in zip(indice.level_bounds, indice.level_bounds[1:]):
+            for pos in range(level_start, level_end, 4):
+                child = indice.indices[pos >> 2]
+                for c in indice._children(child):
+                    assert boxes[pos] <= boxes[c] and boxes[pos + 1] <= boxes[c + 1]
+                    assert boxes[pos + 2] >= boxes[c + 2] and boxes[pos + 3] >= boxes[c + 3]
+
+    def test_orden_hilbert_es_permutacion(self, indice):
+        assert sorted(indice.order()) == list(range(len(PUNTOS)))
+
+    def test_hilbert(self):
+        # Esquinas de la curva de Flatbush
+        assert hilbert(0, 0) == 0
+        assert hilbert(0xFFFF, 0) == 0xFFFFFFFF
+        assert len({hilbert(x, y) for x in range(16) for y in range(16)}) == 256
+
+    def test_sin_elementos(self):
+        with pytest.raises(ValueError):
+            build_flatbush([])
+
+
+# ============================================================================
+# TESTS CONTRA FUERZA BRUTA
+# ============================================================================
+
+class TestBusquedas:
+    """Las búsquedas del árbol coinciden con recorrer todos los puntos."""
+
+    @pytest.mark.parametrize("semilla", range(20))
+    def test_bbox(self, indice, semilla):
+        rnd = random.Random(semilla)
+        x, y = rnd.uniform(100000, 625000), rnd.uniform(3980000, 4290000)
+        w, h = rnd.uniform(0, 60000), rnd.uniform(0, 60000)
+        assert sorted(indice.search(x, y, x + w, y + h)) == _fuerza_bruta_bbox(PUNTOS, x, y, x + w, y + h)
+
+    def test_bbox_total(self, indice):
+        assert sorted(indice.search(*indice.bbox)) == list(range(len(PUNTOS)))
+
+    @pytest.mark.parametrize("semilla", range(20))
+    def test_vecinos(self, indice, semilla):
+        rnd = random.Random(semilla)
+        x, y = rnd.uniform(100000, 625000), rnd.uniform(3980000, 4290000)
+        cercanos = indice.neighbors(x, y, 10)
+        esperados = sorted(range(len(PUNTOS)), key=lambda i: _distancia(i, x, y))[:10]
+        assert [_distancia(i, x, y) for i in cercanos] == [_distancia(i, x, y) for i in esperados]
+
+    def test_vecinos_con_distancia_maxima(self, indice):
+        x, y = PUNTOS[0]
+        cercanos = indice.neighbors(x, y, len(PUNTOS), 5000)
+        assert sorted(cercanos) == sorted(i for i in range(len(PUNTOS)) if _distancia(i, x, y) <= 5000)
+
+
+# ============================================================================
+# TESTS DE INTEGRACIÓN
+# ============================================================================
+
+def _feature(i, x, y):
+    return {"type": "Feature", "id": f"g10_02_ParqueEolico.{i}",
+            "geometry": {"type": "MultiPoint", "coordinates": [[x, y]]},
+            "properties": {"id_dera": 1000 + i, "nombre": f"Parque {i}", "cod_mun": "04083"}}
+
+
+class TestIntegracion:
+    """write_rtree y process_category con rtree=True."""
+
+    def test_descarta_sin_coordenadas(self, tmp_path):
+        columns = ColumnarWriter("energy")
+        features = [_feature(0, 1, 1), {"properties": {"id_dera": 7}}, _feature(2, 0, 0), _feature(3, 5, 5)]
+        list(columns.wrap(features))
+        assert write_rtree(columns, tmp_path, "energy") == 2
+
+        meta = json.loads(rtree_paths(tmp_path, "energy")[1].read_text(encoding="utf-8"))
+        assert meta["idDera"] == [1000, 1003]
+        assert meta["bbox"] == [1, 1, 5, 5]
+
+    def test_capa_sin_puntos_no_escribe(self, tmp_path):
+        columns = ColumnarWriter("energy")
+        columns.add({"properties": {}})
+        assert write_rtree(columns, tmp_path, "energy") is None
+        assert not rtree_paths(tmp_path, "energy")[0].exists()
+
+    def test_process_category(self, tmp_path):
+        features = [_feature(i, x, y) for i, (x, y) in enumerate(PUNTOS[:200])]
+        body = json.dumps({"type": "FeatureCollection", "features": features}).encode("utf-8")
+        with patch.object(download_dera_actions, "OUTPUT_DIR", tmp_path), \
+             patch("download_dera_actions.http_stream", return_value=iter([body])):
+            assert download_dera_actions.process_category("energy", rtree=True) == 200
+
+        bin_path, meta_path = rtree_paths(tmp_path, "energy")
+        tree = FlatbushIndex(bin_path.read_bytes())
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        x, y = PUNTOS[7]
+        assert meta["idDera"][tree.neighbors(x, y)[0]] == 1007
+        assert not (tmp_path / "energy.columnar.bin").exists()
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v", "--tb=short"])
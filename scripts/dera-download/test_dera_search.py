@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+test_dera_search.py
+
+Tests del índice de búsqueda por nombre (dera_search.py).
+Ejecutar con: pytest test_dera_search.py -v
+
+@version 1.0.0
+@date 2025-12-09
+"""
+
+import json
+from pathlib import Path
+
+import pytest
+from unittest.mock import patch
+
+import download_dera_actions
+from dera_columnar import ColumnarWriter, columns_from_geojson
+from dera_search import build_search_index, fold, normalize_name, search, search_path, trigrams
+
+DATA_DIR = Path(__file__).parent.parent.parent / "public" / "data" / "dera"
+
+
+def _feature(i, nombre, cod_mun):
+    return {"type": "Feature", "id": f"g12_05_CentroEducativo.{i}",
+            "geometry": {"type": "MultiPoint", "coordinates": [[235000.0 + i, 4142000.0]]},
+            "properties": {"id_dera": 100 + i, "nombre": nombre, "cod_mun": cod_mun}}
+
+
+FEATURES = [
+    _feature(0, "C.E.I.P. Miguel Hernández", "41091"),
+    _feature(1, "IES Miguel Hernández", "04013"),
+    _feature(2, "Centro de Salud Triana", "41091"),
+    _feature(3, "CEIP San José Obrero", "41091"),
+    _feature(4, "CEIP", "41091"),
+    _feature(5, "Colegio San José", None),
+]
+
+
+@pytest.fixture
+def indice():
+    columns = ColumnarWriter("education")
+    list(columns.wrap(FEATURES))
+    return build_search_index(columns)
+
+
+# ============================================================================
+# TESTS DE NORMALIZACIÓN
+# ============================================================================
+
+class TestNormalizacion:
+    """Plegado de acentos/mayúsculas y palabras vacías."""
+
+    def test_fold(self):
+        assert fold("  Peñarroya-Pueblonuevo  ") == "penarroya pueblonuevo"
+        assert fold("C.S. Virgen del Rocío") == "cs virgen del rocio"
+        assert fold("C.E.I.P. Nº 3") == "ceip n 3"  # NFD, como LocalDataService
+
+    @pytest.mark.parametrize("nombre", [
+        "CEIP Miguel Hernández", "C.E.I.P. Miguel Hernández", "I.E.S. MIGUEL HERNANDEZ",
+        "Colegio Miguel Hernández",
+    ])
+    def test_siglas_de_tipologia(self, nombre):
+        assert normalize_name(nombre) == "miguel hernandez"
+
+    def test_centro_de_salud(self):
+        assert normalize_name("Centro de Salud El Madroño") == normalize_name("C.S. Madroño") == "madrono"
+
+    def test_solo_palabras_vacias_se_conserva(self):
+        assert normalize_name("CEIP") == "ceip"
+
+    def test_trigramas(self):
+        assert trigrams("sol") == [" so", "ol ", "sol"]
+        assert trigrams("a") == [" a "]
+
+
+# ============================================================================
+# TESTS DEL ÍNDICE
+# ============================================================================
+
+class TestIndice:
+    """Listas por municipio y búsqueda por intersección."""
+
+    def test_particiones_por_municipio(self, indice):
+        assert set(indice["postings"]) == {"41091", "04013", "00000"}
+        assert indice["postings"]["41091"]["mig"] == [0]
+        assert indice["postings"]["04013"]["mig"] == [1]
+
+    def test_busqueda_en_municipio(self, indice):
+        resultados = search(indice, "CEIP Miguel Hernandez", "41091")
+        assert resultados == [(0, 1.0)]
+
+    def test_busqueda_sin_municipio(self, indice):
+        assert sorted(i for i, _ in search(indice, "miguel hernández")) == [0, 1]
+
+    def test_busqueda_aproximada(self, indice):
+        resultados = search(indice, "San Jose", "41091")
+        assert resultados[0][0] == 3
+        assert 0.3 <= resultados[0][1] < 1
+
+    def test_coincide_con_recorrido_lineal(self, indice):
+        """El índice da lo mismo que comparar trigramas con todos los nombres."""
+        consulta = set(trigrams(normalize_name("salud triana")))
+        esperado = []
+        for i, name in enumerate(indice["names"]):
+            propios = set(trigrams(name))
+            similitud = len(consulta & propios) / len(consulta | propios)
+            if similitud >= 0.3:
+                esperado.append((i, similitud))
+        assert search(indice, "salud triana", limit=10) == sorted(esperado, key=lambda r: (-r[1], r[0]))
+
+    @pytest.mark.skipif(not (DATA_DIR / "education.geojson").exists(), reason="sin datos DERA")
+    def test_datos_reales(self):
+        columns = columns_from_geojson(DATA_DIR / "education.geojson", "education")
+        indice = build_search_index(columns)
+        for i in range(0, columns.count, 500):
+            nombre = columns.strings[columns.columns["nombre"][i]]
+            cod_mun = f"{columns.columns['codMun'][i]:05d}"
+            assert i in [j for j, s in search(indice, nombre, cod_mun, limit=50) if s == 1.0]
+
+
+class TestIntegracion:
+    """process_category con search_index=True."""
+
+    def test_process_category(self, tmp_path):
+        body = json.dumps({"type": "FeatureCollection", "features": FEATURES}).encode("utf-8")
+        with patch.object(download_dera_actions, "OUTPUT_DIR", tmp_path), \
+             patch("download_dera_actions.http_stream", return_value=iter([body])):
+            assert download_dera_actions.process_category("energy", search_index=True) == len(FEATURES)
+
+        indice = json.loads(search_path(tmp_path, "energy").read_text(encoding="utf-8"))
+        assert indice["idDera"][search(indice, "Triana", "41091")[0][0]] == 102
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v", "--tb=short"])
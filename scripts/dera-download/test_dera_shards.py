@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+test_dera_shards.py
+
+Tests de las particiones por municipio y provincia (dera_shards.py).
+Ejecutar con: pytest test_dera_shards.py -v
+
+@version 1.0.0
+@date 2025-12-09
+"""
+
+import json
+
+import pytest
+from unittest.mock import patch
+
+import download_dera_actions
+from dera_shards import cod_mun, manifest_path, shard_dir, write_shards
+from geojson_io import write_feature_collection
+
+
+def _feature(i, cod, x=235000.0, y=4142000.0):
+    return {"type": "Feature", "id": f"g12_01_CentroSalud.{i}",
+            "geometry": {"type": "MultiPoint", "coordinates": [[x, y]]},
+            "properties": {"id_dera": i, "nombre": f"Centro {i}", "cod_mun": cod}}
+
+
+FEATURES = [
+    _feature(1, "41091", 230000, 4140000),
+    _feature(2, "41091", 240000, 4150000),
+    _feature(3, "41057"),
+    _feature(4, "04013", 550000, 4080000),
+    _feature(5, 4013, 551000, 4081000),  # cod_mun numérico sin el cero inicial
+    _feature(6, None),
+]
+
+
+def _leer(path):
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+@pytest.fixture
+def capa(tmp_path):
+    path = tmp_path / "health.geojson"
+    write_feature_collection(path, {"type": "FeatureCollection", "features": FEATURES})
+    return path
+
+
+class TestParticiones:
+    """Reparto por municipio y provincia y manifiesto."""
+
+    def test_cod_mun(self):
+        assert cod_mun(FEATURES[4]) == "04013"
+        assert cod_mun(FEATURES[5]) == "00000"
+
+    def test_manifiesto(self, tmp_path, capa):
+        manifest = write_shards(capa, tmp_path, "health")
+
+        assert manifest["count"] == len(FEATURES)
+        assert set(manifest["provincias"]) == {"41", "04", "00"}
+        assert set(manifest["municipios"]) == {"41091", "41057", "04013", "00000"}
+        assert sum(e["count"] for e in manifest["municipios"].values()) == len(FEATURES)
+        assert sum(e["count"] for e in manifest["provincias"].values()) == len(FEATURES)
+
+        sevilla = manifest["municipios"]["41091"]
+        assert sevilla["count"] == 2
+        assert sevilla["bbox"] == [230000, 4140000, 240000, 4150000]
+        assert sevilla["provincia"] == "41"
+        assert sevilla["bytes"] == (shard_dir(tmp_path, "health") / sevilla["file"]).stat().st_size
+        assert _leer(manifest_path(tmp_path, "health")) == manifest
+
+    def test_cada_particion_solo_su_municipio(self, tmp_path, capa):
+        manifest = write_shards(capa, tmp_path, "health")
+        for code, entry in manifest["municipios"].items():
+            data = _leer(shard_dir(tmp_path, "health") / entry["file"])
+            assert {cod_mun(f) for f in data["features"]} == {code}
+            assert data["metadata"]["featuresCount"] == entry["count"]
+
+    def test_borra_particiones_obsoletas(self, tmp_path, capa):
+        write_shards(capa, tmp_path, "health")
+        write_feature_collection(capa, {"type": "FeatureCollection", "features": FEATURES[:2]})
+        manifest = write_shards(capa, tmp_path, "health")
+
+        archivos = sorted(p.name for p in shard_dir(tmp_path, "health").iterdir())
+        assert archivos == ["manifest.json", "mun-41091.geojson", "prov-41.geojson"]
+        assert list(manifest["municipios"]) == ["41091"]
+
+
+class TestIntegracion:
+    """process_category con shards=True."""
+
+    def test_process_category(self, tmp_path):
+        body = json.dumps({"type": "FeatureCollection", "features": FEATURES}).encode("utf-8")
+        with patch.object(download_dera_actions, "OUTPUT_DIR", tmp_path), \
+             patch("download_dera_actions.http_stream", return_value=iter([body])):
+            assert download_dera_actions.process_category("energy", shards=True) == len(FEATURES)
+
+        manifest = _leer(manifest_path(tmp_path, "energy"))
+        assert manifest["source"] == "energy.geojson"
+        assert manifest["municipios"]["04013"]["count"] == 2
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v", "--tb=short"])
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+test_dera_sidecars.py
+
+Tests de la regeneración de sidecars de capas sin cambios (dera_sidecars.py).
+Ejecutar con: pytest test_dera_sidecars.py -v
+
+@version 1.0.0
+@date 2025-12-09
+"""
+
+import json
+
+import pytest
+
+from dera_columnar import columnar_path, read_columnar_header
+from dera_shards import manifest_path
+from dera_sidecars import refresh_sidecars, stale_sidecars
+from geojson_io import write_feature_collection
+from wfs_standin import synthetic_features
+
+TODOS = {"columnar": True, "rtree": True, "search_index": True, "shards": True}
+
+
+@pytest.fixture
+def capa(tmp_path):
+    path = tmp_path / "health.geojson"
+    write_feature_collection(path, {"features": list(synthetic_features("bench:capa", 50))})
+    return path
+
+
+# ============================================================================
+# TESTS DE REGENERACIÓN
+# ============================================================================
+
+class TestSidecars:
+    """Solo se regenera lo que falta o no corresponde a esta ejecución."""
+
+    def test_faltan_y_despues_al_dia(self, capa, tmp_path):
+        assert refresh_sidecars(capa, tmp_path, "health", **TODOS, fingerprint="v1") == [
+            "columnar", "rtree", "search", "shards"]
+        assert stale_sidecars(capa, tmp_path, "health", **TODOS, fingerprint="v1") == []
+        assert refresh_sidecars(capa, tmp_path, "health", **TODOS, fingerprint="v1") == []
+
+    def test_solo_los_pedidos(self, capa, tmp_path):
+        assert refresh_sidecars(capa, tmp_path, "health", columnar=True, fingerprint="v1") == ["columnar"]
+        assert not manifest_path(tmp_path, "health").exists()
+
+    def test_otra_precision(self, capa, tmp_path):
+        refresh_sidecars(capa, tmp_path, "health", columnar=True, fingerprint="v1")
+        assert refresh_sidecars(capa, tmp_path, "health", columnar=True, precision=1.0,
+                                fingerprint="v1") == ["columnar"]
+        assert read_columnar_header(columnar_path(tmp_path, "health"))["quantization"]["precision"] == 1.0
+
+    def test_otro_contenido(self, capa, tmp_path):
+        """Sidecars generados de otra versión de la capa no se dan por buenos."""
+        refresh_sidecars(capa, tmp_path, "health", **TODOS, fingerprint="v1")
+        assert stale_sidecars(capa, tmp_path, "health", **TODOS, fingerprint="v2") == [
+            "columnar", "rtree", "search", "shards"]
+
+    def test_manifiesto_de_version_anterior(self, capa, tmp_path):
+        refresh_sidecars(capa, tmp_path, "health", shards=True, fingerprint="v1")
+        manifest = json.loads(manifest_path(tmp_path, "health").read_text(encoding="utf-8"))
+        del manifest["version"]
+        manifest_path(tmp_path, "health").write_text(json.dumps(manifest), encoding="utf-8")
+        assert stale_sidecars(capa, tmp_path, "health", shards=True, fingerprint="v1") == ["shards"]
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v", "--tb=short"])
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+test_dera_spill.py
+
+Tests del presupuesto de memoria con volcado a NDJSON (dera_spill.py).
+Ejecutar con: pytest test_dera_spill.py -v
+
+@version 1.0.0
+@date 2025-12-09
+"""
+
+import json
+from dataclasses import replace
+
+import pytest
+from unittest.mock import patch
+
+import download_dera
+import download_dera_actions
+from dera_delta import LayerDelta
+from dera_spill import SpillBuffer, parse_megabytes
+from wfs_http import INITIAL_RATE, MAX_RATE, RATE_LIMITER, configure_session
+from wfs_standin import WFSStandin, synthetic_features
+
+
+@pytest.fixture
+def standin():
+    configure_session()
+    RATE_LIMITER.configure(initial_rate=1000, max_rate=1000)
+    with WFSStandin(features=1500) as server:
+        yield server
+    RATE_LIMITER.configure(initial_rate=INITIAL_RATE, max_rate=MAX_RATE)
+    configure_session()
+
+
+# ============================================================================
+# TESTS DEL BUFFER
+# ============================================================================
+
+class TestSpillBuffer:
+    """Volcado, orden y limpieza de temporales."""
+
+    def test_sin_presupuesto_no_vuelca(self, tmp_path):
+        features = list(synthetic_features("bench:a", 500))
+        buffer = SpillBuffer(None, tmp_path)
+        buffer.extend(features)
+        assert list(buffer) == features and len(buffer) == 500
+        assert buffer.files == [] and buffer.spilled == 0
+
+    def test_vuelca_y_conserva_el_orden(self, tmp_path):
+        features = list(synthetic_features("bench:a", 2000))
+        with SpillBuffer(64 * 1024, tmp_path) as buffer:
+            buffer.extend(features)
+            assert len(buffer.files) > 1
+            assert 0 < buffer.spilled <= len(buffer) == 2000
+            assert buffer.memory_bytes <= 64 * 1024
+            assert list(buffer) == features
+            assert list(buffer) == features  # se puede recorrer otra vez
+            for path in buffer.files:
+                first = json.loads(path.read_text(encoding="utf-8").splitlines()[0])
+                assert first["type"] == "Feature"
+        assert list(tmp_path.iterdir()) == []
+
+    def test_temporales_borrados_al_liberar(self, tmp_path):
+        buffer = SpillBuffer(1024, tmp_path)
+        buffer.extend(synthetic_features("bench:a", 100))
+        assert list(tmp_path.iterdir())
+        del buffer
+        assert list(tmp_path.iterdir()) == []
+
+    def test_megabytes(self):
+        assert parse_megabytes(None) is None
+        assert parse_megabytes(1.5) == 1536 * 1024
+        with pytest.raises(ValueError):
+            parse_megabytes(0)
+
+
+# ============================================================================
+# TESTS DE INTEGRACIÓN
+# ============================================================================
+
+class TestIntegracion:
+    """Mismo resultado con y sin presupuesto."""
+
+    def test_fetch_wfs_features(self, standin):
+        options = download_dera.DownloadOptions(batch_size=500)
+        full = download_dera.fetch_wfs_features(standin.url, "bench:a", "Bench", options=options)
+        spilled = download_dera.fetch_wfs_features(standin.url, "bench:a", "Bench",
+                                                   options=replace(options, max_memory=128 * 1024))
+        assert isinstance(spilled["features"], SpillBuffer) and spilled["features"].files
+        assert len(spilled["features"]) == spilled["numberMatched"] == 1500
+        assert list(spilled["features"]) == full["features"]
+
+    def test_paginas_en_vuelo(self, standin):
+        options = download_dera.DownloadOptions(batch_size=300, page_concurrency=4)
+        limited = replace(options, max_memory=128 * 1024)
+        full = list(download_dera.iter_wfs_features(standin.url, "bench:a", "Bench", options=options))
+        page = download_dera._fetch_page_features(standin.url, "bench:a", None, 300, 300, None,
+                                                  in_flight=4, options=limited)
+        assert isinstance(page, SpillBuffer) and page.max_bytes == 32 * 1024 and page.files
+        spilled = list(download_dera.iter_wfs_features(standin.url, "bench:a", "Bench", options=limited))
+        assert list(page) == full[300:600]
+        assert spilled == full and len(full) == 1500
+
+    def test_delta_con_presupuesto(self, tmp_path):
+        v1 = list(synthetic_features("bench:a", 1000))
+        v2 = [dict(f, properties={**f["properties"], "nombre": "Renombrado"}) for f in v1]
+
+        def publicar(delta_dir, **kwargs):
+            for version in (v1, v2):
+                delta = LayerDelta("bench", delta_dir, **kwargs)
+                list(delta.wrap(version))
+                summary = delta.commit()
+            return summary
+
+        delta = LayerDelta("bench", tmp_path / "reparto", max_memory=64 * 1024)
+        assert delta.added.max_bytes + delta.modified.max_bytes == 64 * 1024
+
+        plain = publicar(tmp_path / "lista")
+        spilled = publicar(tmp_path / "spill", max_memory=64 * 1024)
+        assert plain["modified"] == spilled["modified"] == 1000
+        text = (tmp_path / "spill" / spilled["file"]).read_text(encoding="utf-8")
+        assert text == (tmp_path / "lista" / plain["file"]).read_text(encoding="utf-8")
+        assert text == json.dumps(json.loads(text), ensure_ascii=False, separators=(",", ":"))
+
+    def test_argumento(self):
+        assert download_dera_actions.parse_args([]).max_memory is None
+        assert download_dera_actions.parse_args(["--max-memory", "64"]).max_memory == 64 * 1024 * 1024
+        with pytest.raises(SystemExit):
+            download_dera_actions.parse_args(["--max-memory", "0"])
+        with patch("sys.argv", ["download_dera.py", "--max-memory", "0"]), pytest.raises(SystemExit):
+            download_dera.main()
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v", "--tb=short"])
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+test_dera_state.py
+
+Tests del refresco condicional (dera_state.py) y su uso en
+download_dera_actions.py.
+Ejecutar con: pytest test_dera_state.py -v
+
+@version 1.0.0
+@date 2025-12-09
+"""
+
+import json
+
+import pytest
+import requests
+from unittest.mock import patch, MagicMock
+
+import download_dera_actions
+from dera_state import (
+    Fingerprint, check_layer, default_state_file, is_force_env, load_state, probe_planner,
+    probe_source, record_layer, save_state, source_unchanged,
+)
+
+HITS = '<wfs:FeatureCollection numberMatched="1516" numberReturned="0"/>'
+
+
+def _respuesta(status=200, etag='"v1"', last_modified="Mon, 08 Dec 2025 10:00:00 GMT", text=HITS,
+               features=None):
+    response = MagicMock()
+    response.status_code = status
+    response.text = text
+    response.json.return_value = {"type": "FeatureCollection", "features": features or []}
+    response.headers = {k: v for k, v in (("ETag", etag), ("Last-Modified", last_modified)) if v}
+    response.raise_for_status.return_value = None
+    return response
+
+
+# ============================================================================
+# TESTS DE SONDEO
+# ============================================================================
+
+class TestSondeo:
+    """Tests de la petición condicional y la decisión de saltar."""
+
+    def test_probe_envia_validadores_previos(self):
+        """Con estado previo se envían If-None-Match / If-Modified-Since."""
+        previous = {"etag": '"v1"', "lastModified": "Mon, 08 Dec 2025 10:00:00 GMT", "numberMatched": 1516}
+        with patch("dera_state.http_get", return_value=_respuesta(status=304)) as mock_get:
+            probe = probe_source("http://test.com/wfs", "test:layer", previous)
+
+        headers = mock_get.call_args[1]["headers"]
+        assert headers == {"If-None-Match": '"v1"', "If-Modified-Since": previous["lastModified"]}
+        assert "resultType=hits" in mock_get.call_args[0][0]
+        assert probe["notModified"] is True
+        assert probe["numberMatched"] == 1516
+
+    def test_probe_lee_validadores(self):
+        with patch("dera_state.http_get", return_value=_respuesta()):
+            probe = probe_source("http://test.com/wfs", "test:layer")
+        assert probe == {"etag": '"v1"', "lastModified": "Mon, 08 Dec 2025 10:00:00 GMT",
+                         "numberMatched": 1516, "notModified": False}
+
+    def test_probe_error_devuelve_none(self):
+        with patch("dera_state.http_get", side_effect=requests.exceptions.Timeout()):
+            assert probe_source("http://test.com/wfs", "test:layer") is None
+
+    def test_mismo_conteo_sin_validadores_no_basta(self):
+        """Sin ETag ni Last-Modified el conteo igual no garantiza contenido igual."""
+        previous = {"etag": None, "lastModified": None, "numberMatched": 10}
+        current = {"etag": None, "lastModified": None, "numberMatched": 10, "notModified": False}
+        assert not source_unchanged(previous, current)
+
+    def test_validadores_iguales_y_conteo_igual(self):
+        previous = {"etag": '"v1"', "lastModified": None, "numberMatched": 10}
+        assert source_unchanged(previous, {**previous, "notModified": False})
+        assert not source_unchanged(previous, {**previous, "numberMatched": 11, "notModified": False})
+        assert not source_unchanged(previous, {**previous, "etag": '"v2"', "notModified": False})
+
+    def test_sin_validadores_compara_muestra(self):
+        """GeoServer no envía validadores en hits: decide el conteo más una muestra."""
+        def servidor(nombre):
+            muestra = [{"type": "Feature", "id": "a.1", "properties": {"id_dera": 1, "nombre": nombre}}]
+            return lambda url, **kw: _respuesta(etag=None, last_modified=None, features=muestra)
+
+        with patch("dera_state.http_get", side_effect=servidor("Centro")) as mock_get:
+            previous = probe_source("http://test.com/wfs", "test:layer")
+        muestra = mock_get.call_args_list[1][0][0]
+        assert "count=100" in muestra and "sortBy=id_dera" in muestra
+        assert previous["numberMatched"] == 1516 and len(previous["sample"]) == 64
+
+        with patch("dera_state.http_get", side_effect=servidor("Centro")):
+            assert source_unchanged(previous, probe_source("http://test.com/wfs", "test:layer", previous))
+        with patch("dera_state.http_get", side_effect=servidor("Renombrado")):
+            assert not source_unchanged(previous, probe_source("http://test.com/wfs", "test:layer", previous))
+
+    def test_muestra_fallida_no_salta(self):
+        previous = {"etag": None, "lastModified": None, "numberMatched": 10, "sample": None}
+        assert not source_unchanged(previous, {**previous, "notModified": False})
+
+    def test_check_layer_reutiliza_sondeos_del_plan(self, tmp_path):
+        """Con --jobs el sondeo de plan_layers no se repite en check_layer."""
+        (tmp_path / "health.geojson").write_text("{}")
+        state = {"version": 1, "layers": {"health": {"sources": {"a": {"etag": '"v1"', "numberMatched": 1516}}}}}
+        probed = {}
+        with patch("dera_state.http_get", return_value=_respuesta(status=304)) as mock_get:
+            assert probe_planner(state, probed)("u", "a") == 1516
+            assert mock_get.call_args[1]["headers"] == {"If-None-Match": '"v1"'}
+            unchanged, probes = check_layer("health", [("u", "a")], state, tmp_path / "health.geojson", probed)
+        assert unchanged and probes == probed
+        assert mock_get.call_count == 1
+
+    def test_check_layer_requiere_archivo(self, tmp_path):
+        """Sin archivo de salida la capa se descarga aunque el servidor diga 304."""
+        state = {"version": 1, "layers": {"health": {"sources": {"a": {"etag": '"v1"'}}}}}
+        with patch("dera_state.http_get", return_value=_respuesta(status=304)):
+            unchanged, _ = check_layer("health", [("u", "a")], state, tmp_path / "health.geojson")
+            assert not unchanged
+            (tmp_path / "health.geojson").write_text("{}")
+            unchanged, _ = check_layer("health", [("u", "a")], state, tmp_path / "health.geojson")
+            assert unchanged
+
+
+# ============================================================================
+# TESTS DE ESTADO
+# ============================================================================
+
+class TestEstado:
+    """Persistencia del estado y huella de contenido."""
+
+    def test_guardar_y_cargar(self, tmp_path):
+        path = tmp_path / "dera-state.json"
+        state = load_state(path)
+        assert state == {"version": 1, "layers": {}}
+
+        record_layer(state, "health", {"a": {"etag": '"v1"', "numberMatched": 3}}, 3, "abc")
+        save_state(path, state)
+        assert load_state(path)["layers"]["health"]["sources"]["a"]["etag"] == '"v1"'
+        assert list(tmp_path.iterdir()) == [path]
+
+    def test_estado_fuera_de_la_salida(self, tmp_path):
+        """El estado no va junto a los GeoJSON: public/ se publica con la aplicación."""
+        salida = tmp_path / "public" / "data" / "dera"
+        path = default_state_file(salida)
+        assert salida not in path.parents
+        assert path.name == "dera-state.json"
+        assert default_state_file(tmp_path / "otra" / "dera") != path
+
+    def test_record_layer_guarda_muestra(self):
+        state = {"version": 1, "layers": {}}
+        record_layer(state, "health", {"a": {"etag": None, "lastModified": None, "numberMatched": 3,
+                                             "sample": "abc", "notModified": False}}, 3, "f")
+        assert state["layers"]["health"]["sources"]["a"] == {
+            "etag": None, "lastModified": None, "numberMatched": 3, "sample": "abc"}
+
+    def test_estado_corrupto_empieza_de_cero(self, tmp_path):
+        path = tmp_path / "dera-state.json"
+        path.write_text("{no es json")
+        assert load_state(path) == {"version": 1, "layers": {}}
+
+    def test_record_layer_detecta_cambio_de_contenido(self):
+        state = {"version": 1, "layers": {}}
+        assert record_layer(state, "health", {}, 3, "abc")
+        updated = state["layers"]["health"]["updatedAt"]
+        assert not record_layer(state, "health", {}, 3, "abc")
+        assert state["layers"]["health"]["updatedAt"] == updated
+
+    def test_huella_independiente_del_orden_de_claves(self):
+        a, b = Fingerprint(), Fingerprint()
+        a.update({"type": "Feature", "properties": {"x": 1, "y": 2}})
+        b.update({"properties": {"y": 2, "x": 1}, "type": "Feature"})
+        assert a.hexdigest() == b.hexdigest()
+        assert a.count == 1
+
+    @pytest.mark.parametrize("value,expected", [("true", True), ("1", True), ("false", False), (None, False)])
+    def test_force_update_env(self, value, expected):
+        assert is_force_env(value) is expected
+
+
+# ============================================================================
+# TESTS DE INTEGRACIÓN (download_dera_actions)
+# ============================================================================
+
+class TestRefrescoCondicional:
+    """process_category debe saltarse las categorías sin cambios."""
+
+    def test_categoria_sin_cambios_no_descarga(self, tmp_path):
+        (tmp_path / "energy.geojson").write_text("anterior")
+        state = {"version": 1, "layers": {"energy": {
+            "sources": {"DERA_g10_infra_energetica:g10_02_ParqueEolico": {"etag": '"v1"', "numberMatched": 1516}},
+            "featuresCount": 1516,
+            "fingerprint": "abc",
+        }}}
+
+        with patch.object(download_dera_actions, "OUTPUT_DIR", tmp_path), \
+             patch("dera_state.http_get", return_value=_respuesta(status=304)), \
+             patch("download_dera_actions.http_stream") as mock_stream:
+            assert download_dera_actions.process_category("energy", state) == 1516
+
+        mock_stream.assert_not_called()
+        assert (tmp_path / "energy.geojson").read_text() == "anterior"
+
+    def test_force_descarga_y_registra(self, tmp_path):
+        (tmp_path / "energy.geojson").write_text("anterior")
+        state = {"version": 1, "layers": {}}
+        body = json.dumps({"type": "FeatureCollection", "features": [
+            {"type": "Feature", "properties": {"nombre": "Parque"}}
+        ]}).encode("utf-8")
+
+        with patch.object(download_dera_actions, "OUTPUT_DIR", tmp_path), \
+             patch("dera_state.http_get", return_value=_respuesta(status=304)), \
+             patch("download_dera_actions.http_stream", return_value=iter([body])):
+            assert download_dera_actions.process_category("energy", state, force=True) == 1
+
+        layer = state["layers"]["energy"]
+        assert layer["featuresCount"] == 1
+        assert len(layer["fingerprint"]) == 64
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v", "--tb=short"])
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+test_dera_tiles.py
+
+Tests de la descarga por teselas BBOX (dera_tiles.py y download_dera --tiled).
+Ejecutar con: pytest test_dera_tiles.py -v
+
+@version 1.0.0
+@date 2025-12-09
+"""
+
+import json
+import random
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+import requests
+from unittest.mock import patch
+
+import download_dera
+from dera_tiles import ANDALUCIA_BBOX, bbox_param, grid, iter_tiled_features, plan_tiles, TileResult
+
+# Puntos sintéticos: un núcleo denso (Sevilla) y dispersos por Andalucía
+random.seed(7)
+PUNTOS = (
+    [(235000 + random.random() * 20000, 4140000 + random.random() * 20000) for _ in range(900)]
+    + [(random.uniform(ANDALUCIA_BBOX[0], ANDALUCIA_BBOX[2]),
+        random.uniform(ANDALUCIA_BBOX[1], ANDALUCIA_BBOX[3])) for _ in range(400)]
+    # En un borde compartido de la rejilla inicial: entra en dos teselas
+    + [(grid(ANDALUCIA_BBOX, 4)[0][2], 4000000.0)]
+)
+FEATURES = [
+    {"type": "Feature", "id": f"g12_05_CentroEducativo.{i}",
+     "geometry": {"type": "Point", "coordinates": [x, y]}, "properties": {"id_dera": i}}
+    for i, (x, y) in enumerate(PUNTOS)
+]
+
+
+def _dentro(feature, bbox):
+    x, y = feature["geometry"]["coordinates"]
+    return bbox[0] <= x <= bbox[2] and bbox[1] <= y <= bbox[3]
+
+
+def _contar(bbox):
+    return sum(1 for f in FEATURES if _dentro(f, bbox))
+
+
+def _parse_bbox(url):
+    values = parse_qs(urlparse(url).query)
+    raw = values.get("bbox", values.get("BBOX"))
+    return tuple(float(v) for v in raw[0].split(",")[:4]) if raw else None
+
+
+# ============================================================================
+# TESTS DE PLANIFICACIÓN
+# ============================================================================
+
+class TestPlanificacion:
+    """Rejilla adaptativa sobre la extensión de Andalucía."""
+
+    def test_teselas_acotadas(self):
+        """Ninguna tesela supera el máximo y las densas se subdividen."""
+        tiles = plan_tiles(_contar, max_features=100)
+        assert all(hits <= 100 for _, hits in tiles)
+        assert len(tiles) > 16
+        # Las teselas cubren todas las features (el borde suma de más)
+        assert sum(hits for _, hits in tiles) >= len(FEATURES)
+
+    def test_descarta_vacias(self):
+        tiles = plan_tiles(lambda bbox: 0)
+        assert tiles == []
+
+    def test_conteo_fallido_no_subdivide(self):
+        tiles = plan_tiles(lambda bbox: None, grid_size=2)
+        assert len(tiles) == 4
+        assert all(hits is None for _, hits in tiles)
+
+    def test_bbox_param(self):
+        assert bbox_param((100000.0, 3980000.5, 625000, 4290000)) == "100000,3980000.5,625000,4290000,EPSG:25830"
+
+
+# ============================================================================
+# TESTS DE DESCARGA
+# ============================================================================
+
+class TestDescarga:
+    """Descarga paralela con eliminación de duplicados."""
+
+    def test_equivale_a_fuerza_bruta(self):
+        tiles = plan_tiles(_contar, max_features=100)
+        result = TileResult()
+        features = list(iter_tiled_features(
+            lambda bbox, hits: [f for f in FEATURES if _dentro(f, bbox)], tiles, result=result,
+        ))
+
+        assert sorted(f["id"] for f in features) == sorted(f["id"] for f in FEATURES)
+        assert result.duplicates >= 1
+        assert result.complete
+
+    def test_tesela_fallida_marca_incompleto(self):
+        tiles = [((0, 0, 1, 1), 1), ((1, 0, 2, 1), 1)]
+
+        def fetch(bbox, hits):
+            if bbox[0] == 1:
+                raise requests.exceptions.Timeout()
+            return [{"id": 1}]
+
+        result = TileResult()
+        errores = []
+        features = list(iter_tiled_features(fetch, tiles, result=result,
+                                            errors=(requests.exceptions.RequestException,),
+                                            on_error=lambda bbox, e: errores.append(bbox)))
+        assert features == [{"id": 1}]
+        assert not result.complete
+        assert errores == [(1, 0, 2, 1)]
+
+
+class TestDownloadDeraTeselas:
+    """download_dera.download_layer con DownloadOptions(tiled=True)."""
+
+    def _servidor(self, url, timeout):
+        bbox = _parse_bbox(url)
+        features = [f for f in FEATURES if bbox is None or _dentro(f, bbox)]
+        yield json.dumps({"type": "FeatureCollection", "features": features}).encode("utf-8")
+
+    def _hits(self, url, layer, timeout=20, bbox=None):
+        return _contar(tuple(float(v) for v in bbox.split(",")[:4])) if bbox else len(FEATURES)
+
+    def test_descarga_por_teselas(self, tmp_path):
+        with patch("download_dera.probe_hits", side_effect=self._hits), \
+             patch("download_dera.http_stream", side_effect=self._servidor) as mock_stream:
+            assert download_dera.download_layer("energy", tmp_path, download_dera.DownloadOptions(tiled=True))
+
+        data = json.loads((tmp_path / "energy.geojson").read_text(encoding="utf-8"))
+        assert sorted(f["id"] for f in data["features"]) == sorted(f["id"] for f in FEATURES)
+        # Ninguna petición sin BBOX ni con startIndex profundo
+        assert all(_parse_bbox(c.args[0]) for c in mock_stream.call_args_list)
+
+    def test_features_fuera_de_la_extension_no_publica(self, tmp_path):
+        """Si el total sin duplicados no cuadra con numberMatched, la capa no se publica."""
+        with patch("download_dera.probe_hits",
+                   side_effect=lambda url, layer, timeout=20, bbox=None:
+                   self._hits(url, layer, timeout, bbox) + (0 if bbox else 5)), \
+             patch("download_dera.http_stream", side_effect=self._servidor):
+            assert not download_dera.download_layer("energy", tmp_path, download_dera.DownloadOptions(tiled=True))
+        assert not (tmp_path / "energy.geojson").exists()
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v", "--tb=short"])
@@ -14,15 +14,16 @@ import pytest
 import requests
 from pathlib import Path
 from unittest.mock import patch, MagicMock
-from urllib.parse import urlencode
+from urllib.parse import parse_qs, urlencode, urlparse
 
 # Importar módulo a testear
 from download_dera_actions import (
     WFS_LAYERS,
     OUTPUT_DIR,
     MAX_RETRIES,
-    fetch_wfs,
-    merge_features,
+    iter_layer_features,
+    iter_wfs_stream,
+    write_category_geojson,
 )
 
 
@@ -259,45 +260,37 @@ class TestConteosMinimos:
 class TestEstructuraGeoJSON:
     """Tests de estructura del GeoJSON generado."""
     
-    def test_merge_features_genera_featurecollection(self):
-        """merge_features debe generar un FeatureCollection válido."""
-        # Mock de datos
-        mock_data = {
-            "type": "FeatureCollection",
-            "features": [
-                {
-                    "type": "Feature",
-                    "geometry": {"type": "Point", "coordinates": [500000, 4200000]},
-                    "properties": {"nombre": "Test"}
-                }
-            ]
+    FEATURES = [
+        {
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [500000, 4200000]},
+            "properties": {"nombre": "Test"}
         }
+    ]
+    
+    def _respuesta(self, url, timeout):
+        yield json.dumps({"type": "FeatureCollection", "features": self.FEATURES}).encode("utf-8")
+    
+    def test_write_category_geojson_genera_featurecollection(self, tmp_path):
+        """write_category_geojson debe generar un FeatureCollection válido."""
+        with patch('download_dera_actions.OUTPUT_DIR', tmp_path), \
+             patch('download_dera_actions.http_stream', side_effect=self._respuesta):
+            count = write_category_geojson("emergency", "emergency.geojson")
         
-        with patch('download_dera_actions.fetch_wfs', return_value=mock_data):
-            resultado = merge_features([
-                ("http://test.com", "test:layer", "Test Layer")
-            ])
-        
+        resultado = json.loads((tmp_path / "emergency.geojson").read_text(encoding="utf-8"))
+        assert count == 1
         assert resultado['type'] == 'FeatureCollection'
         assert 'features' in resultado
         assert 'crs' in resultado
         assert resultado['crs']['properties']['name'] == 'EPSG:25830'
     
-    def test_merge_features_anade_source_a_properties(self):
-        """merge_features debe añadir _source a cada feature."""
-        mock_data = {
-            "type": "FeatureCollection",
-            "features": [
-                {"type": "Feature", "properties": {"nombre": "Test"}}
-            ]
-        }
+    def test_iter_layer_features_anade_source_a_properties(self):
+        """iter_layer_features debe añadir _source a cada feature."""
+        with patch.dict(WFS_LAYERS, {"prueba": [("http://test.com", "test:layer", "Mi Descripción")]}), \
+             patch('download_dera_actions.http_stream', side_effect=self._respuesta):
+            resultado = list(iter_layer_features("prueba"))
         
-        with patch('download_dera_actions.fetch_wfs', return_value=mock_data):
-            resultado = merge_features([
-                ("http://test.com", "test:layer", "Mi Descripción")
-            ])
-        
-        assert resultado['features'][0]['properties']['_source'] == 'Mi Descripción'
+        assert resultado[0]['properties']['_source'] == 'Mi Descripción'
 
 
 # ============================================================================
@@ -307,45 +300,251 @@ class TestEstructuraGeoJSON:
 class TestManejoErrores:
     """Tests de manejo de errores y reintentos."""
     
-    def test_fetch_wfs_reintenta_en_timeout(self):
-        """fetch_wfs debe reintentar cuando hay timeout."""
-        with patch('download_dera_actions.requests.get') as mock_get:
-            mock_get.side_effect = requests.exceptions.Timeout()
-            
-            resultado = fetch_wfs("http://test.com", "test:layer")
-            
-            # Debe haber intentado MAX_RETRIES veces
-            assert mock_get.call_count == MAX_RETRIES
-            # Debe retornar FeatureCollection vacío
-            assert resultado == {"type": "FeatureCollection", "features": []}
-    
-    def test_fetch_wfs_reintenta_en_error_http(self):
-        """fetch_wfs debe reintentar cuando hay error HTTP."""
-        with patch('download_dera_actions.requests.get') as mock_get:
-            # Crear mock de respuesta con status_code
-            mock_response = MagicMock()
-            mock_response.status_code = 500
-            error = requests.exceptions.HTTPError()
-            error.response = mock_response
-            mock_response.raise_for_status.side_effect = error
-            mock_get.return_value = mock_response
-            
-            resultado = fetch_wfs("http://test.com", "test:layer")
-            
-            assert mock_get.call_count == MAX_RETRIES
-            assert resultado['features'] == []
-    
-    def test_fetch_wfs_maneja_json_invalido(self):
-        """fetch_wfs debe manejar respuestas JSON inválidas."""
-        with patch('download_dera_actions.requests.get') as mock_get:
-            mock_response = MagicMock()
-            mock_response.raise_for_status.return_value = None
-            mock_response.json.side_effect = json.JSONDecodeError("test", "doc", 0)
-            mock_get.return_value = mock_response
-            
-            resultado = fetch_wfs("http://test.com", "test:layer")
-            
-            assert resultado['features'] == []
+    def _descargar(self, side_effect):
+        with patch('download_dera_actions.http_stream', side_effect=side_effect) as mock_stream, \
+             patch('download_dera_actions.time.sleep'):
+            with pytest.raises((requests.exceptions.RequestException, ValueError)):
+                list(iter_wfs_stream("http://test.com", "test:layer"))
+        return mock_stream
+    
+    def test_iter_wfs_stream_reintenta_en_timeout(self):
+        """iter_wfs_stream debe reintentar cuando hay timeout."""
+        mock_stream = self._descargar(requests.exceptions.Timeout())
+        
+        # Debe haber intentado MAX_RETRIES veces antes de propagar el error
+        assert mock_stream.call_count == MAX_RETRIES
+    
+    def test_iter_wfs_stream_reintenta_en_error_http(self):
+        """iter_wfs_stream debe reintentar cuando hay error HTTP."""
+        mock_response = MagicMock()
+        mock_response.status_code = 500
+        mock_response.headers = {}
+        error = requests.exceptions.HTTPError(response=mock_response)
+        
+        mock_stream = self._descargar(error)
+        
+        assert mock_stream.call_count == MAX_RETRIES
+    
+    def test_iter_wfs_stream_maneja_json_invalido(self):
+        """iter_wfs_stream debe reintentar y fallar con respuestas JSON inválidas."""
+        mock_stream = self._descargar(lambda url, timeout: iter([b"<html>no es json</html>"]))
+        
+        assert mock_stream.call_count == MAX_RETRIES
+    
+    def test_write_category_geojson_retorna_cero_si_falla(self, tmp_path):
+        """Si la descarga falla, write_category_geojson retorna 0 sin crear el archivo."""
+        with patch('download_dera_actions.OUTPUT_DIR', tmp_path), \
+             patch('download_dera_actions.http_stream', side_effect=requests.exceptions.Timeout()), \
+             patch('download_dera_actions.time.sleep'):
+            assert write_category_geojson("emergency", "emergency.geojson") == 0
+        
+        assert not (tmp_path / "emergency.geojson").exists()
+
+
+class TestStreaming:
+    """Tests de la descarga en streaming de download_dera_actions."""
+    
+    FEATURES = [{"type": "Feature", "properties": {"nombre": f"Centro {i}"}} for i in range(3)]
+    
+    def _respuesta(self, corte=None):
+        body = json.dumps({"type": "FeatureCollection", "features": self.FEATURES}).encode("utf-8")
+        if corte is not None:
+            yield body[:corte]
+            raise requests.exceptions.ConnectionError("conexión cortada")
+        yield body
+    
+    def test_iter_layer_features_etiqueta_source(self):
+        """Cada feature debe llevar la descripción de su capa de origen."""
+        import download_dera_actions
+        with patch('download_dera_actions.http_stream', side_effect=lambda url, timeout: self._respuesta()):
+            features = list(download_dera_actions.iter_layer_features("emergency"))
+        
+        assert len(features) == 3
+        assert all(f["properties"]["_source"] == "Centros Emergencias" for f in features)
+    
+    def test_reintenta_si_falla_antes_de_la_primera_feature(self):
+        """Un fallo al conectar antes de la primera feature se reintenta."""
+        import download_dera_actions
+        respuestas = iter([self._respuesta(corte=0), self._respuesta()])
+        with patch('download_dera_actions.http_stream', side_effect=lambda url, timeout: next(respuestas)), \
+             patch('download_dera_actions.time.sleep'):
+            features = list(download_dera_actions.iter_wfs_stream("http://test.com", "test:layer"))
+        
+        assert len(features) == 3
+    
+    def test_corte_a_mitad_conserva_archivo_anterior(self, tmp_path):
+        """Si la respuesta se corta tras entregar features, no se publica un archivo truncado."""
+        import download_dera_actions
+        anterior = tmp_path / "emergency.geojson"
+        anterior.write_text("anterior", encoding="utf-8")
+        
+        with patch('download_dera_actions.OUTPUT_DIR', tmp_path), \
+             patch('download_dera_actions.http_stream',
+                   side_effect=lambda url, timeout: self._respuesta(corte=120)):
+            count = download_dera_actions.write_category_geojson("emergency", "emergency.geojson")
+        
+        assert count == 0
+        assert anterior.read_text(encoding="utf-8") == "anterior"
+    
+    def test_conteo_distinto_de_number_matched_conserva_archivo(self, tmp_path):
+        """Una respuesta con menos features que numberMatched no se publica."""
+        import download_dera_actions
+        anterior = tmp_path / "emergency.geojson"
+        anterior.write_text("anterior", encoding="utf-8")
+        body = json.dumps({"type": "FeatureCollection", "features": self.FEATURES,
+                           "numberMatched": 10}).encode("utf-8")
+        
+        with patch('download_dera_actions.OUTPUT_DIR', tmp_path), \
+             patch('download_dera_actions.http_stream', side_effect=lambda url, timeout: iter([body])):
+            count = download_dera_actions.write_category_geojson("emergency", "emergency.geojson")
+        
+        assert count == 0
+        assert anterior.read_text(encoding="utf-8") == "anterior"
+
+
+class TestAgrupacion:
+    """Tests de la petición agrupada (varios typeNames) de download_dera_actions."""
+    
+    def _servidor(self, url, timeout, admite_agrupadas=True):
+        tipos = parse_qs(urlparse(url).query)["TYPENAME"][0].split(",")
+        if len(tipos) > 1 and not admite_agrupadas:
+            error = requests.exceptions.HTTPError("400 Bad Request")
+            error.response = MagicMock(headers={})
+            raise error
+        features = [
+            {"type": "Feature", "id": f"{tipo.split(':')[-1]}.{i}", "properties": {}}
+            for tipo in tipos for i in range(2)
+        ]
+        yield json.dumps({"type": "FeatureCollection", "features": features,
+                          "numberMatched": len(features)}).encode("utf-8")
+    
+    def test_una_peticion_por_endpoint(self):
+        """Las dos capas de health van en una petición y se etiquetan por su id."""
+        import download_dera_actions
+        with patch('download_dera_actions.http_stream', side_effect=self._servidor) as mock_stream:
+            features = list(download_dera_actions.iter_layer_features("health"))
+        
+        assert mock_stream.call_count == 1
+        assert [f["properties"]["_source"] for f in features] == ["CAP", "CAP", "Hospitales", "Hospitales"]
+    
+    def test_sin_soporte_descarga_capa_a_capa(self):
+        """Si el servidor rechaza la petición agrupada, se cae a una petición por capa."""
+        import download_dera_actions
+        with patch('download_dera_actions.http_stream',
+                   side_effect=lambda url, timeout: self._servidor(url, timeout, admite_agrupadas=False)) as mock_stream:
+            features = list(download_dera_actions.iter_layer_features("security"))
+        
+        assert mock_stream.call_count == 4
+        assert [f["properties"]["_source"] for f in features] == \
+            ["Policía"] * 2 + ["Bomberos"] * 2 + ["Guardia Civil"] * 2
+    
+    def test_download_dera_coalesce(self, tmp_path):
+        """download_dera --coalesce une las fuentes de la capa en un typeName."""
+        import download_dera
+        
+        def servidor(url, timeout):
+            tipos = parse_qs(urlparse(url).query)["typeName"][0].split(",")
+            features = [{"type": "Feature", "id": f"{t}.0", "properties": {}} for t in tipos]
+            yield json.dumps({"type": "FeatureCollection", "features": features,
+                              "numberMatched": len(features)}).encode("utf-8")
+        
+        with patch('download_dera.http_stream', side_effect=servidor) as mock_stream:
+            assert download_dera.download_layer("security", tmp_path, download_dera.DownloadOptions(coalesce=True))
+        
+        assert mock_stream.call_count == 1
+        data = json.loads((tmp_path / "security.geojson").read_text(encoding="utf-8"))
+        assert data["metadata"]["featuresCount"] == 4
+
+
+# ============================================================================
+# TESTS DE PAGINACIÓN (download_dera.py)
+# ============================================================================
+
+class TestPaginacion:
+    """Tests de paginación secuencial y paralela de fetch_wfs_features."""
+    
+    TOTAL = 35
+    BATCH = 10
+    
+    def _pagina(self, url, timeout, fallo=None):
+        """Simula el servidor WFS en streaming: páginas de BATCH features con id secuencial."""
+        start_index = int(parse_qs(urlparse(url).query)["startIndex"][0])
+        if start_index == fallo:
+            raise requests.exceptions.Timeout()
+        ids = range(start_index, min(start_index + self.BATCH, self.TOTAL))
+        body = json.dumps({
+            "type": "FeatureCollection",
+            "features": [{"type": "Feature", "id": i, "properties": {}} for i in ids],
+            "numberMatched": self.TOTAL,
+        }).encode("utf-8")
+        # Bloques pequeños para ejercitar el parser incremental
+        for i in range(0, len(body), 64):
+            yield body[i:i + 64]
+    
+    @pytest.mark.parametrize("page_concurrency", [1, 4])
+    def test_descarga_todas_las_paginas_en_orden(self, page_concurrency):
+        """Secuencial y paralelo deben devolver las mismas features en orden."""
+        import download_dera
+        options = download_dera.DownloadOptions(batch_size=self.BATCH, page_concurrency=page_concurrency)
+        with patch('download_dera.time.sleep'), \
+             patch('download_dera.http_stream', side_effect=self._pagina) as mock_page:
+            resultado = download_dera.fetch_wfs_features("http://test.com", "test:layer", "Test", options=options)
+        
+        assert [f["id"] for f in resultado["features"]] == list(range(self.TOTAL))
+        assert mock_page.call_count == 4
+    
+    def test_paralelo_no_duerme_entre_paginas(self):
+        """El modo paralelo no debe aplicar el sleep fijo entre páginas."""
+        import download_dera
+        options = download_dera.DownloadOptions(batch_size=self.BATCH, page_concurrency=4)
+        with patch('download_dera.time.sleep') as mock_sleep, \
+             patch('download_dera.http_stream', side_effect=self._pagina):
+            download_dera.fetch_wfs_features("http://test.com", "test:layer", "Test", options=options)
+        
+        mock_sleep.assert_not_called()
+    
+    def test_paralelo_avisa_si_conteo_no_coincide(self, capsys):
+        """Si falla una página, el conteo final no coincide con numberMatched."""
+        import download_dera
+        
+        def pagina_con_fallo(url, timeout):
+            return self._pagina(url, timeout, fallo=20)
+        
+        options = download_dera.DownloadOptions(batch_size=self.BATCH, page_concurrency=4)
+        with patch('download_dera.http_stream', side_effect=pagina_con_fallo):
+            resultado = download_dera.fetch_wfs_features("http://test.com", "test:layer", "Test", options=options)
+        
+        assert len(resultado["features"]) == 25
+        assert "Conteo incompleto: 25/35" in capsys.readouterr().out
+    
+    def test_download_layer_escribe_todas_las_paginas(self, tmp_path):
+        """download_layer debe volcar cada página al GeoJSON y contar el total."""
+        import download_dera
+        options = download_dera.DownloadOptions(batch_size=self.BATCH)
+        with patch('download_dera.time.sleep'), \
+             patch('download_dera.http_stream', side_effect=self._pagina):
+            assert download_dera.download_layer("energy", tmp_path, options)
+        
+        data = json.loads((tmp_path / "energy.geojson").read_text(encoding="utf-8"))
+        assert [f["id"] for f in data["features"]] == list(range(self.TOTAL))
+        assert data["metadata"]["featuresCount"] == self.TOTAL
+    
+    def test_iter_layer_features_genera_antes_de_terminar_la_pagina(self):
+        """La primera feature debe estar disponible antes de leer toda la respuesta."""
+        import download_dera
+        leidos = []
+        
+        def pagina_observada(url, timeout):
+            for chunk in self._pagina(url, timeout):
+                leidos.append(chunk)
+                yield chunk
+        
+        options = download_dera.DownloadOptions(batch_size=self.BATCH)
+        with patch('download_dera.http_stream', side_effect=pagina_observada):
+            features = download_dera.iter_layer_features("energy", options=options)
+            assert next(features)["id"] == 0
+            total_bloques = len(list(self._pagina("http://t?startIndex=0", 1)))
+            assert len(leidos) < total_bloques
 
 
 # ============================================================================
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+test_geojson_io.py
+
+Tests de escritura y lectura incremental de GeoJSON (geojson_io.py).
+Ejecutar con: pytest test_geojson_io.py -v
+
+@version 1.0.0
+@date 2025-12-08
+"""
+
+import json
+from pathlib import Path
+
+import pytest
+from unittest.mock import patch
+
+import download_dera
+import download_dera_actions
+from dera_columnar import read_columnar
+from dera_shards import manifest_path
+from geojson_io import (
+    FeatureCollectionWriter, FeatureSequenceWriter, FeatureStream, atomic_writer, feature_filename,
+    feature_writer, read_feature_file, sidecar_path, write_feature_collection,
+)
+from wfs_http import INITIAL_RATE, MAX_RATE, RATE_LIMITER, configure_session
+from wfs_standin import WFSStandin
+
+DATA_DIR = Path(__file__).parent.parent.parent / "public" / "data" / "dera"
+
+FEATURES = [
+    {
+        "type": "Feature",
+        "id": f"g12_01_CentroSalud.{i}",
+        "geometry": {"type": "MultiPoint", "coordinates": [[190372.28344586 + i, 4172207.46443277]]},
+        "properties": {"nombre": "Centro Málaga", "cod_mun": "29067", "_source": "CAP"},
+    }
+    for i in range(5)
+]
+
+
+# ============================================================================
+# TESTS DE FORMATO
+# ============================================================================
+
+class TestFormato:
+    """La salida incremental debe ser idéntica a json.dump."""
+
+    def test_identico_a_json_dump_indentado(self, tmp_path):
+        """indent=2 reproduce el formato de download_dera.py."""
+        metadata = {"layer": "health", "featuresCount": 5, "sources": ["a", "b"]}
+        path = tmp_path / "health.geojson"
+
+        with FeatureCollectionWriter(path, indent=2) as writer:
+            writer.write_features(FEATURES[:2])
+            writer.write_features(FEATURES[2:])
+            writer.finish(metadata=metadata)
+
+        esperado = json.dumps(
+            {"type": "FeatureCollection", "features": FEATURES, "metadata": metadata},
+            ensure_ascii=False, indent=2,
+        )
+        assert path.read_text(encoding="utf-8") == esperado
+
+    def test_identico_a_json_dump_compacto(self, tmp_path):
+        """Sin indent reproduce el formato de download_dera_actions.py."""
+        data = {"type": "FeatureCollection", "features": FEATURES, "crs": {"type": "name"}}
+        path = tmp_path / "health.geojson"
+
+        assert write_feature_collection(path, data) == 5
+        assert path.read_text(encoding="utf-8") == json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+    @pytest.mark.parametrize("indent", [None, 2])
+    def test_coleccion_vacia(self, tmp_path, indent):
+        """Una colección sin features debe seguir siendo JSON válido."""
+        path = tmp_path / "vacio.geojson"
+        with FeatureCollectionWriter(path, indent=indent) as writer:
+            writer.finish(metadata={"featuresCount": 0})
+
+        kwargs = {"indent": indent} if indent else {"separators": (",", ":")}
+        esperado = json.dumps({"type": "FeatureCollection", "features": [], "metadata": {"featuresCount": 0}},
+                              ensure_ascii=False, **kwargs)
+        assert path.read_text(encoding="utf-8") == esperado
+
+    def test_reescribe_archivo_real_sin_cambios(self, tmp_path):
+        """Reescribir un GeoJSON publicado debe producir los mismos bytes."""
+        original = DATA_DIR / "energy.geojson"
+        if not original.exists():
+            pytest.skip("energy.geojson no disponible")
+
+        data = json.loads(original.read_text(encoding="utf-8"))
+        path = tmp_path / "energy.geojson"
+        write_feature_collection(path, data)
+        assert path.read_bytes() == original.read_bytes()
+
+
+# ============================================================================
+# TESTS DE ATOMICIDAD
+# ============================================================================
+
+class TestAtomicidad:
+    """El destino solo se reemplaza cuando la escritura termina bien."""
+
+    def test_error_conserva_archivo_anterior(self, tmp_path):
+        """Una excepción a mitad de descarga no debe tocar el archivo existente."""
+        path = tmp_path / "health.geojson"
+        path.write_text("anterior", encoding="utf-8")
+
+        with pytest.raises(RuntimeError):
+            with FeatureCollectionWriter(path) as writer:
+                writer.write_features(FEATURES)
+                raise RuntimeError("timeout a mitad de capa")
+
+        assert path.read_text(encoding="utf-8") == "anterior"
+        assert list(tmp_path.iterdir()) == [path]
+
+    def test_destino_no_existe_hasta_finish(self, tmp_path):
+        """Mientras se escribe, solo existe el temporal."""
+        path = tmp_path / "health.geojson"
+        with FeatureCollectionWriter(path) as writer:
+            writer.write_features(FEATURES)
+            assert not path.exists()
+        assert json.loads(path.read_text(encoding="utf-8"))["features"] == FEATURES
+        assert list(tmp_path.iterdir()) == [path]
+
+    @pytest.mark.parametrize("mode, data", [("w", "métricas"), ("wb", b"\x00\x01")])
+    def test_atomic_writer(self, tmp_path, mode, data):
+        path = tmp_path / "sub" / "dera.prom"
+        with atomic_writer(path, mode) as f:
+            f.write(data)
+            assert not path.exists()
+        assert (path.read_bytes() if "b" in mode else path.read_text(encoding="utf-8")) == data
+
+        with pytest.raises(RuntimeError):
+            with atomic_writer(path, mode) as f:
+                f.write(data * 2)
+                raise RuntimeError("corte")
+        assert list(path.parent.iterdir()) == [path]
+
+    def test_atomic_writer_temporales_distintos(self, tmp_path):
+        """Dos escrituras simultáneas del mismo destino no comparten temporal."""
+        path = tmp_path / "dera.prom"
+        with atomic_writer(path) as a, atomic_writer(path) as b:
+            a.write("a")
+            b.write("b")
+            assert a.name != b.name
+        assert path.read_text(encoding="utf-8") == "a"
+        assert list(tmp_path.iterdir()) == [path]
+
+
+# ============================================================================
+# TESTS DE LECTURA INCREMENTAL
+# ============================================================================
+
+def _bloques(data: bytes, size: int):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+class TestLecturaIncremental:
+    """FeatureStream debe equivaler a json.loads troceando la entrada."""
+
+    DOC = {
+        "type": "FeatureCollection",
+        "features": FEATURES,
+        "totalFeatures": 12345,
+        "numberMatched": 5,
+        "crs": {"type": "name", "properties": {"name": "EPSG:25830"}},
+    }
+
+    @pytest.mark.parametrize("size", [1, 2, 7, 64, 1 << 20])
+    @pytest.mark.parametrize("indent", [None, 2])
+    def test_equivale_a_json_loads(self, size, indent):
+        """Cualquier troceado (incluido a mitad de carácter UTF-8) da el mismo resultado."""
+        data = json.dumps(self.DOC, ensure_ascii=False, indent=indent).encode("utf-8")
+        stream = FeatureStream(_bloques(data, size))
+
+        assert list(stream) == FEATURES
+        assert stream.members == {k: v for k, v in self.DOC.items() if k != "features"}
+
+    def test_numero_cortado_entre_bloques(self):
+        """Un número partido entre dos bloques no debe leerse truncado."""
+        stream = FeatureStream([b'{"features":[],"numberMatched":12', b'34}'])
+        list(stream)
+        assert stream.members["numberMatched"] == 1234
+
+    def test_genera_antes_del_final(self):
+        """La primera feature debe salir sin haber leído todos los bloques."""
+        data = json.dumps(self.DOC).encode("utf-8")
+        bloques = _bloques(data, 32)
+        consumidos = []
+
+        def origen():
+            for b in bloques:
+                consumidos.append(b)
+                yield b
+
+        assert next(iter(FeatureStream(origen()))) == FEATURES[0]
+        assert len(consumidos) < len(bloques)
+
+    def test_json_truncado_lanza_error(self):
+        """Una respuesta cortada debe detectarse como error, no como fin normal."""
+        data = json.dumps(self.DOC).encode("utf-8")
+        with pytest.raises(json.JSONDecodeError):
+            list(FeatureStream([data[:len(data) // 2]]))
+
+    def test_lee_archivo_real(self):
+        """Un GeoJSON publicado debe leerse igual que con json.load."""
+        original = DATA_DIR / "health.geojson"
+        if not original.exists():
+            pytest.skip("health.geojson no disponible")
+
+        data = original.read_bytes()
+        assert list(FeatureStream(_bloques(data, 65536))) == json.loads(data)["features"]
+
+
+
+# ============================================================================
+# TESTS DE GEOJSONSEQ
+# ============================================================================
+
+class TestGeoJSONSeq:
+    """Una feature por línea con sidecar de metadatos."""
+
+    def test_una_feature_por_linea_y_sidecar(self, tmp_path):
+        path = tmp_path / feature_filename("health", "geojsonseq")
+        assert path.name == "health.geojsonl"
+        with FeatureSequenceWriter(path) as writer:
+            writer.write_features(FEATURES)
+            writer.finish(crs={"type": "name"})
+
+        lines = path.read_text(encoding="utf-8").splitlines()
+        assert [json.loads(line) for line in lines] == FEATURES
+        assert "Málaga" in lines[0]
+        sidecar = json.loads(sidecar_path(path).read_text(encoding="utf-8"))
+        assert sidecar_path(path).name == "health.meta.json"
+        assert sidecar == {"type": "FeatureCollection", "features": "health.geojsonl",
+                           "featuresCount": 5, "crs": {"type": "name"}}
+
+    def test_error_conserva_anteriores(self, tmp_path):
+        path = tmp_path / "health.geojsonl"
+        write_feature_collection(path, {"features": FEATURES[:1]})
+        with pytest.raises(RuntimeError):
+            with feature_writer(path) as writer:
+                writer.write_features(FEATURES)
+                raise RuntimeError("corte")
+        assert list(read_feature_file(path)) == FEATURES[:1]
+        assert json.loads(sidecar_path(path).read_text(encoding="utf-8"))["featuresCount"] == 1
+        assert [p.name for p in tmp_path.iterdir() if p.suffix == ".tmp"] == []
+
+    def test_lectura_de_ambos_formatos(self, tmp_path):
+        write_feature_collection(tmp_path / "a.geojson", {"features": FEATURES}, indent=2)
+        (tmp_path / "b.geojsonl").write_text(
+            "".join("\x1e" + json.dumps(f) + "\n\n" for f in FEATURES), encoding="utf-8")
+        assert list(read_feature_file(tmp_path / "a.geojson")) == FEATURES
+        assert list(read_feature_file(tmp_path / "b.geojsonl")) == FEATURES
+
+    def test_formato_desconocido(self):
+        with pytest.raises(ValueError):
+            feature_filename("health", "csv")
+
+
+class TestSalidaGeoJSONSeq:
+    """--format geojsonseq en los dos scripts, derivados incluidos."""
+
+    @pytest.fixture
+    def standin(self):
+        configure_session()
+        RATE_LIMITER.configure(initial_rate=1000, max_rate=1000)
+        with WFSStandin(features=1200) as server:
+            yield server
+        RATE_LIMITER.configure(initial_rate=INITIAL_RATE, max_rate=MAX_RATE)
+        configure_session()
+
+    def test_process_category(self, standin, tmp_path):
+        sources = {"bench": [(standin.url, "bench:capa", "CAP")]}
+        with patch.object(download_dera_actions, "OUTPUT_DIR", tmp_path), \
+                patch.dict(download_dera_actions.WFS_LAYERS, sources):
+            count = download_dera_actions.process_category("bench", columnar=True, shards=True,
+                                                           output_format="geojsonseq")
+        assert count == 1200
+        features = list(read_feature_file(tmp_path / "bench.geojsonl"))
+        assert len(features) == 1200 and features[0]["properties"]["_source"] == "CAP"
+        sidecar = json.loads((tmp_path / "bench.meta.json").read_text(encoding="utf-8"))
+        assert sidecar["featuresCount"] == 1200 and sidecar["crs"] == download_dera_actions.CRS
+        assert not (tmp_path / "bench.geojson").exists()
+        assert read_columnar(tmp_path / "bench.columnar.bin")["count"] == 1200
+        manifest = json.loads(manifest_path(tmp_path, "bench").read_text(encoding="utf-8"))
+        assert manifest["count"] == 1200 and manifest["source"] == "bench.geojsonl"
+
+    def test_download_layer(self, standin, tmp_path):
+        config = {"bench": {"name": "Bench", "urls": [
+            {"url": standin.url, "layer": "bench:capa", "description": "Bench"}]}}
+        options = download_dera.DownloadOptions(batch_size=500, output_format="geojsonseq")
+        with patch.dict(download_dera.WFS_CONFIG, config):
+            assert download_dera.download_layer("bench", tmp_path, options)
+        assert len(list(read_feature_file(tmp_path / "bench.geojsonl"))) == 1200
+        sidecar = json.loads((tmp_path / "bench.meta.json").read_text(encoding="utf-8"))
+        assert sidecar["metadata"]["featuresCount"] == sidecar["featuresCount"] == 1200
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v", "--tb=short"])
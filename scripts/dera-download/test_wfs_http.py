@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+test_wfs_http.py
+
+Tests de la capa HTTP compartida (wfs_http.py) contra un servidor local.
+Ejecutar con: pytest test_wfs_http.py -v
+
+@version 1.0.0
+@date 2025-12-08
+"""
+
+import gzip
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import wfs_http
+from wfs_http import (
+    AdaptiveRateLimiter, HostLimiter, backoff_delay, configure_session, get_stats,
+    http_get, http_stream, retry_after_seconds,
+)
+
+
+# ============================================================================
+# SERVIDOR LOCAL
+# ============================================================================
+
+PAYLOAD = json.dumps({
+    "type": "FeatureCollection",
+    "features": [{"type": "Feature", "properties": {"nombre": "Centro %d" % i}} for i in range(200)],
+}).encode("utf-8")
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def do_GET(self):
+        body = PAYLOAD
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    configure_session()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}/wfs"
+    httpd.shutdown()
+    httpd.server_close()
+    configure_session()
+
+
+# ============================================================================
+# TESTS DE SESIÓN
+# ============================================================================
+
+class TestSesion:
+    """Tests del pool keep-alive y la compresión."""
+
+    def test_reutiliza_conexiones(self, server):
+        """Peticiones secuenciales al mismo host deben reutilizar la conexión."""
+        for _ in range(5):
+            assert http_get(server, timeout=5).json()["type"] == "FeatureCollection"
+
+        stats = get_stats()
+        assert stats["requests"] == 5
+        assert stats["connectionsOpened"] == 1
+        assert stats["connectionsReused"] == 4
+
+    def test_negocia_gzip(self, server):
+        """Con Accept-Encoding gzip se transfieren menos bytes de los que se decodifican."""
+        http_get(server, timeout=5)
+        stats = get_stats()
+        assert stats["bytesDecoded"] == len(PAYLOAD)
+        assert stats["bytesWire"] < stats["bytesDecoded"]
+
+    def test_http_stream_por_bloques(self, server):
+        """http_stream debe entregar el cuerpo descomprimido y contarlo al terminar."""
+        chunks = list(http_stream(server, timeout=5, chunk_size=1024))
+        assert len(chunks) > 1
+        assert b"".join(chunks) == PAYLOAD
+        stats = get_stats()
+        assert stats["requests"] == 1
+        assert stats["bytesDecoded"] == len(PAYLOAD)
+
+    def test_sin_keep_alive_abre_conexion_por_peticion(self, server):
+        """keep_alive=False debe cerrar la conexión tras cada respuesta."""
+        configure_session(keep_alive=False)
+        for _ in range(3):
+            http_get(server, timeout=5)
+        assert get_stats()["connectionsOpened"] == 3
+
+    def test_adaptador_por_host(self):
+        """Los prefijos de HOST_POOLS deben tener su propio adaptador."""
+        session = wfs_http.build_session(host_pools={"https://www.ideandalucia.es/": 3})
+        adapter = session.get_adapter("https://www.ideandalucia.es/services/x")
+        assert adapter is not session.get_adapter("https://otro.example/")
+        assert adapter._pool_maxsize == 3
+
+
+# ============================================================================
+# TESTS DE LÍMITE POR HOST
+# ============================================================================
+
+class TestLimitePorHost:
+    """Tests del limitador de peticiones simultáneas por host."""
+
+    def test_host_limiter_respeta_maximo(self):
+        """No debe haber más de max_per_host peticiones simultáneas al mismo host."""
+        limiter = HostLimiter(max_per_host=2)
+        active = []
+        peak = []
+        lock = threading.Lock()
+
+        def worker(key):
+            with limiter.slot("https://www.ideandalucia.es/services/x"):
+                with lock:
+                    active.append(key)
+                    peak.append(len(active))
+                time.sleep(0.05)
+                with lock:
+                    active.remove(key)
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(6)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert max(peak) == 2
+
+    def test_host_limiter_hosts_independientes(self):
+        """El límite se aplica por host, no globalmente."""
+        limiter = HostLimiter(max_per_host=1)
+        with limiter.slot("https://a.example/wfs"):
+            acquired = threading.Event()
+
+            def other():
+                with limiter.slot("https://b.example/wfs"):
+                    acquired.set()
+
+            t = threading.Thread(target=other)
+            t.start()
+            t.join(timeout=1)
+            assert acquired.is_set()
+
+    def test_http_stream_ocupa_el_host_hasta_cerrar(self, server):
+        """El hueco del host se libera al cerrar el cuerpo, no al recibir las cabeceras."""
+        wfs_http.HOST_LIMITER.configure(1)
+        try:
+            chunks = http_stream(server, timeout=5, chunk_size=1024)
+            next(chunks)
+            host = wfs_http.HOST_LIMITER._semaphore(server.split("/")[2])
+            assert not host.acquire(blocking=False)
+            chunks.close()
+            assert host.acquire(blocking=False)
+            host.release()
+        finally:
+            wfs_http.HOST_LIMITER.configure(wfs_http.MAX_PER_HOST)
+
+
+# ============================================================================
+# TESTS DE RITMO ADAPTATIVO
+# ============================================================================
+
+class _Reloj:
+    """Reloj simulado: sleep avanza el tiempo sin esperar."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.dormido = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.dormido.append(seconds)
+        self.now += seconds
+
+
+URL = "https://www.ideandalucia.es/services/DERA_g12_servicios/wfs"
+
+
+class TestRitmoAdaptativo:
+    """Tests del token bucket AIMD y del backoff."""
+
+    def _limiter(self, **kwargs):
+        reloj = _Reloj()
+        return AdaptiveRateLimiter(clock=reloj, sleep=reloj.sleep, **kwargs), reloj
+
+    def test_respeta_la_tasa(self):
+        """A 2 peticiones/s, 5 peticiones seguidas necesitan unos 2 segundos."""
+        limiter, reloj = self._limiter(initial_rate=2.0, max_rate=2.0)
+        for _ in range(5):
+            limiter.acquire(URL)
+        assert reloj.now == pytest.approx(2.0)
+
+    def test_acelera_con_latencia_baja(self):
+        limiter, _ = self._limiter(initial_rate=1.0)
+        for _ in range(4):
+            limiter.observe(URL, 0.1, 200)
+        assert limiter.rate(URL) == pytest.approx(3.0)
+
+    def test_frena_ante_429(self):
+        limiter, _ = self._limiter(initial_rate=8.0)
+        limiter.observe(URL, 0.1, 429)
+        assert limiter.rate(URL) == pytest.approx(4.0)
+
+    def test_frena_si_sube_la_latencia(self):
+        limiter, reloj = self._limiter(initial_rate=8.0, max_rate=8.0)
+        for _ in range(5):
+            limiter.observe(URL, 0.2, 200)
+        reloj.now += 1
+        limiter.observe(URL, 1.0, 200)
+        assert limiter.rate(URL) == pytest.approx(4.0)
+
+    def test_una_reduccion_por_congestion(self):
+        """Varias respuestas lentas simultáneas cuentan como una sola señal."""
+        limiter, _ = self._limiter(initial_rate=8.0)
+        limiter.observe(URL, 0.5, 200)
+        limiter.observe(URL, 0.5, 503)
+        limiter.observe(URL, 0.5, 503)
+        assert limiter.rate(URL) == pytest.approx(8.5 * 0.5)
+
+    def test_retry_after_bloquea_el_host(self):
+        limiter, reloj = self._limiter(initial_rate=10.0)
+        limiter.observe(URL, 0.1, 503, retry_after=30)
+        limiter.acquire(URL)
+        assert reloj.now >= 30
+        # Otro host no se ve afectado
+        assert limiter.acquire("https://otro.example/wfs") == 0
+
+    def test_backoff_exponencial_con_jitter(self):
+        for attempt in range(1, 6):
+            delays = [backoff_delay(attempt, base=1.0, cap=8.0) for _ in range(50)]
+            assert all(0 <= d <= min(8.0, 2 ** (attempt - 1)) for d in delays)
+        assert len(set(delays)) > 1
+        assert backoff_delay(1, base=1.0, retry_after=20) == 20
+
+    def test_retry_after_segundos_y_fecha(self):
+        class Respuesta:
+            def __init__(self, value):
+                self.headers = {"Retry-After": value}
+
+        assert retry_after_seconds(Respuesta("120")) == 120
+        assert retry_after_seconds(Respuesta("Wed, 21 Oct 2015 07:28:00 GMT")) == 0
+        assert retry_after_seconds(Respuesta("mañana")) is None
+        assert retry_after_seconds(None) is None
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v", "--tb=short"])
@@ -10,6 +10,8 @@
  * 
  * ENTRADA:
  *   public/data/dera/*.geojson (archivos originales DERA)
+ *   public/data/dera/*.geojsonl (--format geojsonseq: una feature por línea,
+ *   leídas en streaming). Si una capa tiene ambos, se usa el más reciente.
  * 
  * SALIDA:
  *   public/data/dera-dexie/*.json (formato DERAFeature[])
@@ -21,6 +23,7 @@
 
 const fs = require('fs');
 const path = require('path');
+const readline = require('readline');
 
 // ============================================================================
 // CONFIGURACIÓN
@@ -99,11 +102,48 @@ function transformFeature(feature, tipologia, index) {
   };
 }
 
+const INPUT_PATTERN = /\.geojsonl?$/;
+
+/**
+ * Genera los features de un .geojson o, línea a línea, de un .geojsonl
+ */
+async function* readFeatures(inputPath) {
+  if (inputPath.endsWith('.geojsonl')) {
+    const lines = readline.createInterface({
+      input: fs.createReadStream(inputPath, 'utf8'),
+      crlfDelay: Infinity
+    });
+    for await (const line of lines) {
+      const text = line.replace(/^\x1e/, '').trim();
+      if (text) yield JSON.parse(text);
+    }
+    return;
+  }
+  const data = JSON.parse(fs.readFileSync(inputPath, 'utf8'));
+  yield* (data.features || []);
+}
+
 /**
- * Procesa un archivo GeoJSON y genera DERAFeature[]
+ * Un archivo por capa: con .geojson y .geojsonl a la vez, el más reciente
  */
-function processFile(filename) {
-  const baseName = path.basename(filename, '.geojson');
+function listInputFiles() {
+  const byLayer = new Map();
+  fs.readdirSync(INPUT_DIR).filter(f => INPUT_PATTERN.test(f)).forEach(file => {
+    const baseName = file.replace(INPUT_PATTERN, '');
+    const mtime = fs.statSync(path.join(INPUT_DIR, file)).mtimeMs;
+    const current = byLayer.get(baseName);
+    if (!current || mtime > current.mtime) {
+      byLayer.set(baseName, { file, mtime });
+    }
+  });
+  return [...byLayer.values()].map(entry => entry.file).sort();
+}
+
+/**
+ * Procesa un archivo GeoJSON (o GeoJSONSeq) y genera DERAFeature[]
+ */
+async function processFile(filename) {
+  const baseName = filename.replace(INPUT_PATTERN, '');
   const tipologia = FILE_TO_TIPOLOGIA[baseName];
   
   if (!tipologia) {
@@ -112,14 +152,14 @@ function processFile(filename) {
   }
   
   const inputPath = path.join(INPUT_DIR, filename);
-  const data = JSON.parse(fs.readFileSync(inputPath, 'utf8'));
-  const features = data.features || [];
+  const transformed = [];
+  for await (const feature of readFeatures(inputPath)) {
+    transformed.push(transformFeature(feature, tipologia, transformed.length));
+  }
   
-  console.log(`\n  📁 ${baseName}.geojson`);
+  console.log(`\n  📁 ${filename}`);
   console.log(`     Tipología: ${tipologia}`);
-  console.log(`     Features origen: ${features.length}`);
-  
-  const transformed = features.map((f, i) => transformFeature(f, tipologia, i));
+  console.log(`     Features origen: ${transformed.length}`);
   
   // Filtrar features sin coordenadas válidas
   const valid = transformed.filter(f => f.x !== 0 && f.y !== 0);
@@ -148,7 +188,7 @@ function processFile(filename) {
 // MAIN
 // ============================================================================
 
-function main() {
+async function main() {
   console.log(`
 ╔══════════════════════════════════════════════════════════════════╗
 ║     TRANSFORMACIÓN DERA → DERAFeature (Dexie.js)                 ║
@@ -164,7 +204,7 @@ function main() {
   }
 
   // Listar archivos GeoJSON
-  const files = fs.readdirSync(INPUT_DIR).filter(f => f.endsWith('.geojson'));
+  const files = listInputFiles();
   console.log(`  📋 Archivos encontrados: ${files.length}`);
 
   let totalFeatures = 0;
@@ -172,8 +212,8 @@ function main() {
   const stats = [];
 
   // Procesar cada archivo
-  files.forEach(file => {
-    const result = processFile(file);
+  for (const file of files) {
+    const result = await processFile(file);
     if (result) {
       // Guardar archivo individual
       const outputPath = path.join(OUTPUT_DIR, `${result.baseName}.json`);
@@ -191,7 +231,7 @@ function main() {
         count: result.features.length
       });
     }
-  });
+  }
 
   // Guardar archivo consolidado
   const consolidatedPath = path.join(OUTPUT_DIR, 'all-dera.json');
@@ -224,4 +264,7 @@ function main() {
   return 0;
 }
 
-main();
+main().catch(err => {
+  console.error(err);
+  process.exit(1);
+});
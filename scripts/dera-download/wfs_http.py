@@ -0,0 +1,474 @@
+#!/usr/bin/env python3
+"""
+wfs_http.py
+
+Capa HTTP compartida para las peticiones WFS de los scripts DERA.
+
+- Sesión requests única con pool de conexiones keep-alive
+- Negociación Accept-Encoding (gzip/deflate)
+- Adaptadores por host con su propio tamaño de pool
+- Límite de peticiones simultáneas por host
+- Ritmo adaptativo por host (token bucket + AIMD): acelera con latencias
+  bajas y frena ante 429/503, Retry-After o latencia creciente
+- Backoff exponencial con jitter para los reintentos (backoff_delay)
+- Lectura en streaming por bloques (http_stream)
+- Estadísticas por ejecución: conexiones reutilizadas vs nuevas, bytes
+- Cada petición se registra en dera_metrics.METRICS (latencia, estado, bytes)
+
+@version 1.0.0
+@date 2025-12-08
+"""
+
+import random
+import threading
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterator, Optional
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from dera_metrics import METRICS
+
+# ============================================================================
+# CONFIGURACIÓN
+# ============================================================================
+
+MAX_PER_HOST = 2  # peticiones simultáneas por host (cortesía con ideandalucia.es)
+POOL_SIZE = 8  # conexiones keep-alive por host
+ACCEPT_ENCODING = "gzip, deflate"
+STREAM_CHUNK_SIZE = 64 * 1024  # bytes por bloque en http_stream
+USER_AGENT = "PTEL-DERA-Downloader/1.0 (+https://github.com/luismgarcia/norm-coord-ptel)"
+
+# Adaptadores dedicados por host (prefijo → tamaño de pool)
+HOST_POOLS = {
+    "https://www.ideandalucia.es/": POOL_SIZE,
+}
+
+# Ritmo adaptativo por host (peticiones/segundo)
+INITIAL_RATE = 4.0
+MIN_RATE = 0.2
+MAX_RATE = 20.0
+RATE_INCREASE = 0.5  # suma por respuesta rápida
+RATE_DECREASE = 0.5  # factor ante saturación
+LATENCY_TARGET = 5.0  # segundos hasta cabeceras; por encima se frena
+THROTTLE_STATUS = (429, 503)
+
+# Backoff de reintentos
+BACKOFF_BASE = 2.0  # segundos
+BACKOFF_MAX = 60.0
+
+
+# ============================================================================
+# LÍMITE POR HOST
+# ============================================================================
+
+class HostLimiter:
+    """Semáforos por host para acotar peticiones simultáneas a un mismo servidor."""
+
+    def __init__(self, max_per_host: int = MAX_PER_HOST):
+        self.max_per_host = max(1, max_per_host)
+        self._lock = threading.Lock()
+        self._semaphores: Dict[str, threading.BoundedSemaphore] = {}
+
+    def configure(self, max_per_host: int):
+        """Cambia el límite. Solo afecta a hosts todavía no usados."""
+        with self._lock:
+            self.max_per_host = max(1, max_per_host)
+            self._semaphores.clear()
+
+    def _semaphore(self, host: str) -> threading.BoundedSemaphore:
+        with self._lock:
+            sem = self._semaphores.get(host)
+            if sem is None:
+                sem = threading.BoundedSemaphore(self.max_per_host)
+                self._semaphores[host] = sem
+            return sem
+
+    @contextmanager
+    def slot(self, url: str):
+        """Reserva un hueco para el host de la URL durante la petición."""
+        sem = self._semaphore(urlparse(url).netloc)
+        with sem:
+            yield
+
+
+HOST_LIMITER = HostLimiter()
+
+
+def host_slot(url: str):
+    """Atajo al limitador global de hosts."""
+    return HOST_LIMITER.slot(url)
+
+
+# ============================================================================
+# RITMO ADAPTATIVO
+# ============================================================================
+
+class _Bucket:
+    __slots__ = ("rate", "tokens", "updated", "blocked_until", "latency", "last_decrease")
+
+    def __init__(self, rate: float, now: float):
+        self.rate = rate
+        self.tokens = 1.0
+        self.updated = now
+        self.blocked_until = 0.0
+        self.latency: Optional[float] = None  # media móvil exponencial
+        self.last_decrease = float("-inf")
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket por host cuya tasa se ajusta con AIMD.
+
+    Todas las peticiones en vuelo a un mismo host comparten el bucket.
+    Cada respuesta rápida suma RATE_INCREASE a la tasa; un 429/503, una
+    cabecera Retry-After o una latencia por encima del objetivo (o del
+    doble de la media reciente) la multiplican por RATE_DECREASE, como
+    mucho una vez por latencia media para no castigar varias veces la
+    misma congestión. Retry-After además bloquea el host hasta su plazo.
+    """
+
+    def __init__(self, initial_rate: float = INITIAL_RATE, min_rate: float = MIN_RATE,
+                 max_rate: float = MAX_RATE, latency_target: float = LATENCY_TARGET,
+                 clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.initial_rate = initial_rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.latency_target = latency_target
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._buckets: Dict[str, _Bucket] = {}
+
+    def configure(self, initial_rate: Optional[float] = None, max_rate: Optional[float] = None):
+        """Cambia los límites y reinicia el estado de todos los hosts."""
+        with self._lock:
+            if max_rate is not None:
+                self.max_rate = max(self.min_rate, max_rate)
+            if initial_rate is not None:
+                self.initial_rate = initial_rate
+            self.initial_rate = min(self.initial_rate, self.max_rate)
+            self._buckets.clear()
+
+    def _bucket(self, host: str, now: float) -> _Bucket:
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            bucket = _Bucket(self.initial_rate, now)
+            self._buckets[host] = bucket
+        return bucket
+
+    def acquire(self, url: str) -> float:
+        """
+        Espera el turno del host. Retorna los segundos esperados.
+
+        El token se reserva bajo el lock (el saldo puede quedar negativo) y
+        la espera se hace fuera, de modo que el orden de llegada se respeta.
+        """
+        host = urlparse(url).netloc
+        with self._lock:
+            now = self._clock()
+            bucket = self._bucket(host, now)
+            bucket.tokens = min(max(1.0, bucket.rate),
+                                bucket.tokens + (now - bucket.updated) * bucket.rate)
+            bucket.updated = now
+            bucket.tokens -= 1.0
+            wait = max(0.0, -bucket.tokens / bucket.rate, bucket.blocked_until - now)
+        if wait > 0:
+            self._sleep(wait)
+        return wait
+
+    def observe(self, url: str, latency: float, status: Optional[int] = None,
+                retry_after: Optional[float] = None):
+        """Ajusta la tasa del host con el resultado de una petición."""
+        host = urlparse(url).netloc
+        with self._lock:
+            now = self._clock()
+            bucket = self._bucket(host, now)
+            average = bucket.latency
+            bucket.latency = latency if average is None else 0.8 * average + 0.2 * latency
+
+            if retry_after is not None:
+                bucket.blocked_until = max(bucket.blocked_until, now + retry_after)
+
+            slow = latency > self.latency_target or (average is not None and latency > 2 * average)
+            if status in THROTTLE_STATUS or retry_after is not None or slow:
+                if now - bucket.last_decrease >= (average or 0.0):
+                    bucket.rate = max(self.min_rate, bucket.rate * RATE_DECREASE)
+                    bucket.tokens = min(bucket.tokens, 0.0)
+                    bucket.last_decrease = now
+            elif status is None or status < 400:
+                bucket.rate = min(self.max_rate, bucket.rate + RATE_INCREASE)
+
+    def rate(self, url: str) -> float:
+        """Tasa actual del host (peticiones/segundo)."""
+        with self._lock:
+            bucket = self._buckets.get(urlparse(url).netloc)
+            return bucket.rate if bucket else self.initial_rate
+
+
+RATE_LIMITER = AdaptiveRateLimiter()
+
+
+def retry_after_seconds(response) -> Optional[float]:
+    """Segundos indicados por Retry-After (entero o fecha HTTP), o None."""
+    value = getattr(response, "headers", {}).get("Retry-After")
+    if not isinstance(value, str):
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return max(0.0, (date - datetime.now(timezone.utc)).total_seconds())
+
+
+def backoff_delay(attempt: int, base: float = BACKOFF_BASE, cap: float = BACKOFF_MAX,
+                  retry_after: Optional[float] = None) -> float:
+    """
+    Espera antes del reintento `attempt` (1, 2, ...): backoff exponencial
+    con jitter completo, nunca menor que lo pedido por Retry-After.
+    """
+    delay = random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, cap))
+    return delay
+
+
+@contextmanager
+def _paced(url: str):
+    """Turno del limitador adaptativo + hueco del límite por host."""
+    RATE_LIMITER.acquire(url)
+    with host_slot(url):
+        yield
+
+
+def _observe(url: str, response: requests.Response):
+    # elapsed = tiempo hasta recibir cabeceras (no depende del tamaño del cuerpo)
+    RATE_LIMITER.observe(
+        url,
+        response.elapsed.total_seconds(),
+        response.status_code,
+        retry_after_seconds(response) if response.status_code in THROTTLE_STATUS else None,
+    )
+
+
+# ============================================================================
+# SESIÓN
+# ============================================================================
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+_config = {
+    "pool_size": POOL_SIZE,
+    "keep_alive": True,
+    "accept_encoding": ACCEPT_ENCODING,
+    "host_pools": dict(HOST_POOLS),
+}
+_stats_lock = threading.Lock()
+_stats = {"requests": 0, "connectionsOpened": 0, "bytesWire": 0, "bytesDecoded": 0}
+
+
+def _count_connect():
+    with _stats_lock:
+        _stats["connectionsOpened"] += 1
+
+
+class _CountingHTTPConnection(HTTPConnection):
+    def connect(self):
+        super().connect()
+        _count_connect()
+
+
+class _CountingHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        super().connect()
+        _count_connect()
+
+
+class _CountingHTTPPool(HTTPConnectionPool):
+    ConnectionCls = _CountingHTTPConnection
+
+
+class _CountingHTTPSPool(HTTPSConnectionPool):
+    ConnectionCls = _CountingHTTPSConnection
+
+
+class PooledAdapter(HTTPAdapter):
+    """HTTPAdapter que cuenta cada socket abierto (incluidas reconexiones)."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _CountingHTTPPool,
+            "https": _CountingHTTPSPool,
+        }
+
+
+def build_session(pool_size: int = POOL_SIZE, keep_alive: bool = True,
+                  accept_encoding: str = ACCEPT_ENCODING,
+                  host_pools: Optional[Dict[str, int]] = None) -> requests.Session:
+    """Crea una sesión con pool keep-alive y adaptadores por host."""
+    session = requests.Session()
+    session.headers.update({
+        "Accept-Encoding": accept_encoding,
+        "User-Agent": USER_AGENT,
+    })
+    if not keep_alive:
+        session.headers["Connection"] = "close"
+
+    default_adapter = PooledAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount("https://", default_adapter)
+    session.mount("http://", default_adapter)
+
+    for prefix, size in (host_pools or {}).items():
+        session.mount(prefix, PooledAdapter(pool_connections=1, pool_maxsize=size))
+
+    return session
+
+
+def configure_session(pool_size: Optional[int] = None, keep_alive: Optional[bool] = None,
+                      accept_encoding: Optional[str] = None,
+                      host_pools: Optional[Dict[str, int]] = None):
+    """Cambia la configuración; la sesión se recrea en la siguiente petición."""
+    global _session
+    with _session_lock:
+        if pool_size is not None:
+            _config["pool_size"] = pool_size
+            _config["host_pools"] = {prefix: pool_size for prefix in _config["host_pools"]}
+        if keep_alive is not None:
+            _config["keep_alive"] = keep_alive
+        if accept_encoding is not None:
+            _config["accept_encoding"] = accept_encoding
+        if host_pools is not None:
+            _config["host_pools"] = dict(host_pools)
+        if _session is not None:
+            _session.close()
+        _session = None
+    reset_stats()
+
+
+def get_session() -> requests.Session:
+    """Sesión compartida por todos los hilos (el pool de urllib3 es thread-safe)."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = build_session(**_config)
+        return _session
+
+
+def http_get(url: str, timeout: float, **kwargs) -> requests.Response:
+    """GET a través de la sesión compartida, respetando el límite por host."""
+    session = get_session()
+    with _paced(url):
+        start = time.perf_counter()
+        try:
+            response = session.get(url, timeout=timeout, **kwargs)
+        except requests.exceptions.RequestException as e:
+            _failed(url, timeout, start, isinstance(e, requests.exceptions.Timeout))
+            raise
+    _observe(url, response)
+
+    if not kwargs.get("stream"):
+        decoded = len(response.content)
+        wire = _wire_bytes(response, decoded)
+        _record(wire, decoded)
+        METRICS.observe_request(url, response.status_code, response.elapsed.total_seconds(),
+                                time.perf_counter() - start, wire)
+    return response
+
+
+def http_stream(url: str, timeout: float, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    GET en streaming: genera el cuerpo ya descomprimido por bloques.
+
+    La petición se lanza al pedir el primer bloque; los errores HTTP se
+    propagan como requests.exceptions.HTTPError en ese momento. El hueco
+    del host se mantiene hasta leer o cerrar el cuerpo: la conexión sigue
+    ocupada mientras llegan los bloques.
+    """
+    session = get_session()
+    with _paced(url):
+        start = time.perf_counter()
+        try:
+            response = session.get(url, timeout=timeout, stream=True)
+        except requests.exceptions.RequestException as e:
+            _failed(url, timeout, start, isinstance(e, requests.exceptions.Timeout))
+            raise
+        _observe(url, response)
+
+        decoded = 0
+        try:
+            with response:
+                response.raise_for_status()
+                for chunk in response.iter_content(chunk_size):
+                    decoded += len(chunk)
+                    yield chunk
+                _record(_wire_bytes(response, decoded), decoded)
+        finally:
+            # También si el cuerpo se corta o se deja de leer
+            METRICS.observe_request(url, response.status_code, response.elapsed.total_seconds(),
+                                    time.perf_counter() - start, _wire_bytes(response, decoded))
+
+
+def _failed(url: str, timeout: float, start: float, timed_out: bool):
+    """Petición sin respuesta (timeout o error de conexión)."""
+    if timed_out:
+        RATE_LIMITER.observe(url, timeout)  # un timeout cuenta como latencia máxima
+    elapsed = time.perf_counter() - start
+    METRICS.observe_request(url, None, elapsed, elapsed, 0)
+
+
+def _wire_bytes(response: requests.Response, decoded: int) -> int:
+    try:
+        return response.raw.tell() or decoded
+    except (AttributeError, TypeError):
+        return decoded
+
+
+def _record(wire: int, decoded: int):
+    with _stats_lock:
+        _stats["requests"] += 1
+        _stats["bytesWire"] += wire
+        _stats["bytesDecoded"] += decoded
+
+
+# ============================================================================
+# ESTADÍSTICAS
+# ============================================================================
+
+def reset_stats():
+    with _stats_lock:
+        for key in _stats:
+            _stats[key] = 0
+
+
+def get_stats() -> dict:
+    """Estadísticas de la ejecución: cada petición que no abrió socket reutilizó uno."""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["connectionsReused"] = max(0, stats["requests"] - stats["connectionsOpened"])
+    return stats
+
+
+def format_stats(stats: Optional[dict] = None) -> str:
+    """Resumen legible de get_stats()."""
+    stats = stats or get_stats()
+    saved = stats["bytesDecoded"] - stats["bytesWire"]
+    ratio = (saved / stats["bytesDecoded"] * 100) if stats["bytesDecoded"] else 0
+    return (
+        f"{stats['requests']} peticiones, "
+        f"{stats['connectionsOpened']} conexiones nuevas / {stats['connectionsReused']} reutilizadas, "
+        f"{stats['bytesWire'] / 1024:.1f} KB transferidos "
+        f"({stats['bytesDecoded'] / 1024:.1f} KB descomprimidos, {ratio:.0f}% ahorro)"
+    )
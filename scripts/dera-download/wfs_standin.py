@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+wfs_standin.py
+
+Servidor WFS local que imita el GetFeature de GeoServer (ideandalucia.es)
+para los benchmarks y tests sin red.
+
+Responde a:
+- GetCapabilities: OperationsMetadata con ImplementsResultPaging y
+  CountDefault, seguido de FeatureTypeList
+- DescribeFeatureType: XSD con los atributos de las features sintéticas
+  y la geometría "geom" (gml:MultiPointPropertyType)
+- GetFeature con resultType=hits: XML con numberMatched
+- GetFeature: FeatureCollection GeoJSON paginado con startIndex/count,
+  con numberMatched y numberReturned; varios typeNames separados por
+  comas se concatenan en orden (como la petición agrupada)
+
+Las features son sintéticas y deterministas: la i-ésima de cada capa
+tiene siempre el mismo id ("<capa>.<i+1>"), id_dera, cod_mun y punto, así
+que se pueden servir 10^6 sin tenerlas en memoria. El cuerpo se genera y
+envía por bloques (chunked, gzip si el cliente lo acepta).
+
+Parámetros de la simulación:
+- features: features por typeName
+- latency: segundos antes de las cabeceras de cada respuesta
+- max_page: máximo de features por respuesta que no se anuncia;
+  None = sin límite
+- count_default: CountDefault anunciado en GetCapabilities; también
+  limita cada respuesta (como maxFeatures de GeoServer)
+- paging: False anuncia ImplementsResultPaging=FALSE e ignora startIndex
+- error_rate: fracción de peticiones que reciben 503 con Retry-After: 0
+- seed: semilla de la inyección de errores (reproducible)
+
+CQL_FILTER, BBOX y PROPERTYNAME se ignoran.
+
+@version 1.0.0
+@date 2025-12-09
+"""
+
+import json
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+# ============================================================================
+# CONFIGURACIÓN
+# ============================================================================
+
+DEFAULT_FEATURES = 10_000
+FEATURES_PER_CHUNK = 500  # features por bloque chunked
+WFS_PATH = "/wfs"
+
+# Municipios con los que se reparten las features sintéticas
+_MUNICIPIOS = [
+    ("41091", "Sevilla", "Sevilla"), ("29067", "Málaga", "Málaga"), ("14021", "Córdoba", "Córdoba"),
+    ("18087", "Granada", "Granada"), ("04013", "Almería", "Almería"), ("11012", "Cádiz", "Cádiz"),
+    ("21041", "Huelva", "Huelva"), ("23050", "Jaén", "Jaén"),
+]
+_FEATURE = (
+    '{{"type":"Feature","id":"{layer}.{n}","geometry":{{"type":"MultiPoint",'
+    '"coordinates":[[{x},{y}]]}},"geometry_name":"geom","properties":{{'
+    '"id_dera":{id_dera},"nombre":"Centro {n}","direccion":"CL Sintética, {n}",'
+    '"localidad":"{municipio}","cod_mun":"{cod_mun}","municipio":"{municipio}",'
+    '"provincia":"{provincia}"}}}}'
+)
+_PROPERTIES = ("id_dera", "nombre", "direccion", "localidad", "cod_mun", "municipio", "provincia")
+
+
+def synthetic_feature(layer: str, index: int) -> str:
+    """JSON de la feature `index` (desde 0) de una capa."""
+    local = layer.split(":")[-1]
+    cod_mun, municipio, provincia = _MUNICIPIOS[index % len(_MUNICIPIOS)]
+    return _FEATURE.format(
+        layer=local, n=index + 1, id_dera=(zlib.crc32(local.encode()) << 20) + index,
+        x=100000 + (index * 7919) % 520000 + 0.28344586,
+        y=3980000 + (index * 104729) % 310000 + 0.46443277,
+        cod_mun=cod_mun, municipio=municipio, provincia=provincia,
+    )
+
+
+def synthetic_features(layer: str, count: int) -> Iterator[dict]:
+    """Las mismas features ya decodificadas (para las etapas sin red)."""
+    for index in range(count):
+        yield json.loads(synthetic_feature(layer, index))
+
+
+# ============================================================================
+# SERVIDOR
+# ============================================================================
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, como GeoServer
+
+    def do_GET(self):
+        standin: "WFSStandin" = self.server.standin
+        url = urlparse(self.path)
+        params = {k.lower(): v[0] for k, v in parse_qs(url.query).items()}
+        if standin.latency:
+            time.sleep(standin.latency)
+        if standin._inject_error():
+            self._send(503, b"Servicio saturado", "text/plain", {"Retry-After": "0"})
+            return
+
+        if url.path == WFS_PATH and params.get("request", "").lower() == "getcapabilities":
+            self._send(200, standin.capabilities().encode("utf-8"), "text/xml")
+            return
+
+        layers = [l for l in (params.get("typenames") or params.get("typename") or "").split(",") if l]
+        if url.path == WFS_PATH and params.get("request", "").lower() == "describefeaturetype" and layers:
+            self._send(200, standin.schema(layers[0]).encode("utf-8"), "text/xml")
+            return
+        if url.path != WFS_PATH or params.get("request", "").lower() != "getfeature" or not layers:
+            self._send(400, b"Peticion no soportada", "text/plain")
+            return
+
+        total = standin.features * len(layers)
+        if params.get("resulttype") == "hits":
+            body = (f'<?xml version="1.0" encoding="UTF-8"?><wfs:FeatureCollection '
+                    f'xmlns:wfs="http://www.opengis.net/wfs/2.0" numberMatched="{total}" '
+                    f'numberReturned="0"/>').encode("utf-8")
+            self._send(200, body, "text/xml")
+            return
+
+        start = int(params.get("startindex", 0)) if standin.paging else 0
+        limits = [int(params["count"])] if "count" in params else []
+        limits += [limit for limit in (standin.max_page, standin.count_default) if limit]
+        end = min([total] + [start + limit for limit in limits])
+        self._send_features(layers, max(start, 0), max(end, start), total)
+
+    def _send(self, status: int, body: bytes, content_type: str, headers: Optional[dict] = None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.standin._record(status, len(body), 0)
+
+    def _send_features(self, layers: List[str], start: int, end: int, total: int):
+        standin: "WFSStandin" = self.server.standin
+        gzip = standin.gzip and "gzip" in self.headers.get("Accept-Encoding", "")
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if gzip else None
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json;charset=UTF-8")
+        self.send_header("Transfer-Encoding", "chunked")
+        if gzip:
+            self.send_header("Content-Encoding", "gzip")
+        self.end_headers()
+
+        sent = 0
+
+        def chunk(data: bytes):
+            nonlocal sent
+            if compressor is not None:
+                data = compressor.compress(data)
+            if data:
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                sent += len(data)
+
+        chunk(b'{"type":"FeatureCollection","features":[')
+        for block in range(start, end, FEATURES_PER_CHUNK):
+            texts = []
+            for position in range(block, min(block + FEATURES_PER_CHUNK, end)):
+                layer = layers[position // standin.features]
+                texts.append(synthetic_feature(layer, position % standin.features))
+            chunk((b"," if block > start else b"") + ",".join(texts).encode("utf-8"))
+        chunk(f'],"totalFeatures":{total},"numberMatched":{total},"numberReturned":{end - start},'
+              f'"timeStamp":"2025-12-09T00:00:00Z","crs":{{"type":"name","properties":'
+              f'{{"name":"urn:ogc:def:crs:EPSG::25830"}}}}}}'.encode("utf-8"))
+        if compressor is not None:
+            tail = compressor.flush()
+            self.wfile.write(f"{len(tail):x}\r\n".encode() + tail + b"\r\n")
+            sent += len(tail)
+        self.wfile.write(b"0\r\n\r\n")
+        standin._record(200, sent, end - start)
+
+    def log_message(self, *args):
+        pass
+
+
+class WFSStandin:
+    """
+    Servidor WFS local en un hilo.
+
+    Uso:
+        with WFSStandin(features=100_000, latency=0.05) as server:
+            fetch_wfs_features(server.url, "bench:capa", "Bench")
+            server.stats()
+    """
+
+    def __init__(self, features: int = DEFAULT_FEATURES, latency: float = 0.0,
+                 max_page: Optional[int] = None, error_rate: float = 0.0,
+                 gzip: bool = True, seed: int = 0, port: int = 0,
+                 count_default: Optional[int] = None, paging: bool = True):
+        self.features = features
+        self.latency = latency
+        self.max_page = max_page
+        self.count_default = count_default
+        self.paging = paging
+        self.error_rate = error_rate
+        self.gzip = gzip
+        self.seed = seed
+        self._lock = threading.Lock()
+        self._stats = {}
+        self.reset_stats()
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.standin = self
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._httpd.server_address[1]}{WFS_PATH}"
+
+    def capabilities(self) -> str:
+        """Documento GetCapabilities (WFS 2.0) con las restricciones de paginación."""
+        constraints = [("ImplementsResultPaging", "TRUE" if self.paging else "FALSE")]
+        if self.count_default:
+            constraints.append(("CountDefault", str(self.count_default)))
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<wfs:WFS_Capabilities version="2.0.0" xmlns:wfs="http://www.opengis.net/wfs/2.0" '
+            'xmlns:ows="http://www.opengis.net/ows/1.1">'
+            '<ows:OperationsMetadata><ows:Operation name="GetFeature"/>'
+            + "".join(f'<ows:Constraint name="{name}"><ows:NoValues/>'
+                      f'<ows:DefaultValue>{value}</ows:DefaultValue></ows:Constraint>'
+                      for name, value in constraints)
+            + '</ows:OperationsMetadata><wfs:FeatureTypeList><wfs:FeatureType>'
+            '<wfs:Name>bench:capa</wfs:Name></wfs:FeatureType></wfs:FeatureTypeList>'
+            '</wfs:WFS_Capabilities>'
+        )
+
+    def schema(self, layer: str) -> str:
+        """Documento DescribeFeatureType (XSD) de una capa."""
+        local = layer.split(":")[-1]
+        elements = ['<xsd:element name="geom" type="gml:MultiPointPropertyType"/>']
+        elements += [f'<xsd:element name="{name}" type="xsd:string"/>' for name in _PROPERTIES]
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<xsd:schema xmlns:xsd="http://www.w3.org/2001/XMLSchema" '
+            'xmlns:gml="http://www.opengis.net/gml/3.2">'
+            f'<xsd:complexType name="{local}Type"><xsd:complexContent>'
+            '<xsd:extension base="gml:AbstractFeatureType"><xsd:sequence>'
+            + "".join(elements)
+            + '</xsd:sequence></xsd:extension></xsd:complexContent></xsd:complexType>'
+            f'<xsd:element name="{local}" type="{local}Type" substitutionGroup="gml:AbstractFeature"/>'
+            '</xsd:schema>'
+        )
+
+    def _inject_error(self) -> bool:
+        if not self.error_rate:
+            return False
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def _record(self, status: int, sent: int, features: int):
+        with self._lock:
+            self._stats["requests"] += 1
+            self._stats["errors"] += status >= 500
+            self._stats["bytesSent"] += sent
+            self._stats["featuresSent"] += features
+
+    def reset_stats(self):
+        """Pone a cero los contadores y reinicia la secuencia de errores."""
+        with self._lock:
+            self._random = random.Random(self.seed)
+            self._stats = {"requests": 0, "errors": 0, "bytesSent": 0, "featuresSent": 0}
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats)
+
+    def start(self) -> "WFSStandin":
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False